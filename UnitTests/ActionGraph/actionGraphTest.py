@@ -0,0 +1,241 @@
+#!/usr/bin/python
+
+"""
+Runs actions on an action graph backed by a single-thread job pool, checking that each action waits for the ones it
+depends on, that a failed action cancels everything waiting on it, directly or not, that a held action only runs once
+it's been released and what it was released on has finished, and that compiles prioritized by the critical path
+planned from recorded build times run longest chain first.
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, "../../")
+
+#Keep csbuild from trying to run a build when it's imported.
+sys.runningSphinx = True
+
+from csbuild import _action_graph
+from csbuild import _build_history
+from csbuild import _job_pool
+from csbuild._action_graph import ActionState
+
+exitCode = 0
+
+def Check(name, condition, details=None):
+	global exitCode
+	if not condition:
+		print("FAILED: {}".format(name))
+		if details is not None:
+			print(details)
+		exitCode = 1
+
+def WaitUntil(condition, timeout=10):
+	deadline = time.time() + timeout
+	while not condition():
+		if time.time() > deadline:
+			return False
+		time.sleep(0.01)
+	return True
+
+order = []
+orderLock = threading.Lock()
+
+def Record(name):
+	with orderLock:
+		order.append(name)
+
+def Fail(name):
+	Record(name)
+	return False
+
+#The job pool logs the exception with its traceback, as it does for any job that raises.
+def Raise(name):
+	Record(name)
+	raise RuntimeError("{} failed".format(name))
+
+def Block(event):
+	event.wait()
+
+def BlockThenRecord(event, name):
+	event.wait()
+	Record(name)
+
+class Callbacks(object):
+	"""
+	Counts how many times each action's callback runs, and the state it was in.
+	"""
+	def __init__(self):
+		self.calls = {}
+		self.lock = threading.Lock()
+
+	def __call__(self, action):
+		with self.lock:
+			self.calls.setdefault(action.name, []).append(action.state)
+
+	def States(self):
+		with self.lock:
+			return dict((name, states[0]) for name, states in self.calls.items() if len(states) == 1)
+
+class Project(object):
+	"""
+	The parts of a project PlanCriticalPath looks at.
+	"""
+	def __init__(self, key, linkDepends=(), srcDepends=()):
+		self.key = key
+		self.reconciledLinkDepends = list(linkDepends)
+		self.srcDepends = list(srcDepends)
+
+def TestDependencyOrder():
+	del order[:]
+	pool = _job_pool.JobPool(1)
+	graph = _action_graph.ActionGraph(pool)
+	callbacks = Callbacks()
+	try:
+		#Held up until everything's been added, so nothing depends on an action that's already done.
+		release = threading.Event()
+		first = graph.Add(BlockThenRecord, (release, "first"), callback=callbacks, name="first")
+		left = graph.Add(Record, ("left",), priority=1, dependencies=[first], callback=callbacks, name="left")
+		right = graph.Add(Record, ("right",), priority=2, dependencies=[first], callback=callbacks, name="right")
+		graph.Add(Record, ("last",), priority=10, dependencies=[left, right], callback=callbacks, name="last")
+		release.set()
+		Check("Graph empties", WaitUntil(lambda: graph.GetOutstandingCount() == 0))
+		Check("Actions wait for what they depend on", order == ["first", "right", "left", "last"], order)
+		Check("Every callback runs once, finished", callbacks.States() == dict(
+			(name, ActionState.Finished) for name in ("first", "left", "right", "last")), callbacks.calls)
+		Check("Completed count covers every action", graph.GetCompletedCount() == 4)
+	finally:
+		pool.Close()
+
+def TestFailureCancelsDependents():
+	for failure in (Fail, Raise):
+		del order[:]
+		pool = _job_pool.JobPool(1)
+		graph = _action_graph.ActionGraph(pool)
+		callbacks = Callbacks()
+		prefix = "{}: ".format("Returning False" if failure is Fail else "Raising")
+		try:
+			release = threading.Event()
+			blocker = graph.Add(Block, (release,), callback=callbacks, name="blocker")
+			failed = graph.Add(failure, ("failed",), dependencies=[blocker], callback=callbacks, name="failed")
+			child = graph.Add(Record, ("child",), dependencies=[failed], callback=callbacks, name="child")
+			grandchild = graph.Add(Record, ("grandchild",), dependencies=[child], callback=callbacks, name="grandchild")
+			#Also depends on something that succeeds, which shouldn't save it.
+			sibling = graph.Add(Record, ("sibling",), callback=callbacks, name="sibling")
+			joined = graph.Add(Record, ("joined",), dependencies=[sibling, grandchild], callback=callbacks, name="joined")
+			unrelated = graph.Add(Record, ("unrelated",), dependencies=[blocker], callback=callbacks, name="unrelated")
+
+			release.set()
+			Check(prefix + "Graph empties", WaitUntil(lambda: graph.GetOutstandingCount() == 0))
+			Check(prefix + "Failed action is marked failed", failed.state == ActionState.Failed)
+			for action in (child, grandchild, joined):
+				Check(prefix + "{} is cancelled".format(action.name), action.state == ActionState.Cancelled)
+			Check(prefix + "Cancelled actions never run", "child" not in order and "grandchild" not in order
+				and "joined" not in order, order)
+			Check(prefix + "Unrelated actions still run", unrelated.state == ActionState.Finished
+				and sibling.state == ActionState.Finished, order)
+			Check(prefix + "Every callback runs once", len(callbacks.States()) == 7, callbacks.calls)
+
+			late = graph.Add(Record, ("late",), dependencies=[failed], callback=callbacks, name="late")
+			Check(prefix + "Action added after its dependency failed is cancelled", late.state == ActionState.Cancelled
+				and callbacks.States().get("late") == ActionState.Cancelled)
+			Check(prefix + "Graph is empty again", graph.GetOutstandingCount() == 0)
+		finally:
+			pool.Close()
+
+def TestHeldActions():
+	del order[:]
+	pool = _job_pool.JobPool(1)
+	graph = _action_graph.ActionGraph(pool)
+	callbacks = Callbacks()
+	try:
+		held = graph.Add(Record, ("held",), held=True, callback=callbacks, name="held")
+		#Other actions can wait on it before it's released.
+		after = graph.Add(Record, ("after",), dependencies=[held], callback=callbacks, name="after")
+		time.sleep(0.2)
+		Check("Held action waits with nothing to depend on", held.state == ActionState.Waiting and not order, order)
+		Check("Held action counts as outstanding", graph.GetOutstandingCount() == 2)
+
+		#Released with more to wait for than it was added with.
+		release = threading.Event()
+		late = graph.Add(BlockThenRecord, (release, "late"), callback=callbacks, name="late")
+		graph.Release(held, [late])
+		time.sleep(0.2)
+		Check("Released action waits for dependencies given on release", held.state == ActionState.Waiting
+			and "held" not in order, order)
+		release.set()
+		Check("Graph empties", WaitUntil(lambda: graph.GetOutstandingCount() == 0))
+		Check("Released action runs after its dependencies", order == ["late", "held", "after"], order)
+
+		#Releasing it after it's run changes nothing.
+		graph.Release(held)
+		Check("Releasing again doesn't run it again", order == ["late", "held", "after"], order)
+
+		#Cancelled while held, it takes what waits on it with it, and releasing it does nothing.
+		cancelled = graph.Add(Record, ("cancelled",), held=True, callback=callbacks, name="cancelled")
+		dependent = graph.Add(Record, ("dependent",), dependencies=[cancelled], callback=callbacks, name="dependent")
+		Check("Held action can be cancelled", graph.Cancel(cancelled))
+		Check("Cancelling a held action cancels its dependents", dependent.state == ActionState.Cancelled)
+		graph.Release(cancelled)
+		time.sleep(0.2)
+		Check("Releasing a cancelled action doesn't run it", cancelled.state == ActionState.Cancelled
+			and "cancelled" not in order, order)
+
+		#Released on an action that already failed, it's cancelled.
+		failed = graph.Add(Fail, ("failed",), name="failed")
+		WaitUntil(lambda: failed.IsDone())
+		orphan = graph.Add(Record, ("orphan",), held=True, callback=callbacks, name="orphan")
+		graph.Release(orphan, [failed])
+		Check("Releasing on a failed action cancels it", orphan.state == ActionState.Cancelled)
+		Check("Every callback runs once", len(callbacks.States()) == 6, callbacks.calls)
+		Check("Graph is empty again", graph.GetOutstandingCount() == 0)
+	finally:
+		pool.Close()
+
+def TestPriorityFromHistory():
+	del order[:]
+	#lib links into app; its compiles start the longest chain, so they go first, slowest first.
+	_build_history.RecordCompile(os.path.abspath("slow.o"), 4.0)
+	_build_history.RecordCompile(os.path.abspath("fast.o"), 1.0)
+	_build_history.RecordCompile(os.path.abspath("main.o"), 2.0)
+	_build_history.RecordCompile(os.path.abspath("tool.o"), 0.5)
+	_build_history.RecordLinkTime("lib", 3.0)
+	_build_history.RecordLinkTime("app", 1.0)
+	lib = Project("lib")
+	app = Project("app", linkDepends=["lib"])
+	#A project nothing depends on, with a compile that's never been timed.
+	tool = Project("tool")
+	objs = {"lib": ["fast.o", "slow.o"], "app": ["main.o", "new.o"], "tool": ["tool.o", "untimed.o"]}
+	plan = _build_history.PlanCriticalPath([lib, app, tool], objs, 1)
+
+	Check("Link time is on the critical path", plan.tails.get("app") == 1.0, plan.tails)
+	Check("Dependent's link is on the critical path", plan.tails.get("lib") == 4.0, plan.tails)
+	Check("Untimed compile is estimated from its project", plan.EstimateCompileTime(app, "new.o") == 2.0)
+
+	pool = _job_pool.JobPool(1)
+	graph = _action_graph.ActionGraph(pool)
+	try:
+		release = threading.Event()
+		blocker = graph.Add(Block, (release,), name="blocker")
+		WaitUntil(lambda: pool.GetRunningJobs())
+		for project in (tool, app, lib):
+			for obj in objs[project.key]:
+				graph.Add(Record, (obj,), priority=plan.GetPriority(project, obj), dependencies=[blocker], name=obj)
+		release.set()
+		WaitUntil(lambda: graph.GetOutstandingCount() == 0)
+		#slow 8, fast 5, main and new 3, tool and untimed (the average of the one timed compile in tool) 0.5
+		expected = ["slow.o", "fast.o", "main.o", "new.o", "tool.o", "untimed.o"]
+		Check("Compiles run longest chain first", order == expected, order)
+	finally:
+		pool.Close()
+
+TestDependencyOrder()
+TestFailureCancelsDependents()
+TestHeldActions()
+TestPriorityFromHistory()
+
+if exitCode == 0:
+	print("Action graph test successful.")
+sys.exit(exitCode)
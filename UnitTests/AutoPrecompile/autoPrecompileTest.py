@@ -0,0 +1,154 @@
+#!/usr/bin/python
+
+"""
+Builds the project in template/ in a scratch directory several times with EnableAutoPrecompile(), changing headers
+between builds, and checks which headers end up in the generated precompiled header each time, and that it's only
+rebuilt when it has to be.
+
+The project has five translation units. common.h (which pulls in base.h) is included by all of them, config.h by
+four, shared.h by three and rare.h by one. With a minimum share of half the translation units and a maximum change
+rate of a quarter of the builds with changes in them:
+
+- rare.h is never chosen, since too few translation units include it.
+- config.h is chosen until it has changed in too many builds, and then dropped.
+- base.h only goes in through common.h, and common.h stays in once it's been chosen even when base.h changes a little
+  more often than a header that's new to the precompiled header could.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+csbuildPath = os.path.abspath("../../")
+templateDir = os.path.abspath("template")
+
+exitCode = 0
+
+_ansiEscape = re.compile(r"\x1b[^m]*m")
+_compiling = re.compile(r"Compiling (\S+?)_release\.o")
+_precompiling = re.compile(r"Precompiling \S+precompiled_headers\S*")
+_pchInclude = re.compile(r'#include "([^"]+)"')
+
+def Check(name, condition, output=None):
+	global exitCode
+	if not condition:
+		print("FAILED: {}".format(name))
+		if output is not None:
+			print(output)
+		exitCode = 1
+	else:
+		print("ok: {}".format(name))
+
+class Checkout(object):
+	"""
+	A scratch copy of the template project.
+	"""
+	def __init__(self):
+		self.root = tempfile.mkdtemp()
+		self.dir = os.path.join(self.root, "project")
+		shutil.copytree(templateDir, self.dir)
+
+	def Path(self, name):
+		return os.path.join(self.dir, name)
+
+	def Edit(self, name, old, new):
+		#Some filesystems only keep modification times to the second.
+		time.sleep(1.0)
+		with open(self.Path(name)) as f:
+			contents = f.read()
+		with open(self.Path(name), "w") as f:
+			f.write(contents.replace(old, new))
+
+	def Build(self):
+		"""
+		:return: Whether the build succeeded, the names of the translation units it compiled, whether it built the
+			precompiled header, and its output
+		:rtype: tuple[bool, list[str], bool, str]
+		"""
+		env = dict(os.environ)
+		env["CSBUILD_PATH"] = csbuildPath
+		proc = subprocess.Popen(
+			[sys.executable, "make.py", "--no-chunks", "--force-color", "off", "--force-progress-bar", "off"],
+			stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=self.dir, env=env
+		)
+		output = proc.communicate()[0]
+		if sys.version_info >= (3, 0):
+			output = output.decode("UTF-8", "replace")
+		output = _ansiEscape.sub("", output)
+		return proc.returncode == 0, sorted(_compiling.findall(output)), bool(_precompiling.search(output)), output
+
+	def Precompiled(self):
+		"""
+		:return: The names of the headers the generated precompiled header includes
+		:rtype: list[str]
+		"""
+		path = self.Path(os.path.join("gcc-x64-release", "obj", ".csbuild", "app_cpp_precompiled_headers_release.hpp"))
+		if not os.path.exists(path):
+			return []
+		with open(path) as f:
+			return sorted(os.path.basename(header) for header in _pchInclude.findall(f.read()))
+
+	def Run(self):
+		proc = subprocess.Popen([os.path.join(self.dir, "gcc-x64-release", "app")], stdout=subprocess.PIPE)
+		output = proc.communicate()[0]
+		if sys.version_info >= (3, 0):
+			output = output.decode("UTF-8")
+		return output.strip()
+
+	def Close(self):
+		shutil.rmtree(self.root)
+
+_everything = ["a", "b", "c", "d", "main"]
+
+def CheckBuild(checkout, name, expectedHeaders, expectPrecompile, expectedCompiles, expectedResult=None):
+	success, compiled, precompiled, output = checkout.Build()
+	Check("{}: build succeeds".format(name), success, output)
+	Check("{}: precompiles {}".format(name, expectedHeaders), checkout.Precompiled() == sorted(expectedHeaders), output)
+	Check("{}: {} the precompiled header".format(name, "rebuilds" if expectPrecompile else "doesn't rebuild"),
+		precompiled == expectPrecompile, output)
+	Check("{}: compiles {}".format(name, expectedCompiles or "nothing"), compiled == sorted(expectedCompiles), output)
+	if expectedResult is not None and success:
+		Check("{}: app prints {}".format(name, expectedResult), checkout.Run() == expectedResult)
+
+def TestAutoPrecompile():
+	checkout = Checkout()
+	try:
+		#Nothing has changed yet, so everything included often enough is chosen.
+		CheckBuild(checkout, "First build", ["common.h", "config.h", "shared.h"], True, _everything, "24")
+		CheckBuild(checkout, "No changes", ["common.h", "config.h", "shared.h"], False, [])
+
+		#Changes only count once a build with them has succeeded, so config.h stays in for this one. main.cpp doesn't
+		#include it, so doesn't need rebuilding.
+		checkout.Edit("include/config.h", "CONFIG_VALUE 0", "CONFIG_VALUE 1")
+		CheckBuild(checkout, "Edit config.h", ["common.h", "config.h", "shared.h"], True, ["a", "b", "c", "d"], "28")
+
+		#Now it's changed in every build with changes, so it's dropped.
+		checkout.Edit("include/config.h", "CONFIG_VALUE 1", "CONFIG_VALUE 2")
+		CheckBuild(checkout, "Edit config.h again", ["common.h", "shared.h"], True, ["a", "b", "c", "d"], "32")
+		CheckBuild(checkout, "No changes after dropping config.h", ["common.h", "shared.h"], False, [])
+
+		#Nothing in the precompiled header, so only the one translation unit that includes it is rebuilt.
+		checkout.Edit("include/rare.h", "return 5;", "return 6;")
+		CheckBuild(checkout, "Edit rare.h", ["common.h", "shared.h"], False, ["a"], "33")
+
+		#base.h goes in with common.h, so changing it rebuilds the precompiled header and everything using it.
+		checkout.Edit("include/base.h", "return 1;", "return 2;")
+		CheckBuild(checkout, "Edit base.h", ["common.h", "shared.h"], True, _everything, "38")
+		checkout.Edit("include/base.h", "return 2;", "return 3;")
+		CheckBuild(checkout, "Edit base.h again", ["common.h", "shared.h"], True, _everything, "43")
+
+		#base.h has now changed in 2 of 5 builds with changes, more than the limit, but common.h was already chosen
+		#and is given some slack rather than going in and out of the precompiled header.
+		CheckBuild(checkout, "No changes after editing base.h", ["common.h", "shared.h"], False, [])
+	finally:
+		checkout.Close()
+
+TestAutoPrecompile()
+
+if exitCode == 0:
+	print("Auto-precompile test successful.")
+sys.exit(exitCode)
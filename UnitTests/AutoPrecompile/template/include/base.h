@@ -0,0 +1,3 @@
+#pragma once
+
+inline int Base() { return 1; }
@@ -0,0 +1,5 @@
+#pragma once
+
+#include "base.h"
+
+inline int Common() { return Base() + 1; }
@@ -0,0 +1,3 @@
+#pragma once
+
+#define CONFIG_VALUE 0
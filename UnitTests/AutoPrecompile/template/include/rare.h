@@ -0,0 +1,3 @@
+#pragma once
+
+inline int Rare() { return 5; }
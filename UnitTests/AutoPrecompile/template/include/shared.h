@@ -0,0 +1,3 @@
+#pragma once
+
+inline int Shared() { return 3; }
@@ -0,0 +1,19 @@
+#!/usr/bin/python
+
+import os
+import sys
+sys.path.insert(0, os.environ["CSBUILD_PATH"])
+
+import csbuild
+
+csbuild.Toolchain("gcc").SetCxxCommand(os.environ.get("CXX", "g++"))
+
+@csbuild.project(
+	name="app",
+	workingDirectory="src",
+	depends=[],
+)
+def app():
+	csbuild.SetOutput("app", csbuild.ProjectType.Application)
+	csbuild.AddIncludeDirectories("include")
+	csbuild.EnableAutoPrecompile(minShare=0.5, maxChangeRate=0.25)
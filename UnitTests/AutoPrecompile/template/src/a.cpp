@@ -0,0 +1,6 @@
+#include "common.h"
+#include "config.h"
+#include "shared.h"
+#include "rare.h"
+
+int A() { return Common() + Shared() + Rare() + CONFIG_VALUE; }
@@ -0,0 +1,5 @@
+#include "common.h"
+#include "config.h"
+#include "shared.h"
+
+int B() { return Common() + Shared() + CONFIG_VALUE; }
@@ -0,0 +1,5 @@
+#include "common.h"
+#include "config.h"
+#include "shared.h"
+
+int C() { return Common() + Shared() + CONFIG_VALUE; }
@@ -0,0 +1,4 @@
+#include "common.h"
+#include "config.h"
+
+int D() { return Common() + CONFIG_VALUE; }
@@ -0,0 +1,14 @@
+#include <cstdio>
+
+#include "common.h"
+
+int A();
+int B();
+int C();
+int D();
+
+int main()
+{
+	std::printf("%d\n", A() + B() + C() + D() + Common());
+	return 0;
+}
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+
+"""
+Times the chunk packer (_chunking.PackChunks) on a large generated project, and checks that the chunks it makes
+follow the chunking rules: every file in exactly one chunk, no chunk over budget unless it holds a single file, no C
+and C++ in the same chunk, excluded and Objective-C files on their own, and mutually exclusive files kept apart.
+Then it checks that repacking from the previous chunks (_chunking.UpdateChunks) after adding and removing a few files
+only changes the chunks those files were in or went into, and times looking up every file's chunk through
+_chunking.ChunkIndex. The original make_chunks() size packing and chunk lookup are timed on a smaller project for
+comparison.
+
+Run from this directory: python chunkingBenchmark.py
+"""
+
+import os
+import sys
+import random
+import time
+
+sys.path.insert(0, "../../")
+
+#Keep csbuild from trying to run a build when it's imported.
+sys.runningSphinx = True
+
+from csbuild import _chunking
+from csbuild import log
+from csbuild import _utils
+
+exitCode = 0
+
+#Keep the "Rejecting ... mutually exclusive" messages out of the timings.
+log.LOG_INFO = lambda *args, **kwargs: None
+
+cExtensions = {".c"}
+cppExtensions = {".cpp", ".cxx", ".cc", ".cp", ".c++"}
+
+def Check(name, condition):
+	global exitCode
+	if not condition:
+		print("FAILED: {}".format(name))
+		exitCode = 1
+
+def MakeProject(numFiles):
+	files = []
+	for i in range(numFiles):
+		extension = random.choice([".cpp"] * 16 + [".c"] * 3 + [".mm"])
+		files.append("/src/module{}/file{}{}".format(i // 200, i, extension))
+	sizes = dict((srcFile, random.randint(200, 40000)) for srcFile in files)
+	excludes = set(random.sample(files, numFiles // 1000))
+	mutexes = {}
+	for _ in range(numFiles // 100):
+		srcFile = random.choice(files)
+		mutexes.setdefault(srcFile, set()).update(random.sample(files, 5))
+	return files, sizes, excludes, mutexes
+
+def OldSizePacking(l, sizes, budget, canJoin):
+	#make_chunks() chunkFilesize packing before the packer, using sizes that are already known.
+	chunks = []
+	sorted_list = sorted(l, key=sizes.get, reverse=True)
+	while sorted_list:
+		remaining = []
+		chunksize = sizes[sorted_list[0]]
+		chunk = [sorted_list.pop(0)]
+		for i in reversed(range(len(sorted_list))):
+			srcFile = sorted_list[i]
+			if not canJoin(chunk, srcFile):
+				remaining.append(srcFile)
+				continue
+			if chunksize + sizes[srcFile] > budget:
+				chunks.append(chunk)
+				remaining += sorted_list[i::-1]
+				chunk = []
+				break
+			chunk.append(srcFile)
+			chunksize += sizes[srcFile]
+		sorted_list = sorted(remaining, key=sizes.get, reverse=True)
+		if chunk:
+			chunks.append(chunk)
+	return chunks
+
+def Validate(name, files, chunks, costs, budget, rules, mutexes):
+	seen = {}
+	for index, chunk in enumerate(chunks):
+		for srcFile in chunk:
+			seen[srcFile] = seen.get(srcFile, 0) + 1
+	Check("{}: every file is in exactly one chunk".format(name), len(seen) == len(files) and all(count == 1 for count in seen.values()))
+
+	#Compile times are floats, so allow for rounding in the sums.
+	overBudget = [chunk for chunk in chunks if len(chunk) > 1 and sum(costs[srcFile] for srcFile in chunk) > budget * (1 + 1e-9)]
+	Check("{}: no chunk of more than one file is over budget".format(name), not overBudget)
+
+	mixed = [chunk for chunk in chunks if len(set(rules.GetGroup(srcFile) for srcFile in chunk)) > 1]
+	Check("{}: C and C++ files never share a chunk".format(name), not mixed)
+
+	alone = [chunk for chunk in chunks if len(chunk) > 1 and any(rules.GetGroup(srcFile) is None for srcFile in chunk)]
+	Check("{}: excluded and Objective-C files are chunked on their own".format(name), not alone)
+
+	chunkOf = {}
+	for index, chunk in enumerate(chunks):
+		for srcFile in chunk:
+			chunkOf[srcFile] = index
+	together = [(srcFile, other) for srcFile, others in mutexes.items() for other in others if other != srcFile and srcFile in chunkOf and chunkOf[srcFile] == chunkOf.get(other)]
+	Check("{}: mutually exclusive files are kept apart".format(name), not together)
+
+def Time(func, repeat=3):
+	best = None
+	for _ in range(repeat):
+		start = time.time()
+		result = func()
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best, result
+
+random.seed(4321)
+
+numFiles = 50000
+files, sizes, excludes, mutexes = MakeProject(numFiles)
+rules = _chunking.ChunkRules(cExtensions, cppExtensions, excludes, mutexes)
+compileTimes = dict((srcFile, size / 20000.0) for srcFile, size in sizes.items())
+counts = dict.fromkeys(files, 1)
+
+print("{} files, {} excluded, {} with mutexes".format(numFiles, len(excludes), len(mutexes)))
+for name, costs, budget in (
+	("By size (512000 bytes)", sizes, 512000),
+	("By compile time (10s)", compileTimes, 10.0),
+	("By file count (10)", counts, 10),
+):
+	elapsed, (chunks, chunkCosts) = Time(lambda: _chunking.PackChunks(files, costs, budget, _chunking.ChunkRules(cExtensions, cppExtensions, excludes, mutexes)))
+	multi = [cost for chunk, cost in zip(chunks, chunkCosts) if len(chunk) > 1]
+	print("  {:24} {:.3f}s, {} chunks, average fill {:.0f}%".format(name + ":", elapsed, len(chunks), 100.0 * sum(multi) / (len(multi) * budget)))
+	Validate(name, files, chunks, costs, budget, rules, mutexes)
+	Check("{}: packed in under a second".format(name), elapsed < 1.0)
+
+#Adding and removing files should only change the chunks they were in or went into.
+chunks, _ = _chunking.PackChunks(files, sizes, 512000, rules)
+removed = set(random.sample([srcFile for srcFile in files if srcFile not in mutexes], 20))
+added = ["/src/module{}/added{}.cpp".format(random.randint(0, numFiles // 200), i) for i in range(20)]
+newSizes = dict(sizes)
+for srcFile in added:
+	newSizes[srcFile] = random.randint(200, 40000)
+for srcFile in removed:
+	del newSizes[srcFile]
+newFiles = [srcFile for srcFile in files if srcFile not in removed] + added
+elapsed, (newChunks, _) = Time(lambda: _chunking.UpdateChunks(chunks, newFiles, newSizes, 512000, rules))
+before = set(tuple(chunk) for chunk in chunks)
+after = set(tuple(chunk) for chunk in newChunks)
+changed = len(after - before)
+print("Repacking after adding 20 files and removing 20: {:.3f}s, {} of {} chunks changed".format(elapsed, changed, len(newChunks)))
+Validate("Repacked", newFiles, newChunks, newSizes, 512000 * _chunking._OVERFLOW, rules, mutexes)
+Check("Repacked: only chunks that gained or lost files changed", changed <= len(removed) + len(added))
+sameDirectory = sum(1 for chunk in newChunks for srcFile in chunk if srcFile in added and any(os.path.dirname(other) == os.path.dirname(srcFile) for other in chunk if other != srcFile))
+print("  {} of {} added files went into a chunk with files from their own directory".format(sameDirectory, len(added)))
+
+#Looking up every file's chunk, as the dependency check does, and every chunk by name, as the build does.
+def LookUpAll():
+	index = _chunking.ChunkIndex("bench", chunks)
+	names = [index.GetChunkName(srcFile) for srcFile in files]
+	return index, names
+elapsed, (index, names) = Time(LookUpAll)
+Check("Lookup: every file's chunk is found by name", all(srcFile in index.GetChunk(name) for srcFile, name in zip(files, names)))
+print("Indexing {} chunks and looking up {} files: {:.3f}s".format(len(chunks), len(files), elapsed))
+
+#The original packing is quadratic, so it's only timed on a tenth of the files.
+smallFiles = files[:numFiles // 10]
+def CanJoin(chunk, newFile):
+	group = rules.GetGroup(newFile)
+	return group is not None and group == rules.GetGroup(chunk[0]) and not rules.Conflicts(newFile, set(chunk))
+oldTime, _ = Time(lambda: OldSizePacking(smallFiles, sizes, 512000, CanJoin), repeat=1)
+newTime, _ = Time(lambda: _chunking.PackChunks(smallFiles, sizes, 512000, rules))
+smallChunks, _ = _chunking.PackChunks(smallFiles, sizes, 512000, rules)
+def OldLookUp(srcFile):
+	#projectSettings.get_chunk() before the index, hashing every chunk's file names until it found the file.
+	for chunk in smallChunks:
+		if srcFile in chunk:
+			return _utils.GetChunkName("bench", chunk)
+	return None
+oldLookup, _ = Time(lambda: [OldLookUp(srcFile) for srcFile in smallFiles[:500]], repeat=1)
+def NewLookUp():
+	smallIndex = _chunking.ChunkIndex("bench", smallChunks)
+	return [smallIndex.GetChunkName(srcFile) for srcFile in smallFiles[:500]]
+newLookup, _ = Time(NewLookUp)
+print("{} files by size: original packing {:.3f}s, packer {:.3f}s ({:.0f}x)".format(len(smallFiles), oldTime, newTime, oldTime / max(newTime, 1e-9)))
+print("500 chunk lookups in {} files: original {:.3f}s, index {:.3f}s including building it ({:.0f}x)".format(len(smallFiles), oldLookup, newLookup, oldLookup / max(newLookup, 1e-9)))
+
+if exitCode == 0:
+	print("All checks passed.")
+sys.exit(exitCode)
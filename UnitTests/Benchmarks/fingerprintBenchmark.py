@@ -0,0 +1,155 @@
+#!/usr/bin/python
+
+"""
+Compares the streaming fingerprint hasher (_utils.GetFileFingerprint) against the original
+regex-based _utils.GetMd5, both for speed and for the rebuild decisions they lead to.
+
+Run from this directory: python fingerprintBenchmark.py
+"""
+
+import sys
+import os
+import random
+import shutil
+import tempfile
+import time
+import hashlib
+
+sys.path.insert(0, "../../")
+
+#Keep csbuild from trying to run a build when it's imported.
+sys.runningSphinx = True
+
+from csbuild import _utils
+from csbuild import _shared_globals
+
+exitCode = 0
+
+fragments = [
+	"int x = 0;\n",
+	"// line comment with \"quotes\" and 'apostrophes'\n",
+	"/* block\n   comment */\n",
+	"const char* s = \"not // a comment\";\n",
+	"const char* t = \"escaped \\\" quote /* still a string */\";\n",
+	"char c = '\\'';\n",
+	"char d = '\"';\n",
+	"a = b / c;\n",
+	"#define URL \"http://example.com\"\n",
+	"#error don't do this\n",
+	"/* unterminated",
+	"\"unterminated\n",
+	"x = y/*inline*/+z;\n",
+	"path = \"C:\\\\dir\\\\\"; // trailing backslashes\n",
+	"\r\n",
+	"y = 1; // old mac line ending\r",
+]
+
+def OldFingerprint(path):
+	if sys.version_info >= (3, 0):
+		f = open(path, encoding="latin-1", newline=None)
+	else:
+		f = open(path)
+	with f:
+		return _utils.GetMd5(f)
+
+def WriteFile(path, text):
+	with open(path, "wb") as f:
+		f.write(text.encode("latin-1"))
+
+def Check(name, condition):
+	global exitCode
+	if not condition:
+		print("FAILED: {}".format(name))
+		exitCode = 1
+
+tempDir = tempfile.mkdtemp()
+try:
+	_shared_globals.fingerprint_digest = "md5"
+
+	# 1. Equivalence: for randomly assembled sources, both hashers must see exactly the same comment-stripped text.
+	random.seed(1234)
+	mismatches = 0
+	trials = 2000
+	for i in range(trials):
+		text = "".join(random.choice(fragments) for _ in range(random.randint(0, 30)))
+		path = os.path.join(tempDir, "fuzz.cpp")
+		WriteFile(path, text)
+		if OldFingerprint(path) != _utils.GetFileFingerprint(path):
+			mismatches += 1
+			if mismatches <= 3:
+				print("Mismatch for input: {!r}".format(text))
+	print("Equivalence: {}/{} random inputs produced identical md5 fingerprints".format(trials - mismatches, trials))
+	Check("fingerprints match the regex-based hasher", mismatches == 0)
+
+	# 2. Rebuild decisions: comment-only edits must not change the fingerprint, code edits must.
+	#The "#error don't" fragment is left out: like remove_comments(), the fingerprint treats its apostrophe as
+	#the start of a character literal, so comments after it are hashed until the next quote.
+	base = "".join(fragments[:9]) * 50
+	basePath = os.path.join(tempDir, "base.h")
+	WriteFile(basePath, base)
+	commentEdit = base.replace("line comment", "edited comment").replace("block\n   comment", "block\n   remark")
+	codeEdit = base.replace("int x = 0;", "int x = 1;")
+	stringEdit = base.replace("not // a comment", "not // a remark")
+	for digest in ("md5", "sha1", "blake2b"):
+		if digest not in hashlib.algorithms_available:
+			continue
+		_shared_globals.fingerprint_digest = digest
+		baseFingerprint = _utils.GetFileFingerprint(basePath)
+		WriteFile(basePath, commentEdit)
+		Check("{}: comment edit is ignored".format(digest), _utils.GetFileFingerprint(basePath) == baseFingerprint)
+		WriteFile(basePath, codeEdit)
+		Check("{}: code edit is detected".format(digest), _utils.GetFileFingerprint(basePath) != baseFingerprint)
+		WriteFile(basePath, stringEdit)
+		Check("{}: edit inside a string is detected".format(digest), _utils.GetFileFingerprint(basePath) != baseFingerprint)
+		WriteFile(basePath, base)
+	print("Rebuild decisions checked for comment, code and string literal edits")
+
+	# 3. Speed on large generated headers: one with a comment on every line, and a data table with very few.
+	random.seed(5678)
+	lines = []
+	for i in range(200000):
+		lines.append("static const int value_{0} = {1}; // generated entry {0}\n".format(i, random.randint(0, 1 << 30)))
+		if i % 50 == 0:
+			lines.append("/* section {0}\n * with a multi-line comment\n */\n".format(i))
+			lines.append("static const char* name_{0} = \"entry // {0}\";\n".format(i))
+	commentedPath = os.path.join(tempDir, "generated.h")
+	WriteFile(commentedPath, "".join(lines))
+
+	lines = ["// Generated table\n", "static const unsigned char table[] = {\n"]
+	for i in range(200000):
+		lines.append("\t" + ", ".join("0x%02x" % random.randint(0, 255) for _ in range(16)) + ",\n")
+		if i % 1000 == 0:
+			lines.append("\t/* row {} */\n".format(i))
+	lines.append("};\n")
+	tablePath = os.path.join(tempDir, "table.h")
+	WriteFile(tablePath, "".join(lines))
+
+	def Time(func, repeat=3):
+		best = None
+		for _ in range(repeat):
+			start = time.time()
+			result = func()
+			elapsed = time.time() - start
+			if best is None or elapsed < best:
+				best = elapsed
+		return best, result
+
+	for name, path in (("Commented header", commentedPath), ("Table header", tablePath)):
+		_shared_globals.fingerprint_digest = "md5"
+		oldTime, oldResult = Time(lambda: OldFingerprint(path))
+		print("{}: {:.1f} MB".format(name, os.path.getsize(path) / (1024.0 * 1024.0)))
+		print("  regex GetMd5:                       {:.3f}s".format(oldTime))
+		for digest in ("md5", "sha1", "blake2b"):
+			if digest not in hashlib.algorithms_available:
+				continue
+			_shared_globals.fingerprint_digest = digest
+			newTime, newResult = Time(lambda: _utils.GetFileFingerprint(path))
+			print("  streaming GetFileFingerprint ({:7}): {:.3f}s ({:.1f}x)".format(digest, newTime, oldTime / max(newTime, 1e-9)))
+			if digest == "md5":
+				Check("{} fingerprints match".format(name), newResult == oldResult)
+finally:
+	shutil.rmtree(tempDir)
+
+if exitCode == 0:
+	print("All checks passed.")
+sys.exit(exitCode)
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+
+"""
+Packs a made up project's source files into chunks, then adds one file and removes another the way a build would,
+starting from the chunks the previous build saved, and checks that only the chunk that gained or lost a file changes
+name. Also checks that saved chunks are only used when they were saved the same way, and that a file that isn't a
+saved chunk assignment is ignored rather than breaking the build.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+if sys.version_info < (3, 0):
+	import cPickle as pickle
+else:
+	import pickle
+
+sys.path.insert(0, "../../")
+
+#Keep csbuild from trying to run a build when it's imported.
+sys.runningSphinx = True
+
+from csbuild import _chunking
+
+exitCode = 0
+
+def Check(name, condition, details=None):
+	global exitCode
+	if not condition:
+		print("FAILED: {}".format(name))
+		if details is not None:
+			print(details)
+		exitCode = 1
+
+rules = _chunking.ChunkRules([".c"], [".cpp"], ["src/alone.cpp"], {"src/net/a.cpp": ["src/net/b.cpp"]})
+budget = 100
+
+def MakeProject():
+	"""
+	:return: Cost of each file in a project spread over a few directories, with a C file, a file excluded from
+		chunking, and two files that can't share a chunk
+	:rtype: dict[str, int]
+	"""
+	costs = {"src/alone.cpp": 10, "src/legacy.c": 10}
+	for directory, count in (("src/core", 9), ("src/net", 6), ("src/ui", 7)):
+		for i in range(count):
+			costs["{}/{}.cpp".format(directory, "abcdefghi"[i])] = 15 + 5 * (i % 3)
+	return costs
+
+def Names(chunks):
+	return _chunking.ChunkIndex("app", chunks).names
+
+def Changed(before, after):
+	"""
+	:return: Names of chunks that are in one build's chunks but not the other's
+	:rtype: set[str]
+	"""
+	return set(Names(before)) ^ set(Names(after))
+
+def CheckChunks(name, chunks, costs):
+	files = [srcFile for chunk in chunks for srcFile in chunk]
+	Check("{}: every file is in exactly one chunk".format(name), sorted(files) == sorted(costs), chunks)
+	for chunk in chunks:
+		if len(chunk) > 1:
+			Check("{}: chunks stay within budget".format(name), sum(costs[srcFile] for srcFile in chunk) <= budget, chunk)
+			Check("{}: C and C++ files don't share a chunk".format(name),
+				len(set(rules.GetGroup(srcFile) for srcFile in chunk)) == 1, chunk)
+			Check("{}: excluded file gets a chunk to itself".format(name), "src/alone.cpp" not in chunk, chunk)
+			Check("{}: mutually exclusive files don't share a chunk".format(name),
+				not ("src/net/a.cpp" in chunk and "src/net/b.cpp" in chunk), chunk)
+
+def TestStableChunks(tempDir):
+	path = _chunking.GetAssignmentPath(tempDir, "app@release")
+	mode = ("size", budget)
+	costs = MakeProject()
+
+	Check("Nothing saved before the first build", _chunking.LoadAssignment(path, mode) is None)
+	chunks, _ = _chunking.PackChunks(sorted(costs), costs, budget, rules)
+	CheckChunks("First build", chunks, costs)
+	_chunking.SaveAssignment(path, mode, chunks)
+	Check("Saved chunks load back", _chunking.LoadAssignment(path, mode) == chunks)
+
+	#Nothing changed, so nothing is renamed.
+	previous = _chunking.LoadAssignment(path, mode)
+	same, _ = _chunking.UpdateChunks(previous, sorted(costs), costs, budget, rules)
+	Check("No changes: every chunk is kept", same == chunks, same)
+
+	#Adding a file only changes the chunk it goes into.
+	#Costs more than most, so packing from scratch would place it before most other files and move them around.
+	costs["src/core/added.cpp"] = 25
+	added, _ = _chunking.UpdateChunks(previous, sorted(costs), costs, budget, rules)
+	CheckChunks("Add file", added, costs)
+	changed = Changed(chunks, added)
+	gained = [name for name, chunk in zip(Names(added), added) if "src/core/added.cpp" in chunk]
+	Check("Add file: only the chunk that gained it changes", len(changed) == 2 and set(gained) < changed, changed)
+	_chunking.SaveAssignment(path, mode, added)
+
+	#Removing one only changes the chunk it was in.
+	del costs["src/ui/c.cpp"]
+	previous = _chunking.LoadAssignment(path, mode)
+	removed, _ = _chunking.UpdateChunks(previous, sorted(costs), costs, budget, rules)
+	CheckChunks("Remove file", removed, costs)
+	changed = Changed(added, removed)
+	lost = [name for name, chunk in zip(Names(added), added) if "src/ui/c.cpp" in chunk]
+	Check("Remove file: only the chunk that lost it changes", len(changed) == 2 and set(lost) < changed, changed)
+
+	#A saved chunk with a file that can't be in it anymore drops the file, and keeps its other files together.
+	broken = [list(chunk) for chunk in removed if "src/legacy.c" not in chunk]
+	broken[0].append("src/legacy.c")
+	repaired, _ = _chunking.UpdateChunks(broken, sorted(costs), costs, budget, rules)
+	CheckChunks("File that can't share a saved chunk", repaired, costs)
+	Check("File that can't share a saved chunk: the rest of the chunk is kept", broken[0][:-1] in repaired, repaired)
+
+def TestSavedAssignment(tempDir):
+	path = os.path.join(tempDir, "chunks.csbc")
+	chunks = [["src/a.cpp", "src/b.cpp"], ["src/c.cpp"]]
+	_chunking.SaveAssignment(path, ("size", 100), chunks)
+	Check("Saved chunks are used with the same mode", _chunking.LoadAssignment(path, ("size", 100)) == chunks)
+	Check("Saved chunks are ignored with a different mode", _chunking.LoadAssignment(path, ("size", 200)) is None)
+
+	for name, data in (
+		("an older version", {"version": 0, "mode": ("size", 100), "chunks": chunks}),
+		("a list", [chunks]),
+		("a string", "chunks"),
+		("None", None),
+	):
+		with open(path, "wb") as f:
+			pickle.dump(data, f, 2)
+		Check("Saved chunks from {} are ignored".format(name), _chunking.LoadAssignment(path, ("size", 100)) is None)
+
+	with open(path, "wb") as f:
+		f.write(b"not a pickle")
+	Check("Unreadable saved chunks are ignored", _chunking.LoadAssignment(path, ("size", 100)) is None)
+
+tempDir = tempfile.mkdtemp()
+try:
+	TestStableChunks(tempDir)
+	TestSavedAssignment(tempDir)
+finally:
+	shutil.rmtree(tempDir)
+
+if exitCode == 0:
+	print("Chunking test successful.")
+sys.exit(exitCode)
@@ -0,0 +1,184 @@
+#!/usr/bin/python
+
+"""
+Builds the project in template/ in a scratch directory through a build daemon, and checks that the server started by
+the first build is reused by the next ones, that it sees changes made between builds, that it starts over when the
+makefile or the environment changes, and that --stop-daemon shuts it down. Everything is checked twice, once with the
+file watcher keeping the stat cache between builds and once without it, where every build has to rescan the tree.
+
+The client hands its own stdout to the build the server forks, so a build's output is still read from the client's
+pipe here.
+"""
+
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+csbuildPath = os.path.abspath("../../")
+templateDir = os.path.abspath("template")
+
+exitCode = 0
+#Prefixed to the name of every check, to tell the runs with and without the file watcher apart.
+checkPrefix = ""
+
+_ansiEscape = re.compile(r"\x1b[^m]*m")
+_compiling = re.compile(r"Compiling (\S+?)_release\.o")
+_listening = re.compile(r"Build daemon listening on (\S+)")
+
+def Check(name, condition, output=None):
+	global exitCode
+	name = checkPrefix + name
+	if not condition:
+		print("FAILED: {}".format(name))
+		if output is not None:
+			print(output)
+		exitCode = 1
+	else:
+		print("ok: {}".format(name))
+
+class Checkout(object):
+	"""
+	A scratch copy of the template project.
+	"""
+	def __init__(self, fileWatcher=True):
+		self.fileWatcher = fileWatcher
+		self.root = tempfile.mkdtemp()
+		self.dir = os.path.join(self.root, "project")
+		shutil.copytree(templateDir, self.dir)
+
+	def Path(self, name):
+		return os.path.join(self.dir, name)
+
+	def Write(self, name, contents):
+		#Some filesystems only keep modification times to the second.
+		time.sleep(1.0)
+		with open(self.Path(name), "w") as f:
+			f.write(contents)
+
+	def Read(self, name):
+		with open(self.Path(name)) as f:
+			return f.read()
+
+	def Build(self, *args, **kwargs):
+		"""
+		:return: The build's exit code, the names of the translation units it compiled, and its output
+		:rtype: tuple[int, list[str], str]
+		"""
+		env = dict(os.environ)
+		env["CSBUILD_PATH"] = csbuildPath
+		if not self.fileWatcher:
+			env["CSBUILD_TEST_NO_FILE_WATCHER"] = "1"
+		env.update(kwargs.get("env", {}))
+		#Verbose, so the server logs whether it has a file watcher.
+		with open(os.devnull, "r") as devnull:
+			proc = subprocess.Popen(
+				[sys.executable, "make.py", "--no-chunks", "--force-color", "off", "--force-progress-bar", "off", "-v",
+					"--daemon"] + list(args),
+				stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=self.dir, env=env
+			)
+			output = proc.communicate()[0]
+		if sys.version_info >= (3, 0):
+			output = output.decode("UTF-8", "replace")
+		output = _ansiEscape.sub("", output)
+		return proc.returncode, sorted(_compiling.findall(output)), output
+
+	def Run(self):
+		proc = subprocess.Popen([os.path.join(self.dir, "gcc-x64-release", "hello")], stdout=subprocess.PIPE)
+		output = proc.communicate()[0]
+		if sys.version_info >= (3, 0):
+			output = output.decode("UTF-8")
+		return output.strip()
+
+	def ServerLog(self):
+		"""
+		:return: What the current server has logged so far
+		:rtype: str
+		"""
+		try:
+			with open(self.Path(os.path.join(".csbuild", "log", "daemon.log"))) as f:
+				return _ansiEscape.sub("", f.read())
+		except IOError:
+			return ""
+
+	def SocketPath(self):
+		"""
+		:return: The socket the current server reported listening on, or None if it hasn't
+		:rtype: str
+		"""
+		match = _listening.search(self.ServerLog())
+		return match.group(1) if match else None
+
+	def Close(self):
+		self.Build("--stop-daemon")
+		shutil.rmtree(self.root)
+
+def CheckBuild(checkout, name, expectedCompiles, expectStart, expectedResult=None, **kwargs):
+	code, compiled, output = checkout.Build(**kwargs)
+	Check("{}: build succeeds".format(name), code == 0, output)
+	Check("{}: compiles {}".format(name, expectedCompiles or "nothing"), compiled == sorted(expectedCompiles), output)
+	started = "Starting build daemon..." in output
+	Check("{}: {}".format(name, "starts a server" if expectStart else "reuses the server"), started == expectStart, output)
+	if expectedResult is not None and code == 0:
+		Check("{}: hello prints {}".format(name, expectedResult), checkout.Run() == expectedResult)
+	return output
+
+def TestDaemon(fileWatcher):
+	checkout = Checkout(fileWatcher)
+	try:
+		CheckBuild(checkout, "First build", ["main", "other"], True, "1")
+		path = checkout.SocketPath()
+		Check("Server is listening", path is not None and os.path.exists(path))
+		Check("Server {} the file watcher".format("uses" if fileWatcher else "falls back without"),
+			("every build will rescan the tree" in checkout.ServerLog()) != fileWatcher, checkout.ServerLog())
+		CheckBuild(checkout, "No changes", [], False)
+
+		checkout.Write("src/main.cpp", checkout.Read("src/main.cpp").replace("%d\\n\", 1", "%d\\n\", 2"))
+		CheckBuild(checkout, "Edit source", ["main"], False, "2")
+		CheckBuild(checkout, "No changes after editing source", [], False)
+
+		checkout.Write("src/added.cpp", "int Added()\n{\n\treturn 3;\n}\n")
+		CheckBuild(checkout, "Add source", ["added"], False)
+		CheckBuild(checkout, "No changes after adding source", [], False)
+
+		checkout.Write("src/other.cpp", checkout.Read("src/other.cpp").replace("return 2;", "return 2"))
+		code, compiled, output = checkout.Build()
+		Check("Compile error: exit code is passed back", code != 0, output)
+		Check("Compile error: reuses the server", "Starting build daemon..." not in output, output)
+		checkout.Write("src/other.cpp", checkout.Read("src/other.cpp").replace("return 2", "return 2;"))
+		CheckBuild(checkout, "Fix compile error", ["other"], False)
+
+		checkout.Write("make.py", checkout.Read("make.py") + "\n#Edited.\n")
+		CheckBuild(checkout, "Edit makefile", [], True)
+		CheckBuild(checkout, "No changes after editing makefile", [], False)
+
+		CheckBuild(checkout, "Change environment", [], True, env={"CSBUILD_TEST_DAEMON": "1"})
+		CheckBuild(checkout, "No changes after changing environment", [], False, env={"CSBUILD_TEST_DAEMON": "1"})
+		#Back to the environment the other builds ran with.
+		CheckBuild(checkout, "Restore environment", [], True)
+
+		path = checkout.SocketPath()
+		code, _, output = checkout.Build("--stop-daemon")
+		Check("Stop daemon: exits cleanly", code == 0, output)
+		Check("Stop daemon: socket is removed", path is not None and not os.path.exists(path))
+		code, _, output = checkout.Build("--stop-daemon")
+		Check("Stop daemon again: nothing to stop", code == 0 and "No build daemon is running" in output, output)
+	finally:
+		checkout.Close()
+
+#The daemon passes file descriptors over a Unix socket and forks its builds, neither of which works everywhere.
+if sys.version_info < (3, 0) or not hasattr(socket, "AF_UNIX") or not hasattr(os, "fork"):
+	print("Build daemon is not supported here, skipping.")
+	sys.exit(0)
+
+TestDaemon(True)
+checkPrefix = "Without file watcher: "
+TestDaemon(False)
+
+if exitCode == 0:
+	print("Daemon test successful.")
+sys.exit(exitCode)
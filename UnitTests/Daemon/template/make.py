@@ -0,0 +1,21 @@
+#!/usr/bin/python
+
+import os
+import sys
+sys.path.insert(0, os.environ["CSBUILD_PATH"])
+
+import csbuild
+
+csbuild.Toolchain("gcc").SetCxxCommand(os.environ.get("CXX", "g++"))
+if os.environ.get("CSBUILD_TEST_NO_FILE_WATCHER"):
+	#As if inotify weren't available, so the daemon has to rescan the tree for every build.
+	from csbuild import _file_watcher
+	_file_watcher._libc = None
+
+@csbuild.project(
+	name="hello",
+	workingDirectory="src",
+	depends=[],
+)
+def hello():
+	csbuild.SetOutput("hello", csbuild.ProjectType.Application)
@@ -0,0 +1,7 @@
+#include <cstdio>
+
+int main()
+{
+	std::printf("%d\n", 1);
+	return 0;
+}
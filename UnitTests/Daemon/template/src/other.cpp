@@ -0,0 +1,4 @@
+int Other()
+{
+	return 2;
+}
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+"""
+Runs a build worker on a free port and sends it compiles the way a distributed build does, checking that it sends back
+a working object file or the compiler's errors. Then has a worker fail partway through a compile, and checks that the
+translation unit is handed back to be compiled locally, that the worker isn't used again, and that the local compiles
+that take over its share never run more than -j at once.
+"""
+
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, "../../")
+
+#Keep csbuild from trying to run a build when it's imported.
+sys.runningSphinx = True
+
+from csbuild import _distributed
+
+exitCode = 0
+
+compiler = os.environ.get("CXX", "g++")
+
+def Check(name, condition):
+	global exitCode
+	if not condition:
+		print("FAILED: {}".format(name))
+		exitCode = 1
+
+def GetFreePort():
+	sock = socket.socket()
+	sock.bind(("127.0.0.1", 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+def WaitUntil(condition, timeout=10):
+	end = time.time() + timeout
+	while not condition() and time.time() < end:
+		time.sleep(0.01)
+	return condition()
+
+def Reset(localSlots):
+	del _distributed._workers[:]
+	_distributed._localSlots = localSlots
+	_distributed._localInUse = 0
+	_distributed.remoteCompiles = 0
+
+def CompileOn(worker, tempDir, name, contents):
+	source = os.path.join(tempDir, name + ".cpp")
+	with open(source, "w") as f:
+		f.write(contents)
+	obj = os.path.join(tempDir, name + ".o")
+	result = _distributed.Compile(
+		worker,
+		"{} -E -x c++ \"{}\"".format(compiler, source),
+		"{} -c -x c++-cpp-output -o\"{}\" \"{}\"".format(compiler, _distributed.REMOTE_OBJECT_NAME, _distributed.REMOTE_SOURCE_NAME),
+		obj,
+		tempDir,
+		dict(os.environ)
+	)
+	return result, obj
+
+def TestWorker(tempDir):
+	port = GetFreePort()
+	thread = threading.Thread(target=_distributed.RunWorker, args=("127.0.0.1:{}".format(port), 2))
+	thread.daemon = True
+	thread.start()
+
+	def _listening():
+		try:
+			socket.create_connection(("127.0.0.1", port)).close()
+			return True
+		except socket.error:
+			return False
+	Check("Worker listens on the port it's given", WaitUntil(_listening))
+
+	Reset(1)
+	Check("Build connects to worker", _distributed.Connect(["127.0.0.1:{}".format(port)]) == 2)
+	Check("Worker is enabled", _distributed.IsEnabled())
+	worker = _distributed._workers[0]
+
+	result, obj = CompileOn(worker, tempDir, "good", "int Good() { return 1; }\n")
+	Check("Worker compiles", result is not None and result[0] == 0)
+	Check("Worker sends back the object", os.path.exists(obj) and os.path.getsize(obj) > 0)
+	Check("Remote compile is counted", _distributed.remoteCompiles == 1)
+	if os.path.exists(obj):
+		#Checked by linking it into a program that calls it.
+		main = os.path.join(tempDir, "main.cpp")
+		with open(main, "w") as f:
+			f.write("int Good();\nint main() { return Good() == 1 ? 0 : 1; }\n")
+		program = os.path.join(tempDir, "program")
+		Check("Object from worker links", subprocess.call([compiler, "-o", program, main, obj]) == 0)
+		Check("Object from worker runs", subprocess.call([program]) == 0)
+
+	result, obj = CompileOn(worker, tempDir, "bad", "int Bad() { return undeclared; }\n")
+	Check("Worker reports compile errors", result is not None and result[0] != 0 and "undeclared" in result[2])
+	Check("No object for a failed compile", not os.path.exists(obj))
+	Check("Worker is still used after a compile error", not worker.failed)
+
+	result, obj = CompileOn(worker, tempDir, "unprocessed", "#include \"missing.h\"\n")
+	Check("Preprocessor errors are left to a local compile", result is None and not worker.failed)
+
+def TestFailedWorker(tempDir):
+	#Accepts the compile, then hangs up without answering, as a worker that crashes would.
+	listener = socket.socket()
+	listener.bind(("127.0.0.1", 0))
+	listener.listen(5)
+	def _hangUp():
+		while True:
+			try:
+				conn, _ = listener.accept()
+			except socket.error:
+				return
+			conn.close()
+	thread = threading.Thread(target=_hangUp)
+	thread.daemon = True
+	thread.start()
+
+	Reset(2)
+	worker = _distributed.Worker("127.0.0.1", listener.getsockname()[1], 2)
+	_distributed._workers.append(worker)
+	try:
+		Check("Local slots are used first", _distributed.AcquireSlot() is None and _distributed.AcquireSlot() is None)
+		Check("Worker slot is used once local slots are full", _distributed.AcquireSlot() is worker)
+
+		result, obj = CompileOn(worker, tempDir, "lost", "int Lost() { return 1; }\n")
+		Check("Failed worker hands the compile back", result is None)
+		Check("Failed worker is marked", worker.failed)
+		Check("Nothing was compiled remotely", _distributed.remoteCompiles == 0)
+
+		#What the build does with a compile its worker dropped: swap the worker's slot for a local one, which means
+		#waiting while -j compiles are already running locally.
+		_distributed.ReleaseSlot(worker)
+		acquired = []
+		waiter = threading.Thread(target=lambda: acquired.append(_distributed.AcquireSlot(localOnly=True)))
+		waiter.daemon = True
+		waiter.start()
+		time.sleep(0.2)
+		Check("Local compile waits for a local slot", not acquired)
+
+		other = []
+		taker = threading.Thread(target=lambda: other.append(_distributed.AcquireSlot()))
+		taker.daemon = True
+		taker.start()
+		time.sleep(0.2)
+		Check("Failed worker's free slots aren't used", not other)
+		Check("Local compiles never exceed -j", _distributed._localInUse == 2)
+
+		_distributed.ReleaseSlot(None)
+		_distributed.ReleaseSlot(None)
+		Check("Waiting compiles get the freed local slots", WaitUntil(lambda: len(acquired) + len(other) == 2))
+		Check("Freed slots are local", acquired == [None] and other == [None])
+		Check("Local compiles still never exceed -j", _distributed._localInUse == 2)
+		waiter.join(1)
+		taker.join(1)
+	finally:
+		listener.close()
+		Reset(0)
+
+tempDir = tempfile.mkdtemp()
+try:
+	os.mkdir(os.path.join(tempDir, "worker"))
+	os.mkdir(os.path.join(tempDir, "failed"))
+	TestWorker(os.path.join(tempDir, "worker"))
+	TestFailedWorker(os.path.join(tempDir, "failed"))
+finally:
+	shutil.rmtree(tempDir)
+
+if exitCode == 0:
+	print("Distributed test successful.")
+sys.exit(exitCode)
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+
+"""
+Checks that the file watcher reports files created, modified and deleted in the directories it watches, and that the
+stat cache the build daemon keeps between builds with it lets a build skip the directory walk and the stat calls for
+files that haven't changed, while still seeing the ones that have. Without a watcher, the daemon has to fall back to
+rescanning everything on every build.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, "../../")
+
+#Keep csbuild from trying to run a build when it's imported.
+sys.runningSphinx = True
+
+from csbuild import _daemon
+from csbuild import _file_watcher
+from csbuild import _stat_cache
+
+exitCode = 0
+
+def Check(name, condition):
+	global exitCode
+	if not condition:
+		print("FAILED: {}".format(name))
+		exitCode = 1
+
+def Write(path, contents):
+	with open(path, "w") as f:
+		f.write(contents)
+
+def ReadEvents(watcher):
+	#Events are delivered asynchronously, so give the kernel a moment to queue them.
+	time.sleep(0.1)
+	return watcher.ReadEvents()
+
+class Counter(object):
+	"""
+	Counts the directories the stat cache scans, and the files a build has to stat because the cache didn't know them.
+	"""
+	def __init__(self):
+		self.scanned = []
+		self.statted = []
+		self._scandir = _stat_cache._scandir
+
+	def __enter__(self):
+		def _scandir(path):
+			self.scanned.append(path)
+			return self._scandir(path)
+		_stat_cache._scandir = _scandir
+		return self
+
+	def __exit__(self, *args):
+		_stat_cache._scandir = self._scandir
+
+def LookAtEverything(root, counter):
+	"""
+	Do what a build does with its source tree: walk it and stat every file found.
+
+	:return: The size of every file, by path
+	:rtype: dict[str, int]
+	"""
+	sizes = {}
+	for directory, _, filenames in _stat_cache.Walk(root):
+		for filename in filenames:
+			path = os.path.join(directory, filename)
+			if path not in _stat_cache._stats:
+				counter.statted.append(path)
+			sizes[path] = _stat_cache.GetSize(path)
+	return sizes
+
+def Build(watcher, root):
+	"""
+	Run a build the way the daemon does: the build process starts from the cache the server kept and hands what it
+	learned back to the server, which keeps only what the watcher can vouch for.
+	"""
+	trustedDirectories = set(watcher.directories)
+	kept = _stat_cache.GetSnapshot()
+	with Counter() as counter:
+		sizes = LookAtEverything(root, counter)
+	report = {"statCache": _stat_cache.GetSnapshot(), "walkedRoots": _stat_cache.GetWalkedRoots()}
+
+	#Back in the server, which still only knows what it kept before the build.
+	_stat_cache.Clear()
+	_stat_cache.ApplySnapshot(kept, set(os.path.dirname(path) for path in kept[0]) | set(kept[1]))
+	_daemon._keepWarm(watcher, report, trustedDirectories, _file_watcher.Journal())
+	return sizes, counter
+
+def TestJournal(tempDir):
+	watcher = _file_watcher.FileWatcher()
+	try:
+		watcher.WatchDirectory(tempDir, True)
+		path = os.path.join(tempDir, "a.cpp")
+
+		Write(path, "int a;\n")
+		Check("Create is recorded", path in ReadEvents(watcher).changedPaths)
+
+		with open(path, "a") as f:
+			f.write("int b;\n")
+		Check("Modify is recorded", path in ReadEvents(watcher).changedPaths)
+
+		os.remove(path)
+		Check("Delete is recorded", path in ReadEvents(watcher).changedPaths)
+
+		Check("Nothing is recorded without changes", not ReadEvents(watcher).changedPaths)
+
+		#Directories created under a recursive watch are watched too.
+		subdir = os.path.join(tempDir, "sub")
+		os.mkdir(subdir)
+		journal = ReadEvents(watcher)
+		Check("Created directory is recorded", subdir in journal.changedTrees)
+		Check("Created directory is watched", subdir in watcher.directories)
+		nested = os.path.join(subdir, "b.h")
+		Write(nested, "#pragma once\n")
+		Check("Create in new directory is recorded", nested in ReadEvents(watcher).changedPaths)
+
+		shutil.rmtree(subdir)
+		journal = ReadEvents(watcher)
+		Check("Deleted directory is recorded", subdir in journal.changedTrees)
+		Check("Deleted directory is no longer watched", subdir not in watcher.directories)
+		Check("Journal didn't overflow", not journal.overflowed)
+	finally:
+		watcher.Close()
+
+def TestWarmStatCache(tempDir):
+	root = os.path.join(tempDir, "project")
+	os.makedirs(os.path.join(root, "src"))
+	os.makedirs(os.path.join(root, "include"))
+	Write(os.path.join(root, "src", "main.cpp"), "int main(){ return 0; }\n")
+	Write(os.path.join(root, "src", "util.cpp"), "int util(){ return 1; }\n")
+	Write(os.path.join(root, "include", "util.h"), "int util();\n")
+
+	watcher = _file_watcher.FileWatcher()
+	_stat_cache.Clear()
+	try:
+		#Nothing is watched before the first build, so nothing it learns can be kept; it does get watched after.
+		sizes, counter = Build(watcher, root)
+		Check("First build walks every directory", len(counter.scanned) == 3)
+		Check("First build finds every file", len(sizes) == 3)
+		Check("Walked directories are watched afterward", os.path.join(root, "src") in watcher.directories)
+
+		sizes, counter = Build(watcher, root)
+		Check("Second build still walks, since nothing was watched at the start", len(counter.scanned) == 3)
+
+		sizes, counter = Build(watcher, root)
+		Check("Unchanged build doesn't rescan any directory", counter.scanned == [])
+		Check("Unchanged build doesn't stat any file", counter.statted == [])
+		Check("Unchanged build still finds every file", len(sizes) == 3)
+
+		edited = os.path.join(root, "src", "util.cpp")
+		Write(edited, "int util(){ return 2; }\n// Changed.\n")
+		_daemon._applyJournal(ReadEvents(watcher))
+		sizes, counter = Build(watcher, root)
+		Check("Edit only rescans its own directory", counter.scanned == [os.path.join(root, "src")])
+		Check("Edit only stats the edited file", counter.statted == [edited])
+		Check("Edit sees the new size", sizes.get(edited) == os.path.getsize(edited))
+
+		added = os.path.join(root, "include", "added.h")
+		Write(added, "#pragma once\n")
+		_daemon._applyJournal(ReadEvents(watcher))
+		sizes, counter = Build(watcher, root)
+		Check("Added file is found", added in sizes)
+		Check("Added file only rescans its own directory", counter.scanned == [os.path.join(root, "include")])
+
+		os.remove(added)
+		_daemon._applyJournal(ReadEvents(watcher))
+		sizes, counter = Build(watcher, root)
+		Check("Deleted file is gone", added not in sizes)
+	finally:
+		watcher.Close()
+		_stat_cache.Clear()
+
+def TestFallback():
+	libc = _file_watcher._libc
+	_file_watcher._libc = None
+	try:
+		Check("Watcher isn't supported without inotify", not _file_watcher.IsSupported())
+		Check("Daemon starts without a watcher", _daemon._startWatcher() is None)
+	finally:
+		_file_watcher._libc = libc
+
+if sys.version_info < (3, 0) or not _file_watcher.IsSupported():
+	print("File watcher is not supported here, skipping.")
+	sys.exit(0)
+
+tempDir = tempfile.mkdtemp()
+try:
+	os.mkdir(os.path.join(tempDir, "journal"))
+	TestJournal(os.path.join(tempDir, "journal"))
+	TestWarmStatCache(tempDir)
+	TestFallback()
+finally:
+	shutil.rmtree(tempDir)
+
+if exitCode == 0:
+	print("File watcher test successful.")
+sys.exit(exitCode)
@@ -0,0 +1,321 @@
+#!/usr/bin/python
+
+"""
+Builds the project in template/ in a scratch directory, then changes its files between builds and checks that exactly
+the right translation units are recompiled each time, and that the program that's linked reflects the change.
+
+app/src/main.cpp includes app/src/common.h, which includes lib/include/util.h from the other project, so an edit to
+util.h only reaches main.cpp indirectly. Every test of what's recompiled is run twice, once with the headers found by
+scanning for includes and once with the dependency files the compiler writes.
+
+The compile cache is checked the same way: after the objects are deleted, a rebuild should restore every one of them
+from the local store, or from a csbuild-cache-server once the local store is gone too.
+"""
+
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+csbuildPath = os.path.abspath("../../")
+templateDir = os.path.abspath("template")
+
+exitCode = 0
+#Prefixed to the name of every check, to tell the runs with and without dependency files apart.
+checkPrefix = ""
+
+_ansiEscape = re.compile(r"\x1b[^m]*m")
+_compiling = re.compile(r"Compiling (\S+?)_release\.o")
+_cacheStats = re.compile(r"Compile cache: (\d+) hits(?: \((\d+) from [^)]*\))?, (\d+) misses")
+
+def Check(name, condition, output=None):
+	global exitCode
+	name = checkPrefix + name
+	if not condition:
+		print("FAILED: {}".format(name))
+		if output is not None:
+			print(output)
+		exitCode = 1
+	else:
+		print("ok: {}".format(name))
+
+class Checkout(object):
+	"""
+	A scratch copy of the template project.
+	"""
+	def __init__(self, dependencyFiles=False):
+		self.dependencyFiles = dependencyFiles
+		self.root = tempfile.mkdtemp()
+		self.dir = os.path.join(self.root, "project")
+		shutil.copytree(templateDir, self.dir)
+
+	def Path(self, name):
+		return os.path.join(self.dir, name)
+
+	def Write(self, name, contents):
+		#Some filesystems only keep modification times to the second.
+		time.sleep(1.0)
+		path = self.Path(name)
+		if not os.path.isdir(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+		with open(path, "w") as f:
+			f.write(contents)
+
+	def Read(self, name):
+		with open(self.Path(name)) as f:
+			return f.read()
+
+	def Remove(self, name):
+		time.sleep(1.0)
+		os.remove(self.Path(name))
+
+	def Clean(self, keepCache=True):
+		"""
+		Delete everything the builds wrote, except for the local compile cache if keepCache is set.
+		"""
+		for name in os.listdir(self.dir):
+			if name == ".csbuild":
+				if not keepCache:
+					shutil.rmtree(self.Path(name))
+				else:
+					for inner in os.listdir(self.Path(name)):
+						if inner != "cache":
+							shutil.rmtree(os.path.join(self.Path(name), inner))
+			elif name.startswith("gcc-"):
+				shutil.rmtree(self.Path(name))
+		for project in ("app", "lib"):
+			intermediate = os.path.join(self.dir, project, "Intermediate")
+			if os.path.isdir(intermediate):
+				shutil.rmtree(intermediate)
+
+	def Build(self, *args):
+		"""
+		:return: Whether the build succeeded, the names of the translation units it compiled, and its output
+		:rtype: tuple[bool, list[str], str]
+		"""
+		env = dict(os.environ)
+		env["CSBUILD_PATH"] = csbuildPath
+		if self.dependencyFiles:
+			env["CSBUILD_TEST_DEPENDENCY_FILES"] = "1"
+		proc = subprocess.Popen(
+			[sys.executable, "make.py", "--no-chunks", "--force-color", "off", "--force-progress-bar", "off"] + list(args),
+			stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=self.dir, env=env
+		)
+		output = proc.communicate()[0]
+		if sys.version_info >= (3, 0):
+			output = output.decode("UTF-8", "replace")
+		output = _ansiEscape.sub("", output)
+		return proc.returncode == 0, sorted(_compiling.findall(output)), output
+
+	def Run(self):
+		proc = subprocess.Popen([os.path.join(self.dir, "gcc-x64-release", "app")], stdout=subprocess.PIPE)
+		output = proc.communicate()[0]
+		if sys.version_info >= (3, 0):
+			output = output.decode("UTF-8")
+		return output.strip()
+
+	def Close(self):
+		shutil.rmtree(self.root)
+
+def CheckBuild(checkout, name, expectedCompiles, expectedResult=None, *args):
+	success, compiled, output = checkout.Build(*args)
+	Check("{}: build succeeds".format(name), success, output)
+	Check("{}: compiles {}".format(name, expectedCompiles or "nothing"), compiled == sorted(expectedCompiles), output)
+	if expectedResult is not None and success:
+		Check("{}: app prints {}".format(name, expectedResult), checkout.Run() == expectedResult)
+	return output
+
+def GetCacheStats(output):
+	"""
+	:return: Hits, hits from the remote store and misses the build reported, or None if it didn't report any
+	:rtype: tuple[int, int, int]
+	"""
+	match = _cacheStats.search(output)
+	if match is None:
+		return None
+	return int(match.group(1)), int(match.group(2) or 0), int(match.group(3))
+
+def TestSourceEdit(dependencyFiles):
+	checkout = Checkout(dependencyFiles)
+	try:
+		CheckBuild(checkout, "First build", ["main", "util"], "11")
+		CheckBuild(checkout, "No changes", [])
+
+		checkout.Write("lib/src/util.cpp", checkout.Read("lib/src/util.cpp").replace("return 10;", "return 20;"))
+		CheckBuild(checkout, "Edit source", ["util"], "21")
+		CheckBuild(checkout, "No changes after editing source", [])
+	finally:
+		checkout.Close()
+
+def TestIndirectHeaderEdit(dependencyFiles):
+	checkout = Checkout(dependencyFiles)
+	try:
+		CheckBuild(checkout, "First build", ["main", "util"], "11")
+		CheckBuild(checkout, "No changes", [])
+
+		#Twice, so the second edit is checked against the include index the first one's build saved.
+		for value in (2, 3):
+			checkout.Write("lib/include/util.h", checkout.Read("lib/include/util.h").replace(
+				"return {};".format(value - 1), "return {};".format(value)))
+			CheckBuild(checkout, "Edit indirectly included header ({})".format(value), ["main", "util"], str(10 + value))
+			CheckBuild(checkout, "No changes after edit ({})".format(value), [])
+	finally:
+		checkout.Close()
+
+#Quoted includes are looked up next to the includer first, so this hides lib/include/util.h from main.cpp.
+_shadowingHeader = "#pragma once\n\ninline int Value() { return 5; }\n\nint LibValue();\n"
+
+def TestShadowingHeader(dependencyFiles):
+	checkout = Checkout(dependencyFiles)
+	try:
+		CheckBuild(checkout, "First build", ["main", "util"], "11")
+
+		checkout.Write("app/src/util.h", _shadowingHeader)
+		CheckBuild(checkout, "Add header that shadows an include", ["main"], "15")
+		CheckBuild(checkout, "No changes after adding header", [])
+
+		checkout.Remove("app/src/util.h")
+		CheckBuild(checkout, "Remove shadowing header", ["main"], "11")
+		CheckBuild(checkout, "No changes after removing header", [])
+	finally:
+		checkout.Close()
+
+def TestCommentOnlyEdit(dependencyFiles):
+	checkout = Checkout(dependencyFiles)
+	try:
+		CheckBuild(checkout, "First build", ["main", "util"], "11")
+
+		#Comments are rewritten in place: adding or removing lines moves the code after them, which changes the debug
+		#info, so that does need a recompile.
+		checkout.Write("lib/include/util.h", checkout.Read("lib/include/util.h").replace(
+			"// Value added to the library's.", "// Added to LibValue() by main()."))
+		CheckBuild(checkout, "Comment edited in header", [])
+
+		checkout.Write("app/src/main.cpp", checkout.Read("app/src/main.cpp").replace(
+			"/* Prints both values added together. */", "/* Prints the sum. */"))
+		CheckBuild(checkout, "Comment edited in source", [])
+
+		checkout.Write("app/src/main.cpp", checkout.Read("app/src/main.cpp").replace("return 0;", "return 1;"))
+		CheckBuild(checkout, "Code edited after comment edits", ["main"])
+	finally:
+		checkout.Close()
+
+def TestLocalCompileCache():
+	checkout = Checkout()
+	try:
+		output = CheckBuild(checkout, "First cached build", ["main", "util"], "11", "--compile-cache", "-v")
+		Check("First cached build: misses everything", GetCacheStats(output) == (0, 0, 2), output)
+
+		checkout.Clean()
+		output = CheckBuild(checkout, "Cached build after clean", ["main", "util"], "11", "--compile-cache", "-v")
+		Check("Cached build after clean: hits everything", GetCacheStats(output) == (2, 0, 0), output)
+
+		checkout.Write("lib/include/util.h", checkout.Read("lib/include/util.h").replace("return 1;", "return 4;"))
+		output = CheckBuild(checkout, "Cached build after header edit", ["main", "util"], "14", "--compile-cache", "-v")
+		Check("Cached build after header edit: misses everything", GetCacheStats(output) == (0, 0, 2), output)
+	finally:
+		checkout.Close()
+
+def TestLocalCompileCacheShadowingHeader():
+	#With dependency files, the cache matches objects by the headers the compiler read last time, which a new header
+	#can shadow without any of them changing.
+	checkout = Checkout(True)
+	try:
+		output = CheckBuild(checkout, "First cached build", ["main", "util"], "11", "--compile-cache", "-v")
+		Check("First cached build: misses everything", GetCacheStats(output) == (0, 0, 2), output)
+
+		checkout.Write("app/src/util.h", _shadowingHeader)
+		output = CheckBuild(checkout, "Cached build after adding shadowing header", ["main"], "15", "--compile-cache", "-v")
+		Check("Cached build after adding shadowing header: misses", GetCacheStats(output) == (0, 0, 1), output)
+
+		checkout.Remove("app/src/util.h")
+		output = CheckBuild(checkout, "Cached build after removing shadowing header", ["main"], "11", "--compile-cache", "-v")
+		Check("Cached build after removing shadowing header: hits", GetCacheStats(output) == (1, 0, 0), output)
+	finally:
+		checkout.Close()
+
+def GetFreePort():
+	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	sock.bind(("127.0.0.1", 0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+def StartCacheServer(root):
+	port = GetFreePort()
+	server = subprocess.Popen(
+		[sys.executable, os.path.join(csbuildPath, "scripts", "csbuild-cache-server"), "--root", root, "--port", str(port)]
+	)
+	deadline = time.time() + 10
+	while True:
+		try:
+			socket.create_connection(("127.0.0.1", port), 1).close()
+			break
+		except socket.error:
+			if time.time() > deadline or server.poll() is not None:
+				raise
+			time.sleep(0.1)
+	return server, "http://127.0.0.1:{}".format(port)
+
+def TestRemoteCompileCache():
+	checkout = Checkout()
+	serverRoot = tempfile.mkdtemp()
+	server, url = StartCacheServer(serverRoot)
+	try:
+		output = CheckBuild(checkout, "First remote cached build", ["main", "util"], "11", "--compile-cache-url", url, "-v")
+		Check("First remote cached build: misses everything", GetCacheStats(output) == (0, 0, 2), output)
+
+		#Command lines hold absolute paths, so the remote store is only shared by builds from the same directory.
+		checkout.Clean(keepCache=False)
+		output = CheckBuild(checkout, "Remote cached build after clean", ["main", "util"], "11", "--compile-cache-url", url, "-v")
+		Check("Remote cached build after clean: hits everything remotely", GetCacheStats(output) == (2, 2, 0), output)
+	finally:
+		server.terminate()
+		server.wait()
+		shutil.rmtree(serverRoot)
+		checkout.Close()
+
+def TestRemoteCompileCacheShadowingHeader():
+	checkout = Checkout(True)
+	serverRoot = tempfile.mkdtemp()
+	server, url = StartCacheServer(serverRoot)
+	try:
+		output = CheckBuild(checkout, "First remote cached build", ["main", "util"], "11", "--compile-cache-url", url, "-v")
+		Check("First remote cached build: misses everything", GetCacheStats(output) == (0, 0, 2), output)
+
+		#Only the server's manifest is left to match main.cpp against, and it was recorded without the new header.
+		checkout.Clean(keepCache=False)
+		checkout.Write("app/src/util.h", _shadowingHeader)
+		output = CheckBuild(
+			checkout, "Remote cached build after adding shadowing header", ["main", "util"], "15", "--compile-cache-url", url, "-v"
+		)
+		Check(
+			"Remote cached build after adding shadowing header: only hits the unaffected object",
+			GetCacheStats(output) == (1, 1, 1), output
+		)
+	finally:
+		server.terminate()
+		server.wait()
+		shutil.rmtree(serverRoot)
+		checkout.Close()
+
+for dependencyFiles in (False, True):
+	checkPrefix = "[dependency files] " if dependencyFiles else "[include scan] "
+	TestSourceEdit(dependencyFiles)
+	TestIndirectHeaderEdit(dependencyFiles)
+	TestShadowingHeader(dependencyFiles)
+	TestCommentOnlyEdit(dependencyFiles)
+
+checkPrefix = ""
+TestLocalCompileCache()
+TestLocalCompileCacheShadowingHeader()
+TestRemoteCompileCache()
+TestRemoteCompileCacheShadowingHeader()
+
+if exitCode == 0:
+	print("Incremental build test successful.")
+sys.exit(exitCode)
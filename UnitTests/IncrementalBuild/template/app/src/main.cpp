@@ -0,0 +1,9 @@
+#include <cstdio>
+#include "common.h"
+
+/* Prints both values added together. */
+int main()
+{
+	std::printf("%d\n", Value() + LibValue());
+	return 0;
+}
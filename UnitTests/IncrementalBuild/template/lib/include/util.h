@@ -0,0 +1,6 @@
+#pragma once
+
+// Value added to the library's.
+inline int Value() { return 1; }
+
+int LibValue();
@@ -0,0 +1,6 @@
+#include "util.h"
+
+int LibValue()
+{
+	return 10;
+}
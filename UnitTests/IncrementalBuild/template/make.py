@@ -0,0 +1,31 @@
+#!/usr/bin/python
+
+import os
+import sys
+sys.path.insert(0, os.environ["CSBUILD_PATH"])
+
+import csbuild
+
+csbuild.Toolchain("gcc").SetCxxCommand(os.environ.get("CXX", "g++"))
+if os.environ.get("CSBUILD_TEST_DEPENDENCY_FILES"):
+	csbuild.Toolchain("gcc").Compiler().EnableDependencyFiles()
+
+@csbuild.project(
+	name="lib",
+	workingDirectory="lib",
+	depends=[],
+)
+def lib():
+	csbuild.SetOutput("lib", csbuild.ProjectType.StaticLibrary)
+	csbuild.AddIncludeDirectories("lib/include")
+
+@csbuild.project(
+	name="app",
+	workingDirectory="app",
+	depends=[
+		"lib",
+	],
+)
+def app():
+	csbuild.SetOutput("app", csbuild.ProjectType.Application)
+	csbuild.AddIncludeDirectories("lib/include")
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+"""
+Runs jobs on the job pool with blocking jobs holding its threads, so the order everything else is started in can be
+checked: by priority, then submission order; skipping past a job that doesn't fit in the memory budget; and no longer
+skipping past it once it's been passed over MAX_BYPASSES times.
+"""
+
+import sys
+import threading
+import time
+
+sys.path.insert(0, "../../")
+
+#Keep csbuild from trying to run a build when it's imported.
+sys.runningSphinx = True
+
+from csbuild import _job_pool
+
+exitCode = 0
+
+def Check(name, condition, details=None):
+	global exitCode
+	if not condition:
+		print("FAILED: {}".format(name))
+		if details is not None:
+			print(details)
+		exitCode = 1
+
+def WaitUntil(condition, timeout=10):
+	deadline = time.time() + timeout
+	while not condition():
+		if time.time() > deadline:
+			return False
+		time.sleep(0.01)
+	return True
+
+order = []
+orderLock = threading.Lock()
+
+def Record(name):
+	with orderLock:
+		order.append(name)
+
+def Block(event):
+	event.wait()
+
+def TestPriorityOrder():
+	del order[:]
+	pool = _job_pool.JobPool(1)
+	try:
+		release = threading.Event()
+		pool.Submit(Block, (release,), name="blocker")
+		WaitUntil(lambda: pool.GetRunningJobs())
+		pool.Submit(Record, ("low",), priority=1)
+		pool.Submit(Record, ("high",), priority=10)
+		pool.Submit(Record, ("low2",), priority=1)
+		cancelled = pool.Submit(Record, ("cancelled",), priority=5)
+		Check("Pending job can be cancelled", cancelled.Cancel())
+		pool.Submit(Record, ("mid",), priority=5)
+		release.set()
+		WaitUntil(lambda: pool.GetOutstandingCount() == 0)
+		Check("Jobs run by priority, then in submission order", order == ["high", "mid", "low", "low2"], order)
+	finally:
+		pool.Close()
+
+def TestMemoryBudget():
+	del order[:]
+	pool = _job_pool.JobPool(2, memoryBudget=100)
+	try:
+		release = threading.Event()
+		pool.Submit(Block, (release,), memory=60, name="blocker")
+		WaitUntil(lambda: pool.GetRunningJobs())
+		heavy = pool.Submit(Record, ("heavy",), priority=10, memory=50)
+		pool.Submit(Record, ("light",), priority=1, memory=30)
+		Check("Job that fits runs past one that doesn't", WaitUntil(lambda: order == ["light"]), order)
+		Check("Job that doesn't fit waits", not heavy.IsDone())
+		release.set()
+		Check("Job that doesn't fit runs once there's room", heavy.Wait(10) and order == ["light", "heavy"], order)
+	finally:
+		pool.Close()
+
+def TestBypassLimit():
+	del order[:]
+	pool = _job_pool.JobPool(2, memoryBudget=100)
+	try:
+		release = threading.Event()
+		pool.Submit(Block, (release,), memory=60, name="blocker")
+		WaitUntil(lambda: pool.GetRunningJobs())
+		heavy = pool.Submit(Record, ("heavy",), priority=10, memory=100)
+		lights = ["light{}".format(i) for i in range(_job_pool.MAX_BYPASSES + 4)]
+		for name in lights:
+			pool.Submit(Record, (name,), priority=1, memory=30)
+
+		Check(
+			"Jobs behind the heavy one run until it's been passed over enough times",
+			WaitUntil(lambda: len(order) == _job_pool.MAX_BYPASSES), order
+		)
+		#Give anything that shouldn't be started a chance to be.
+		time.sleep(0.2)
+		Check("Nothing more runs ahead of the heavy job", order == lights[:_job_pool.MAX_BYPASSES], order)
+
+		release.set()
+		WaitUntil(lambda: pool.GetOutstandingCount() == 0)
+		expected = lights[:_job_pool.MAX_BYPASSES] + ["heavy"] + lights[_job_pool.MAX_BYPASSES:]
+		Check("Heavy job runs as soon as it fits", heavy.IsDone() and order == expected, order)
+	finally:
+		pool.Close()
+
+TestPriorityOrder()
+TestMemoryBudget()
+TestBypassLimit()
+
+if exitCode == 0:
+	print("Job pool test successful.")
+sys.exit(exitCode)
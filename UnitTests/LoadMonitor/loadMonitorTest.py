@@ -0,0 +1,168 @@
+#!/usr/bin/python
+
+"""
+Runs the load monitor against a job pool with a made up system load and CPU idle time in place of the machine's, and
+checks that it sets the pool's starting limit from the load, lowers the limit when the machine is busy, raises it again
+when there's CPU to spare and jobs waiting, and leaves it alone otherwise.
+"""
+
+import sys
+import threading
+import time
+
+sys.path.insert(0, "../../")
+
+#Keep csbuild from trying to run a build when it's imported.
+sys.runningSphinx = True
+
+from csbuild import _job_pool
+from csbuild import _load_monitor
+
+exitCode = 0
+
+def Check(name, condition, details=None):
+	global exitCode
+	if not condition:
+		print("FAILED: {}".format(name))
+		if details is not None:
+			print(details)
+		exitCode = 1
+
+def WaitUntil(condition, timeout=10):
+	deadline = time.time() + timeout
+	while not condition():
+		if time.time() > deadline:
+			return False
+		time.sleep(0.01)
+	return True
+
+class FakeLoad(object):
+	"""
+	Stands in for the system load average and /proc/stat, with whatever load and idle share the test sets.
+	"""
+	def __init__(self, load, idle):
+		self.load = load
+		self.idle = idle
+		self.hasCpuTimes = True
+		self._idleTime = 0.0
+		self._totalTime = 0.0
+		self._lock = threading.Lock()
+
+	def GetLoad(self):
+		with self._lock:
+			return self.load
+
+	def GetCpuTimes(self):
+		with self._lock:
+			if not self.hasCpuTimes:
+				return None
+			self._idleTime += 100 * self.idle
+			self._totalTime += 100
+			return self._idleTime, self._totalTime
+
+	def Set(self, load, idle):
+		with self._lock:
+			self.load = load
+			self.idle = idle
+
+class RecordingPool(_job_pool.JobPool):
+	"""
+	Job pool that records every limit it's given.
+	"""
+	def __init__(self, size):
+		_job_pool.JobPool.__init__(self, size)
+		self.limits = []
+
+	def SetLimit(self, limit):
+		self.limits.append(limit)
+		_job_pool.JobPool.SetLimit(self, limit)
+
+def Block(event):
+	event.wait()
+
+def Run(test):
+	"""
+	Runs a test with a pool of four threads on a four processor machine, sampled every hundredth of a second.
+	"""
+	pool = RecordingPool(4)
+	source = FakeLoad(0.0, 1.0)
+	monitor = _load_monitor.LoadMonitor(pool, 4, source.GetLoad, source.GetCpuTimes, 0.01)
+	release = threading.Event()
+	try:
+		test(pool, source, monitor, release)
+	finally:
+		monitor.Stop()
+		release.set()
+		pool.Close()
+
+def TestStartingLimit(pool, source, monitor, release):
+	source.Set(1.4, 0.5)
+	monitor.Start()
+	Check("Starting limit leaves room for the load already there", pool.limits[:1] == [3], pool.limits)
+
+def TestBusy(pool, source, monitor, release):
+	for i in range(8):
+		pool.Submit(Block, (release,))
+	monitor.Start()
+	Check("Starts with every thread", pool.limits[:1] == [4], pool.limits)
+
+	source.Set(8.0, 0.01)
+	Check("Busy machine lowers the limit one at a time, down to one",
+		WaitUntil(lambda: pool.GetLimit() == 1) and pool.limits == [4, 3, 2, 1], pool.limits)
+	time.sleep(0.2)
+	Check("Limit never drops below one", pool.GetLimit() == 1 and pool.limits == [4, 3, 2, 1], pool.limits)
+
+	source.Set(4.0, 0.5)
+	Check("Spare CPU with jobs waiting raises the limit one at a time, up to the pool's size",
+		WaitUntil(lambda: pool.GetLimit() == 4) and pool.limits == [4, 3, 2, 1, 2, 3, 4], pool.limits)
+	time.sleep(0.2)
+	Check("Limit never goes above the pool's size", pool.limits == [4, 3, 2, 1, 2, 3, 4], pool.limits)
+
+def TestLoadWithoutIdle(pool, source, monitor, release):
+	#A high load on its own isn't enough while there's CPU idle, since it could be processes waiting on the disk.
+	for i in range(8):
+		pool.Submit(Block, (release,))
+	monitor.Start()
+	source.Set(8.0, 0.5)
+	time.sleep(0.2)
+	Check("High load with CPU idle leaves the limit alone", pool.limits == [4], pool.limits)
+
+def TestNothingWaiting(pool, source, monitor, release):
+	source.Set(3.0, 0.01)
+	monitor.Start()
+	Check("Starting limit leaves room for the load already there", pool.limits[:1] == [1], pool.limits)
+	source.Set(0.0, 1.0)
+	time.sleep(0.2)
+	Check("Spare CPU with nothing waiting leaves the limit alone", pool.limits == [1], pool.limits)
+
+	pool.Submit(Block, (release,))
+	pool.Submit(Block, (release,))
+	Check("Jobs waiting raise it", WaitUntil(lambda: pool.GetLimit() > 1), pool.limits)
+
+def TestWithoutCpuTimes(pool, source, monitor, release):
+	source.hasCpuTimes = False
+	for i in range(8):
+		pool.Submit(Block, (release,))
+	monitor.Start()
+	source.Set(6.0, 0.0)
+	Check("Without CPU times, high load lowers the limit", WaitUntil(lambda: pool.GetLimit() < 4), pool.limits)
+	source.Set(4.0, 0.0)
+	#Let any change made before the load dropped settle first.
+	time.sleep(0.1)
+	limits = list(pool.limits)
+	time.sleep(0.2)
+	Check("Without CPU times, load around the processor count leaves the limit alone", pool.limits == limits,
+		pool.limits)
+	source.Set(2.0, 0.0)
+	Check("Without CPU times, low load with jobs waiting raises the limit", WaitUntil(lambda: pool.GetLimit() == 4),
+		pool.limits)
+
+Run(TestStartingLimit)
+Run(TestBusy)
+Run(TestLoadWithoutIdle)
+Run(TestNothingWaiting)
+Run(TestWithoutCpuTimes)
+
+if exitCode == 0:
+	print("Load monitor test successful.")
+sys.exit(exitCode)
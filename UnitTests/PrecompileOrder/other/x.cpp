@@ -0,0 +1 @@
+int X() { return 3; }
@@ -0,0 +1 @@
+int Y() { return 4; }
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+"""
+Builds two independent projects, one of which precompiles a slow C++ header and a C header, with a compiler that
+records when each compile starts and finishes. Checks that the other project's compiles run while the header is being
+precompiled, and that each of the first project's compiles waits for the precompiled header it uses, and only that one.
+"""
+
+import os
+import sys
+sys.path.insert(0, "../../")
+
+#Compiles can only overlap with the precompiled header if there's more than one build thread.
+if not any(arg.startswith("-j") or arg == "--jobs" for arg in sys.argv):
+	sys.argv += ["-j", "4"]
+
+import csbuild
+from csbuild import log
+
+compilerPath = os.path.abspath("recordingCompiler.py")
+logPath = os.path.abspath("compiles.log")
+
+csbuild.Toolchain("gcc").SetCxxCommand(compilerPath)
+csbuild.Toolchain("gcc").SetCcCommand(compilerPath)
+csbuild.DisableChunkedBuild()
+
+@csbuild.project(
+	name="withPch",
+	workingDirectory="withPch",
+	depends=[],
+)
+def withPch():
+	csbuild.SetOutput("withPch", csbuild.ProjectType.StaticLibrary)
+	csbuild.Precompile("withPch/slow.hpp")
+	csbuild.PrecompileAsC("withPch/fast.h")
+
+@csbuild.project(
+	name="other",
+	workingDirectory="other",
+	depends=[],
+)
+def other():
+	csbuild.SetOutput("other", csbuild.ProjectType.StaticLibrary)
+
+@csbuild.globalPreMakeStep
+def clearLog():
+	if os.path.exists(logPath):
+		os.remove(logPath)
+
+@csbuild.globalPostMakeStep
+def checkOrder():
+	starts = {}
+	ends = {}
+	if os.path.exists(logPath):
+		with open(logPath) as f:
+			for line in f:
+				event, when, output = line.split()
+				(starts if event == "start" else ends)[output] = float(when)
+
+	cppPch = [output for output in ends if output.endswith(".hpp.gch")]
+	cPch = [output for output in ends if output.endswith(".h.gch")]
+	if not cppPch or not cPch:
+		log.LOG_ERROR("Both precompiled headers have to be built for this test; run it with --rebuild.")
+		sys.exit(1)
+	cppPchEnd = ends[cppPch[0]]
+	cPchEnd = ends[cPch[0]]
+
+	failures = []
+	if not any(starts[obj] < cppPchEnd for obj in ("x_release.o", "y_release.o")):
+		failures.append("Other project's compiles waited for the precompiled header")
+	for obj in ("a_release.o", "b_release.o"):
+		if starts[obj] < cppPchEnd:
+			failures.append("{} started before the C++ precompiled header was built".format(obj))
+	if starts["c_release.o"] < cPchEnd:
+		failures.append("c_release.o started before the C precompiled header was built")
+	if starts["c_release.o"] > cppPchEnd:
+		failures.append("c_release.o waited for the C++ precompiled header")
+
+	if failures:
+		for failure in failures:
+			log.LOG_ERROR(failure)
+		sys.exit(1)
+	log.LOG_BUILD("Precompile order test successful.")
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+"""
+Stands in for gcc and g++, recording when each compile starts and finishes in compiles.log next to this script.
+Precompiling the C++ header is slowed down, so the build has time to run other compiles alongside it.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+args = sys.argv[1:]
+output = ""
+for i, arg in enumerate(args):
+	if arg == "-o" and i + 1 < len(args):
+		output = args[i + 1]
+	elif arg.startswith("-o"):
+		output = arg[2:]
+output = os.path.basename(output)
+
+logPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "compiles.log")
+
+def Record(event):
+	with open(logPath, "a") as f:
+		f.write("{} {:.6f} {}\n".format(event, time.time(), output))
+
+Record("start")
+if output.endswith(".hpp.gch"):
+	time.sleep(3)
+isC = any(arg.endswith((".c", ".h")) for arg in args)
+ret = subprocess.call([os.environ.get("CC", "gcc") if isC else os.environ.get("CXX", "g++")] + args)
+Record("end")
+sys.exit(ret)
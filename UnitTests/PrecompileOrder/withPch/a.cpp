@@ -0,0 +1,3 @@
+#include "slow.hpp"
+
+int A() { return Slow(); }
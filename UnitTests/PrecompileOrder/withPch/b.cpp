@@ -0,0 +1,3 @@
+#include "slow.hpp"
+
+int B() { return Slow() + 1; }
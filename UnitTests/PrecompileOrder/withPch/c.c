@@ -0,0 +1,3 @@
+#include "fast.h"
+
+int C(void) { return Fast(); }
@@ -0,0 +1,3 @@
+#pragma once
+
+inline int Slow() { return 1; }
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+"""
+Reads the output of many processes at once through each process runner this Python supports, both collected whole and
+a line at a time, and checks nothing is lost or mixed up between processes or between stdout and stderr.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+
+sys.path.insert(0, "../../")
+
+#Keep csbuild from trying to run a build when it's imported.
+sys.runningSphinx = True
+
+from csbuild import _process_runner
+
+exitCode = 0
+
+def Check(name, condition):
+	global exitCode
+	if not condition:
+		print("FAILED: {}".format(name))
+		exitCode = 1
+
+#Writes a few lines to each pipe, then enough to stdout to fill the pipe's buffer several times over.
+_script = (
+	"import sys\n"
+	"for i in range(3):\n"
+	"	sys.stdout.write('out{0} %d\\n' % i)\n"
+	"	sys.stdout.flush()\n"
+	"	sys.stderr.write('err{0} %d\\n' % i)\n"
+	"	sys.stderr.flush()\n"
+	"sys.stdout.write('x' * 200000)\n"
+)
+
+def Start(index):
+	return subprocess.Popen(
+		[sys.executable, "-c", _script.format(index)], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+	)
+
+def Expected(index):
+	out = "".join("out{} {}\n".format(index, i) for i in range(3)) + "x" * 200000
+	err = "".join("err{} {}\n".format(index, i) for i in range(3))
+	return out.encode("ascii"), err.encode("ascii")
+
+def TestRunner(name, runner):
+	results = {}
+
+	def Communicate(index):
+		proc = Start(index)
+		results[index] = runner.Communicate(proc)
+		proc.wait()
+
+	threads = [threading.Thread(target=Communicate, args=(index,)) for index in range(16)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	for index in range(16):
+		Check("{}: output of process {} is collected".format(name, index), results.get(index) == Expected(index))
+
+	lines = []
+	proc = Start(0)
+	result = runner.Communicate(proc, lambda line, isError: lines.append((line, isError)))
+	proc.wait()
+	out, err = Expected(0)
+	Check("{}: nothing is collected when lines are handed over".format(name), result == (b"", b""))
+	Check(
+		"{}: lines are handed over".format(name),
+		b"".join(line for line, isError in lines if not isError) == out
+			and b"".join(line for line, isError in lines if isError) == err
+	)
+	runner.Close()
+
+if _process_runner.IsSupported():
+	TestRunner("SelectRunner", _process_runner.SelectRunner())
+	if _process_runner.asyncio is not None:
+		TestRunner("ProcessRunner", _process_runner.ProcessRunner())
+
+if exitCode == 0:
+	print("Process runner test successful.")
+sys.exit(exitCode)
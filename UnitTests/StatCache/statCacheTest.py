@@ -0,0 +1,66 @@
+#!/usr/bin/python
+
+"""
+Walks a directory by a relative path through the stat cache, then changes the working directory before looking up
+what the walk found, as happens when csbuild moves on to another project. Every file has to be found, with the right
+size, however the walk was rooted.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, "../../")
+
+#Keep csbuild from trying to run a build when it's imported.
+sys.runningSphinx = True
+
+from csbuild import _stat_cache
+
+exitCode = 0
+
+def Check(name, condition):
+	global exitCode
+	if not condition:
+		print("FAILED: {}".format(name))
+		exitCode = 1
+
+startDir = os.getcwd()
+tempDir = tempfile.mkdtemp()
+try:
+	projectDir = os.path.join(tempDir, "project")
+	otherDir = os.path.join(tempDir, "other")
+	os.makedirs(os.path.join(projectDir, "include", "nested"))
+	os.makedirs(otherDir)
+	files = {
+		os.path.join("include", "common.h"): "#pragma once\n",
+		os.path.join("include", "nested", "util.h"): "int util();\n",
+		"main.cpp": "int main(){ return 0; }\n",
+	}
+	for name, contents in files.items():
+		with open(os.path.join(projectDir, name), "w") as f:
+			f.write(contents)
+
+	_stat_cache.Clear()
+	os.chdir(projectDir)
+	found = []
+	for root, dirnames, filenames in _stat_cache.Walk("."):
+		found.extend(os.path.normpath(os.path.join(root, filename)) for filename in filenames)
+	Check("Walk finds every file", sorted(found) == sorted(files))
+
+	#Same relative names, looked up from somewhere they don't exist.
+	os.chdir(otherDir)
+	for name, contents in files.items():
+		path = os.path.join(projectDir, name)
+		Check("{} exists after changing directory".format(name), _stat_cache.Exists(path))
+		result = _stat_cache.Stat(path)
+		Check("{} has the right size".format(name), result is not None and result.st_size == len(contents))
+	Check("A missing file is still missing", not _stat_cache.Exists(os.path.join(projectDir, "missing.h")))
+finally:
+	os.chdir(startDir)
+	shutil.rmtree(tempDir)
+
+if exitCode == 0:
+	print("Stat cache test successful.")
+sys.exit(exitCode)
@@ -11,7 +11,19 @@ exitCode = 0
 tests = [
 	"Android/unit_test_android.py",
 	"DependencyOrder/dependencyOrderTest.py",
+	"PrecompileOrder/precompileOrderTest.py",
 	"Scope/scopeTest.py",
+	"StatCache/statCacheTest.py",
+	"IncrementalBuild/incrementalBuildTest.py",
+	"JobPool/jobPoolTest.py",
+	"Chunking/chunkingTest.py",
+	"ActionGraph/actionGraphTest.py",
+	"LoadMonitor/loadMonitorTest.py",
+	"ProcessRunner/processRunnerTest.py",
+	"Daemon/daemonTest.py",
+	"FileWatcher/fileWatcherTest.py",
+	"Distributed/distributedTest.py",
+	"AutoPrecompile/autoPrecompileTest.py",
 ]
 
 if platform.system() == "Darwin":
@@ -40,6 +52,8 @@ for test in tests:
 		errors = errors.decode("UTF-8")
 
 	results[test] = (re.sub(ansi_escape, "", output), re.sub(ansi_escape, "", errors), fd.returncode, time.time() - start)
+	if fd.returncode != 0:
+		exitCode += 1
 
 	sys.stdout.write(output)
 	sys.stderr.write(errors)
@@ -40,12 +40,14 @@ import subprocess
 import os
 import sys
 import threading
+import multiprocessing.pool
 import time
 import platform
 import imp
 import re
 import traceback
 import copy
+import hashlib
 
 if sys.version_info >= (3,0):
 	import io
@@ -101,6 +103,17 @@ class RunMode( object ):
 	Qualop = 3
 
 from . import _utils
+from . import _header_cache
+from . import _compile_cache
+from . import _build_history
+from . import _auto_pch
+from . import _distributed
+from . import _action_graph
+from . import _process_runner
+from . import _job_pool
+from . import _load_monitor
+from . import _stat_cache
+from . import _daemon
 from . import toolchain
 from . import toolchain_msvc
 from . import toolchain_gcc
@@ -694,6 +707,21 @@ def SetMaxChunkFileSize( i ):
 	projectSettings.currentProject.SetValue("chunkSize", i)
 
 
+def SetMaxChunkCompileTime( seconds ):
+	"""
+	Make up chunks by how long their files took to compile on previous builds, rather than by their size, so each
+	chunk takes about the given time to compile and they all finish at around the same time. Files that have never
+	been compiled are estimated from their size. Until anything in the project has been compiled, chunks are made
+	the usual way, by SetMaxChunkFileSize() or SetNumFilesPerChunk().
+
+	This value is ignored if SetChunks is called.
+
+	:type seconds: float
+	:param seconds: Compile time to aim for per chunk, or 0 to go back to chunking by size or number of files.
+	"""
+	projectSettings.currentProject.SetValue("chunkCompileTime", seconds)
+
+
 def SetChunkTolerance( i ):
 	"""
 	Please see detailed description.
@@ -803,6 +831,7 @@ def Precompile( *args ):
 		newArgs.append( arg )
 	projectSettings.currentProject.ExtendList( "precompileTemp",  newArgs )
 	projectSettings.currentProject.SetValue( "chunkedPrecompile", False )
+	projectSettings.currentProject.SetValue( "autoPrecompile", False )
 	projectSettings.currentProject.SetValue( "tempsDirty", True )
 
 
@@ -819,7 +848,7 @@ def PrecompileAsC( *args ):
 		arg = _utils.FixupRelativePath( arg )
 		arg = _utils.PathWorkingDirPair( arg )
 		newArgs.append( arg )
-	projectSettings.currentProject.AppendList( "precompileAsCTemp", newArgs )
+	projectSettings.currentProject.ExtendList( "precompileAsCTemp", newArgs )
 	projectSettings.currentProject.SetValue( "tempsDirty", True )
 
 
@@ -828,6 +857,30 @@ def EnableChunkedPrecompile():
 	When this is enabled, all header files will be precompiled into a single "superheader" and included in all files.
 	"""
 	projectSettings.currentProject.SetValue( "chunkedPrecompile", True )
+	projectSettings.currentProject.SetValue( "autoPrecompile", False )
+
+
+def EnableAutoPrecompile( minShare = 0.25, maxChangeRate = 0.1 ):
+	"""
+	When this is enabled, the headers to precompile are chosen each build: those included by enough of the project's
+	translation units that rarely change, going by the include index and how often each header has changed in past
+	builds. The headers chosen, and how much they're expected to save, are reported at the start of the build.
+	Disables chunk precompile and any explicit list of headers to precompile.
+
+	:type minShare: float
+	:param minShare: Smallest share of the translation units (0 to 1) that have to include a header for it to be chosen.
+
+	:type maxChangeRate: float
+	:param maxChangeRate: Largest share of the builds with changes in them (0 to 1) where a chosen header, or anything
+	it includes, can have changed.
+	"""
+	projectSettings.currentProject.SetValue( "autoPrecompile", True )
+	projectSettings.currentProject.SetValue( "autoPrecompileMinShare", minShare )
+	projectSettings.currentProject.SetValue( "autoPrecompileMaxChangeRate", maxChangeRate )
+	projectSettings.currentProject.SetValue( "chunkedPrecompile", False )
+	projectSettings.currentProject.SetValue( "precompileTemp", [] )
+	projectSettings.currentProject.SetValue( "precompileAsCTemp", [] )
+	projectSettings.currentProject.SetValue( "tempsDirty", True )
 
 
 def DisablePrecompile( *args ):
@@ -848,6 +901,7 @@ def DisablePrecompile( *args ):
 		projectSettings.currentProject.ExtendList( "precompileExcludeFilesTemp", newArgs )
 	else:
 		projectSettings.currentProject.SetValue( "chunkedPrecompile", False )
+		projectSettings.currentProject.SetValue( "autoPrecompile", False )
 		projectSettings.currentProject.SetValue( "precompileTemp", [] )
 		projectSettings.currentProject.SetValue( "precompileAsCTemp", [] )
 
@@ -1189,6 +1243,8 @@ def SetActiveToolchain( name ):
 #<editor-fold desc="decorators">
 
 scriptFiles = []
+#Every makefile script run so far, including ones that have since finished
+_executedScripts = set()
 
 class Link(object):
 	def __init__(self, libName, scope = ScopeDef.Final, includeToolchains=None, includeArchitectures=None, excludeToolchains=None, excludeArchitectures=None):
@@ -1571,6 +1627,126 @@ class _LinkStatus(object):
 	Success = 1
 	UpToDate = 2
 
+def _getProgressTimes( ):
+	"""
+	:return: How long the build has been running and, once compile times are known, how long it's estimated to take
+		in total, both as (minutes, seconds). The estimate is None until then.
+	:rtype: tuple[tuple[int, int], tuple[int, int] or None]
+	"""
+	totaltime = time.time( ) - _shared_globals.starttime
+	elapsed = ( int( math.floor( totaltime / 60 ) ), int( math.floor( totaltime % 60 ) ) )
+	if not _shared_globals.times:
+		return elapsed, None
+
+	_shared_globals.lastupdate = totaltime
+	avgtime = sum( _shared_globals.times ) / len( _shared_globals.times )
+	esttime = totaltime + ( avgtime * ( _shared_globals.total_compiles - len( _shared_globals.times ) ) ) / _shared_globals.max_threads
+	if esttime < totaltime:
+		esttime = totaltime
+	_shared_globals.esttime = esttime
+	return elapsed, ( int( math.floor( esttime / 60 ) ), int( math.floor( esttime % 60 ) ) )
+
+
+def _compileChunk( chunk, obj, project, chunkFileStr ):
+	"""Build job that compiles a single chunk or source file."""
+	with _shared_globals.sgmutex:
+		current = _shared_globals.current_compile
+		_shared_globals.current_compile += 1
+
+	elapsed, estimate = _getProgressTimes( )
+	if estimate is not None:
+		log.LOG_BUILD(
+			"Compiling {0}{7}... ({1}/{2}) - {3}:{4:02}/{5}:{6:02}".format( os.path.basename( obj ), current,
+				_shared_globals.total_compiles, elapsed[0], elapsed[1], estimate[0], estimate[1], chunkFileStr ) )
+	else:
+		log.LOG_BUILD(
+			"Compiling {0}{5}... ({1}/{2}) - {3}:{4:02}".format( os.path.basename( obj ), current,
+				_shared_globals.total_compiles, elapsed[0], elapsed[1], chunkFileStr ) )
+
+	_utils.ThreadedBuild( chunk, obj, project ).run( )
+
+
+def _stopIfFailed( ):
+	#With --stop-on-error, nothing that hasn't started by the time a compile fails gets to.
+	if not _shared_globals.build_success and _shared_globals.stopOnError:
+		if _shared_globals.action_graph.CancelPending( ):
+			log.LOG_ERROR("Errors encountered during build, finishing current tasks and exiting...")
+
+
+def _onCompileFinished( action ):
+	if action.state != _action_graph.ActionState.Cancelled:
+		#Cancelling here, on the worker thread, keeps it from picking up another job first.
+		_stopIfFailed( )
+		return
+	#Never ran, because a precompiled header it needed failed or the build is stopping. The project still has to count
+	# it as done, or it will never be seen as finished.
+	chunk, obj, project, chunkFileStr = action.args
+	with project.mutex:
+		project.fileStatus[os.path.normcase( chunk )] = _shared_globals.ProjectState.ABORTED
+		project.compilationFailed = True
+		project.compilationCompleted += 1
+		project.updated = True
+	with _shared_globals.sgmutex:
+		_shared_globals.total_compiles -= 1
+
+
+def _finishCompiles( project ):
+	"""Build action run once all of a project's compiles are done. Its link waits on this."""
+	totaltime = (time.time( ) - project.starttime)
+	minutes = math.floor( totaltime / 60 )
+	seconds = math.floor( totaltime % 60 )
+
+	log.LOG_BUILD(
+		"Compile of {0} ({3} {4}) took {1}:{2:02}".format( project.outputName, int( minutes ),
+			int( seconds ), project.targetName, project.outputArchitecture ) )
+	project.buildEnd = time.time()
+	if project.compilationFailed:
+		_failProject( project )
+		return False
+
+	#Its link may already have been cancelled because something it links against failed.
+	if project.state != _shared_globals.ProjectState.BUILDING:
+		return True
+
+	for depend in project.reconciledLinkDepends:
+		dependProj = _shared_globals.projects[depend]
+		if dependProj.shell or dependProj.prebuilt or dependProj not in _shared_globals.sortedProjects:
+			continue
+		if dependProj.state not in ( _shared_globals.ProjectState.FINISHED, _shared_globals.ProjectState.UP_TO_DATE ):
+			log.LOG_LINKER(
+				"Linking for {} ({} {}/{}) deferred until all dependencies have finished building...".format(
+					project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
+			project.state = _shared_globals.ProjectState.WAITING_FOR_LINK
+			break
+	return True
+
+
+def _failProject( project ):
+	log.LOG_ERROR( "Build of {} ({} {}/{}) failed! Finishing up non-dependent build tasks...".format(
+		project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
+	project.state = _shared_globals.ProjectState.FAILED
+	project.linkQueueStart = time.time()
+	project.linkStart = project.linkQueueStart
+	project.endTime = project.linkQueueStart
+
+
+def _onCompilesDone( action ):
+	if action.state != _action_graph.ActionState.Cancelled:
+		return
+	project = action.args[0]
+	if project.state == _shared_globals.ProjectState.FAILED:
+		return
+	with project.mutex:
+		failed = _shared_globals.ProjectState.FAILED in project.fileStatus.values( )
+	if project.state == _shared_globals.ProjectState.BUILDING and failed:
+		#A precompiled header failed, so the rest of the project's compiles were never run.
+		project.buildEnd = time.time()
+		_failProject( project )
+	else:
+		#Never started, or stopped along with everything else by --stop-on-error.
+		project.state = _shared_globals.ProjectState.ABORTED
+
+
 def _build( ):
 	"""
 	Build the project.
@@ -1597,9 +1773,17 @@ def _build( ):
 						objs.append(obj)
 				project.activeToolchain.Compiler().MakeDummyObjects(objs)
 
-	linker_threads_blocked = _shared_globals.max_linker_threads - 1
-	for i in range( linker_threads_blocked ):
-		_shared_globals.link_semaphore.acquire(True)
+	_shared_globals.job_pool = _job_pool.JobPool( _shared_globals.max_threads, _shared_globals.max_memory )
+	#The linker gets one thread while everything is compiling, and another for each build thread that goes idle.
+	_shared_globals.link_pool = _job_pool.JobPool( _shared_globals.max_linker_threads )
+	_shared_globals.link_pool.SetLimit( 1 )
+	_shared_globals.action_graph = _action_graph.ActionGraph( _shared_globals.job_pool )
+	if _process_runner.IsSupported( ):
+		_shared_globals.process_runner = _process_runner.Create( )
+	loadMonitor = None
+	if _shared_globals.adaptive_jobs:
+		loadMonitor = _load_monitor.LoadMonitor( _shared_globals.job_pool, multiprocessing.cpu_count( ) )
+		loadMonitor.Start( )
 
 	for project in _shared_globals.sortedProjects:
 		_shared_globals.total_compiles += len( project._finalChunkSet )
@@ -1607,11 +1791,21 @@ def _build( ):
 	_shared_globals.total_compiles += _shared_globals.total_precompiles
 	_shared_globals.current_compile = 1
 
-	projects_in_flight = set()
-	projects_done = set()
-	pending_links = set()
-	pending_builds = _shared_globals.sortedProjects
-	#projects_needing_links = set()
+	#Queue the compiles at the head of the longest chain of work toward the end of the build first, going by how
+	# long everything took last time.
+	objsByProject = {}
+	for project in _shared_globals.sortedProjects:
+		objsByProject[project.key] = dict(
+			( chunk, _utils.GetSourceObjPath( project, chunk, sourceIsChunkPath = project.ContainsChunk( chunk ) ) )
+			for chunk in project._finalChunkSet
+		)
+	criticalPath = _build_history.PlanCriticalPath(
+		_shared_globals.sortedProjects,
+		dict( ( key, list( objs.values( ) ) ) for key, objs in objsByProject.items( ) ),
+		_shared_globals.max_threads
+	)
+
+	pending_builds = list( _shared_globals.sortedProjects )
 
 	for project in pending_builds:
 		for plugin in project.plugins:
@@ -1632,244 +1826,216 @@ def _build( ):
 
 	_shared_globals.starttime = time.time( )
 
-	_linkThread.start()
-
-	def ReconcilePostBuild():
-		LinkedSomething = True
-		while LinkedSomething:
-			LinkedSomething = False
-			for otherProj in list( projects_in_flight ):
-				with otherProj.mutex:
-					complete = otherProj.compilationCompleted
-
-				if complete >= len( otherProj._finalChunkSet ) + int(
-						otherProj.needsPrecompileC ) + int(
-						otherProj.needsPrecompileCpp ):
-					totaltime = (time.time( ) - otherProj.starttime)
-					minutes = math.floor( totaltime / 60 )
-					seconds = math.floor( totaltime % 60 )
-
-					log.LOG_BUILD(
-						"Compile of {0} ({3} {4}) took {1}:{2:02}".format( otherProj.outputName, int( minutes ),
-							int( seconds ), otherProj.targetName, otherProj.outputArchitecture ) )
-					otherProj.buildEnd = time.time()
-					projects_in_flight.remove( otherProj )
-					if otherProj.compilationFailed:
-						log.LOG_ERROR( "Build of {} ({} {}/{}) failed! Finishing up non-dependent build tasks...".format(
-							otherProj.outputName, otherProj.targetName, otherProj.outputArchitecture, otherProj.activeToolchainName ) )
-						otherProj.state = _shared_globals.ProjectState.FAILED
-						otherProj.linkQueueStart = time.time()
-						otherProj.linkStart = otherProj.linkQueueStart
-						otherProj.endTime = otherProj.linkQueueStart
-						continue
+	pool = _shared_globals.job_pool
+	linkPool = _shared_globals.link_pool
+	graph = _shared_globals.action_graph
 
-					okToLink = True
-					if otherProj.reconciledLinkDepends:
-						for depend in otherProj.reconciledLinkDepends:
-							if depend not in projects_done:
-								dependProj = _shared_globals.projects[depend]
-								if not dependProj.shell and not dependProj.prebuilt:
-									okToLink = False
-									break
-					if okToLink:
-						_link( otherProj )
-						LinkedSomething = True
-						projects_done.add( otherProj.key )
-					else:
-						log.LOG_LINKER(
-							"Linking for {} ({} {}/{}) deferred until all dependencies have finished building...".format(
-								otherProj.outputName, otherProj.targetName, otherProj.outputArchitecture, otherProj.activeToolchainName ) )
-						otherProj.state = _shared_globals.ProjectState.WAITING_FOR_LINK
-						pending_links.add( otherProj )
-
-			for otherProj in list( pending_links ):
-				okToLink = True
-				for depend in otherProj.reconciledLinkDepends:
-					if depend not in projects_done:
-						dependProj = _shared_globals.projects[depend]
-						if not dependProj.shell and not dependProj.prebuilt:
-							okToLink = False
-							break
-				if okToLink:
-					_link( otherProj )
-					LinkedSomething = True
-					projects_done.add( otherProj.key )
-					pending_links.remove( otherProj )
-
-	while pending_builds:
-		theseBuilds = pending_builds
-		pending_builds = []
-		for project in theseBuilds:
-			for depend in project.srcDepends:
-				if depend not in projects_done:
-					pending_builds.append( project )
-					continue
-			projects_in_flight.add( project )
+	#Every project gets an action that's released once its compiles are queued and finishes when they're done, and a
+	# link action that waits on that and on the links of everything the project links against. Both are held until
+	# every project has them, since a project can be listed before what it links against.
+	compiledActions = {}
+	linkActions = {}
+	for project in _shared_globals.sortedProjects:
+		compiledActions[project.key] = graph.Add(
+			_finishCompiles,
+			( project, ),
+			priority = _job_pool.PRECOMPILE_PRIORITY,
+			callback = _onCompilesDone,
+			name = "{} compiled".format( project.outputName ),
+			held = True
+		)
+		linkActions[project.key] = graph.Add(
+			_linkProject,
+			( project, ),
+			priority = criticalPath.tails.get( project.key, 0 ),
+			dependencies = [ compiledActions[project.key] ],
+			callback = _onLinkDone,
+			name = "{} link".format( project.outputName ),
+			pool = linkPool,
+			held = True,
+			onQueued = _onLinkQueued
+		)
+	for project in _shared_globals.sortedProjects:
+		graph.Release(
+			linkActions[project.key],
+			[ linkActions[depend] for depend in project.reconciledLinkDepends if depend in linkActions ]
+		)
 
-			projectSettings.currentProject = project
+	def AbortProject( project, state = _shared_globals.ProjectState.FAILED ):
+		with project.mutex:
+			for chunk in project._finalChunkSet:
+				project.fileStatus[os.path.normcase(chunk)] = _shared_globals.ProjectState.ABORTED
 
-			project.starttime = time.time( )
+		with _shared_globals.sgmutex:
+			_shared_globals.total_compiles -= len(project._finalChunkSet) + int( project.needsPrecompileC ) + int( project.needsPrecompileCpp )
 
-			for plugin in project.plugins:
-				_utils.CheckRunBuildStep(project, plugin.preBuildStep, "plugin pre-build")
-				plugin.preBuildStep(project)
-			_utils.CheckRunBuildStep(project, project.activeToolchain.preBuildStep, "toolchain pre-build")
-			for buildStep in project.preBuildSteps:
-				_utils.CheckRunBuildStep(project, buildStep, "project pre-build")
-
-			log.LOG_BUILD( "Building {} ({} {}/{})".format( project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
-			project.state = _shared_globals.ProjectState.BUILDING
-			project.startTime = time.time()
-
-			if project.precompile_headers( ):
-				for chunk in projectSettings.currentProject._finalChunkSet:
-					#not set until here because _finalChunkSet may be empty.
-					project._builtSomething = True
+		project.linkQueueStart = time.time()
+		project.linkStart = project.linkQueueStart
+		project.endTime = project.linkQueueStart
+		project.state = state
+		graph.Cancel( compiledActions[project.key] )
+
+	def StartProject( project ):
+		projectSettings.currentProject = project
 
-					chunkFileStr = ""
-					if chunk in project.chunksByFile:
-						chunkFileStr = " {}".format( [ os.path.basename(piece) for piece in project.chunksByFile[chunk] ] )
-					elif chunk in project.splitChunks:
-						chunkFileStr = " [Split from {}_{}{}]".format(
-							project.splitChunks[chunk],
-							project.targetName,
-							project.activeToolchain.Compiler().GetObjExt()
-						)
-
-					built = True
-					obj = _utils.GetSourceObjPath(projectSettings.currentProject, chunk, sourceIsChunkPath=projectSettings.currentProject.ContainsChunk(chunk))
-					if not _shared_globals.semaphore.acquire( False ):
-						if _shared_globals.max_threads != 1:
-							log.LOG_INFO( "Waiting for a build thread to become available..." )
-						_shared_globals.semaphore.acquire( True )
-
-					ReconcilePostBuild()
-
-					if _shared_globals.interrupted:
-						Exit( 2 )
-					if not _shared_globals.build_success and _shared_globals.stopOnError:
-						log.LOG_ERROR("Errors encountered during build, finishing current tasks and exiting...")
-						_shared_globals.semaphore.release()
+		project.starttime = time.time( )
+
+		for plugin in project.plugins:
+			_utils.CheckRunBuildStep(project, plugin.preBuildStep, "plugin pre-build")
+			plugin.preBuildStep(project)
+		_utils.CheckRunBuildStep(project, project.activeToolchain.preBuildStep, "toolchain pre-build")
+		for buildStep in project.preBuildSteps:
+			_utils.CheckRunBuildStep(project, buildStep, "project pre-build")
+
+		log.LOG_BUILD( "Building {} ({} {}/{})".format( project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
+		project.state = _shared_globals.ProjectState.BUILDING
+		project.startTime = time.time()
+
+		#Compiles wait on the project's precompiled headers in the graph rather than here, so other projects can be
+		# started while they're being built. Each compile only waits on the header it's compiled with, so C files don't
+		# wait on the C++ header or the other way around.
+		precompileActions = project.precompile_headers( graph )
+		compileActions = list( precompileActions.values( ) )
+
+		projectObjs = objsByProject[project.key]
+		priorities = dict( ( chunk, criticalPath.GetPriority( project, obj ) ) for chunk, obj in projectObjs.items( ) )
+		for chunk in sorted( project._finalChunkSet, key = lambda chunk: -priorities[chunk] ):
+			#not set until here because _finalChunkSet may be empty.
+			project._builtSomething = True
+
+			chunkFileStr = ""
+			if chunk in project.chunksByFile:
+				chunkFileStr = " {}".format( [ os.path.basename(piece) for piece in project.chunksByFile[chunk] ] )
+			elif chunk in project.splitChunks:
+				chunkFileStr = " [Split from {}_{}{}]".format(
+					project.splitChunks[chunk],
+					project.targetName,
+					project.activeToolchain.Compiler().GetObjExt()
+				)
+
+			obj = projectObjs[chunk]
+			if os.path.splitext( chunk )[1] in project.cExtensions:
+				headerFile = project.cHeaderFile
+			else:
+				headerFile = project.cppHeaderFile
+			compileActions.append(
+				graph.Add(
+					_compileChunk,
+					( chunk, obj, project, chunkFileStr ),
+					priority = priorities[chunk],
+					memory = criticalPath.EstimateMemory( project, obj ),
+					dependencies = [ precompileActions[headerFile] ] if headerFile in precompileActions else [],
+					callback = _onCompileFinished,
+					name = os.path.basename( obj )
+				)
+			)
+
+		graph.Release( compiledActions[project.key], compileActions )
+		return bool( project._finalChunkSet )
+
+	#Everything is driven by the graph from here: projects are started as soon as their source dependencies have
+	# compiled, and each link runs the moment its project's last compile or dependency's link is done. This thread
+	# only starts projects and hands idle build threads to the linker.
+	completed = graph.GetCompletedCount( )
+	scanned = None
+	lastOutstanding = None
+	while True:
+		if _shared_globals.interrupted:
+			Exit( 2 )
+
+		if not _shared_globals.build_success and _shared_globals.stopOnError:
+			pending_builds = []
+			_stopIfFailed( )
+
+		if pending_builds and scanned != completed:
+			scanned = completed
+			for project in list( pending_builds ):
+				if linkActions[project.key].state == _action_graph.ActionState.Cancelled:
+					#Something it links against failed, so there's no point compiling it. That's already been reported.
+					pending_builds.remove( project )
+					AbortProject( project, _shared_globals.ProjectState.ABORTED )
+					continue
+
+				waiting = False
+				failedDepend = None
+				for depend in project.srcDepends:
+					dependAction = compiledActions.get( depend )
+					if dependAction is None or dependAction.state == _action_graph.ActionState.Finished:
+						continue
+					if dependAction.IsDone( ):
+						failedDepend = _shared_globals.projects[depend]
 						break
-					if _shared_globals.times:
-						totaltime = (time.time( ) - _shared_globals.starttime)
-						_shared_globals.lastupdate = totaltime
-						minutes = math.floor( totaltime / 60 )
-						seconds = math.floor( totaltime % 60 )
-						avgtime = sum( _shared_globals.times ) / (len( _shared_globals.times ))
-						esttime = totaltime + ((avgtime * (
-							_shared_globals.total_compiles - len(
-								_shared_globals.times ))) / _shared_globals.max_threads)
-						if esttime < totaltime:
-							esttime = totaltime
-							_shared_globals.esttime = esttime
-						estmin = math.floor( esttime / 60 )
-						estsec = math.floor( esttime % 60 )
-						log.LOG_BUILD(
-							"Compiling {0}{7}... ({1}/{2}) - {3}:{4:02}/{5}:{6:02}".format( os.path.basename( obj ),
-								_shared_globals.current_compile, _shared_globals.total_compiles, int( minutes ),
-								int( seconds ), int( estmin ),
-								int( estsec ), chunkFileStr ) )
-					else:
-						totaltime = (time.time( ) - _shared_globals.starttime)
-						minutes = math.floor( totaltime / 60 )
-						seconds = math.floor( totaltime % 60 )
-						log.LOG_BUILD(
-							"Compiling {0}{5}... ({1}/{2}) - {3}:{4:02}".format( os.path.basename( obj ),
-								_shared_globals.current_compile,
-								_shared_globals.total_compiles, int( minutes ), int( seconds ), chunkFileStr ) )
-					_utils.ThreadedBuild( chunk, obj, project ).start( )
-					_shared_globals.current_compile += 1
+					waiting = True
+
+				if failedDepend is not None:
+					pending_builds.remove( project )
+					log.LOG_ERROR( "Build of {} ({} {}/{}) failed because {} failed to build! Finishing up non-dependent build tasks...".format(
+						project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName, failedDepend.outputName ) )
+					AbortProject( project )
+				elif not waiting:
+					pending_builds.remove( project )
+					if StartProject( project ):
+						built = True
+
+		idle = pool.GetIdleCount( )
+		if linkPool.GetLimit( ) < min( 1 + idle, linkPool.size ):
+			linkPool.SetLimit( 1 + idle )
+
+		if not graph.GetOutstandingCount( ):
+			break
+
+		outstanding = pool.GetOutstandingCount( )
+		if not outstanding and not linkPool.GetOutstandingCount( ) and scanned == graph.GetCompletedCount( ):
+			#Nothing is running, and nothing that's left can start.
+			break
+
+		if not pending_builds and outstanding and outstanding <= pool.size and outstanding != lastOutstanding and _shared_globals.max_threads != 1:
+			lastOutstanding = outstanding
+			elapsed, estimate = _getProgressTimes( )
+			if estimate is not None:
+				log.LOG_THREAD(
+					"Waiting on {0} more build thread{1} to finish... ({2}:{3:02}/{4}:{5:02})".format(
+						outstanding, "s" if outstanding != 1 else "", elapsed[0], elapsed[1], estimate[0], estimate[1] ) )
 			else:
-				projects_in_flight.remove( project )
-				log.LOG_ERROR( "Build of {} ({} {}/{}) failed! Finishing up non-dependent build tasks...".format(
-					project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName  ) )
-
-				with project.mutex:
-					for chunk in project._finalChunkSet:
-						project.fileStatus[os.path.normcase(chunk)] = _shared_globals.ProjectState.ABORTED
-
-				_shared_globals.total_compiles -= len(project._finalChunkSet)
-
-				project.linkQueueStart = time.time()
-				project.linkStart = project.linkQueueStart
-				project.endTime = project.linkQueueStart
-				project.state = _shared_globals.ProjectState.FAILED
-
-			if not _shared_globals.build_success and _shared_globals.stopOnError:
-				break
-
-		#Wait until all threads are finished. Simple way to do this is acquire the semaphore until it's out of
-		# resources.
-		for j in range( _shared_globals.max_threads ):
-			if not _shared_globals.semaphore.acquire( False ):
-				if _shared_globals.max_threads != 1:
-					if _shared_globals.times:
-						totaltime = (time.time( ) - _shared_globals.starttime)
-						_shared_globals.lastupdate = totaltime
-						minutes = math.floor( totaltime / 60 )
-						seconds = math.floor( totaltime % 60 )
-						avgtime = sum( _shared_globals.times ) / (len( _shared_globals.times ))
-						esttime = totaltime + ((avgtime * (_shared_globals.total_compiles - len(
-							_shared_globals.times ))) / _shared_globals.max_threads)
-						if esttime < totaltime:
-							esttime = totaltime
-						estmin = math.floor( esttime / 60 )
-						estsec = math.floor( esttime % 60 )
-						_shared_globals.esttime = esttime
-						log.LOG_THREAD(
-							"Waiting on {0} more build thread{1} to finish... ({2}:{3:02}/{4}:{5:02})".format(
-								_shared_globals.max_threads - j,
-								"s" if _shared_globals.max_threads - j != 1 else "", int( minutes ),
-								int( seconds ), int( estmin ), int( estsec ) ) )
-					else:
-						log.LOG_THREAD(
-							"Waiting on {0} more build thread{1} to finish...".format(
-								_shared_globals.max_threads - j,
-								"s" if _shared_globals.max_threads - j != 1 else "" ) )
-
-				ReconcilePostBuild()
-				_shared_globals.semaphore.acquire( True )
-
-				if linker_threads_blocked > 0:
-					_shared_globals.link_semaphore.release()
-					linker_threads_blocked -= 1
-
-				if _shared_globals.interrupted:
-					Exit( 2 )
-
-		#Then immediately release all the semaphores once we've reclaimed them.
-		#We're not using any more threads so we don't need them now.
-		for j in range( _shared_globals.max_threads ):
-			if _shared_globals.stopOnError:
-				projects_in_flight = set()
-			_shared_globals.semaphore.release( )
-
-		ReconcilePostBuild()
-
-	if projects_in_flight:
-		log.LOG_ERROR( "Could not complete all projects. This is probably very bad and should never happen."
-					   " Remaining projects: {0}".format( [p.key for p in projects_in_flight] ) )
-	if pending_links:
-		log.LOG_ERROR( "Could not link all projects. Do you have unmet dependencies in your makefile?"
-					   " Remaining projects: {0}".format( [p.key for p in pending_links] ) )
-		for p in pending_links:
-			p.state = _shared_globals.ProjectState.ABORTED
+				log.LOG_THREAD(
+					"Waiting on {0} more build thread{1} to finish...".format( outstanding, "s" if outstanding != 1 else "" ) )
+		completed = graph.WaitForCompletion( completed, 0.5 )
+
+	allLinked = not pending_builds
+	if pending_builds:
+		log.LOG_ERROR( "Could not start all projects. Do you have unmet source dependencies in your makefile?"
+					   " Remaining projects: {0}".format( [p.key for p in pending_builds] ) )
+		for p in pending_builds:
+			AbortProject( p )
 		_shared_globals.build_success = False
+	graph.CancelPending( )
+
+	allLinked = allLinked and not any( p.state == _shared_globals.ProjectState.ABORTED for p in _shared_globals.sortedProjects )
 	for proj in _shared_globals.sortedProjects:
 		proj.save_md5s( proj.allsources, proj.allheaders )
+		proj.save_include_index( )
+	if loadMonitor is not None:
+		loadMonitor.Stop( )
+	_shared_globals.action_graph = None
+	_shared_globals.job_pool.Close( )
+	_shared_globals.job_pool = None
+	_shared_globals.link_pool.Close( )
+	_shared_globals.link_pool = None
+	if _shared_globals.process_runner is not None:
+		_shared_globals.process_runner.Close( )
+		_shared_globals.process_runner = None
+
+	_compile_cache.FinishUploads( )
+	_compile_cache.Trim( )
+	if _distributed.remoteCompiles:
+		log.LOG_INFO( "Compiled {} translation units on build workers".format( _distributed.remoteCompiles ) )
 
 	if not built:
 		log.LOG_BUILD( "Nothing to build." )
 	_building = False
-	global _linkCond
-	global _linkMutex
-	with _linkMutex:
-		_linkCond.notify()
-	log.LOG_THREAD("Waiting for linker tasks to finish.")
-	_linkThread.join()
-
-	if not projects_in_flight and not pending_links:
+	_build_history.Save( )
+
+	if allLinked:
 		for project in _shared_globals.sortedProjects:
 			for plugin in project.plugins:
 				_utils.CheckRunBuildStep(project, plugin.postMakeStep, "plugin post-make")
@@ -1896,33 +2062,6 @@ def _build( ):
 
 	return _shared_globals.build_success
 
-_linkMutex = threading.Lock()
-_linkCond = threading.Condition(_linkMutex)
-_linkQueue = []
-_currentLinkThreads = set()
-_linkThreadMutex = threading.Lock()
-_recheckDeferredLinkTasks = False
-
-def _link( project, *objs ):
-	"""
-	Linker:
-	Links all the built files.
-	Accepts an optional list of object files to link; if this list is not provided it will use the auto-generated
-	list created by build()
-	This function also checks (if nothing was built) the modified times of all the required libraries, to see if we need
-	to relink anyway, even though nothing was compiled.
-	"""
-	global _linkQueue
-	global _linkMutex
-	global _linkCond
-
-	project.state = _shared_globals.ProjectState.LINK_QUEUED
-	project.linkQueueStart = time.time()
-	with _linkMutex:
-		_linkQueue.append( (project, list(objs)) )
-		_linkCond.notify()
-
-
 def _performLink(project, objs):
 	project.linkStart = time.time()
 
@@ -1943,13 +2082,14 @@ def _performLink(project, objs):
 	log.LOG_LINKER( "Linking {0}...".format( os.path.abspath( output ) ) )
 
 	if not objs:
-		for chunk in project.chunks:
+		chunkIndex = project.get_chunk_index( )
+		for chunk, chunkName in zip( chunkIndex.chunks, chunkIndex.names ):
 			hasChunk = False
 			if not project.unity:
-				chunkObj = _utils.GetChunkedObjPath(project, chunk)
+				chunkObj = _utils.GetChunkedObjPath(project, chunkName)
 			else:
 				chunkObj = _utils.GetUnityChunkObjPath(project)
-			if project.useChunks and not _shared_globals.disable_chunks and os.access(chunkObj , os.F_OK):
+			if project.useChunks and not _shared_globals.disable_chunks and _stat_cache.Exists( chunkObj ):
 				objs.append( chunkObj )
 				hasChunk = True
 
@@ -1958,7 +2098,7 @@ def _performLink(project, objs):
 				if type( chunk ) == list:
 					for source in chunk:
 						obj = _utils.GetSourceObjPath(project, source)
-						if os.access(obj , os.F_OK):
+						if _stat_cache.Exists( obj ):
 							objs.append( obj )
 							if source in project._finalChunkSet:
 								objsToScrape.append( obj )
@@ -1967,7 +2107,7 @@ def _performLink(project, objs):
 							return _LinkStatus.Fail
 				else:
 					obj = _utils.GetSourceObjPath(project, chunk)
-					if os.access(obj , os.F_OK):
+					if _stat_cache.Exists( obj ):
 						objs.append( obj )
 						if source in project._finalChunkSet:
 							objsToScrape.append( obj )
@@ -1977,6 +2117,9 @@ def _performLink(project, objs):
 
 				if hasChunk and objsToScrape:
 					project.activeToolchain.Compiler().GetObjectScraper().RemoveSharedSymbols(objsToScrape, chunkObj)
+					for obj in objsToScrape:
+						_stat_cache.Invalidate( obj )
+					_stat_cache.Invalidate( chunkObj )
 
 	if not objs:
 		return _LinkStatus.UpToDate
@@ -1989,10 +2132,10 @@ def _performLink(project, objs):
 	objs += project.extraObjs
 
 	if not project._builtSomething:
-		if os.access(output , os.F_OK):
-			mtime = os.path.getmtime( output )
+		if _stat_cache.Exists( output ):
+			mtime = _stat_cache.GetMtime( output )
 			for obj in objs:
-				if os.path.getmtime( obj ) > mtime:
+				if _stat_cache.GetMtime( obj ) > mtime:
 					#If the obj time is later, something got built in another run but never got linked...
 					#Maybe the linker failed last time.
 					#We should count that as having built something, because we do need to link.
@@ -2004,7 +2147,7 @@ def _performLink(project, objs):
 			#Even though we didn't build anything, we should verify all our libraries are up to date too.
 			#If they're not, we need to relink.
 			for i in range( len( project.libraryLocations ) ):
-				if os.path.getmtime(project.libraryLocations[i]) > mtime:
+				if _stat_cache.GetMtime( project.libraryLocations[i] ) > mtime:
 					log.LOG_LINKER(
 						"Library {0} has been modified since the last successful build. Relinking to new library."
 						.format(
@@ -2033,14 +2176,16 @@ def _performLink(project, objs):
 	if platform.system() != "Windows":
 		if os.access(output , os.F_OK):
 			os.remove( output )
+			_stat_cache.Invalidate( output )
 
 	for dep in project.reconciledLinkDepends:
 		proj = _shared_globals.projects[dep]
 		if proj.type == ProjectType.StaticLibrary and project.linkMode == StaticLinkMode.LinkIntermediateObjects:
-			for chunk in proj.chunks:
+			chunkIndex = proj.get_chunk_index( )
+			for chunk, chunkName in zip( chunkIndex.chunks, chunkIndex.names ):
 				hasChunk = False
 				if not proj.unity:
-					chunkObj = _utils.GetChunkedObjPath(proj, chunk)
+					chunkObj = _utils.GetChunkedObjPath(proj, chunkName)
 				else:
 					chunkObj = _utils.GetUnityChunkObjPath(proj)
 				if proj.useChunks and not _shared_globals.disable_chunks and os.access(chunkObj , os.F_OK):
@@ -2095,7 +2240,8 @@ def _performLink(project, objs):
 	with _shared_globals.spmutex:
 		_shared_globals.subprocesses[output] = fd
 
-	(out, errors) = fd.communicate( )
+	out, errors, _ = _utils.CommunicateWithPeakMemory( fd )
+	_stat_cache.Invalidate( output )
 
 	with _shared_globals.spmutex:
 		del _shared_globals.subprocesses[output]
@@ -2154,113 +2300,55 @@ def _performLink(project, objs):
 	totalmin = math.floor( totaltime / 60 )
 	totalsec = math.floor( totaltime % 60 )
 	log.LOG_LINKER( "Link time: {0}:{1:02}".format( int( totalmin ), int( totalsec ) ) )
+	_build_history.RecordLinkTime( project.key, totaltime )
 
 	return _LinkStatus.Success
 
-class _LinkThread(threading.Thread):
-	def __init__(self, project, objs):
-		threading.Thread.__init__( self )
-		self._project = project
-		self._objs = objs
-		#Prevent certain versions of python from choking on dummy threads.
-		if not hasattr( threading.Thread, "_Thread__block" ):
-			threading.Thread._Thread__block = _shared_globals.dummy_block( )
-
-
-	def run( self ):
-		global _linkThreadMutex
-		global _currentLinkThreads
-		global _linkCond
-		global _recheckDeferredLinkTasks
-		try:
-			project = self._project
-			project.state = _shared_globals.ProjectState.LINKING
-			ret = _performLink(project, self._objs)
-
-			if ret == _LinkStatus.Fail:
-				_shared_globals.build_success = False
-				project.state = _shared_globals.ProjectState.LINK_FAILED
-			elif ret == _LinkStatus.Success:
-				for plugin in project.plugins:
-					_utils.CheckRunBuildStep(project, plugin.postBuildStep, "plugin post-build")
-				_utils.CheckRunBuildStep(project, project.activeToolchain.postBuildStep, "toolchain post-build")
-
-				for buildStep in project.postBuildSteps:
-					_utils.CheckRunBuildStep(project, buildStep, "project post-build")
-				project.state = _shared_globals.ProjectState.FINISHED
-			elif ret == _LinkStatus.UpToDate:
-				project.state = _shared_globals.ProjectState.UP_TO_DATE
-			project.endTime = time.time()
-			log.LOG_BUILD( "Finished {} ({} {}/{})".format( project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
-
-			_shared_globals.link_semaphore.release()
-
-			with _linkThreadMutex:
-				_currentLinkThreads.remove(project.key)
-			with _linkMutex:
-				_recheckDeferredLinkTasks = True
-				_linkCond.notify()
-		except Exception:
-			traceback.print_exc()
-
-
-def _linkThreadLoop():
-	global _linkQueue
-	global _linkMutex
-	global _linkCond
-	global _currentLinkThreads
-	global _linkThreadMutex
-	global _recheckDeferredLinkTasks
+def _linkProject( project ):
+	"""Build action that links a project, once its compiles and the links of everything it links against are done."""
+	project.state = _shared_globals.ProjectState.LINKING
+	ret = _performLink(project, [])
 
-	try:
-		global _building
-		deferredLinks = []
-		while True:
-			projectsToLink = []
-			with _linkMutex:
-				if _recheckDeferredLinkTasks:
-					if _linkQueue:
-						_linkQueue += deferredLinks
-					else:
-						_linkQueue = deferredLinks
-					deferredLinks = []
-					_recheckDeferredLinkTasks = False
-				if not _linkQueue:
-					if not _building and not deferredLinks and not _currentLinkThreads:
-						return
-					_linkQueue = deferredLinks
-					deferredLinks = []
-					_linkCond.wait()
-				projectsToLink = _linkQueue
-				_linkQueue = []
-
-
-			for ( project, objs ) in projectsToLink:
-				okToLink = True
-				with _linkThreadMutex:
-					for depend in project.reconciledLinkDepends:
-						if depend in _currentLinkThreads:
-							okToLink = False
-							break
-
-						for ( otherProj, otherObjs ) in projectsToLink:
-							if otherProj.key == depend:
-								okToLink = False
-								break
-						if not okToLink:
-							break
-
-				if okToLink:
-					with _linkThreadMutex:
-						_currentLinkThreads.add(project.key)
-					_shared_globals.link_semaphore.acquire(True)
-					_LinkThread(project, objs).start()
-				else:
-					deferredLinks.append( ( project, objs ) )
-	except Exception:
-		traceback.print_exc()
+	if ret == _LinkStatus.Fail:
+		_shared_globals.build_success = False
+		project.state = _shared_globals.ProjectState.LINK_FAILED
+	elif ret == _LinkStatus.Success:
+		for plugin in project.plugins:
+			_utils.CheckRunBuildStep(project, plugin.postBuildStep, "plugin post-build")
+		_utils.CheckRunBuildStep(project, project.activeToolchain.postBuildStep, "toolchain post-build")
+
+		for buildStep in project.postBuildSteps:
+			_utils.CheckRunBuildStep(project, buildStep, "project post-build")
+		project.state = _shared_globals.ProjectState.FINISHED
+	elif ret == _LinkStatus.UpToDate:
+		project.state = _shared_globals.ProjectState.UP_TO_DATE
+	project.endTime = time.time()
+	log.LOG_BUILD( "Finished {} ({} {}/{})".format( project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
+
+	return ret != _LinkStatus.Fail
+
+
+def _onLinkQueued( action ):
+	project = action.args[0]
+	project.state = _shared_globals.ProjectState.LINK_QUEUED
+	project.linkQueueStart = action.queuedTime
+
+
+def _onLinkDone( action ):
+	if action.state != _action_graph.ActionState.Cancelled:
+		return
+	project = action.args[0]
+	#Projects that failed to compile have already been reported, and --stop-on-error cancels links for no other reason.
+	if project.state in ( _shared_globals.ProjectState.FAILED, _shared_globals.ProjectState.ABORTED ):
+		return
+	failedStates = ( _shared_globals.ProjectState.FAILED, _shared_globals.ProjectState.LINK_FAILED, _shared_globals.ProjectState.ABORTED )
+	if not any( _shared_globals.projects[depend].state in failedStates for depend in project.reconciledLinkDepends ):
+		return
+	log.LOG_ERROR( "Could not link {} ({} {}/{}) because a project it depends on failed to build.".format(
+		project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
+	project.state = _shared_globals.ProjectState.ABORTED
+	_shared_globals.build_success = False
 
-_linkThread = threading.Thread(target=_linkThreadLoop)
 
 def _clean( silent = False ):
 	"""
@@ -2274,7 +2362,7 @@ def _clean( silent = False ):
 			log.LOG_BUILD( "Cleaning {} ({} {}/{})...".format( project.outputName, project.targetName, project.outputArchitecture, project.activeToolchainName ) )
 
 		# Delete any chunks in the current project.
-		for chunk in project.chunks:
+		for chunk in project.get_chunk_index( ).names:
 			if not project.unity:
 				obj = _utils.GetChunkedObjPath(project, chunk)
 			else:
@@ -2319,6 +2407,8 @@ def _clean( silent = False ):
 				log.LOG_INFO( "Deleting {}".format( outpath ) )
 			os.remove( outpath )
 
+	_stat_cache.Clear( )
+
 
 def _installHeaders( ):
 	log.LOG_INSTALL("Installing headers...")
@@ -2403,6 +2493,8 @@ def _make( ):
 	else:
 		log.LOG_BUILD( "Build complete." )
 
+	_header_cache.Save( )
+
 
 def AddScript( incFile ):
 	"""
@@ -2565,6 +2657,8 @@ def Exit( code = 0, killGui = True ):
 			_guiModule.stop()
 		_guiModule.join()
 
+	_daemon.ReportExit( )
+
 	#Die hard, we don't need python to clean up and we want to make sure this exits.
 	#sys.exit just throws an exception that can be caught. No catching allowed.
 	os._exit( code )
@@ -2658,6 +2752,25 @@ def GetTargetList():
 	return _shared_globals.target_list
 
 
+def GetDependentTranslationUnits( header, project = None ):
+	"""
+	Get every source file and precompiled header in a project that includes the given header, directly or
+	indirectly, as of the project's last successful build.
+
+	:param header: Path to the header
+	:type header: str
+
+	:param project: Project to look in. Defaults to the project currently being set up or built.
+	:type project: projectSettings.projectSettings
+
+	:return: Absolute paths of the dependent translation units
+	:rtype: list[str]
+	"""
+	if project is None:
+		project = projectSettings.currentProject
+	return project.GetDependentTranslationUnits( header )
+
+
 def GetRunMode():
 	"""
 	Get the mode csbuild is current running under.
@@ -2676,6 +2789,8 @@ class _dummy( object ):
 
 
 def _execfile( file, glob, loc ):
+	_executedScripts.add( os.path.abspath( file ) )
+
 	# Save the current value of __file__ and set it to the input file path.
 	oldFileVar = glob.get("__file__", None)
 	glob["__file__"] = file
@@ -2693,6 +2808,63 @@ def _execfile( file, glob, loc ):
 mainFile = ""
 mainFileDir = ""
 
+def _startDependencyCheckPools( ):
+	"""
+	Start the worker pools used to decide which files need to be rebuilt during task preparation.
+	"""
+	#Fork the scan processes first, while this is still the only thread running.
+	if _shared_globals.dependency_check_processes > 0:
+		if platform.system() == "Windows":
+			log.LOG_WARN( "--dependency-check-processes is not supported on Windows, scanning on threads instead." )
+		else:
+			_shared_globals.dependency_scan_pool = _utils.ScanProcessPool(
+				_shared_globals.dependency_check_processes,
+				[ _utils.GetFileFingerprint, _header_cache.ScanIncludes ]
+			)
+
+	if _shared_globals.dependency_check_threads > 1:
+		_shared_globals.dependency_check_pool = multiprocessing.pool.ThreadPool( _shared_globals.dependency_check_threads )
+
+
+def _stopDependencyCheckPools( ):
+	if _shared_globals.dependency_check_pool is not None:
+		_shared_globals.dependency_check_pool.close( )
+		_shared_globals.dependency_check_pool = None
+	if _shared_globals.dependency_scan_pool is not None:
+		_shared_globals.dependency_scan_pool.Close( )
+		_shared_globals.dependency_scan_pool = None
+
+
+def _openLogFile( logDirectory ):
+	logFile = os.path.join(logDirectory, "build.log")
+
+	logBackup = "{}.4".format(logFile)
+	if os.path.exists(logBackup):
+		os.remove(logBackup)
+
+	for i in range(3,0,-1):
+		logBackup = "{}.{}".format(logFile, i)
+		if os.path.exists(logBackup):
+			newBackup = "{}.{}".format(logFile, i+1)
+			os.rename(logBackup, newBackup)
+
+	if os.path.exists(logFile):
+		logBackup = "{}.1".format(logFile)
+		os.rename(logFile, logBackup)
+
+	_shared_globals.logFile = open(logFile, "w")
+
+
+def _jobCount( value ):
+	#-j takes a number, or "auto" to adjust the number of compiles to the system load.
+	if value == "auto":
+		return value
+	try:
+		return int( value )
+	except ValueError:
+		raise argparse.ArgumentTypeError( "expected a number or 'auto', got '{}'".format( value ) )
+
+
 def _run( ):
 
 	_setupdefaults( )
@@ -2737,23 +2909,12 @@ def _run( ):
 	if not os.path.exists(logDirectory):
 		os.makedirs(logDirectory)
 
-	logFile = os.path.join(logDirectory, "build.log")
-
-	logBackup = "{}.4".format(logFile)
-	if os.path.exists(logBackup):
-		os.remove(logBackup)
-
-	for i in range(3,0,-1):
-		logBackup = "{}.{}".format(logFile, i)
-		if os.path.exists(logBackup):
-			newBackup = "{}.{}".format(logFile, i+1)
-			os.rename(logBackup, newBackup)
-
-	if os.path.exists(logFile):
-		logBackup = "{}.1".format(logFile)
-		os.rename(logFile, logBackup)
+	if _daemon.IsRequested( sys.argv[1:] ) and not _daemon.IsServer( ) and _runMode != RunMode.Help:
+		_daemon.RunClient( os.path.join( mainFileDir, mainFile ), sys.argv[1:], logDirectory )
 
-	_shared_globals.logFile = open(logFile, "w")
+	#A daemon server only logs to its own output until it starts a build.
+	if not _daemon.IsServer( ):
+		_openLogFile( logDirectory )
 
 	epilog = "    ------------------------------------------------------------    \n\nProjects available in this makefile (listed in build order):\n\n"
 
@@ -2854,7 +3015,9 @@ def _run( ):
 		help = "Quiet. Disables all logging except for WARN and ERROR.", default = 1 )
 	group2.add_argument( '-qq', '--very-quiet', action = "store_const", const = 3, dest = "quiet",
 		help = "Very quiet. Disables all csb-specific logging.", default = 1 )
-	parser.add_argument( "-j", "--jobs", action = "store", dest = "jobs", type = int, help = "Number of simultaneous build processes" )
+	parser.add_argument( "-j", "--jobs", action = "store", dest = "jobs", type = _jobCount,
+		help = "Number of simultaneous build processes, or 'auto' to raise and lower it with the system load, "
+		"up to the number of processors" )
 
 	parser.add_argument(
 		"-l",
@@ -2866,6 +3029,79 @@ def _run( ):
 		"Note that this pool is shared with build threads, and linker will only get one thread from the pool until compile threads start becoming free."
 		"This value only specifies a maximum."
 	)
+	parser.add_argument(
+		"--max-memory",
+		action = "store",
+		type = int,
+		default = 0,
+		help = "Memory budget for compiles, in megabytes. Compiles are only started while the memory they needed on earlier builds "
+		"adds up to less than this, so heavy files don't all run at once, while light ones still use every thread. "
+		"(Default 0, no limit.)"
+	)
+	parser.add_argument(
+		"--dependency-check-threads",
+		action = "store",
+		type = int,
+		help = "Number of threads used to check which files are out of date before building. (If not specified, same value as -j.)"
+	)
+	parser.add_argument(
+		"--dependency-check-processes",
+		action = "store",
+		type = int,
+		default = 0,
+		help = "Number of worker processes used to scan and hash files while checking which files are out of date. "
+		"Useful when many files have changed on large trees. (Default 0, scanning happens on the checking threads.)"
+	)
+	parser.add_argument(
+		"--fingerprint-digest",
+		action = "store",
+		default = "md5",
+		choices = sorted( algorithm for algorithm in ( "md5", "sha1", "sha256", "blake2b", "blake2s" ) if algorithm in hashlib.algorithms_available ),
+		help = "Hash algorithm used to detect changes to file contents. Changing it causes every modified file to be rehashed once."
+	)
+	parser.add_argument(
+		"--compile-cache",
+		action = "store_true",
+		help = "Reuse object files from earlier compiles of identical sources, commands and headers, from any project or checkout. "
+		"Objects are kept in the cache directory in .csbuild."
+	)
+	parser.add_argument(
+		"--compile-cache-size",
+		action = "store",
+		type = int,
+		default = 5120,
+		help = "Maximum size of the compile cache in megabytes. Least recently used objects are evicted past this. (Default 5120)"
+	)
+	parser.add_argument(
+		"--compile-cache-url",
+		action = "store",
+		help = "Share the compile cache through an HTTP store at this URL (implies --compile-cache). "
+		"Objects missing locally are fetched from it, and new ones are uploaded in the background. "
+		"See scripts/csbuild-cache-server for a reference server."
+	)
+	parser.add_argument(
+		"--distribute",
+		action = "append",
+		metavar = "HOST:PORT[/SLOTS]",
+		help = "Send compiles to a build worker started with --worker, in addition to compiling locally. "
+		"May be given more than once. SLOTS overrides the number of compiles the worker says it takes."
+	)
+	parser.add_argument(
+		"--worker",
+		nargs = "?",
+		const = str( _distributed.DEFAULT_PORT ),
+		metavar = "[HOST:]PORT",
+		help = "Instead of building, compile translation units sent by builds run with --distribute, up to -j at a time. "
+		"Listens on 127.0.0.1:{} unless told otherwise. Workers run any command they're sent, so only listen on trusted networks.".format( _distributed.DEFAULT_PORT )
+	)
+	group = parser.add_mutually_exclusive_group( )
+	group.add_argument(
+		"--daemon",
+		action = "store_true",
+		help = "Keep this makefile loaded in a background server between builds and build through it, starting it if needed. "
+		"The server restarts itself whenever a makefile script or the environment changes. (Unix only)"
+	)
+	group.add_argument( "--stop-daemon", action = "store_true", help = "Stop the background server started by --daemon with the same arguments." )
 	parser.add_argument( "-g", "--gui", action = "store_true", dest = "gui", help = "Show GUI while building (experimental)")
 	parser.add_argument( "--auto-close-gui", action = "store_true", help = "Automatically close the gui on build success (will stay open on failure)")
 	parser.add_argument("--profile", action="store_true", help="Collect detailed line-by-line profiling information on compile time. --gui option required to see this information.")
@@ -3012,13 +3248,36 @@ def _run( ):
 	_shared_globals.install_libdir = os.path.abspath(_shared_globals.install_libdir.format(prefix=_shared_globals.install_prefix, project=proj))
 	_shared_globals.install_incdir = os.path.abspath(_shared_globals.install_incdir.format(prefix=_shared_globals.install_prefix, project=proj))
 
-	if args.jobs:
+	_shared_globals.adaptive_jobs = args.jobs == "auto" and _load_monitor.IsSupported( )
+	if args.jobs == "auto":
+		if not _shared_globals.adaptive_jobs:
+			log.LOG_WARN( "-j auto needs os.getloadavg(), which isn't available here; using {} build threads".format( _shared_globals.max_threads ) )
+	elif args.jobs:
 		_shared_globals.max_threads = args.jobs
-		_shared_globals.semaphore = threading.BoundedSemaphore( value = _shared_globals.max_threads )
 
 	if args.linker_jobs:
 		_shared_globals.max_linker_threads = max(args.linker_jobs, _shared_globals.max_threads)
-		_shared_globals.link_semaphore = threading.BoundedSemaphore( value = _shared_globals.max_linker_threads )
+
+	_shared_globals.max_memory = args.max_memory * 1024 * 1024
+
+	if args.dependency_check_threads:
+		_shared_globals.dependency_check_threads = args.dependency_check_threads
+	else:
+		_shared_globals.dependency_check_threads = _shared_globals.max_threads
+	_shared_globals.dependency_check_processes = args.dependency_check_processes
+	_shared_globals.fingerprint_digest = args.fingerprint_digest
+	_shared_globals.compile_cache = args.compile_cache or args.compile_cache_url is not None
+	_shared_globals.compile_cache_url = args.compile_cache_url
+	_shared_globals.compile_cache_size = args.compile_cache_size * 1024 * 1024
+
+	if args.worker is not None:
+		_distributed.RunWorker( args.worker, _shared_globals.max_threads )
+		Exit( 0 )
+
+	if args.distribute:
+		remoteSlots = _distributed.Connect( args.distribute )
+		if remoteSlots:
+			_shared_globals.max_threads += remoteSlots
 
 	_shared_globals.profile = args.profile
 	_shared_globals.disable_chunks = args.no_chunks
@@ -3513,22 +3772,22 @@ def _run( ):
 			log.LOG_BUILD("Wrote depends.png")
 		return
 
-	#headerCacheFile = os.path.join(_shared_globals.cacheDirectory, "header_info.csbc")
-	#if os.path.exists(headerCacheFile):
-	#	log.LOG_BUILD("Loading cache data...")
-	#	with open(headerCacheFile, "rb") as f:
-	#		_shared_globals.allheaders = pickle.load(f)
-	#	mtime = os.path.getmtime(headerCacheFile)
-	#	for header in _shared_globals.allheaders.keys():
-	#		if not header:
-	#			continue
-	#		try:
-	#			htime = os.path.getmtime(header)
-	#			if htime > mtime:
-	#				del _shared_globals.allheaders[header]
-	#		except:
-	#			del _shared_globals.allheaders[header]
-
+	if _daemon.IsServer( ):
+		#Everything up to this point is kept in the server; each build request continues from here in a fresh fork.
+		_daemon.Serve( _executedScripts )
+		_openLogFile( logDirectory )
+		_shared_globals.starttime = time.time( )
+		if args.force_color is None and not os.isatty( 1 ):
+			_shared_globals.color_supported = False
+			if _shared_globals.forceProgressBar is None:
+				_shared_globals.forceProgressBar = "off"
+
+	if not _daemon.HasWarmStatCache( ):
+		_stat_cache.Clear( )
+	_header_cache.Load( )
+	#Loaded before the projects are prepared, since chunks can be made up by how long their files took to compile.
+	_build_history.Load( )
+	_startDependencyCheckPools( )
 
 	for proj in _shared_globals.sortedProjects:
 		if proj.prebuilt == False and (proj.shell == False or args.generate_solution):
@@ -3536,11 +3795,12 @@ def _run( ):
 		else:
 			proj.minimalPrepareBuild()
 
+	_stopDependencyCheckPools( )
+
 	# Remove projects that don't actually build.
 	_shared_globals.sortedProjects = [ proj for proj in _shared_globals.sortedProjects if proj.prebuilt == False and (proj.shell == False or args.generate_solution) ]
 
-	#with open(headerCacheFile, "wb") as f:
-	#	pickle.dump(_shared_globals.allheaders, f, 2)
+	_header_cache.Save( )
 
 	_utils.CheckVersion( )
 
@@ -0,0 +1,372 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Graph of build actions across every project being built.
+
+Each action is a function to run on a job pool, along with the actions it has to wait for. Every action keeps count of
+how many of those are still outstanding, and as soon as the last of them finishes, it's submitted to its pool, so
+work from any project, target or architecture runs the moment it's able to rather than when everything queued before
+it is done. If an action fails, by raising or by returning False, everything waiting on it is cancelled, along with
+everything waiting on those.
+
+An action can also be added held, which keeps it waiting until it's released, whatever it depends on. That lets an
+action be created before everything it has to wait for is known, so other actions can depend on it in the meantime.
+
+Every action's callback is run once it's done, whether it finished, failed or was cancelled, so the caller's
+bookkeeping sees every action exactly once.
+"""
+
+import threading
+import time
+import traceback
+
+
+class ActionState( object ):
+	"""
+	States an action goes through.
+	"""
+	Waiting = 0
+	Queued = 1
+	Finished = 2
+	Failed = 3
+	Cancelled = 4
+
+
+class Action( object ):
+	"""
+	A function to run once everything it depends on has finished.
+
+	:ivar name: Name shown in the job pool
+	:type name: str
+
+	:ivar args: Arguments the function is called with
+	:type args: tuple
+
+	:ivar priority: Priority of the action's job once it's queued
+	:type priority: int or float
+
+	:ivar memory: Memory the action is expected to need, in bytes
+	:type memory: int
+
+	:ivar state: Where the action is in its life
+	:type state: :class:`ActionState`
+
+	:ivar result: What the function returned, once it's run
+	:type result: any
+
+	:ivar queuedTime: When the action was submitted to its pool, or None if it hasn't been
+	:type queuedTime: float or None
+	"""
+	def __init__( self, pool, func, args, priority, memory, callback, onQueued, name ):
+		self.name = name
+		self.args = args
+		self.priority = priority
+		self.memory = memory
+		self.state = ActionState.Waiting
+		self.result = None
+		self.queuedTime = None
+		self._pool = pool
+		self._func = func
+		self._callback = callback
+		self._onQueued = onQueued
+		self._dependents = []
+		self._remaining = 0
+		self._job = None
+
+
+	def __repr__( self ):
+		return "<Action {} priority={} state={}>".format( self.name, self.priority, self.state )
+
+
+	def IsDone( self ):
+		"""
+		:return: Whether the action has finished, failed or been cancelled
+		:rtype: bool
+		"""
+		return self.state >= ActionState.Finished
+
+
+class ActionGraph( object ):
+	"""
+	Runs actions on job pools in dependency order.
+	"""
+	def __init__( self, pool ):
+		self._pool = pool
+		self._lock = threading.Lock( )
+		self._cond = threading.Condition( self._lock )
+		self._pending = set( )
+		self._outstanding = 0
+		self._completed = 0
+
+
+	def Add( self, func, args = ( ), priority = 0, memory = 0, dependencies = ( ), callback = None, name = None,
+			pool = None, held = False, onQueued = None ):
+		"""
+		Add an action to the graph. It's queued right away if nothing it depends on is still outstanding, unless it's
+		held.
+
+		:param func: Function to run. Returning False marks the action as failed.
+		:type func: callable
+
+		:param args: Arguments to call it with
+		:type args: tuple
+
+		:param priority: Priority of the action's job once it's queued
+		:type priority: int or float
+
+		:param memory: Memory the action is expected to need, in bytes, checked against the pool's memory budget
+		:type memory: int
+
+		:param dependencies: Actions that have to finish first
+		:type dependencies: list[Action]
+
+		:param callback: Called with the action once it's done, whatever its outcome
+		:type callback: callable
+
+		:param name: Name shown in the job pool
+		:type name: str
+
+		:param pool: Pool to run the action on, if not the graph's own
+		:type pool: csbuild._job_pool.JobPool
+
+		:param held: Keep the action waiting until it's passed to Release()
+		:type held: bool
+
+		:param onQueued: Called with the action when it's submitted to its pool
+		:type onQueued: callable
+
+		:return: The new action
+		:rtype: :class:`Action`
+		"""
+		action = Action( pool or self._pool, func, args, priority, memory, callback, onQueued,
+			name or getattr( func, "__name__", "action" ) )
+		with self._lock:
+			self._outstanding += 1
+			self._pending.add( action )
+			if held:
+				action._remaining += 1
+		self._addDependencies( action, dependencies, False )
+		return action
+
+
+	def Release( self, action, dependencies = ( ) ):
+		"""
+		Let a held action run once the given actions, along with everything it already depended on, have finished.
+
+		:param action: Action that was added held
+		:type action: :class:`Action`
+
+		:param dependencies: More actions that have to finish first
+		:type dependencies: list[Action]
+		"""
+		self._addDependencies( action, dependencies, True )
+
+
+	def _addDependencies( self, action, dependencies, release ):
+		cancelled = []
+		with self._lock:
+			if action.state != ActionState.Waiting:
+				return
+			for dependency in dependencies:
+				if dependency.state == ActionState.Finished:
+					continue
+				if dependency.IsDone( ):
+					self._cancelLocked( action, cancelled )
+					break
+				dependency._dependents.append( action )
+				action._remaining += 1
+			else:
+				if release:
+					action._remaining -= 1
+				if not action._remaining:
+					action.state = ActionState.Queued
+
+		if cancelled:
+			self._finishCancelled( cancelled )
+		elif action.state == ActionState.Queued:
+			self._submit( action )
+
+
+	def Cancel( self, action ):
+		"""
+		Cancel an action, along with everything waiting on it, if it hasn't started running yet.
+
+		:param action: Action to cancel
+		:type action: :class:`Action`
+
+		:return: Whether it was cancelled
+		:rtype: bool
+		"""
+		cancelled = []
+		with self._lock:
+			if self._isCancellable( action ):
+				self._cancelLocked( action, cancelled )
+		self._finishCancelled( cancelled )
+		return bool( cancelled )
+
+
+	def CancelPending( self ):
+		"""
+		Cancel every action that hasn't started running yet.
+
+		:return: The actions that were cancelled
+		:rtype: list[Action]
+		"""
+		cancelled = []
+		with self._lock:
+			for action in list( self._pending ):
+				if action.state <= ActionState.Queued and self._isCancellable( action ):
+					self._cancelLocked( action, cancelled )
+		self._finishCancelled( cancelled )
+		return cancelled
+
+
+	def GetOutstandingCount( self ):
+		"""
+		:return: Number of actions that haven't finished, failed or been cancelled yet, including ones still waiting
+			on others
+		:rtype: int
+		"""
+		with self._lock:
+			return self._outstanding
+
+
+	def GetCompletedCount( self ):
+		"""
+		:return: Number of actions that have finished, failed or been cancelled
+		:rtype: int
+		"""
+		with self._lock:
+			return self._completed
+
+
+	def WaitForCompletion( self, completedCount, timeout = None ):
+		"""
+		Block until another action is done, or until the timeout.
+
+		:param completedCount: The value GetCompletedCount() (or the last call to this) returned
+		:type completedCount: int
+
+		:param timeout: Longest time to wait, in seconds
+		:type timeout: float
+
+		:return: The number of actions done so far
+		:rtype: int
+		"""
+		with self._cond:
+			if self._completed == completedCount:
+				self._cond.wait( timeout )
+			return self._completed
+
+
+	def _isCancellable( self, action ):
+		#Called with the lock held. A queued action can only be cancelled if its job hasn't started.
+		if action.state == ActionState.Waiting:
+			return True
+		if action.state == ActionState.Queued:
+			return action._job is None or action._job.Cancel( )
+		return False
+
+
+	def _cancelLocked( self, action, cancelled ):
+		#Called with the lock held. Cancels the action and everything waiting on it.
+		stack = [ action ]
+		while stack:
+			current = stack.pop( )
+			current.state = ActionState.Cancelled
+			self._pending.discard( current )
+			cancelled.append( current )
+			for dependent in current._dependents:
+				if dependent.state == ActionState.Waiting:
+					stack.append( dependent )
+
+
+	def _finishCancelled( self, cancelled ):
+		if not cancelled:
+			return
+		for action in cancelled:
+			self._runCallback( action, action._callback )
+		with self._cond:
+			self._outstanding -= len( cancelled )
+			self._completed += len( cancelled )
+			self._cond.notify_all( )
+
+
+	def _submit( self, action ):
+		with self._lock:
+			#It may have been cancelled since it was marked as queued.
+			if action.state != ActionState.Queued:
+				return
+			action.queuedTime = time.time( )
+			action._job = action._pool.Submit( self._run, ( action, ), priority = action.priority, memory = action.memory,
+				name = action.name )
+		self._runCallback( action, action._onQueued )
+
+
+	def _run( self, action ):
+		failed = True
+		try:
+			action.result = action._func( *action.args )
+			failed = action.result is False
+		finally:
+			self._finish( action, ActionState.Failed if failed else ActionState.Finished )
+		return action.result
+
+
+	def _finish( self, action, state ):
+		ready = []
+		cancelled = []
+		with self._lock:
+			action.state = state
+			self._pending.discard( action )
+			for dependent in action._dependents:
+				if dependent.state != ActionState.Waiting:
+					continue
+				if state == ActionState.Finished:
+					dependent._remaining -= 1
+					if not dependent._remaining:
+						dependent.state = ActionState.Queued
+						ready.append( dependent )
+				else:
+					self._cancelLocked( dependent, cancelled )
+
+		#Callbacks run before the action stops counting as outstanding, so anyone waiting for the graph to empty
+		# sees everything they did. Dependents are submitted first, so the pools never look empty in between.
+		for dependent in ready:
+			self._submit( dependent )
+		self._runCallback( action, action._callback )
+		self._finishCancelled( cancelled )
+
+		with self._cond:
+			self._outstanding -= 1
+			self._completed += 1
+			self._cond.notify_all( )
+
+
+	@staticmethod
+	def _runCallback( action, callback ):
+		if callback is None:
+			return
+		try:
+			callback( action )
+		except Exception:
+			traceback.print_exc( )
@@ -0,0 +1,324 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Picks what goes into a project's precompiled headers (EnableAutoPrecompile), instead of listing headers by hand with
+Precompile() or precompiling every header in the project with EnableChunkedPrecompile().
+
+A header is worth precompiling when many translation units include it, it's expensive to parse, and it rarely
+changes: any change to anything in the precompiled header means rebuilding it, and every translation unit that uses
+it. The include index (see _include_index) says which headers each translation unit includes, directly or
+indirectly, and how often each header has changed across the project's successful builds. A header is chosen if at
+least a given share of the translation units include it, and neither it nor anything it includes has changed in more
+than a given share of those builds. Headers are taken in order of how much parsing they'd save - the size of
+everything they pull in, times the number of translation units that include them - and a header that's already
+pulled in by one taken earlier isn't listed again.
+
+Headers that were chosen last time are given some slack on both limits, so a header on the edge of them doesn't go in
+and out of the precompiled header from one build to the next, rebuilding everything each time it does.
+
+The savings are estimated from how much header text the translation units no longer have to parse, converted to time
+using how long the project's sources took to compile last time, per byte of the source and its headers.
+"""
+
+import math
+import os
+
+from . import log
+from . import _build_history
+from . import _include_index
+from . import _stat_cache
+
+#How far past the limits a header chosen last time can go before it's dropped again
+_KEEP_SHARE = 0.5
+_KEEP_CHANGE_RATE = 2.0
+
+
+class Estimate( object ):
+	"""
+	Expected effect of precompiling a set of headers.
+
+	:ivar headers: Number of headers in the precompiled header, counting everything the chosen ones include
+	:type headers: int
+
+	:ivar size: Total size of those headers, in bytes
+	:type size: int
+
+	:ivar users: Number of translation units that include at least one of them
+	:type users: int
+
+	:ivar translationUnits: Number of translation units considered
+	:type translationUnits: int
+
+	:ivar bytesSaved: Header text the translation units no longer parse themselves on a full build, in bytes
+	:type bytesSaved: int
+
+	:ivar secondsSaved: Compile time that saves on a full build, less the time to build the precompiled header, or
+		None if there's no compile history to go on
+	:type secondsSaved: float or None
+
+	:ivar changeRate: Share of the project's builds with changes in them where something in the precompiled header
+		changed
+	:type changeRate: float
+	"""
+	def __init__( self ):
+		self.headers = 0
+		self.size = 0
+		self.users = 0
+		self.translationUnits = 0
+		self.bytesSaved = 0
+		self.secondsSaved = None
+		self.changeRate = 0.0
+
+
+def SelectHeaders( translationUnits, getIncludes, followHeader, getChangeRate, getSize, minShare, maxChangeRate,
+	previous = ( ), excludes = ( ) ):
+	"""
+	Choose the headers to precompile for a set of translation units.
+
+	:param translationUnits: Absolute paths of the translation units that will use the precompiled header
+	:type translationUnits: list[str]
+
+	:param getIncludes: Returns every header a translation unit includes, directly or indirectly
+	:type getIncludes: callable
+
+	:param followHeader: Returns every header a header includes, directly or indirectly
+	:type followHeader: callable
+
+	:param getChangeRate: Returns the share of builds with changes in them where a header changed
+	:type getChangeRate: callable
+
+	:param getSize: Returns the size of a file in bytes
+	:type getSize: callable
+
+	:param minShare: Smallest share of the translation units that have to include a header for it to be chosen
+	:type minShare: float
+
+	:param maxChangeRate: Largest share of builds a header, or anything it includes, can have changed in
+	:type maxChangeRate: float
+
+	:param previous: Headers chosen last time
+	:type previous: iterable[str]
+
+	:param excludes: Headers never to choose
+	:type excludes: iterable[str]
+
+	:return: The chosen headers, most valuable first, and the set of every header they pull in
+	:rtype: tuple[list[str], set[str]]
+	"""
+	previous = set( previous )
+	excludes = set( excludes )
+
+	users = { }
+	for translationUnit in translationUnits:
+		for header in getIncludes( translationUnit ):
+			users[header] = users.get( header, 0 ) + 1
+
+	#A header only one translation unit includes gains nothing from being precompiled.
+	minUsers = max( 2, int( math.ceil( minShare * len( translationUnits ) ) ) )
+	keepUsers = max( 2, int( math.ceil( minShare * _KEEP_SHARE * len( translationUnits ) ) ) )
+
+	candidates = [ ]
+	closures = { }
+	for header, count in users.items( ):
+		if header in excludes:
+			continue
+		kept = header in previous
+		if count < ( keepUsers if kept else minUsers ):
+			continue
+		closure = set( followHeader( header ) )
+		closure.add( header )
+		#Everything the header includes goes into the precompiled header with it.
+		if closure & excludes:
+			continue
+		limit = maxChangeRate * _KEEP_CHANGE_RATE if kept else maxChangeRate
+		if any( getChangeRate( included ) > limit for included in closure ):
+			continue
+		closures[header] = closure
+		candidates.append( ( -count * sum( getSize( included ) for included in closure ), header ) )
+
+	chosen = [ ]
+	covered = set( )
+	for _, header in sorted( candidates ):
+		if header in covered:
+			continue
+		chosen.append( header )
+		covered |= closures[header]
+	return chosen, covered
+
+
+def EstimateSavings( translationUnits, getIncludes, covered, getChangeRate, getSize, getCompileTime ):
+	"""
+	Estimate what precompiling a set of headers saves on a full build.
+
+	:param translationUnits: Absolute paths of the translation units that will use the precompiled header
+	:type translationUnits: list[str]
+
+	:param getIncludes: Returns every header a translation unit includes, directly or indirectly
+	:type getIncludes: callable
+
+	:param covered: Every header in the precompiled header
+	:type covered: set[str]
+
+	:param getChangeRate: Returns the share of builds with changes in them where a header changed
+	:type getChangeRate: callable
+
+	:param getSize: Returns the size of a file in bytes
+	:type getSize: callable
+
+	:param getCompileTime: Returns how long a source took to compile last time, or None if it's not known
+	:type getCompileTime: callable
+
+	:rtype: :class:`Estimate`
+	"""
+	estimate = Estimate( )
+	estimate.headers = len( covered )
+	estimate.size = sum( getSize( header ) for header in covered )
+	estimate.translationUnits = len( translationUnits )
+
+	measuredSeconds = 0.0
+	measuredBytes = 0
+	for translationUnit in translationUnits:
+		includes = getIncludes( translationUnit )
+		shared = covered.intersection( includes )
+		if shared:
+			estimate.users += 1
+			estimate.bytesSaved += sum( getSize( header ) for header in shared )
+		seconds = getCompileTime( translationUnit )
+		if seconds is not None:
+			measuredSeconds += seconds
+			measuredBytes += getSize( translationUnit ) + sum( getSize( header ) for header in includes )
+
+	if measuredBytes:
+		secondsPerByte = measuredSeconds / measuredBytes
+		#The precompiled header has to be built once itself.
+		estimate.secondsSaved = ( estimate.bytesSaved - estimate.size ) * secondsPerByte
+
+	unchanged = 1.0
+	for header in covered:
+		unchanged *= 1.0 - min( getChangeRate( header ), 1.0 )
+	estimate.changeRate = 1.0 - unchanged
+	return estimate
+
+
+def GetPreviousHeaders( headerFile ):
+	"""
+	:param headerFile: A precompiled header generated by an earlier build
+	:type headerFile: str
+
+	:return: The headers it includes, or an empty list if it doesn't exist
+	:rtype: list[str]
+	"""
+	if not _stat_cache.Exists( headerFile ):
+		return [ ]
+	headers = [ ]
+	with open( headerFile, "r" ) as f:
+		for line in f:
+			line = line.strip( )
+			if line.startswith( '#include "' ):
+				headers.append( line[len( '#include "' ):].rsplit( '"', 1 )[0] )
+	return headers
+
+
+def SelectForProject( project, cppHeaderFile, cHeaderFile, excludes ):
+	"""
+	Choose the headers to precompile for a project, one set for its C++ sources and one for its C sources, and log
+	what they're expected to save.
+
+	:param project: Project to choose for
+	:type project: csbuild.projectSettings.projectSettings
+
+	:param cppHeaderFile: Where the project's C++ precompiled header is generated
+	:type cppHeaderFile: str
+
+	:param cHeaderFile: Where the project's C precompiled header is generated
+	:type cHeaderFile: str
+
+	:param excludes: Headers never to precompile
+	:type excludes: set[str]
+
+	:return: The C++ headers and the C headers to precompile
+	:rtype: tuple[list[str], list[str]]
+	"""
+	index = _include_index.GetIndex( project.csbuildDir, project.key )
+	includesCache = { }
+
+	def getIncludes( translationUnit ):
+		headers = includesCache.get( translationUnit )
+		if headers is None:
+			headers = project._scannedIncludes.get( translationUnit )
+			if headers is None:
+				headers = index.GetIncludes( translationUnit )
+			if headers is None:
+				headers = set( )
+				project.follow_headers( translationUnit, headers )
+			includesCache[translationUnit] = headers
+		return headers
+
+	def followHeader( header ):
+		headers = set( )
+		project.follow_headers( header, headers )
+		return headers
+
+	def getCompileTime( translationUnit ):
+		return _build_history.GetSourceCompileTime( translationUnit )
+
+	#The generated headers themselves, and anything else csbuild writes, are never candidates.
+	excludes = set( excludes )
+	for translationUnit in project.allsources:
+		excludes.update( header for header in getIncludes( translationUnit ) if header.startswith( project.csbuildDir ) )
+
+	cSources = [ source for source in project.allsources if os.path.splitext( source )[1] in project.cExtensions ]
+	cppSources = [ source for source in project.allsources if os.path.splitext( source )[1] not in project.cExtensions ]
+
+	results = [ ]
+	for language, sources, headerFile in ( ( "C++", cppSources, cppHeaderFile ), ( "C", cSources, cHeaderFile ) ):
+		if not sources:
+			results.append( [ ] )
+			continue
+
+		chosen, covered = SelectHeaders(
+			sources, getIncludes, followHeader, index.GetChangeRate, _stat_cache.GetSize,
+			project.autoPrecompileMinShare, project.autoPrecompileMaxChangeRate,
+			GetPreviousHeaders( headerFile ), excludes
+		)
+		results.append( chosen )
+
+		if not chosen:
+			log.LOG_BUILD( "Auto-precompile for {} ({}): no header is included by enough translation units and changes rarely enough.".format( project.outputName, language ) )
+			continue
+
+		estimate = EstimateSavings( sources, getIncludes, covered, index.GetChangeRate, _stat_cache.GetSize, getCompileTime )
+		for header in chosen:
+			log.LOG_INFO( "Auto-precompiling {}".format( header ) )
+		if estimate.secondsSaved is not None:
+			savings = "about {:.1f}s".format( estimate.secondsSaved )
+		else:
+			savings = "parsing {:.1f} MB of headers".format( estimate.bytesSaved / ( 1024.0 * 1024.0 ) )
+		log.LOG_BUILD(
+			"Auto-precompile for {} ({}): {} headers ({} with what they include, {} KB), used by {} of {} translation units. "
+			"Expected to save {} per full build; contents changed in {:.0f}% of recent builds with changes.".format(
+				project.outputName, language, len( chosen ), estimate.headers, estimate.size // 1024, estimate.users,
+				estimate.translationUnits, savings, estimate.changeRate * 100
+			)
+		)
+
+	return results[0], results[1]
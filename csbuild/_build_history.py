@@ -0,0 +1,402 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+How long each translation unit took to compile and each project took to link on previous builds, how much memory each
+compile needed, and the critical path estimates the build scheduler derives from them.
+
+Compile times are keyed by object file and link times by project key. Each source file's share of the compile of the
+translation unit it was built in is kept as well, so chunks can be made up by how long their files take to compile
+(see projectSettings.make_chunks). Each is a moving average, so one slow run on a
+busy machine doesn't throw off the next build's schedule. Peak memory is tracked the same way, except that a higher
+reading replaces the old one outright, since underestimating it is what gets a build killed. The history is kept in
+the cache directory and loaded at the start of every build.
+
+Before anything is queued, PlanCriticalPath() works out, for every project, how long the build can't finish after its
+compiles are done: its own link, plus the longest chain of dependent projects that have to wait for it. A compile's
+priority is its own expected duration plus that, so the longest work on the critical path to each link starts
+first, and projects that gate other projects' links go ahead of those that don't.
+"""
+
+import os
+import sys
+import threading
+import time
+
+if sys.version_info < (3,0):
+	import cPickle as pickle
+else:
+	import pickle
+
+from . import log
+from . import _shared_globals
+from . import _stat_cache
+from . import _utils
+
+_HISTORY_VERSION = 3
+
+#Weight given to the newest measurement in the moving averages
+_SMOOTHING = 0.5
+
+#Entries that haven't been measured for this long are dropped when the history is saved
+_MAX_AGE = 30 * 24 * 60 * 60
+
+#Guess for a compile nothing is known about, when there's no history at all to go on
+_DEFAULT_COMPILE_TIME = 1.0
+
+_lock = threading.Lock( )
+#{ absolute object path : ( seconds, peak memory in bytes or None, time last measured ) }
+_compileTimes = {}
+#{ project key : ( seconds, time last measured ) }
+_linkTimes = {}
+#{ absolute source path : ( seconds, time last measured ) }
+_sourceTimes = {}
+_dirty = False
+
+
+def _getPath( ):
+	return os.path.join( _shared_globals.cacheDirectory, "build_history.csbc" )
+
+
+def Load( ):
+	"""
+	Read the history saved by previous builds, replacing whatever is in memory.
+	"""
+	global _compileTimes
+	global _linkTimes
+	global _sourceTimes
+	global _dirty
+
+	compileTimes = {}
+	linkTimes = {}
+	sourceTimes = {}
+	path = _getPath( )
+	if os.access( path, os.F_OK ):
+		try:
+			with open( path, "rb" ) as f:
+				data = pickle.load( f )
+			if data.get( "version" ) == _HISTORY_VERSION:
+				compileTimes = data["compile"]
+				linkTimes = data["link"]
+				sourceTimes = data["source"]
+		except Exception as e:
+			log.LOG_WARN( "Could not read build history from {}: {}".format( path, e ) )
+
+	with _lock:
+		_compileTimes = compileTimes
+		_linkTimes = linkTimes
+		_sourceTimes = sourceTimes
+		_dirty = False
+
+
+def Save( ):
+	"""
+	Write the history back to the cache directory, if anything was measured since it was loaded.
+	"""
+	global _dirty
+
+	cutoff = time.time( ) - _MAX_AGE
+	with _lock:
+		if not _dirty:
+			return
+		data = {
+			"version" : _HISTORY_VERSION,
+			"compile" : dict( ( key, value ) for key, value in _compileTimes.items( ) if value[-1] >= cutoff ),
+			"link" : dict( ( key, value ) for key, value in _linkTimes.items( ) if value[-1] >= cutoff ),
+			"source" : dict( ( key, value ) for key, value in _sourceTimes.items( ) if value[-1] >= cutoff ),
+		}
+		_dirty = False
+
+	try:
+		_utils.AtomicPickleDump( data, _getPath( ) )
+	except ( OSError, IOError ) as e:
+		log.LOG_WARN( "Could not save build history: {}".format( e ) )
+
+
+def _smooth( previous, value ):
+	if previous is None:
+		return value
+	return previous + ( value - previous ) * _SMOOTHING
+
+
+def RecordCompile( obj, seconds, peakMemory = None, sources = None ):
+	"""
+	Record how long an object file took to compile, and how much memory the compiler needed.
+
+	:param obj: Object file that was built
+	:type obj: str
+
+	:param seconds: How long the compile took
+	:type seconds: float
+
+	:param peakMemory: Peak resident memory of the compiler in bytes, or None if it wasn't measured (for instance
+		because it ran on a build worker)
+	:type peakMemory: int or None
+
+	:param sources: Source files that were compiled into it, if it was a chunk or a single source file. The time is
+		split between them by size.
+	:type sources: list[str]
+	"""
+	global _dirty
+	key = os.path.abspath( obj )
+
+	shares = []
+	if sources:
+		sizes = []
+		for source in sources:
+			try:
+				sizes.append( _stat_cache.GetSize( source ) )
+			except OSError:
+				sizes.append( 0 )
+		totalSize = sum( sizes )
+		for source, size in zip( sources, sizes ):
+			if totalSize:
+				shares.append( ( os.path.abspath( source ), seconds * size / totalSize ) )
+			else:
+				shares.append( ( os.path.abspath( source ), seconds / len( sources ) ) )
+
+	now = time.time( )
+	with _lock:
+		for source, share in shares:
+			previous = _sourceTimes.get( source )
+			_sourceTimes[source] = ( _smooth( previous[0] if previous is not None else None, share ), now )
+		previous = _compileTimes.get( key )
+		if previous is not None:
+			seconds = _smooth( previous[0], seconds )
+			if peakMemory is None:
+				peakMemory = previous[1]
+			elif previous[1] is not None and peakMemory < previous[1]:
+				peakMemory = int( _smooth( previous[1], peakMemory ) )
+		_compileTimes[key] = ( seconds, peakMemory, now )
+		_dirty = True
+
+
+def RecordLinkTime( projectKey, seconds ):
+	"""
+	Record how long a project took to link.
+
+	:param projectKey: Key of the project that was linked
+	:type projectKey: str
+
+	:param seconds: How long the link took
+	:type seconds: float
+	"""
+	global _dirty
+	with _lock:
+		previous = _linkTimes.get( projectKey )
+		_linkTimes[projectKey] = ( _smooth( previous[0] if previous is not None else None, seconds ), time.time( ) )
+		_dirty = True
+
+
+def GetCompileTime( obj ):
+	"""
+	:param obj: Object file to look up
+	:type obj: str
+
+	:return: How long the object file usually takes to compile, or None if it's never been compiled
+	:rtype: float or None
+	"""
+	entry = _compileTimes.get( os.path.abspath( obj ) )
+	if entry is None:
+		return None
+	return entry[0]
+
+
+def GetSourceCompileTime( source ):
+	"""
+	:param source: Source file to look up
+	:type source: str
+
+	:return: How long the source file usually takes to compile, or None if it's never been compiled
+	:rtype: float or None
+	"""
+	entry = _sourceTimes.get( os.path.abspath( source ) )
+	if entry is None:
+		return None
+	return entry[0]
+
+
+def GetPeakMemory( obj ):
+	"""
+	:param obj: Object file to look up
+	:type obj: str
+
+	:return: How much memory, in bytes, the object file's compile usually needs, or None if it's never been measured
+	:rtype: int or None
+	"""
+	entry = _compileTimes.get( os.path.abspath( obj ) )
+	if entry is None:
+		return None
+	return entry[1]
+
+
+def GetLinkTime( projectKey ):
+	"""
+	:param projectKey: Key of the project to look up
+	:type projectKey: str
+
+	:return: How long the project usually takes to link, or None if it's never been linked
+	:rtype: float or None
+	"""
+	entry = _linkTimes.get( projectKey )
+	if entry is None:
+		return None
+	return entry[0]
+
+
+class CriticalPathPlan( object ):
+	"""
+	Expected durations and memory use for one build, used to prioritize and throttle its compiles.
+
+	:ivar tails: How long, in seconds, the build is expected to keep going after each project's compiles are done,
+		keyed by project key
+	:type tails: dict[str, float]
+	"""
+	def __init__( self ):
+		self.tails = {}
+		self._estimates = {}
+		self._defaults = {}
+		self._memory = {}
+		self._defaultMemory = {}
+
+
+	def EstimateCompileTime( self, project, obj ):
+		"""
+		:param project: Project the object file belongs to
+		:type project: projectSettings.projectSettings
+
+		:param obj: Object file to estimate
+		:type obj: str
+
+		:return: Expected compile time of the object file, falling back to the average of the project (or of the
+			whole build) for ones that have never been compiled
+		:rtype: float
+		"""
+		estimate = self._estimates.get( obj )
+		if estimate is None:
+			estimate = self._defaults.get( project.key, _DEFAULT_COMPILE_TIME )
+		return estimate
+
+
+	def EstimateMemory( self, project, obj ):
+		"""
+		:param project: Project the object file belongs to
+		:type project: projectSettings.projectSettings
+
+		:param obj: Object file to estimate
+		:type obj: str
+
+		:return: Memory, in bytes, the object file's compile is expected to need, falling back to the average of the
+			project (or of the whole build) for ones that have never been measured, or 0 if nothing has
+		:rtype: int
+		"""
+		memory = self._memory.get( obj )
+		if memory is None:
+			memory = self._defaultMemory.get( project.key, 0 )
+		return memory
+
+
+	def GetPriority( self, project, obj ):
+		"""
+		:param project: Project the object file belongs to
+		:type project: projectSettings.projectSettings
+
+		:param obj: Object file to be compiled
+		:type obj: str
+
+		:return: Length of the longest chain of work, in seconds, that starts with this compile
+		:rtype: float
+		"""
+		return self.EstimateCompileTime( project, obj ) + self.tails.get( project.key, 0 )
+
+
+def PlanCriticalPath( projects, objsByProject, threads ):
+	"""
+	Estimate the critical path through the build from the recorded history.
+
+	:param projects: Projects being built, with every project after the ones it depends on
+	:type projects: list[projectSettings.projectSettings]
+
+	:param objsByProject: Object files each project is going to compile, keyed by project key
+	:type objsByProject: dict[str, list[str]]
+
+	:param threads: Number of compiles that can run at once
+	:type threads: int
+
+	:return: The plan
+	:rtype: :class:`CriticalPathPlan`
+	"""
+	plan = CriticalPathPlan( )
+	known = []
+	knownMemory = []
+	with _lock:
+		for project in projects:
+			projectKnown = []
+			projectKnownMemory = []
+			for obj in objsByProject.get( project.key, [] ):
+				entry = _compileTimes.get( os.path.abspath( obj ) )
+				if entry is not None:
+					plan._estimates[obj] = entry[0]
+					projectKnown.append( entry[0] )
+					if entry[1] is not None:
+						plan._memory[obj] = entry[1]
+						projectKnownMemory.append( entry[1] )
+			if projectKnown:
+				plan._defaults[project.key] = sum( projectKnown ) / len( projectKnown )
+			if projectKnownMemory:
+				plan._defaultMemory[project.key] = sum( projectKnownMemory ) // len( projectKnownMemory )
+			known += projectKnown
+			knownMemory += projectKnownMemory
+		linkTimes = dict( ( key, value[0] ) for key, value in _linkTimes.items( ) )
+
+	overallDefault = sum( known ) / len( known ) if known else _DEFAULT_COMPILE_TIME
+	overallDefaultMemory = sum( knownMemory ) // len( knownMemory ) if knownMemory else 0
+	for project in projects:
+		plan._defaults.setdefault( project.key, overallDefault )
+		plan._defaultMemory.setdefault( project.key, overallDefaultMemory )
+
+	#Projects whose link or compiles wait on each project, and how long each one's compiles take with the whole
+	# build to themselves.
+	linkDependents = {}
+	srcDependents = {}
+	compileSpans = {}
+	for project in projects:
+		for depend in project.reconciledLinkDepends:
+			linkDependents.setdefault( depend, [] ).append( project )
+		for depend in project.srcDepends:
+			srcDependents.setdefault( depend, [] ).append( project )
+		estimates = [ plan.EstimateCompileTime( project, obj ) for obj in objsByProject.get( project.key, [] ) ]
+		if estimates:
+			compileSpans[project.key] = max( max( estimates ), sum( estimates ) / max( threads, 1 ) )
+		else:
+			compileSpans[project.key] = 0
+
+	#Dependents always come after what they depend on, so walking backward fills in every dependent's tail before
+	# it's needed.
+	for project in reversed( projects ):
+		longest = 0
+		for dependent in linkDependents.get( project.key, [] ):
+			longest = max( longest, plan.tails.get( dependent.key, 0 ) )
+		for dependent in srcDependents.get( project.key, [] ):
+			longest = max( longest, compileSpans[dependent.key] + plan.tails.get( dependent.key, 0 ) )
+		plan.tails[project.key] = linkTimes.get( project.key, 0 ) + longest
+
+	return plan
@@ -0,0 +1,429 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Packs a project's source files into chunks, keeping the chunks from the previous build where it can.
+
+Every file has a cost - its size, its expected compile time, or just 1 when chunking by number of files - and every
+chunk has a budget. Files are sorted by cost once, most expensive first, and each one goes into an open chunk it can
+join that has room for it: one that already has files from the same directory if possible, otherwise whichever has the
+most room, found through a heap. A new chunk is only started when no open chunk has room for the file, so chunks come
+out about as full as each other, mostly made up of neighbouring files, and packing is O(n log n) in the number of
+files.
+
+Since a chunk's name comes from the files in it, repacking from scratch every build would mean adding one file could
+move others between chunks, renaming them and forcing them to rebuild. The chunks each build makes are saved in the
+project's csbuildDir instead, and the next build starts from them: files that are gone are dropped from their chunks,
+and new files are packed into chunks with room, or new chunks if none have any. Only the chunks that gained or lost a
+file change. A chunk is only broken up again if its files have grown well past the budget.
+
+Once a project's chunks are made, :class:`ChunkIndex` maps each file to its chunk and each chunk name back to its
+files, so looking either up doesn't mean hashing the file names of every chunk in the project.
+
+Which files can share a chunk is worked out up front by :class:`ChunkRules`: C and C++ files never share one,
+Objective-C files and files excluded from chunking always get one to themselves, and files marked as mutually
+exclusive are kept apart by looking each one up in a set of the files it conflicts with.
+"""
+
+import hashlib
+import heapq
+import os
+import sys
+
+if sys.version_info < (3,0):
+	import cPickle as pickle
+else:
+	import pickle
+
+from . import log
+from . import _utils
+
+_ASSIGNMENT_VERSION = 1
+
+#How far over budget a chunk from a previous build can get, as its files grow or take longer to compile, before its
+# files are packed again. Without some slack, compile times varying from build to build would keep breaking chunks up.
+_OVERFLOW = 1.5
+
+
+class ChunkRules( object ):
+	"""
+	Which files are allowed to share a chunk.
+
+	:ivar excludes: Files that are never chunked with anything else
+	:type excludes: set[str]
+	"""
+	def __init__( self, cExtensions, cppExtensions, excludes, mutexes ):
+		self._cExtensions = set( cExtensions )
+		self._cppExtensions = set( cppExtensions )
+		self.excludes = set( excludes )
+		#{ file : set of files it can't share a chunk with }, filled in both directions
+		self._conflicts = {}
+		for srcFile, others in mutexes.items( ):
+			for other in others:
+				self._conflicts.setdefault( srcFile, set( ) ).add( other )
+				self._conflicts.setdefault( other, set( ) ).add( srcFile )
+
+
+	def GetGroup( self, srcFile ):
+		"""
+		:param srcFile: Source file to look up
+		:type srcFile: str
+
+		:return: Only files in the same group can share a chunk. None if the file has to be in a chunk on its own.
+		:rtype: str or None
+		"""
+		if srcFile in self.excludes:
+			return None
+		extension = os.path.splitext( srcFile )[1]
+		#TODO: Remove this once the source file extension management has been reworked.
+		# Objective-C/C++ files should not be chunked since they won't play nice with C++.
+		if extension == ".m" or extension == ".mm":
+			return None
+		if extension in self._cExtensions:
+			return "c"
+		if extension in self._cppExtensions:
+			return "cpp"
+		return extension
+
+
+	def Conflicts( self, srcFile, members ):
+		"""
+		:param srcFile: File that's going to be added to a chunk
+		:type srcFile: str
+
+		:param members: Files already in the chunk
+		:type members: set[str]
+
+		:return: Whether the file has been marked as mutually exclusive with anything in the chunk
+		:rtype: bool
+		"""
+		conflicts = self._conflicts.get( srcFile )
+		if not conflicts or conflicts.isdisjoint( members ):
+			return False
+		other = next( iter( conflicts & members ) )
+		log.LOG_INFO( "Rejecting {} for this chunk because it is labeled as mutually exclusive with {} for chunking".format( srcFile, other ) )
+		return True
+
+
+class ChunkIndex( object ):
+	"""
+	Lookup tables for a project's chunks.
+
+	:ivar chunks: The chunks the index was built from
+	:type chunks: list[list[str]]
+
+	:ivar outputName: Output name of the project the chunks were named for
+	:type outputName: str
+
+	:ivar names: Name of each chunk, in the same order as chunks
+	:type names: list[str]
+	"""
+	def __init__( self, outputName, chunks ):
+		self.chunks = chunks
+		self.outputName = outputName
+		self.names = [ _utils.GetChunkName( outputName, chunk ) for chunk in chunks ]
+		self._chunksByName = dict( zip( self.names, chunks ) )
+		self._namesByFile = {}
+		for name, chunk in zip( self.names, chunks ):
+			for srcFile in chunk:
+				self._namesByFile.setdefault( srcFile, name )
+
+
+	def GetChunkName( self, srcFile ):
+		"""
+		:param srcFile: Source file to look up
+		:type srcFile: str
+
+		:return: Name of the chunk the file is in, or None if it isn't in one
+		:rtype: str or None
+		"""
+		return self._namesByFile.get( srcFile )
+
+
+	def GetChunk( self, name ):
+		"""
+		:param name: Chunk name to look up
+		:type name: str
+
+		:return: Files in the chunk with that name, or None if there isn't one
+		:rtype: list[str] or None
+		"""
+		return self._chunksByName.get( name )
+
+
+	def GroupSources( self, sources ):
+		"""
+		:param sources: Source files to group
+		:type sources: list[str]
+
+		:return: The given files that are in each chunk, keyed by chunk name, in the order they were given
+		:rtype: dict[str, list[str]]
+		"""
+		grouped = {}
+		for srcFile in sources:
+			name = self._namesByFile.get( srcFile )
+			if name is not None:
+				grouped.setdefault( name, [] ).append( srcFile )
+		return grouped
+
+
+class _Packer( object ):
+	"""
+	Adds files to chunks one at a time. See the module description for how each file is placed.
+
+	:ivar chunks: Files in each chunk
+	:type chunks: list[list[str]]
+
+	:ivar chunkCosts: What each chunk costs
+	:type chunkCosts: list[int or float]
+	"""
+	def __init__( self, costs, budget, rules ):
+		self.chunks = []
+		self.chunkCosts = []
+		self._costs = costs
+		self._budget = budget
+		self._rules = rules
+		self._members = []
+		self._groups = []
+		#{ group, or ( group, directory ) : heap of ( -room left, chunk index ) }, so the chunk with the most room is on
+		# top. Entries aren't removed when a chunk's room changes; they're skipped once they no longer match it.
+		self._heaps = {}
+
+
+	def AddChunk( self, chunk ):
+		"""
+		Add a chunk as it is, for files to be added to later.
+
+		:param chunk: Files in the chunk, which have to be allowed to share it
+		:type chunk: list[str]
+		"""
+		index = len( self.chunks )
+		self.chunks.append( list( chunk ) )
+		self.chunkCosts.append( sum( self._costs[srcFile] for srcFile in chunk ) )
+		group = self._rules.GetGroup( chunk[0] )
+		self._groups.append( group )
+		if group is None:
+			self._members.append( None )
+			return
+		self._members.append( set( chunk ) )
+		self._push( index, set( os.path.dirname( srcFile ) for srcFile in chunk ) )
+
+
+	def Add( self, srcFile ):
+		"""
+		Add a file to the chunk that suits it best, or to a new chunk.
+
+		:param srcFile: File to add
+		:type srcFile: str
+		"""
+		cost = self._costs[srcFile]
+		group = self._rules.GetGroup( srcFile )
+		if group is None:
+			self.AddChunk( [ srcFile ] )
+			return
+
+		directory = os.path.dirname( srcFile )
+		index = None
+		heap = self._heaps.get( ( group, directory ) )
+		if heap:
+			index = self._take( heap, srcFile, cost )
+		if index is None:
+			heap = self._heaps.get( group )
+			if heap:
+				index = self._take( heap, srcFile, cost )
+		if index is None:
+			self.AddChunk( [ srcFile ] )
+			return
+
+		self.chunks[index].append( srcFile )
+		self.chunkCosts[index] += cost
+		self._members[index].add( srcFile )
+		#The chunk drops out of the heaps for its other directories, which is fine since those are only a preference;
+		# keeping them all up to date would cost as much as the number of directories in the chunk on every file.
+		self._push( index, ( directory, ) )
+
+
+	def _push( self, index, directories ):
+		entry = ( self.chunkCosts[index] - self._budget, index )
+		group = self._groups[index]
+		heapq.heappush( self._heaps.setdefault( group, [] ), entry )
+		for directory in directories:
+			heapq.heappush( self._heaps.setdefault( ( group, directory ), [] ), entry )
+
+
+	def _take( self, heap, srcFile, cost ):
+		#Index of the chunk in the heap with the most room that the file fits in and can join, or None.
+		skipped = []
+		found = None
+		while heap:
+			room, index = heap[0]
+			if room != self.chunkCosts[index] - self._budget:
+				heapq.heappop( heap )
+				continue
+			#Everything below the top has less room, so once the top can't fit the file, nothing can.
+			if -room < cost:
+				break
+			entry = heapq.heappop( heap )
+			if self._rules.Conflicts( srcFile, self._members[index] ):
+				skipped.append( entry )
+				continue
+			found = index
+			break
+		for entry in skipped:
+			heapq.heappush( heap, entry )
+		return found
+
+
+def PackChunks( files, costs, budget, rules ):
+	"""
+	Pack files into chunks that each cost no more than the budget, where possible. A file that costs more than the
+	budget on its own gets a chunk to itself.
+
+	:param files: Files to pack. Files that cost the same are packed in this order.
+	:type files: list[str]
+
+	:param costs: Cost of each file
+	:type costs: dict[str, int or float]
+
+	:param budget: Most a chunk should cost
+	:type budget: int or float
+
+	:param rules: Which files can share a chunk
+	:type rules: :class:`ChunkRules`
+
+	:return: The chunks, and what each one costs
+	:rtype: tuple[list[list[str]], list[int or float]]
+	"""
+	packer = _Packer( costs, budget, rules )
+	for srcFile in sorted( files, key = lambda srcFile: -costs[srcFile] ):
+		packer.Add( srcFile )
+	return packer.chunks, packer.chunkCosts
+
+
+def UpdateChunks( previous, files, costs, budget, rules ):
+	"""
+	Pack files into chunks, starting from the chunks a previous build made. Chunks keep the files they had that are
+	still in the project and can still share them, unless they've grown well past the budget; every other file is
+	packed as it would be by :func:`PackChunks`, into those chunks where there's room.
+
+	:param previous: Chunks the previous build made
+	:type previous: list[list[str]]
+
+	:param files: Files to pack
+	:type files: list[str]
+
+	:param costs: Cost of each file
+	:type costs: dict[str, int or float]
+
+	:param budget: Most a chunk should cost
+	:type budget: int or float
+
+	:param rules: Which files can share a chunk
+	:type rules: :class:`ChunkRules`
+
+	:return: The chunks, and what each one costs
+	:rtype: tuple[list[list[str]], list[int or float]]
+	"""
+	packer = _Packer( costs, budget, rules )
+	assigned = set( )
+	for chunk in previous:
+		kept = []
+		members = set( )
+		group = None
+		for srcFile in chunk:
+			if srcFile not in costs or srcFile in assigned:
+				continue
+			fileGroup = rules.GetGroup( srcFile )
+			if kept and ( fileGroup is None or fileGroup != group or rules.Conflicts( srcFile, members ) ):
+				continue
+			group = fileGroup
+			kept.append( srcFile )
+			members.add( srcFile )
+		if not kept:
+			continue
+		if len( kept ) > 1 and sum( costs[srcFile] for srcFile in kept ) > budget * _OVERFLOW:
+			continue
+		packer.AddChunk( kept )
+		assigned.update( kept )
+
+	for srcFile in sorted( ( srcFile for srcFile in files if srcFile not in assigned ), key = lambda srcFile: -costs[srcFile] ):
+		packer.Add( srcFile )
+	return packer.chunks, packer.chunkCosts
+
+
+def GetAssignmentPath( csbuildDir, projectKey ):
+	"""
+	:param csbuildDir: The project's csbuildDir
+	:type csbuildDir: str
+
+	:param projectKey: The project's key. Several projects can share a csbuildDir, so each gets its own file in it.
+	:type projectKey: str
+
+	:return: Where the project's chunks are saved
+	:rtype: str
+	"""
+	key = projectKey
+	if sys.version_info >= (3, 0):
+		key = key.encode( "utf-8" )
+	return os.path.join( csbuildDir, "chunks_{}.csbc".format( hashlib.md5( key ).hexdigest( ) ) )
+
+
+def LoadAssignment( path, mode ):
+	"""
+	:param path: File the chunks were saved to
+	:type path: str
+
+	:param mode: How the chunks are being made, which has to match how the saved ones were
+	:type mode: tuple
+
+	:return: The chunks saved by the previous build, or None if there aren't any to start from
+	:rtype: list[list[str]] or None
+	"""
+	if not os.access( path, os.F_OK ):
+		return None
+	try:
+		with open( path, "rb" ) as f:
+			data = pickle.load( f )
+	except Exception as e:
+		log.LOG_WARN( "Could not read chunks from {}: {}".format( path, e ) )
+		return None
+	if not isinstance( data, dict ) or data.get( "version" ) != _ASSIGNMENT_VERSION or data.get( "mode" ) != mode:
+		return None
+	return data["chunks"]
+
+
+def SaveAssignment( path, mode, chunks ):
+	"""
+	Save the chunks a build made, for the next one to start from.
+
+	:param path: File to save the chunks to
+	:type path: str
+
+	:param mode: How the chunks were made
+	:type mode: tuple
+
+	:param chunks: The chunks
+	:type chunks: list[list[str]]
+	"""
+	try:
+		_utils.AtomicPickleDump( { "version" : _ASSIGNMENT_VERSION, "mode" : mode, "chunks" : chunks }, path )
+	except ( OSError, IOError ) as e:
+		log.LOG_WARN( "Could not save chunks to {}: {}".format( path, e ) )
@@ -0,0 +1,686 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Local content-addressed compile cache, enabled with --compile-cache.
+
+Before a translation unit is compiled, a key is computed from everything that determines the object file: the
+compiler executable, the full command line (with the output path taken out), the working directory, the environment
+variables the compiler reads, and the contents of the source and every header it includes. If an object with that
+key has been stored before, by any project, target or earlier checkout, it's linked or copied out of the store
+instead of running the compiler.
+
+How the headers are accounted for depends on the compiler:
+
+* When the compiler writes dependency files, the exact set of files a translation unit read is known after each
+  compile. It's recorded in a manifest keyed by everything but the headers, and a later lookup hashes the headers
+  listed in the manifest to find the object. No preprocessing is needed. While the project has headers that weren't
+  there at its last successful build, manifests aren't matched at all, since a new header could shadow one they list
+  without any of them changing.
+* Otherwise, if the compiler can preprocess with the same settings it compiles with, the preprocessed output is
+  hashed instead.
+
+Compilers that can do neither, precompiled headers and --profile builds are never cached. Only clean compiles are
+stored, so warnings are never lost to a cache hit.
+
+The store lives under the cache directory in .csbuild. It's trimmed back under --compile-cache-size at the end of
+each build, least recently used entries first.
+
+With --compile-cache-url, the local store is backed by a shared HTTP store, so build machines can reuse each other's
+objects. Anything missing locally is fetched from it, and everything stored locally is uploaded to it in the
+background while the build continues. The protocol is plain GET and PUT of /objects/<key>, /objects/<key>.d and
+/manifests/<key>, with 404 for anything the server doesn't have; scripts/csbuild-cache-server is a reference
+implementation. Since command lines contain absolute paths, only machines that build from the same paths share
+objects.
+"""
+
+import hashlib
+import json
+import os
+import platform
+import shlex
+import shutil
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+if sys.version_info < (3,0):
+	import cPickle as pickle
+	import Queue as queue
+	import urllib2 as urllib_request
+	HTTPError = urllib_request.HTTPError
+else:
+	import pickle
+	import queue
+	import urllib.request as urllib_request
+	from urllib.error import HTTPError
+
+#Imported lazily when host names are resolved, which build threads can't do while the makefile is importing csbuild.
+import encodings.idna
+
+from . import log
+from . import _header_cache
+from . import _shared_globals
+from . import _stat_cache
+
+_CACHE_VERSION = 2
+
+#Environment variables that change what the compiler does without appearing on its command line
+_ENV_VARS = (
+	"CPATH", "C_INCLUDE_PATH", "CPLUS_INCLUDE_PATH", "OBJC_INCLUDE_PATH", "GCC_EXEC_PREFIX", "COMPILER_PATH",
+	"SOURCE_DATE_EPOCH", "INCLUDE", "CL", "_CL_",
+)
+
+#Macros that make an object depend on when it was compiled rather than only on its inputs
+_TIME_MACROS = ( b"__DATE__", b"__TIME__", b"__TIMESTAMP__" )
+
+#Most manifest entries kept for a single source and command line
+_MAX_MANIFEST_ENTRIES = 16
+
+_OBJ_PLACEHOLDER = "<csbuild-obj>"
+
+_compilerIdentities = { }
+#{ path : ( stat fingerprint, digest ) } for files hashed this build
+_contentHashes = { }
+_statsLock = threading.Lock( )
+_bytesAdded = 0
+hits = 0
+misses = 0
+
+#Seconds to wait on the remote store before giving up on a request
+_REMOTE_TIMEOUT = 10
+
+_remoteLock = threading.Lock( )
+_remoteDisabled = False
+_uploadQueue = queue.Queue( )
+_uploadThread = None
+remoteHits = 0
+uploads = 0
+
+
+def IsEnabled( ):
+	"""
+	:return: Whether the compile cache is turned on for this build
+	:rtype: bool
+	"""
+	return _shared_globals.compile_cache
+
+
+def GetCacheDirectory( ):
+	"""
+	:return: Root of the content-addressed store
+	:rtype: str
+	"""
+	return os.path.join( _shared_globals.cacheDirectory, "compile" )
+
+
+def _hashBytes( *parts ):
+	hasher = hashlib.sha1( )
+	for part in parts:
+		if not isinstance( part, bytes ):
+			part = part.encode( "utf-8" )
+		hasher.update( part )
+		hasher.update( b"\0" )
+	return hasher.hexdigest( )
+
+
+def _hashFile( path ):
+	try:
+		fingerprint = _header_cache.GetFingerprint( path )
+	except OSError:
+		return None
+	cached = _contentHashes.get( path )
+	if cached is not None and cached[0] == fingerprint:
+		return cached[1]
+	hasher = hashlib.sha1( )
+	with open( path, "rb" ) as f:
+		while True:
+			block = f.read( 1024 * 1024 )
+			if not block:
+				break
+			hasher.update( block )
+	digest = hasher.hexdigest( )
+	_contentHashes[path] = ( fingerprint, digest )
+	return digest
+
+
+def _findExecutable( name ):
+	if os.path.dirname( name ):
+		return os.path.abspath( name )
+	extensions = [ "" ]
+	if platform.system( ) == "Windows":
+		extensions += os.environ.get( "PATHEXT", ".EXE" ).split( os.pathsep )
+	for directory in os.environ.get( "PATH", "" ).split( os.pathsep ):
+		for extension in extensions:
+			candidate = os.path.join( directory, name + extension )
+			if os.path.isfile( candidate ):
+				return candidate
+	return None
+
+
+def _getCompilerIdentity( executable ):
+	identity = _compilerIdentities.get( executable )
+	if identity is None:
+		path = _findExecutable( executable )
+		if path is None:
+			identity = executable
+		else:
+			path = os.path.realpath( path )
+			st = os.stat( path )
+			identity = "{}|{}|{}".format( path, st.st_size, st.st_mtime )
+		_compilerIdentities[executable] = identity
+	return identity
+
+
+def _splitCommand( cmd ):
+	if platform.system( ) == "Windows":
+		return cmd.split( " ", 1 )[0].strip( "\"" )
+	return shlex.split( cmd )[0]
+
+
+def _getObjectPath( key ):
+	return os.path.join( GetCacheDirectory( ), "objects", key[:2], key )
+
+
+def _getManifestPath( key ):
+	return os.path.join( GetCacheDirectory( ), "manifests", key[:2], key )
+
+
+def _writeFileAtomic( path, data, readOnly = False ):
+	directory = os.path.dirname( path )
+	if not os.access( directory, os.F_OK ):
+		try:
+			os.makedirs( directory )
+		except OSError:
+			#Another thread may have just created it.
+			if not os.access( directory, os.F_OK ):
+				raise
+	tempFile = "{}.{}.{}.tmp".format( path, os.getpid( ), threading.current_thread( ).ident )
+	with open( tempFile, "wb" ) as f:
+		f.write( data )
+	if readOnly:
+		os.chmod( tempFile, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH )
+	if sys.version_info >= (3,3):
+		os.replace( tempFile, path )
+	else:
+		if os.access( path, os.F_OK ):
+			os.remove( path )
+		os.rename( tempFile, path )
+
+
+def IsRemoteEnabled( ):
+	"""
+	:return: Whether a remote store is configured and hasn't failed during this build
+	:rtype: bool
+	"""
+	return _shared_globals.compile_cache_url is not None and not _remoteDisabled
+
+
+def _getRemoteUrl( kind, name ):
+	return "{}/{}/{}".format( _shared_globals.compile_cache_url.rstrip( "/" ), kind, name )
+
+
+def _disableRemote( e ):
+	#A server that's down would otherwise cost a timeout on every translation unit.
+	global _remoteDisabled
+	with _remoteLock:
+		if _remoteDisabled:
+			return
+		_remoteDisabled = True
+	log.LOG_WARN( "Compile cache server {} is unavailable, continuing without it: {}".format( _shared_globals.compile_cache_url, e ) )
+
+
+def _fetch( kind, name ):
+	if not IsRemoteEnabled( ):
+		return None
+	try:
+		response = urllib_request.urlopen( _getRemoteUrl( kind, name ), timeout = _REMOTE_TIMEOUT )
+		try:
+			return response.read( )
+		finally:
+			response.close( )
+	except HTTPError as e:
+		if e.code != 404:
+			_disableRemote( e )
+	except Exception as e:
+		_disableRemote( e )
+	return None
+
+
+def _put( kind, name, data ):
+	request = urllib_request.Request( _getRemoteUrl( kind, name ), data = data )
+	request.add_header( "Content-Type", "application/octet-stream" )
+	request.get_method = lambda: "PUT"
+	urllib_request.urlopen( request, timeout = _REMOTE_TIMEOUT ).close( )
+
+
+def _uploadLoop( ):
+	global uploads
+	while True:
+		files = _uploadQueue.get( )
+		if files is None:
+			return
+		if not IsRemoteEnabled( ):
+			continue
+		try:
+			for kind, name, data in files:
+				_put( kind, name, data )
+		except Exception as e:
+			_disableRemote( e )
+		else:
+			uploads += 1
+
+
+def _queueUpload( files ):
+	global _uploadThread
+	with _remoteLock:
+		if _uploadThread is None:
+			_uploadThread = threading.Thread( target = _uploadLoop )
+			_uploadThread.daemon = True
+			_uploadThread.start( )
+	_uploadQueue.put( files )
+
+
+def FinishUploads( ):
+	"""
+	Wait for every object stored during this build to be uploaded to the remote store.
+	"""
+	global _uploadThread
+	if _uploadThread is None:
+		return
+	pending = _uploadQueue.qsize( )
+	if pending and IsRemoteEnabled( ):
+		log.LOG_INFO( "Compile cache: waiting for {} uploads to finish".format( pending ) )
+	_uploadQueue.put( None )
+	_uploadThread.join( )
+	_uploadThread = None
+	if uploads:
+		log.LOG_INFO( "Compile cache: uploaded {} objects to {}".format( uploads, _shared_globals.compile_cache_url ) )
+
+
+class CacheEntry( object ):
+	"""
+	The cache's view of one translation unit about to be compiled.
+
+	:ivar obj: Object file being built
+	:type obj: str
+
+	:ivar depFile: Dependency file the compiler writes alongside the object, if any
+	:type depFile: str or None
+
+	:ivar baseKey: Hash of every input except the headers
+	:type baseKey: str
+
+	:ivar key: Key of the object in the store, if known before compiling
+	:type key: str or None
+	"""
+	def __init__( self, obj, depFile, workingDirectory, baseKey, key ):
+		self.obj = obj
+		self.depFile = depFile
+		self.workingDirectory = workingDirectory
+		self.baseKey = baseKey
+		self.key = key
+		self.startTime = time.time( )
+
+
+	def Restore( self ):
+		"""
+		Put the cached object (and dependency file) in place, if there is one.
+
+		:return: Whether the object was restored
+		:rtype: bool
+		"""
+		global hits
+		global misses
+		if self.key is None:
+			with _statsLock:
+				misses += 1
+			return False
+
+		cached = _getObjectPath( self.key )
+		isStored = _stat_cache.Exists( cached ) and ( self.depFile is None or _stat_cache.Exists( cached + ".d" ) )
+		if not isStored and not self._fetchRemote( cached ):
+			with _statsLock:
+				misses += 1
+			return False
+
+		try:
+			if self.depFile is not None:
+				with open( cached + ".d", "rb" ) as f:
+					depData = f.read( ).decode( "utf-8" ).replace( _OBJ_PLACEHOLDER, self.obj )
+				with open( self.depFile, "w" ) as f:
+					f.write( depData )
+
+			if os.access( self.obj, os.F_OK ):
+				os.remove( self.obj )
+			#Cached files are read-only, which would keep the object from being replaced later on Windows.
+			if platform.system( ) == "Windows" or not hasattr( os, "link" ):
+				shutil.copyfile( cached, self.obj )
+			else:
+				try:
+					os.link( cached, self.obj )
+				except OSError:
+					shutil.copyfile( cached, self.obj )
+			#Marks the entry as recently used, and makes sure a hard-linked object is newer than its sources.
+			os.utime( cached, None )
+		except ( OSError, IOError ) as e:
+			log.LOG_WARN( "Could not restore {} from the compile cache: {}".format( os.path.basename( self.obj ), e ) )
+			with _statsLock:
+				misses += 1
+			return False
+		finally:
+			_stat_cache.Invalidate( self.obj )
+			_stat_cache.Invalidate( cached )
+
+		with _statsLock:
+			hits += 1
+		return True
+
+
+	def _fetchRemote( self, cached ):
+		global _bytesAdded
+		global remoteHits
+		if not IsRemoteEnabled( ):
+			return False
+
+		depData = None
+		if self.depFile is not None:
+			depData = _fetch( "objects", self.key + ".d" )
+			if depData is None:
+				return False
+		data = _fetch( "objects", self.key )
+		if data is None:
+			return False
+
+		try:
+			if depData is not None:
+				_writeFileAtomic( cached + ".d", depData )
+			_writeFileAtomic( cached, data, platform.system( ) != "Windows" )
+		except ( OSError, IOError ) as e:
+			log.LOG_WARN( "Could not add {} to the compile cache: {}".format( os.path.basename( self.obj ), e ) )
+			return False
+		finally:
+			_stat_cache.Invalidate( cached )
+			_stat_cache.Invalidate( cached + ".d" )
+
+		with _statsLock:
+			_bytesAdded += len( data )
+			remoteHits += 1
+		return True
+
+
+	def Store( self ):
+		"""
+		Add the freshly compiled object to the store, and queue it for upload if there's a remote store.
+		"""
+		global _bytesAdded
+		try:
+			depData = None
+			manifestData = None
+			key = self.key
+			if self.depFile is not None:
+				key, manifestData = self._recordManifest( )
+				if key is None:
+					return
+				with open( self.depFile, "r" ) as f:
+					depData = f.read( ).replace( self.obj, _OBJ_PLACEHOLDER ).encode( "utf-8" )
+
+			cached = _getObjectPath( key )
+			with open( self.obj, "rb" ) as f:
+				data = f.read( )
+			if depData is not None:
+				_writeFileAtomic( cached + ".d", depData )
+			#Objects may be hard-linked into the build tree, so they're made read-only to keep anything from
+			#modifying the cached copy through the link.
+			_writeFileAtomic( cached, data, platform.system( ) != "Windows" )
+			_stat_cache.Invalidate( cached )
+			with _statsLock:
+				_bytesAdded += len( data )
+		except ( OSError, IOError ) as e:
+			log.LOG_WARN( "Could not add {} to the compile cache: {}".format( os.path.basename( self.obj ), e ) )
+			return
+
+		if IsRemoteEnabled( ):
+			#The manifest goes last, so other machines never see it before the object it points to.
+			files = [ ( "objects", key, data ) ]
+			if depData is not None:
+				files.insert( 0, ( "objects", key + ".d", depData ) )
+			if manifestData is not None:
+				files.append( ( "manifests", self.baseKey, manifestData ) )
+			_queueUpload( files )
+
+
+	def _recordManifest( self ):
+		dependencies = _header_cache.ParseDependencyFile( self.depFile, self.workingDirectory )
+		hashes = []
+		for dependency in sorted( set( dependencies ) ):
+			_stat_cache.Invalidate( dependency )
+			st = _stat_cache.Stat( dependency )
+			#A file that changed while it was being compiled may not match what the compiler read.
+			if st is None or st.st_mtime > self.startTime:
+				return None, None
+			hashes.append( ( dependency, _hashFile( dependency ) ) )
+
+		key = _hashBytes( self.baseKey, *[ "{}={}".format( path, digest ) for path, digest in hashes ] )
+
+		manifestPath = _getManifestPath( self.baseKey )
+		entries = _readManifest( manifestPath )
+		entries = [ entry for entry in entries if entry[1] != key ]
+		entries.insert( 0, ( hashes, key ) )
+		manifestData = _writeManifest( manifestPath, entries )
+		return key, manifestData
+
+
+#Manifests are JSON rather than pickles, since they may come from a remote store.
+def _encodeManifest( entries ):
+	manifest = { "version" : _CACHE_VERSION, "entries" : entries[:_MAX_MANIFEST_ENTRIES] }
+	return json.dumps( manifest, separators = ( ",", ":" ) ).encode( "utf-8" )
+
+
+def _decodeManifest( data ):
+	try:
+		manifest = json.loads( data.decode( "utf-8" ) )
+		if manifest["version"] != _CACHE_VERSION:
+			return []
+		return [ ( [ tuple( pair ) for pair in hashes ], key ) for hashes, key in manifest["entries"] ]
+	except ( ValueError, KeyError, TypeError, AttributeError ):
+		return []
+
+
+def _readManifest( manifestPath ):
+	if not _stat_cache.Exists( manifestPath ):
+		return []
+	try:
+		with open( manifestPath, "rb" ) as f:
+			return _decodeManifest( f.read( ) )
+	except ( OSError, IOError ):
+		return []
+
+
+def _writeManifest( manifestPath, entries ):
+	data = _encodeManifest( entries )
+	_writeFileAtomic( manifestPath, data )
+	_stat_cache.Invalidate( manifestPath )
+	return data
+
+
+def _matchManifest( entries ):
+	for hashes, key in entries:
+		if all( _hashFile( path ) == digest for path, digest in hashes ):
+			return key
+	return None
+
+
+def Lookup( compiler, cmd, preprocessCmd, inFile, obj, workingDirectory, env, trustManifests = True ):
+	"""
+	Work out the cache key of a translation unit that's about to be compiled.
+
+	:param compiler: The compiler tool
+	:type compiler: :class:`csbuild.toolchain.compilerBase`
+
+	:param cmd: The full command line that will compile it
+	:type cmd: str
+
+	:param preprocessCmd: Command that preprocesses it with the same settings, or None if the compiler can't
+	:type preprocessCmd: str or None
+
+	:param inFile: Absolute path of the source file
+	:type inFile: str
+
+	:param obj: Absolute path of the object file
+	:type obj: str
+
+	:param workingDirectory: Directory the compiler runs in
+	:type workingDirectory: str
+
+	:param env: Environment the compiler runs with
+	:type env: dict
+
+	:param trustManifests: Whether the headers recorded in manifests can still be the ones the translation unit
+		includes. Not the case when the project has new headers, which could shadow one of them; the translation unit
+		is then compiled, and the manifest updated with what it read.
+	:type trustManifests: bool
+
+	:return: The entry to restore from or store into, or None if this translation unit can't be cached
+	:rtype: CacheEntry or None
+	"""
+	useDependencyFiles = compiler.SupportsDependencyFiles( )
+	if not useDependencyFiles and preprocessCmd is None:
+		return None
+
+	try:
+		with open( inFile, "rb" ) as f:
+			source = f.read( )
+	except ( OSError, IOError ):
+		return None
+	for macro in _TIME_MACROS:
+		if macro in source:
+			return None
+
+	baseKey = _hashBytes(
+		str( _CACHE_VERSION ),
+		_getCompilerIdentity( _splitCommand( cmd ) ),
+		cmd.replace( obj, _OBJ_PLACEHOLDER ),
+		workingDirectory,
+		"\n".join( "{}={}".format( var, env.get( var, "" ) ) for var in _ENV_VARS ),
+	)
+
+	if useDependencyFiles:
+		depFile = compiler.GetDependencyFile( obj )
+		baseKey = _hashBytes( baseKey, inFile, hashlib.sha1( source ).hexdigest( ) )
+		manifestPath = _getManifestPath( baseKey )
+		entries = _readManifest( manifestPath )
+		key = None
+		if trustManifests:
+			key = _matchManifest( entries )
+		#The remote manifest was recorded without the new headers just the same, maybe on another machine.
+		if key is None and trustManifests and IsRemoteEnabled( ):
+			knownKeys = set( entry[1] for entry in entries )
+			remoteEntries = [ entry for entry in _decodeManifest( _fetch( "manifests", baseKey ) or b"" ) if entry[1] not in knownKeys ]
+			if remoteEntries:
+				key = _matchManifest( remoteEntries )
+				try:
+					_writeManifest( manifestPath, entries + remoteEntries )
+				except ( OSError, IOError ):
+					pass
+		return CacheEntry( obj, depFile, workingDirectory, baseKey, key )
+
+	if platform.system( ) != "Windows":
+		preprocessCmd = shlex.split( preprocessCmd )
+	fd = subprocess.Popen( preprocessCmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = workingDirectory, env = env )
+	with _shared_globals.spmutex:
+		_shared_globals.subprocesses[obj + ".i"] = fd
+	output, _ = fd.communicate( )
+	with _shared_globals.spmutex:
+		del _shared_globals.subprocesses[obj + ".i"]
+	if fd.returncode != 0:
+		#Let the real compile report the error.
+		return None
+	key = _hashBytes( baseKey, output )
+	return CacheEntry( obj, None, workingDirectory, baseKey, key )
+
+
+def Trim( ):
+	"""
+	Evict the least recently used entries until the store is back under the size limit. The store is only scanned
+	when the running estimate of its size says it may have gone over.
+	"""
+	global _bytesAdded
+	if not IsEnabled( ):
+		return
+
+	cacheDirectory = GetCacheDirectory( )
+	statsFile = os.path.join( cacheDirectory, "size.csbc" )
+	total = None
+	if os.access( statsFile, os.F_OK ):
+		try:
+			with open( statsFile, "rb" ) as f:
+				total = pickle.load( f )
+		except Exception:
+			total = None
+
+	if hits or misses:
+		if _shared_globals.compile_cache_url is not None:
+			log.LOG_INFO( "Compile cache: {} hits ({} from {}), {} misses".format( hits, remoteHits, _shared_globals.compile_cache_url, misses ) )
+		else:
+			log.LOG_INFO( "Compile cache: {} hits, {} misses".format( hits, misses ) )
+
+	if total is not None:
+		total += _bytesAdded
+		_bytesAdded = 0
+		if total <= _shared_globals.compile_cache_size:
+			if os.access( cacheDirectory, os.F_OK ):
+				_writeFileAtomic( statsFile, pickle.dumps( total, 2 ) )
+			return
+
+	files = []
+	total = 0
+	for directory in ( "objects", "manifests" ):
+		for root, _, filenames in os.walk( os.path.join( cacheDirectory, directory ) ):
+			for filename in filenames:
+				path = os.path.join( root, filename )
+				try:
+					st = os.stat( path )
+				except OSError:
+					continue
+				files.append( ( st.st_mtime, st.st_size, path ) )
+				total += st.st_size
+
+	if total > _shared_globals.compile_cache_size:
+		#Trim a little further than needed so the next few builds don't have to scan again.
+		target = _shared_globals.compile_cache_size * 0.9
+		files.sort( )
+		removed = 0
+		for _, size, path in files:
+			if total <= target:
+				break
+			try:
+				os.remove( path )
+			except OSError:
+				continue
+			total -= size
+			removed += 1
+		log.LOG_INFO( "Compile cache: evicted {} files".format( removed ) )
+
+	_bytesAdded = 0
+	if os.access( cacheDirectory, os.F_OK ):
+		_writeFileAtomic( statsFile, pickle.dumps( total, 2 ) )
@@ -0,0 +1,576 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Optional build daemon, enabled with --daemon.
+
+The first run with --daemon starts a server process in the background. The server runs the makefile and finalizes
+every project exactly as a normal run would, then waits on a Unix socket instead of building. The client hands it
+its terminal and environment, and for each request the server forks a build process. That process picks up where a
+normal run would be after finalizing its projects, with the header cache, fingerprint databases and include indexes
+already in memory. Builds are run one at a time, and the client exits with the build's exit code.
+
+Each distinct makefile and command line gets its own server. A server replaces itself with a fresh one as soon as
+any script it ran or any module it imported changes, or when it's called with a different environment. It exits on
+its own after being idle for a few hours, or when it's asked to with --stop-daemon.
+
+Where the file watcher is available, the server also watches every directory its builds have looked at, and keeps
+the stat cache and directory listings from one build to the next, invalidating only what the watcher reports as
+changed. Builds then skip the directory walk and most stat calls for untouched parts of the tree. Without the
+watcher, each build starts with an empty stat cache as usual.
+
+The daemon is only available on platforms with Unix sockets and fork(), on Python 3. Elsewhere --daemon is ignored
+with a warning.
+"""
+
+import array
+import hashlib
+import os
+import platform
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+if sys.version_info < (3,0):
+	import cPickle as pickle
+else:
+	import pickle
+
+from . import log
+from . import _file_watcher
+from . import _fingerprints
+from . import _header_cache
+from . import _include_index
+from . import _stat_cache
+
+_SOCKET_ENV_VAR = "CSBUILD_DAEMON_SOCKET"
+_IDLE_TIMEOUT = 3 * 60 * 60
+_DAEMON_FLAGS = ( "--daemon", "--stop-daemon" )
+#Variables the shell changes on its own, which don't mean the environment has really changed
+_IGNORED_ENV_VARS = ( "_", "SHLVL", "PWD", "OLDPWD" )
+
+_RESTART = "restart"
+_EXIT = "exit"
+
+#Write end of the pipe a forked build process uses to tell the server which databases it loaded
+_reportFd = None
+#Whether a forked build process inherited a stat cache the server has kept up to date
+_warmStatCache = False
+
+
+def IsSupported( ):
+	"""
+	:return: Whether the daemon can run on this platform
+	:rtype: bool
+	"""
+	return (
+		platform.system( ) != "Windows"
+		and hasattr( socket, "AF_UNIX" )
+		and hasattr( socket.socket, "sendmsg" )
+		and hasattr( os, "fork" )
+	)
+
+
+def IsRequested( argv ):
+	"""
+	:param argv: Command line arguments, not including the program name
+	:type argv: list[str]
+
+	:return: Whether the command line asks for the daemon to be used or stopped
+	:rtype: bool
+	"""
+	return any( flag in argv for flag in _DAEMON_FLAGS )
+
+
+def HasWarmStatCache( ):
+	"""
+	:return: Whether this is a build process forked by the server with a stat cache that is still valid, which
+		should be used rather than cleared
+	:rtype: bool
+	"""
+	return _warmStatCache
+
+
+def IsServer( ):
+	"""
+	:return: Whether this process was started as a daemon server
+	:rtype: bool
+	"""
+	return _SOCKET_ENV_VAR in os.environ
+
+
+def GetSocketPath( mainFile, argv ):
+	"""
+	:param mainFile: Absolute path of the main makefile
+	:type mainFile: str
+
+	:param argv: Command line arguments, not including the program name
+	:type argv: list[str]
+
+	:return: The socket of the server for this makefile and command line
+	:rtype: str
+	"""
+	key = "\0".join( [ sys.executable, mainFile ] + [ arg for arg in argv if arg not in _DAEMON_FLAGS ] )
+	if sys.version_info >= (3, 0):
+		key = key.encode( "utf-8" )
+	directory = os.path.join( tempfile.gettempdir( ), "csbuild-{}".format( os.getuid( ) ) )
+	return os.path.join( directory, "{}.sock".format( hashlib.md5( key ).hexdigest( ) ) )
+
+
+def _sendMessage( sock, message ):
+	data = pickle.dumps( message, 2 )
+	sock.sendall( struct.pack( "!I", len( data ) ) + data )
+
+
+def _recvExactly( sock, size ):
+	data = b""
+	while len( data ) < size:
+		chunk = sock.recv( size - len( data ) )
+		if not chunk:
+			return None
+		data += chunk
+	return data
+
+
+def _recvMessage( sock ):
+	header = _recvExactly( sock, 4 )
+	if header is None:
+		return None
+	data = _recvExactly( sock, struct.unpack( "!I", header )[0] )
+	if data is None:
+		return None
+	return pickle.loads( data )
+
+
+def _connect( path ):
+	sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+	try:
+		sock.connect( path )
+	except socket.error:
+		sock.close( )
+		return None
+	return sock
+
+
+def _startServer( mainFile, argv, path, logDirectory ):
+	directory = os.path.dirname( path )
+	if not os.access( directory, os.F_OK ):
+		os.makedirs( directory, 0o700 )
+	if os.stat( directory ).st_uid != os.getuid( ):
+		log.LOG_WARN( "Not starting the build daemon: {} belongs to another user".format( directory ) )
+		return None
+
+	if os.access( path, os.F_OK ):
+		os.remove( path )
+
+	log.LOG_BUILD( "Starting build daemon..." )
+	env = dict( os.environ )
+	env[_SOCKET_ENV_VAR] = path
+	with open( os.devnull, "r" ) as devnull, open( os.path.join( logDirectory, "daemon.log" ), "w" ) as daemonLog:
+		fd = subprocess.Popen(
+			[ sys.executable, mainFile ] + argv,
+			env = env,
+			stdin = devnull,
+			stdout = daemonLog,
+			stderr = subprocess.STDOUT,
+			close_fds = True,
+			start_new_session = True
+		)
+
+	while True:
+		sock = _connect( path )
+		if sock is not None:
+			return sock
+		if fd.poll( ) is not None:
+			return None
+		time.sleep( 0.05 )
+
+
+def _sendRequest( sock, stop ):
+	sock.sendmsg(
+		[ b"r" ],
+		[ ( socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array( "i", [ 0, 1, 2 ] ).tobytes( ) ) ]
+	)
+	_sendMessage( sock, { "env" : dict( os.environ ), "stop" : stop } )
+
+	#The build has our terminal now, so an interrupt here has to be passed along for it to abort cleanly.
+	def _forwardSignal( sig, frame ):
+		try:
+			sock.send( b"i" )
+		except socket.error:
+			pass
+
+	oldInt = signal.signal( signal.SIGINT, _forwardSignal )
+	oldTerm = signal.signal( signal.SIGTERM, _forwardSignal )
+	try:
+		response = _recvMessage( sock )
+	finally:
+		signal.signal( signal.SIGINT, oldInt )
+		signal.signal( signal.SIGTERM, oldTerm )
+		sock.close( )
+
+	if response is None:
+		return ( _EXIT, 1 )
+	return response
+
+
+def RunClient( mainFile, argv, logDirectory ):
+	"""
+	Hand the build off to a daemon server, starting one if needed. Only returns if the build should go ahead in this
+	process instead; otherwise exits with the build's exit code.
+
+	:param mainFile: Absolute path of the main makefile
+	:type mainFile: str
+
+	:param argv: Command line arguments, not including the program name
+	:type argv: list[str]
+
+	:param logDirectory: Directory to write the server's own log to
+	:type logDirectory: str
+	"""
+	if not IsSupported( ):
+		log.LOG_WARN( "The build daemon is not supported on this platform, building without it." )
+		return
+	if "-g" in argv or "--gui" in argv:
+		log.LOG_WARN( "The build daemon can't be used with the GUI, building without it." )
+		return
+
+	stop = "--stop-daemon" in argv
+	path = GetSocketPath( mainFile, argv )
+
+	for _ in range( 3 ):
+		sock = _connect( path )
+		if sock is None:
+			if stop:
+				log.LOG_BUILD( "No build daemon is running for this makefile and command line." )
+				os._exit( 0 )
+			sock = _startServer( mainFile, argv, path, logDirectory )
+			if sock is None:
+				log.LOG_WARN( "The build daemon could not be started, building without it. See {} for details.".format(
+					os.path.join( logDirectory, "daemon.log" ) ) )
+				return
+
+		response = _sendRequest( sock, stop )
+		if response[0] == _EXIT:
+			os._exit( response[1] )
+
+	log.LOG_WARN( "The build daemon kept restarting, building without it." )
+
+
+def _getComparableEnv( env ):
+	return dict( ( key, value ) for key, value in env.items( ) if key not in _IGNORED_ENV_VARS )
+
+
+def _getWatchedFiles( scripts ):
+	files = set( scripts )
+	for module in list( sys.modules.values( ) ):
+		filename = getattr( module, "__file__", None )
+		if filename:
+			files.add( os.path.abspath( filename ) )
+	return files
+
+
+def _getStamps( files ):
+	stamps = { }
+	for filename in files:
+		try:
+			stamps[filename] = os.stat( filename ).st_mtime
+		except OSError:
+			stamps[filename] = None
+	return stamps
+
+
+def _bind( path ):
+	listener = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+	try:
+		listener.bind( path )
+	except socket.error:
+		#Either another server got there first, or one died without cleaning up after itself.
+		other = _connect( path )
+		if other is not None:
+			other.close( )
+			listener.close( )
+			return None
+		os.remove( path )
+		listener.bind( path )
+	listener.listen( 16 )
+	return listener
+
+
+def _receiveRequest( conn ):
+	fdSize = array.array( "i" ).itemsize
+	_, ancdata, _, _ = conn.recvmsg( 1, socket.CMSG_SPACE( 3 * fdSize ) )
+	fds = array.array( "i" )
+	for level, kind, data in ancdata:
+		if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+			fds.frombytes( data[:len( data ) - ( len( data ) % fdSize )] )
+	request = _recvMessage( conn )
+	if request is None or len( fds ) != 3:
+		for fd in fds:
+			os.close( fd )
+		return None, None
+	return request, list( fds )
+
+
+def _watchForInterrupt( conn ):
+	#Anything from the client, or the client going away, means the build should stop.
+	try:
+		conn.recv( 1 )
+	except socket.error:
+		pass
+	os.kill( os.getpid( ), signal.SIGINT )
+
+
+def _becomeBuildProcess( conn, fds, env, reportFd, watcher ):
+	global _reportFd
+	global _warmStatCache
+	_reportFd = reportFd
+	if watcher is not None:
+		watcher.Close( )
+		_warmStatCache = True
+
+	sys.stdout.flush( )
+	sys.stderr.flush( )
+	for target, fd in enumerate( fds ):
+		os.dup2( fd, target )
+		os.close( fd )
+
+	os.environ.clear( )
+	os.environ.update( env )
+
+	thread = threading.Thread( target = _watchForInterrupt, args = ( conn, ) )
+	thread.daemon = True
+	thread.start( )
+
+
+def _getReport( ):
+	report = { "fingerprints" : _fingerprints.GetLoaded( ), "includeIndexes" : _include_index.GetLoaded( ) }
+	if _warmStatCache:
+		try:
+			report["statCache"] = _stat_cache.GetSnapshot( )
+			report["walkedRoots"] = _stat_cache.GetWalkedRoots( )
+		except RuntimeError:
+			#Build threads were still changing the cache when the build was interrupted.
+			pass
+	return report
+
+
+def _applyJournal( journal ):
+	if journal.overflowed:
+		log.LOG_INFO( "File watcher lost events, forgetting all cached file information." )
+		_stat_cache.Clear( )
+		return
+	for directory in journal.changedTrees:
+		_stat_cache.InvalidateTree( directory )
+	for path in journal.changedPaths:
+		_stat_cache.Invalidate( path )
+
+
+def _startWatcher( ):
+	if not _file_watcher.IsSupported( ):
+		log.LOG_INFO( "No file watcher on this platform, every build will rescan the tree." )
+		return None
+	try:
+		return _file_watcher.FileWatcher( )
+	except OSError as e:
+		log.LOG_WARN( "Could not start the file watcher, every build will rescan the tree: {}".format( e ) )
+		return None
+
+
+def _keepWarm( watcher, report, trustedDirectories, journal ):
+	#Only what was learned in directories that were already being watched when the build started is kept, since
+	#a change in any other directory could have been missed. Those directories are watched from now on, so the next
+	#build's results for them can be kept.
+	if "statCache" in report:
+		_stat_cache.ApplySnapshot( report["statCache"], trustedDirectories )
+	journal.Merge( watcher.ReadEvents( ) )
+	_applyJournal( journal )
+
+	for root in report.get( "walkedRoots", () ):
+		watcher.WatchDirectory( root, True )
+	if "statCache" in report:
+		for directory in set( os.path.dirname( path ) for path in report["statCache"][0] ):
+			if os.path.isdir( directory ):
+				watcher.WatchDirectory( directory )
+
+
+def Serve( scripts ):
+	"""
+	Run the daemon server. Only returns in a freshly forked build process, which should carry on with the build as
+	if it were a normal run.
+
+	:param scripts: Every makefile script that was run to set up the projects
+	:type scripts: iterable[str]
+	"""
+	path = os.environ.pop( _SOCKET_ENV_VAR )
+	listener = _bind( path )
+	if listener is None:
+		os._exit( 0 )
+
+	startupEnv = _getComparableEnv( os.environ )
+	watchedFiles = _getWatchedFiles( scripts )
+	watchedStamps = _getStamps( watchedFiles )
+	loaded = { "fingerprints" : [], "includeIndexes" : [] }
+
+	#Nothing looked up while running the makefile is being watched, so it can't be trusted later.
+	_stat_cache.Clear( )
+	watcher = _startWatcher( )
+	waitables = [ listener ]
+	if watcher is not None:
+		waitables.append( watcher )
+	log.LOG_BUILD( "Build daemon listening on {}".format( path ) )
+
+	def _shutdown( ):
+		listener.close( )
+		try:
+			os.remove( path )
+		except OSError:
+			pass
+		sys.stdout.flush( )
+		os._exit( 0 )
+
+	lastRequest = time.time( )
+	while True:
+		readable, _, _ = select.select( waitables, [], [], max( lastRequest + _IDLE_TIMEOUT - time.time( ), 0 ) )
+		if not readable:
+			log.LOG_BUILD( "Build daemon idle, exiting." )
+			_shutdown( )
+
+		if watcher in readable:
+			_applyJournal( watcher.ReadEvents( ) )
+		if listener not in readable:
+			continue
+		lastRequest = time.time( )
+
+		conn, _ = listener.accept( )
+		request, fds = _receiveRequest( conn )
+		if request is None:
+			conn.close( )
+			continue
+
+		if request["stop"]:
+			for fd in fds:
+				os.close( fd )
+			log.LOG_BUILD( "Build daemon stopped." )
+			_sendMessage( conn, ( _EXIT, 0 ) )
+			conn.close( )
+			_shutdown( )
+
+		if _getComparableEnv( request["env"] ) != startupEnv or _getStamps( watchedFiles ) != watchedStamps:
+			for fd in fds:
+				os.close( fd )
+			log.LOG_BUILD( "Makefiles, csbuild or the environment have changed, restarting." )
+			#Get out of the way before answering so the client can start a new server right away.
+			listener.close( )
+			os.remove( path )
+			_sendMessage( conn, ( _RESTART, ) )
+			conn.close( )
+			sys.stdout.flush( )
+			os._exit( 0 )
+
+		_header_cache.Load( )
+		_fingerprints.Refresh( loaded["fingerprints"] )
+		_include_index.Refresh( loaded["includeIndexes"] )
+
+		trustedDirectories = None
+		if watcher is not None:
+			_applyJournal( watcher.ReadEvents( ) )
+			trustedDirectories = set( watcher.directories )
+
+		readFd, writeFd = os.pipe( )
+		sys.stdout.flush( )
+		sys.stderr.flush( )
+		pid = os.fork( )
+		if pid == 0:
+			listener.close( )
+			os.close( readFd )
+			_becomeBuildProcess( conn, fds, request["env"], writeFd, watcher )
+			return
+
+		for fd in fds:
+			os.close( fd )
+		os.close( writeFd )
+
+		#Keep collecting changes while the build runs; anything it reports back may already be out of date.
+		buildJournal = _file_watcher.Journal( )
+		chunks = []
+		while True:
+			readable, _, _ = select.select( [ readFd ] + waitables[1:], [], [] )
+			if watcher in readable:
+				buildJournal.Merge( watcher.ReadEvents( ) )
+			if readFd in readable:
+				chunk = os.read( readFd, 65536 )
+				if not chunk:
+					break
+				chunks.append( chunk )
+		os.close( readFd )
+
+		_, status = os.waitpid( pid, 0 )
+		if os.WIFSIGNALED( status ):
+			code = 128 + os.WTERMSIG( status )
+		else:
+			code = os.WEXITSTATUS( status )
+
+		try:
+			_sendMessage( conn, ( _EXIT, code ) )
+		except socket.error:
+			pass
+		conn.close( )
+
+		report = { }
+		if chunks:
+			try:
+				report = pickle.loads( b"".join( chunks ) )
+			except Exception:
+				pass
+		if report:
+			loaded = report
+
+		if watcher is not None:
+			_keepWarm( watcher, report, trustedDirectories, buildJournal )
+
+
+def ReportExit( ):
+	"""
+	Called by a forked build process just before it exits, to flush its output and let the server know which
+	databases it used so they can be kept in memory for the next build.
+	"""
+	global _reportFd
+	if _reportFd is None:
+		return
+	try:
+		sys.stdout.flush( )
+		sys.stderr.flush( )
+	except Exception:
+		pass
+	data = pickle.dumps( _getReport( ), 2 )
+	try:
+		while data:
+			data = data[os.write( _reportFd, data ):]
+		os.close( _reportFd )
+	except OSError:
+		pass
+	_reportFd = None
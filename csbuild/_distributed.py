@@ -0,0 +1,406 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Distributed compilation, enabled with --distribute.
+
+A worker is any makefile run with --worker, which listens on a TCP port instead of building and compiles whatever
+it's sent, up to -j compiles at a time. Workers need the same compilers installed as the machine running the build,
+but not the sources or headers.
+
+The build machine connects to each worker at startup to learn how many compiles it takes, and adds those slots to
+its own -j. Each translation unit then goes to a free local slot if there is one, and otherwise to the least busy
+worker. A translation unit sent to a worker is preprocessed locally, which also writes its dependency file, and the
+preprocessed source is shipped along with the command line to compile it. The worker sends back the object file and
+whatever the compiler printed.
+
+A translation unit that fails to preprocess is compiled locally instead, so its errors are reported normally. So is
+anything sent to a worker that stops responding; that worker isn't used again for the rest of the build, and its share
+waits for local slots, so no more than -j compiles ever run locally. Precompiled headers, --profile builds and compilers
+without a remote compile command are always built locally.
+
+Workers run any command they're sent, so they should only listen on trusted networks.
+"""
+
+import json
+import os
+import platform
+import shlex
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+
+if sys.version_info < (3,0):
+	import SocketServer as socketserver
+else:
+	import socketserver
+
+from . import log
+from . import _shared_globals
+
+_PROTOCOL_VERSION = 1
+DEFAULT_PORT = 8422
+
+#Seconds to wait for a worker to accept a connection or answer a request for its slot count
+_CONNECT_TIMEOUT = 10
+
+#Names of the files a worker compiles in its temporary directory, for building the command it runs
+REMOTE_SOURCE_NAME = "source.i"
+REMOTE_OBJECT_NAME = "output.o"
+
+_HEADER = struct.Struct( "!II" )
+
+
+class Worker( object ):
+	"""
+	A remote worker the build can send compiles to.
+
+	:ivar host: Host name or address of the worker
+	:type host: str
+
+	:ivar port: Port the worker listens on
+	:type port: int
+
+	:ivar slots: Number of compiles the worker runs at once
+	:type slots: int
+
+	:ivar inUse: Number of compiles currently sent to the worker
+	:type inUse: int
+
+	:ivar failed: Whether the worker stopped responding during this build
+	:type failed: bool
+	"""
+	def __init__( self, host, port, slots ):
+		self.host = host
+		self.port = port
+		self.slots = slots
+		self.inUse = 0
+		self.failed = False
+
+
+	def __str__( self ):
+		return "{}:{}".format( self.host, self.port )
+
+
+_workers = []
+_localSlots = 0
+_localInUse = 0
+_slotLock = threading.Lock( )
+#Notified whenever a slot is given back
+_slotFreed = threading.Condition( _slotLock )
+remoteCompiles = 0
+
+
+def ParseAddress( address, defaultHost = "127.0.0.1" ):
+	"""
+	Split an address of the form HOST:PORT, HOST or PORT.
+
+	:param address: The address
+	:type address: str
+
+	:param defaultHost: Host to use when only a port is given
+	:type defaultHost: str
+
+	:return: The host and port
+	:rtype: tuple[str, int]
+	"""
+	if ":" in address:
+		host, port = address.rsplit( ":", 1 )
+		return host, int( port )
+	if address.isdigit( ):
+		return defaultHost, int( address )
+	return address, DEFAULT_PORT
+
+
+def _sendMessage( sock, header, payload = b"" ):
+	headerData = json.dumps( header ).encode( "utf-8" )
+	sock.sendall( _HEADER.pack( len( headerData ), len( payload ) ) + headerData )
+	if payload:
+		sock.sendall( payload )
+
+
+def _recvExactly( sock, size ):
+	chunks = []
+	remaining = size
+	while remaining > 0:
+		chunk = sock.recv( min( remaining, 1024 * 1024 ) )
+		if not chunk:
+			raise EOFError( "Connection closed" )
+		chunks.append( chunk )
+		remaining -= len( chunk )
+	return b"".join( chunks )
+
+
+def _recvMessage( sock ):
+	headerSize, payloadSize = _HEADER.unpack( _recvExactly( sock, _HEADER.size ) )
+	header = json.loads( _recvExactly( sock, headerSize ).decode( "utf-8" ) )
+	return header, _recvExactly( sock, payloadSize )
+
+
+def _request( worker, header, payload = b"", timeout = None ):
+	sock = socket.create_connection( ( worker.host, worker.port ), _CONNECT_TIMEOUT )
+	try:
+		sock.settimeout( timeout )
+		header["version"] = _PROTOCOL_VERSION
+		_sendMessage( sock, header, payload )
+		response, responsePayload = _recvMessage( sock )
+	finally:
+		sock.close( )
+	if "error" in response:
+		raise RuntimeError( response["error"] )
+	return response, responsePayload
+
+
+def Connect( addresses ):
+	"""
+	Contact every worker given on the command line and find out how many compiles each one takes. Workers that can't
+	be reached are left out with a warning.
+
+	:param addresses: Worker addresses, as HOST:PORT, optionally followed by /SLOTS to override the worker's own count
+	:type addresses: list[str]
+
+	:return: Total number of remote slots
+	:rtype: int
+	"""
+	global _localSlots
+	_localSlots = _shared_globals.max_threads
+	for address in addresses:
+		slots = None
+		if "/" in address:
+			address, slots = address.rsplit( "/", 1 )
+			slots = int( slots )
+		host, port = ParseAddress( address )
+		worker = Worker( host, port, 0 )
+		try:
+			response, _ = _request( worker, { "type" : "info" }, timeout = _CONNECT_TIMEOUT )
+		except ( socket.error, EOFError, ValueError, RuntimeError ) as e:
+			log.LOG_WARN( "Could not reach build worker {}, compiling without it: {}".format( worker, e ) )
+			continue
+		worker.slots = slots if slots is not None else response["slots"]
+		if worker.slots > 0:
+			_workers.append( worker )
+
+	total = sum( worker.slots for worker in _workers )
+	if _workers:
+		log.LOG_INFO( "Distributing compiles to {} worker{} with {} slots".format( len( _workers ), "s" if len( _workers ) != 1 else "", total ) )
+	return total
+
+
+def IsEnabled( ):
+	"""
+	:return: Whether any workers are available to this build
+	:rtype: bool
+	"""
+	return bool( _workers )
+
+
+def AcquireSlot( localOnly = False ):
+	"""
+	Reserve somewhere to run a compile. Local slots are used first, since they don't need anything sent over the
+	network. Never more than -j compiles run locally: once a worker has failed, the build has more threads than there
+	are slots left, so this waits for one to be given back.
+
+	:param localOnly: Whether to wait for a local slot rather than take a worker's
+	:type localOnly: bool
+
+	:return: The worker to send the compile to, or None to compile locally
+	:rtype: Worker or None
+	"""
+	global _localInUse
+	with _slotFreed:
+		while True:
+			if _localInUse < _localSlots:
+				_localInUse += 1
+				return None
+			if not localOnly:
+				best = None
+				for worker in _workers:
+					if worker.failed or worker.inUse >= worker.slots:
+						continue
+					if best is None or float( worker.inUse ) / worker.slots < float( best.inUse ) / best.slots:
+						best = worker
+				if best is not None:
+					best.inUse += 1
+					return best
+			_slotFreed.wait( )
+
+
+def ReleaseSlot( worker ):
+	"""
+	Give back a slot reserved with AcquireSlot().
+
+	:param worker: The worker the slot belonged to, or None for a local slot
+	:type worker: Worker or None
+	"""
+	global _localInUse
+	with _slotFreed:
+		if worker is None:
+			_localInUse -= 1
+		else:
+			worker.inUse -= 1
+		_slotFreed.notify_all( )
+
+
+def _markFailed( worker, e ):
+	with _slotLock:
+		if worker.failed:
+			return
+		worker.failed = True
+	log.LOG_WARN( "Build worker {} failed, compiling its share locally for the rest of the build: {}".format( worker, e ) )
+
+
+def Compile( worker, preprocessCmd, remoteCmd, obj, workingDirectory, env ):
+	"""
+	Preprocess a translation unit locally and compile it on a worker.
+
+	:param worker: Worker to compile on
+	:type worker: Worker
+
+	:param preprocessCmd: Command that preprocesses the translation unit to stdout
+	:type preprocessCmd: str
+
+	:param remoteCmd: Command the worker runs to compile the preprocessed source
+	:type remoteCmd: str
+
+	:param obj: Object file to write
+	:type obj: str
+
+	:param workingDirectory: Directory to preprocess in
+	:type workingDirectory: str
+
+	:param env: Environment to preprocess with
+	:type env: dict
+
+	:return: The compiler's return code, output and errors, or None if the translation unit has to be compiled
+		locally instead
+	:rtype: tuple[int, str, str] or None
+	"""
+	global remoteCompiles
+	if platform.system( ) != "Windows":
+		preprocessCmd = shlex.split( preprocessCmd )
+	fd = subprocess.Popen( preprocessCmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = workingDirectory, env = env )
+	with _shared_globals.spmutex:
+		_shared_globals.subprocesses[obj] = fd
+	source, _ = fd.communicate( )
+	with _shared_globals.spmutex:
+		del _shared_globals.subprocesses[obj]
+		if _shared_globals.exiting:
+			return None
+	if fd.returncode != 0:
+		return None
+
+	try:
+		response, data = _request( worker, { "type" : "compile", "command" : remoteCmd }, source )
+	except ( socket.error, EOFError, ValueError, RuntimeError ) as e:
+		_markFailed( worker, e )
+		return None
+
+	if response["returncode"] == 0:
+		with open( obj, "wb" ) as f:
+			f.write( data )
+	with _slotLock:
+		remoteCompiles += 1
+	return response["returncode"], response["stdout"], response["stderr"]
+
+
+class _WorkerHandler( socketserver.BaseRequestHandler ):
+	def handle( self ):
+		try:
+			header, payload = _recvMessage( self.request )
+		except ( socket.error, EOFError, ValueError ):
+			return
+
+		try:
+			if header.get( "version" ) != _PROTOCOL_VERSION:
+				_sendMessage( self.request, { "error" : "Protocol version {} is not supported by this worker (expected {})".format( header.get( "version" ), _PROTOCOL_VERSION ) } )
+			elif header.get( "type" ) == "info":
+				_sendMessage( self.request, { "slots" : self.server.slots } )
+			elif header.get( "type" ) == "compile":
+				with self.server.semaphore:
+					response, data = self._compile( header["command"], payload )
+				_sendMessage( self.request, response, data )
+			else:
+				_sendMessage( self.request, { "error" : "Unknown request {}".format( header.get( "type" ) ) } )
+		except socket.error:
+			#The build went away; nothing to send the result to.
+			pass
+
+
+	def _compile( self, command, source ):
+		directory = tempfile.mkdtemp( prefix = "csbuild-worker-" )
+		try:
+			with open( os.path.join( directory, REMOTE_SOURCE_NAME ), "wb" ) as f:
+				f.write( source )
+			if platform.system( ) != "Windows":
+				command = shlex.split( command )
+			try:
+				fd = subprocess.Popen( command, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = directory )
+			except OSError as e:
+				return { "returncode" : 1, "stdout" : "", "stderr" : "csbuild worker could not run the compiler: {}\n".format( e ) }, b""
+			output, errors = fd.communicate( )
+
+			data = b""
+			if fd.returncode == 0:
+				with open( os.path.join( directory, REMOTE_OBJECT_NAME ), "rb" ) as f:
+					data = f.read( )
+			response = {
+				"returncode" : fd.returncode,
+				"stdout" : output.decode( "utf-8", "replace" ),
+				"stderr" : errors.decode( "utf-8", "replace" ),
+			}
+			return response, data
+		finally:
+			shutil.rmtree( directory, ignore_errors = True )
+
+
+class _WorkerServer( socketserver.ThreadingMixIn, socketserver.TCPServer ):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__( self, address, slots ):
+		socketserver.TCPServer.__init__( self, address, _WorkerHandler )
+		self.slots = slots
+		self.semaphore = threading.BoundedSemaphore( slots )
+
+
+def RunWorker( address, slots ):
+	"""
+	Serve compiles for other builds until interrupted.
+
+	:param address: Address to listen on, as HOST:PORT, HOST or PORT
+	:type address: str
+
+	:param slots: Number of compiles to run at once
+	:type slots: int
+	"""
+	server = _WorkerServer( ParseAddress( address ), slots )
+	host, port = server.server_address[:2]
+	log.LOG_BUILD( "Build worker listening on {}:{} with {} slots".format( host, port, slots ) )
+	try:
+		server.serve_forever( )
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close( )
+
@@ -0,0 +1,261 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Directory watcher used by the build daemon to keep the stat cache valid between builds.
+
+On Linux this uses inotify through ctypes, so nothing needs to be installed. Every change the kernel reports in a
+watched directory (a file created, modified, deleted or moved, or the directory itself going away) is recorded in a
+journal, which the daemon reads before each build to invalidate exactly those paths. Everything else it already
+knows, including directory listings, is handed to the build as-is, so file discovery and recompile checks don't go
+back to the disk for untouched directories.
+
+The daemon only runs on Python 3, which this relies on for encoding paths. Where inotify isn't available, or if the
+kernel's event queue overflows, the daemon falls back to clearing the stat cache and walking everything again, as a
+normal run does.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import platform
+import struct
+
+from . import log
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+_WATCH_MASK = (
+	IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+	| IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+
+_EVENT_HEADER = struct.Struct( "iIII" )
+
+_libc = None
+if platform.system( ) == "Linux":
+	try:
+		_libc = ctypes.CDLL( ctypes.util.find_library( "c" ) or "libc.so.6", use_errno = True )
+		_libc.inotify_init1.argtypes = [ ctypes.c_int ]
+		_libc.inotify_add_watch.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+		_libc.inotify_rm_watch.argtypes = [ ctypes.c_int, ctypes.c_int ]
+	except ( OSError, AttributeError ):
+		_libc = None
+
+
+def IsSupported( ):
+	"""
+	:return: Whether directories can be watched on this platform
+	:rtype: bool
+	"""
+	return _libc is not None
+
+
+class Journal( object ):
+	"""
+	Everything that changed in the watched directories since the journal was last read.
+
+	:ivar changedPaths: Files and directories that were created, modified or deleted
+	:type changedPaths: set[str]
+
+	:ivar changedTrees: Directories that were deleted, moved or replaced, along with everything under them
+	:type changedTrees: set[str]
+
+	:ivar overflowed: Whether events were lost, in which case nothing known about the watched directories can be trusted
+	:type overflowed: bool
+	"""
+	def __init__( self ):
+		self.changedPaths = set( )
+		self.changedTrees = set( )
+		self.overflowed = False
+
+
+	def Merge( self, other ):
+		"""
+		Add the contents of another journal to this one.
+
+		:param other: Journal to merge in
+		:type other: Journal
+		"""
+		self.changedPaths |= other.changedPaths
+		self.changedTrees |= other.changedTrees
+		self.overflowed = self.overflowed or other.overflowed
+
+
+class FileWatcher( object ):
+	"""
+	Watches directories for changes with inotify.
+
+	:ivar directories: Absolute paths of every directory being watched
+	:type directories: set[str]
+	"""
+	def __init__( self ):
+		self._fd = _libc.inotify_init1( IN_NONBLOCK | IN_CLOEXEC )
+		if self._fd < 0:
+			err = ctypes.get_errno( )
+			raise OSError( err, os.strerror( err ) )
+		self._paths = { }
+		self._descriptors = { }
+		self._recursive = set( )
+		self._warnedLimit = False
+		self.directories = set( )
+
+
+	def fileno( self ):
+		"""
+		:return: The inotify descriptor, which becomes readable when there are events waiting
+		:rtype: int
+		"""
+		return self._fd
+
+
+	def Close( self ):
+		"""
+		Stop watching everything.
+		"""
+		if self._fd >= 0:
+			os.close( self._fd )
+			self._fd = -1
+
+
+	def _addWatch( self, directory ):
+		if directory in self.directories:
+			return True
+		wd = _libc.inotify_add_watch( self._fd, os.fsencode( directory ), _WATCH_MASK )
+		if wd < 0:
+			err = ctypes.get_errno( )
+			if err == errno.ENOSPC and not self._warnedLimit:
+				log.LOG_WARN( "Reached the inotify watch limit; directories past this point will be rescanned on every build. "
+					"Raise fs.inotify.max_user_watches to watch more." )
+				self._warnedLimit = True
+			return False
+		self._paths[wd] = directory
+		self._descriptors[directory] = wd
+		self.directories.add( directory )
+		return True
+
+
+	def WatchDirectory( self, directory, recursive = False ):
+		"""
+		Start watching a directory, and optionally everything under it, including directories created later.
+
+		:param directory: Absolute path of the directory
+		:type directory: str
+
+		:param recursive: Whether to watch subdirectories as well
+		:type recursive: bool
+		"""
+		if not recursive:
+			self._addWatch( directory )
+			return
+
+		if directory in self._recursive:
+			return
+		for root, dirnames, _ in os.walk( directory ):
+			if not self._addWatch( root ):
+				del dirnames[:]
+				continue
+			self._recursive.add( root )
+
+
+	def _forget( self, directory ):
+		prefix = os.path.join( directory, "" )
+		for path in [ path for path in self.directories if path == directory or path.startswith( prefix ) ]:
+			wd = self._descriptors.pop( path )
+			del self._paths[wd]
+			self.directories.discard( path )
+			self._recursive.discard( path )
+			_libc.inotify_rm_watch( self._fd, wd )
+
+
+	def ReadEvents( self ):
+		"""
+		Read every event waiting, without blocking.
+
+		:return: What changed since the last call
+		:rtype: Journal
+		"""
+		journal = Journal( )
+		while True:
+			try:
+				data = os.read( self._fd, 65536 )
+			except OSError as e:
+				if e.errno in ( errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR ):
+					break
+				raise
+			if not data:
+				break
+
+			offset = 0
+			while offset < len( data ):
+				wd, mask, _, length = _EVENT_HEADER.unpack_from( data, offset )
+				offset += _EVENT_HEADER.size
+				name = data[offset:offset + length].rstrip( b"\0" )
+				offset += length
+
+				if mask & IN_Q_OVERFLOW:
+					journal.overflowed = True
+					continue
+
+				directory = self._paths.get( wd )
+				if directory is None:
+					continue
+
+				if mask & IN_IGNORED:
+					self._paths.pop( wd, None )
+					self._descriptors.pop( directory, None )
+					self.directories.discard( directory )
+					self._recursive.discard( directory )
+					continue
+
+				if mask & ( IN_DELETE_SELF | IN_MOVE_SELF ):
+					journal.changedTrees.add( directory )
+					continue
+
+				if not name:
+					journal.changedPaths.add( directory )
+					continue
+
+				path = os.path.join( directory, os.fsdecode( name ) )
+				journal.changedPaths.add( path )
+				if mask & IN_ISDIR and mask & ( IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE ):
+					journal.changedTrees.add( path )
+					if mask & ( IN_DELETE | IN_MOVED_FROM ):
+						self._forget( path )
+					elif directory in self._recursive:
+						self.WatchDirectory( path, True )
+
+		return journal
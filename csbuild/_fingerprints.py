@@ -0,0 +1,178 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Per-project store of content fingerprints from the last successful build.
+
+Each project keeps a single fingerprint file in its .csbuild directory, mapping every source and header to the
+comment-stripped digest it had when it was last built. The file is read once, the first time the project needs it,
+and written once at the end of the build.
+"""
+
+import os
+import sys
+import threading
+
+if sys.version_info < (3,0):
+	import cPickle as pickle
+else:
+	import pickle
+
+from . import log
+from . import _shared_globals
+from . import _utils
+
+_DATABASE_VERSION = 1
+
+_databases = {}
+_databasesLock = threading.Lock( )
+
+
+class FingerprintDatabase( object ):
+	"""
+	Fingerprints for all of the files in one project.
+
+	:ivar path: Location of the database on disk
+	:type path: str
+
+	:ivar fingerprints: Digest of each file as of the last build
+	:type fingerprints: dict[str, bytes]
+
+	:ivar stamp: Stamp of the file on disk as of the last time it was read or written
+	:type stamp: tuple or None
+	"""
+	def __init__( self, path ):
+		self.path = path
+		self.fingerprints = { }
+		self.dirty = False
+		self.lock = threading.Lock( )
+		self.stamp = _utils.GetFileStamp( path )
+
+		if self.stamp is None:
+			return
+
+		try:
+			with open( path, "rb" ) as f:
+				data = pickle.load( f )
+		except Exception as e:
+			log.LOG_WARN( "Could not read fingerprint database {}, it will be rebuilt: {}".format( path, e ) )
+			return
+
+		if not isinstance( data, dict ) or data.get( "version" ) != _DATABASE_VERSION:
+			return
+
+		#Fingerprints taken with a different digest can't be compared, so everything has to be rehashed.
+		if data.get( "digest", "md5" ) != _shared_globals.fingerprint_digest:
+			log.LOG_INFO( "Fingerprint digest changed, discarding {}".format( path ) )
+			self.dirty = True
+			return
+
+		self.fingerprints = data["fingerprints"]
+
+
+	def Get( self, filename ):
+		"""
+		:param filename: Absolute path of a source or header
+		:type filename: str
+
+		:return: The file's digest as of the last build, or None if it has never been recorded
+		:rtype: bytes or None
+		"""
+		return self.fingerprints.get( filename )
+
+
+	def Set( self, filename, fingerprint ):
+		"""
+		Record a file's current digest. Nothing is written to disk until Flush() is called.
+
+		:param filename: Absolute path of a source or header
+		:type filename: str
+
+		:param fingerprint: The file's digest
+		:type fingerprint: bytes
+		"""
+		with self.lock:
+			if self.fingerprints.get( filename ) != fingerprint:
+				self.fingerprints[filename] = fingerprint
+				self.dirty = True
+
+
+	def Flush( self ):
+		"""
+		Write the database to disk if anything has changed.
+		"""
+		with self.lock:
+			if not self.dirty:
+				return
+			directory = os.path.dirname( self.path )
+			if not os.access( directory, os.F_OK ):
+				os.makedirs( directory )
+			_utils.AtomicPickleDump(
+				{
+					"version" : _DATABASE_VERSION,
+					"digest" : _shared_globals.fingerprint_digest,
+					"fingerprints" : self.fingerprints
+				},
+				self.path
+			)
+			self.stamp = _utils.GetFileStamp( self.path )
+			self.dirty = False
+
+
+def GetDatabase( csbuildDir ):
+	"""
+	Get the fingerprint database stored in a project's .csbuild directory, loading it on first use.
+
+	:param csbuildDir: The project's csbuildDir
+	:type csbuildDir: str
+
+	:rtype: FingerprintDatabase
+	"""
+	with _databasesLock:
+		database = _databases.get( csbuildDir )
+		if database is None:
+			database = FingerprintDatabase( os.path.join( csbuildDir, "fingerprints.csbc" ) )
+			_databases[csbuildDir] = database
+		return database
+
+
+def GetLoaded( ):
+	"""
+	:return: The csbuildDir of every database loaded so far
+	:rtype: list[str]
+	"""
+	with _databasesLock:
+		return list( _databases )
+
+
+def Refresh( csbuildDirs = () ):
+	"""
+	Reload every loaded database that has been rewritten on disk since it was read, and load the databases of the
+	given directories if they aren't loaded yet. Lets a long-lived process keep databases in memory across builds.
+
+	:param csbuildDirs: Additional directories whose databases should be loaded
+	:type csbuildDirs: iterable[str]
+	"""
+	with _databasesLock:
+		for csbuildDir, database in list( _databases.items( ) ):
+			if not database.dirty and _utils.GetFileStamp( database.path ) != database.stamp:
+				del _databases[csbuildDir]
+	for csbuildDir in csbuildDirs:
+		GetDatabase( csbuildDir )
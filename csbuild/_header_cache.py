@@ -0,0 +1,285 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Persistent include graph cache.
+
+Every source and header csbuild scans for includes is recorded here along with its direct includes and a
+fingerprint of the file at the time it was scanned. The cache is stored in the csbuild cache directory and
+reloaded on the next run, so only files whose fingerprint has changed need to be read again.
+
+Only the include names as written in the file are cached; resolving them to paths still happens per project,
+since that depends on each project's include directories.
+
+Toolchains that can emit dependency files also feed the cache with the exact, already-resolved list of files each
+object was built from, which is used in place of the include scan when deciding whether to recompile.
+
+Both are read and filled in from the dependency check threads, so every access goes through a module lock. Files are
+scanned outside it, so threads only wait on each other for the lookups themselves.
+"""
+
+import os
+import re
+import sys
+import threading
+
+if sys.version_info < (3,0):
+	import cPickle as pickle
+else:
+	import pickle
+
+from . import log
+from . import _shared_globals
+from . import _stat_cache
+from . import _utils
+
+_CACHE_VERSION = 1
+
+_lock = threading.Lock( )
+
+#{ path : ( fingerprint, [ includes ] ) }
+_entries = {}
+#{ object file : [ absolute dependency paths ] }
+_dependencies = {}
+_dirty = False
+#Stamp of the cache file as of the last time it was loaded or saved
+_loadedStamp = None
+
+_includeRegex = re.compile( r"#\s*include\s*[<\"](.*?)[\">]" )
+_depTokenRegex = re.compile( r"(?:\\.|[^\s\\])+" )
+
+
+def GetCacheFile( ):
+	"""
+	:return: Path to the on-disk cache file
+	:rtype: str
+	"""
+	return os.path.join( _shared_globals.cacheDirectory, "header_info.csbc" )
+
+
+def GetFingerprint( path ):
+	"""
+	Get a cheap fingerprint of a file that changes whenever the file is modified or replaced.
+
+	:param path: File to fingerprint
+	:type path: str
+
+	:return: ( mtime in nanoseconds, size, inode )
+	:rtype: tuple
+	"""
+	st = _stat_cache.Stat( path )
+	if st is None:
+		raise OSError( "No such file: {}".format( path ) )
+	if hasattr( st, "st_mtime_ns" ):
+		mtime = st.st_mtime_ns
+	else:
+		mtime = int( st.st_mtime * 1000000000 )
+	return ( mtime, st.st_size, st.st_ino )
+
+
+def ScanIncludes( path ):
+	"""
+	Read a file and pull out the names of the files it #includes. System headers (anything without an
+	extension) are skipped, since they're assumed to be immutable.
+
+	:param path: File to scan
+	:type path: str
+
+	:return: List of include names as written in the file
+	:rtype: list[str]
+	"""
+	headers = []
+	if sys.version_info >= (3, 0):
+		f = open( path, encoding = "latin-1" )
+	else:
+		f = open( path )
+	with f:
+		for line in f:
+			line = line.strip()
+			if not line or line[0] != '#':
+				continue
+
+			RMatch = _includeRegex.search( line )
+			if RMatch is None:
+				continue
+
+			#Don't follow system headers, we should assume those are immutable
+			if "." not in RMatch.group( 1 ):
+				continue
+
+			headers.append( RMatch.group( 1 ) )
+
+	return headers
+
+
+def GetIncludes( path ):
+	"""
+	Get the direct includes of a file, only re-scanning it if it has changed since it was last scanned.
+
+	:param path: Absolute path of the file
+	:type path: str
+
+	:return: List of include names as written in the file
+	:rtype: list[str]
+	"""
+	global _dirty
+	try:
+		fingerprint = GetFingerprint( path )
+	except OSError:
+		return _utils.RunScanTask( ScanIncludes, path )
+
+	with _lock:
+		entry = _entries.get( path )
+	if entry is not None and entry[0] == fingerprint:
+		return entry[1]
+
+	includes = _utils.RunScanTask( ScanIncludes, path )
+	with _lock:
+		_entries[path] = ( fingerprint, includes )
+		_dirty = True
+	return includes
+
+
+def GetDependencies( objFile ):
+	"""
+	Get the dependencies recorded by the compiler the last time an object file was successfully built.
+
+	:param objFile: Absolute path of the object file
+	:type objFile: str
+
+	:return: List of absolute paths, or None if nothing has been recorded for this object
+	:rtype: list[str] or None
+	"""
+	with _lock:
+		return _dependencies.get( objFile )
+
+
+def SetDependencies( objFile, dependencies ):
+	"""
+	Record the dependencies of a freshly built object file.
+
+	:param objFile: Absolute path of the object file
+	:type objFile: str
+
+	:param dependencies: Absolute paths of every file the object was built from
+	:type dependencies: list[str]
+	"""
+	global _dirty
+	with _lock:
+		_dependencies[objFile] = dependencies
+		_dirty = True
+
+
+def ParseDependencyFile( depFile, workingDirectory ):
+	"""
+	Parse a make-style dependency file, as written by gcc and clang with -MD/-MMD.
+
+	:param depFile: Path to the dependency file
+	:type depFile: str
+
+	:param workingDirectory: Directory the compiler was run from, used to resolve relative paths
+	:type workingDirectory: str
+
+	:return: Absolute paths of all prerequisites listed in the file
+	:rtype: list[str]
+	"""
+	with open( depFile, "r" ) as f:
+		text = f.read( )
+
+	text = text.replace( "\\\r\n", " " ).replace( "\\\n", " " )
+
+	dependencies = []
+	seen = set()
+	#The first rule names the object file itself; everything after its colon is a prerequisite.
+	#With -MP there may be further empty rules for each header, which are skipped.
+	for line in text.splitlines( ):
+		tokens = _depTokenRegex.findall( line )
+		if not tokens:
+			continue
+		colonIdx = None
+		for i, token in enumerate( tokens ):
+			if token.endswith( ":" ):
+				colonIdx = i
+				break
+		if colonIdx is None:
+			continue
+		if dependencies and colonIdx == len( tokens ) - 1:
+			continue
+		for token in tokens[colonIdx+1:]:
+			path = token.replace( "\\ ", " " ).replace( "\\#", "#" ).replace( "$$", "$" )
+			path = os.path.normcase( os.path.normpath( os.path.join( workingDirectory, path ) ) )
+			if path not in seen:
+				seen.add( path )
+				dependencies.append( path )
+	return dependencies
+
+
+def Load( ):
+	"""
+	Load the cache from disk. Missing, corrupt or outdated caches are silently discarded. If the file hasn't changed
+	since it was last loaded or saved by this process, what's already in memory is kept.
+	"""
+	global _entries
+	global _dependencies
+	global _dirty
+	global _loadedStamp
+	cacheFile = GetCacheFile( )
+	_dirty = False
+	stamp = _utils.GetFileStamp( cacheFile )
+	if stamp is None or stamp == _loadedStamp:
+		return
+	_loadedStamp = stamp
+
+	log.LOG_INFO( "Loading header cache from {}...".format( cacheFile ) )
+	try:
+		with open( cacheFile, "rb" ) as f:
+			data = pickle.load( f )
+	except Exception as e:
+		log.LOG_WARN( "Could not read header cache, it will be rebuilt: {}".format( e ) )
+		return
+
+	if not isinstance( data, dict ) or data.get( "version" ) != _CACHE_VERSION:
+		return
+
+	with _lock:
+		_entries = data["entries"]
+		_dependencies = data.get( "dependencies", { } )
+
+
+def Save( ):
+	"""
+	Write the cache back to disk if anything changed during this run.
+	"""
+	global _dirty
+	global _loadedStamp
+	with _lock:
+		if not _dirty:
+			return
+		data = { "version" : _CACHE_VERSION, "entries" : dict( _entries ), "dependencies" : dict( _dependencies ) }
+
+	cacheFile = GetCacheFile( )
+	try:
+		_utils.AtomicPickleDump( data, cacheFile )
+	except Exception as e:
+		log.LOG_WARN( "Could not write header cache: {}".format( e ) )
+		return
+
+	_loadedStamp = _utils.GetFileStamp( cacheFile )
+	_dirty = False
@@ -0,0 +1,389 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Per-project reverse include index.
+
+For every translation unit (source file or precompiled header) a project built, the index records the full set of
+headers it includes, directly or indirectly, and the inverse: for every header, the translation units that include it.
+Alongside it is a baseline stat fingerprint of each of those files, taken the last time the project built
+successfully.
+
+On the next build, only headers whose fingerprint differs from the baseline need to be looked at; the translation
+units that include them are found directly in the reverse index, and every other indexed translation unit can skip
+following its headers entirely.
+
+Includes that couldn't be resolved to a file when a translation unit was indexed are recorded with it. If one of them
+resolves on a later build, a header has appeared (or become visible) that the recorded includes don't account for, so
+the translation unit has to be scanned again rather than trusted to the index.
+
+Each time the baseline is updated, the index also counts which files had changed since the one before, so it can
+tell how often each header changes relative to the rest of the project (see _auto_pch).
+"""
+
+import hashlib
+import os
+import sys
+import threading
+
+if sys.version_info < (3,0):
+	import cPickle as pickle
+else:
+	import pickle
+
+from . import log
+from . import _header_cache
+from . import _utils
+
+_INDEX_VERSION = 1
+
+_indexes = {}
+_indexesLock = threading.Lock( )
+
+
+def GetStatFingerprint( path ):
+	"""
+	:param path: File to fingerprint
+	:type path: str
+
+	:return: The file's current stat fingerprint, or None if it doesn't exist
+	:rtype: tuple or None
+	"""
+	try:
+		return _header_cache.GetFingerprint( path )
+	except OSError:
+		return None
+
+
+class IncludeIndex( object ):
+	"""
+	Include relationships and baseline fingerprints for one project.
+
+	:ivar path: Location of the index on disk
+	:type path: str
+
+	:ivar includes: Every header each translation unit includes, directly or indirectly
+	:type includes: dict[str, frozenset[str]]
+
+	:ivar dependents: Every translation unit that includes each header, directly or indirectly
+	:type dependents: dict[str, set[str]]
+
+	:ivar unresolved: Includes of each translation unit that couldn't be found, as ( including file, include name )
+	:type unresolved: dict[str, frozenset[tuple[str, str]]]
+
+	:ivar baseline: Stat fingerprint of each file as of the last successful build
+	:type baseline: dict[str, tuple]
+
+	:ivar changes: Number of successful builds each file had changed since the build before
+	:type changes: dict[str, int]
+
+	:ivar changedBuilds: Number of successful builds where anything in the baseline had changed
+	:type changedBuilds: int
+
+	:ivar stamp: Stamp of the file on disk as of the last time it was read or written
+	:type stamp: tuple or None
+	"""
+	def __init__( self, path ):
+		self.path = path
+		self.includes = { }
+		self.dependents = { }
+		self.unresolved = { }
+		self.baseline = { }
+		self.changes = { }
+		self.changedBuilds = 0
+		self.dirty = False
+		self.lock = threading.Lock( )
+		self.stamp = _utils.GetFileStamp( path )
+
+		if self.stamp is None:
+			return
+
+		try:
+			with open( path, "rb" ) as f:
+				data = pickle.load( f )
+		except Exception as e:
+			log.LOG_WARN( "Could not read include index {}, it will be rebuilt: {}".format( path, e ) )
+			return
+
+		if not isinstance( data, dict ) or data.get( "version" ) != _INDEX_VERSION:
+			return
+
+		self.includes = data["includes"]
+		self.dependents = data["dependents"]
+		self.baseline = data["baseline"]
+		self.unresolved = data.get( "unresolved", { } )
+		self.changes = data.get( "changes", { } )
+		self.changedBuilds = data.get( "changedBuilds", 0 )
+
+
+	def GetIncludes( self, translationUnit ):
+		"""
+		:param translationUnit: Absolute path of a source file or precompiled header
+		:type translationUnit: str
+
+		:return: Every header the translation unit included as of the last time it was indexed, or None if it never has been
+		:rtype: frozenset[str] or None
+		"""
+		return self.includes.get( translationUnit )
+
+
+	def GetDependents( self, header ):
+		"""
+		:param header: Absolute path of a header
+		:type header: str
+
+		:return: Every indexed translation unit that includes the header, directly or indirectly
+		:rtype: set[str]
+		"""
+		return set( self.dependents.get( header, () ) )
+
+
+	def GetUnresolved( self, translationUnit ):
+		"""
+		:param translationUnit: Absolute path of a source file or precompiled header
+		:type translationUnit: str
+
+		:return: Includes that couldn't be found when the translation unit was indexed, as ( including file, include name )
+		:rtype: frozenset[tuple[str, str]]
+		"""
+		return self.unresolved.get( translationUnit, frozenset( ) )
+
+
+	def SetIncludes( self, translationUnit, headers, unresolved = ( ) ):
+		"""
+		Replace the recorded includes of a translation unit, updating the reverse index to match.
+
+		:param translationUnit: Absolute path of a source file or precompiled header
+		:type translationUnit: str
+
+		:param headers: Absolute paths of every header it includes, directly or indirectly
+		:type headers: iterable[str]
+
+		:param unresolved: Includes that couldn't be found, as ( including file, include name )
+		:type unresolved: iterable[tuple[str, str]]
+		"""
+		headers = frozenset( headers )
+		unresolved = frozenset( unresolved )
+		with self.lock:
+			if unresolved:
+				if self.unresolved.get( translationUnit ) != unresolved:
+					self.unresolved[translationUnit] = unresolved
+					self.dirty = True
+			elif self.unresolved.pop( translationUnit, None ) is not None:
+				self.dirty = True
+
+			oldHeaders = self.includes.get( translationUnit )
+			if oldHeaders == headers:
+				return
+
+			if oldHeaders is not None:
+				for header in oldHeaders - headers:
+					dependents = self.dependents.get( header )
+					if dependents is not None:
+						dependents.discard( translationUnit )
+						if not dependents:
+							del self.dependents[header]
+				headersToAdd = headers - oldHeaders
+			else:
+				headersToAdd = headers
+
+			for header in headersToAdd:
+				self.dependents.setdefault( header, set( ) ).add( translationUnit )
+
+			self.includes[translationUnit] = headers
+			self.dirty = True
+
+
+	def Prune( self, translationUnits ):
+		"""
+		Forget every translation unit that isn't in the given set, such as sources that have been removed from the
+		project.
+
+		:param translationUnits: Absolute paths of every translation unit the project still has
+		:type translationUnits: set[str]
+		"""
+		for translationUnit in [ tu for tu in self.includes if tu not in translationUnits ]:
+			self.RemoveIncludes( translationUnit )
+
+
+	def RemoveIncludes( self, translationUnit ):
+		"""
+		Forget a translation unit, so it's scanned in full on the next build.
+
+		:param translationUnit: Absolute path of a source file or precompiled header
+		:type translationUnit: str
+		"""
+		if translationUnit not in self.includes:
+			return
+		self.SetIncludes( translationUnit, () )
+		with self.lock:
+			del self.includes[translationUnit]
+			self.dirty = True
+
+
+	def HasBaseline( self, path ):
+		"""
+		:param path: Absolute path of a file
+		:type path: str
+
+		:return: Whether the file existed at the end of the last successful build
+		:rtype: bool
+		"""
+		return self.baseline.get( path ) is not None
+
+
+	def GetChangedHeaders( self ):
+		"""
+		:return: Every indexed header that has been modified, replaced or deleted since the last successful build
+		:rtype: set[str]
+		"""
+		return set(
+			header for header in self.dependents
+			if GetStatFingerprint( header ) != self.baseline.get( header )
+		)
+
+
+	def GetAffectedTranslationUnits( self, changedHeaders ):
+		"""
+		:param changedHeaders: Headers that have changed
+		:type changedHeaders: iterable[str]
+
+		:return: Every indexed translation unit that includes any of the given headers
+		:rtype: set[str]
+		"""
+		affected = set( )
+		for header in changedHeaders:
+			affected.update( self.dependents.get( header, () ) )
+		return affected
+
+
+	def GetChangeRate( self, path ):
+		"""
+		:param path: Absolute path of a file
+		:type path: str
+
+		:return: Fraction of the successful builds with changes in them where this file was one of the changes, or 0
+			if the project hasn't been rebuilt with changes yet
+		:rtype: float
+		"""
+		if not self.changedBuilds:
+			return 0.0
+		return self.changes.get( path, 0 ) / float( self.changedBuilds )
+
+
+	def UpdateBaseline( self, paths ):
+		"""
+		Record the current fingerprints of files as the state they were in for a successful build.
+
+		:param paths: Absolute paths of files
+		:type paths: iterable[str]
+		"""
+		with self.lock:
+			changed = False
+			for path in paths:
+				fingerprint = GetStatFingerprint( path )
+				if self.baseline.get( path ) != fingerprint:
+					#A file seen for the first time hasn't changed, it's just new to the index.
+					if path in self.baseline:
+						self.changes[path] = self.changes.get( path, 0 ) + 1
+						changed = True
+					self.baseline[path] = fingerprint
+					self.dirty = True
+			if changed:
+				self.changedBuilds += 1
+
+
+	def Flush( self ):
+		"""
+		Write the index to disk if anything has changed.
+		"""
+		with self.lock:
+			if not self.dirty:
+				return
+			directory = os.path.dirname( self.path )
+			if not os.access( directory, os.F_OK ):
+				os.makedirs( directory )
+			_utils.AtomicPickleDump(
+				{
+					"version" : _INDEX_VERSION,
+					"includes" : self.includes,
+					"dependents" : self.dependents,
+					"unresolved" : self.unresolved,
+					"baseline" : self.baseline,
+					"changes" : self.changes,
+					"changedBuilds" : self.changedBuilds
+				},
+				self.path
+			)
+			self.stamp = _utils.GetFileStamp( self.path )
+			self.dirty = False
+
+
+def GetIndex( csbuildDir, projectKey ):
+	"""
+	Get the include index for a project, loading it on first use. Several projects can share a .csbuild directory,
+	so each one gets its own index file within it.
+
+	:param csbuildDir: The project's csbuildDir
+	:type csbuildDir: str
+
+	:param projectKey: The project's key, which is unique across names, targets, architectures and toolchains
+	:type projectKey: str
+
+	:rtype: IncludeIndex
+	"""
+	key = projectKey
+	if sys.version_info >= (3, 0):
+		key = key.encode( "utf-8" )
+	return _getIndexByPath( os.path.join( csbuildDir, "include_index_{}.csbc".format( hashlib.md5( key ).hexdigest( ) ) ) )
+
+
+def _getIndexByPath( path ):
+	with _indexesLock:
+		index = _indexes.get( path )
+		if index is None:
+			index = IncludeIndex( path )
+			_indexes[path] = index
+		return index
+
+
+def GetLoaded( ):
+	"""
+	:return: The path of every index loaded so far
+	:rtype: list[str]
+	"""
+	with _indexesLock:
+		return list( _indexes )
+
+
+def Refresh( paths = () ):
+	"""
+	Reload every loaded index that has been rewritten on disk since it was read, and load the given ones if they
+	aren't loaded yet. Lets a long-lived process keep indexes in memory across builds.
+
+	:param paths: Additional index files to load, as returned by GetLoaded()
+	:type paths: iterable[str]
+	"""
+	with _indexesLock:
+		for path, index in list( _indexes.items( ) ):
+			if not index.dirty and _utils.GetFileStamp( path ) != index.stamp:
+				del _indexes[path]
+	for path in paths:
+		_getIndexByPath( path )
@@ -0,0 +1,397 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Fixed-size pool of worker threads that runs build jobs from a priority queue.
+
+Compiles used to each get a thread of their own, gated by a semaphore. The pool starts its threads once, and every
+compile is submitted to it as a job instead. Jobs with a higher priority run first, and jobs with the same priority
+run in the order they were submitted. A job that hasn't started yet can be cancelled, and each job can have a
+callback that's run on the worker thread once it's done. Anything can look at what's queued and running.
+
+The pool can also be given a memory budget, with each job saying how much memory it's expected to need. A job is only
+started while the expected total of everything running stays within the budget, so a few heavy compiles can't push
+the machine into swap, while light ones still get every thread. When the job at the front of the queue doesn't fit,
+the highest priority one behind it that does is started instead. That can only happen to a job so many times
+(MAX_BYPASSES): after that, nothing queued behind it is started until it fits, so a steady stream of light jobs can't
+keep a heavy one waiting forever. A job is always started if nothing else is running, however much it needs.
+
+The number of jobs allowed to run at once can be lowered below the number of threads, and raised back, while the pool
+is running (see _load_monitor). Jobs already running are left alone when it's lowered; new ones just aren't started
+until enough of them finish.
+"""
+
+import heapq
+import itertools
+import threading
+import traceback
+
+from . import log
+
+#Priority of precompiled header jobs, which every other compile in their project waits on. Compiles are prioritized by
+# their expected critical path length in seconds, so nothing else can outrank these.
+PRECOMPILE_PRIORITY = float( "inf" )
+
+#How many times a job that doesn't fit in the memory budget can have jobs behind it started ahead of it, before the
+# pool waits for enough memory to free up to run it.
+MAX_BYPASSES = 8
+
+
+class JobState( object ):
+	"""
+	States a job goes through.
+	"""
+	Pending = 0
+	Running = 1
+	Finished = 2
+	Cancelled = 3
+
+
+class Job( object ):
+	"""
+	A function queued to run on the pool.
+
+	:ivar name: Name shown when inspecting the pool
+	:type name: str
+
+	:ivar priority: Jobs with a higher priority run first
+	:type priority: int or float
+
+	:ivar memory: Memory the job is expected to need, in bytes
+	:type memory: int
+
+	:ivar state: Where the job is in its life
+	:type state: :class:`JobState`
+
+	:ivar result: What the function returned, once it's finished
+	:type result: any
+
+	:ivar exception: The exception the function raised, if it raised one
+	:type exception: Exception or None
+	"""
+	def __init__( self, pool, func, args, priority, memory, callback, name ):
+		self.name = name
+		self.priority = priority
+		self.memory = memory
+		self.state = JobState.Pending
+		self.result = None
+		self.exception = None
+		self._pool = pool
+		self._func = func
+		self._args = args
+		self._callback = callback
+		self._done = threading.Event( )
+		self._bypassed = 0
+
+
+	def __repr__( self ):
+		return "<Job {} priority={} state={}>".format( self.name, self.priority, self.state )
+
+
+	def Cancel( self ):
+		"""
+		Keep the job from running, if it hasn't started yet.
+
+		:return: Whether the job was cancelled
+		:rtype: bool
+		"""
+		return self._pool._cancel( self )
+
+
+	def Wait( self, timeout = None ):
+		"""
+		Block until the job has finished or been cancelled.
+
+		:param timeout: Longest time to wait, in seconds
+		:type timeout: float
+
+		:return: Whether the job is done
+		:rtype: bool
+		"""
+		self._done.wait( timeout )
+		return self._done.is_set( )
+
+
+	def IsDone( self ):
+		"""
+		:return: Whether the job has finished or been cancelled
+		:rtype: bool
+		"""
+		return self._done.is_set( )
+
+
+class JobPool( object ):
+	"""
+	Runs jobs on a fixed number of worker threads.
+
+	:ivar size: Number of worker threads
+	:type size: int
+
+	:ivar memoryBudget: Most memory, in bytes, the running jobs are expected to need at once, or 0 for no limit
+	:type memoryBudget: int
+	"""
+	def __init__( self, size, memoryBudget = 0 ):
+		self.size = size
+		self.memoryBudget = memoryBudget
+		self._memoryInUse = 0
+		self._limit = size
+		self._cond = threading.Condition( )
+		self._queue = []
+		self._running = set( )
+		self._counter = itertools.count( )
+		self._completed = 0
+		self._closing = False
+		self._threads = []
+		for i in range( size ):
+			thread = threading.Thread( target = self._workerLoop, name = "csbuild-job-{}".format( i ) )
+			thread.daemon = True
+			thread.start( )
+			self._threads.append( thread )
+
+
+	def Submit( self, func, args = ( ), priority = 0, memory = 0, callback = None, name = None ):
+		"""
+		Queue a function to run on the pool.
+
+		:param func: Function to run
+		:type func: callable
+
+		:param args: Arguments to call it with
+		:type args: tuple
+
+		:param priority: Jobs with a higher priority run first
+		:type priority: int or float
+
+		:param memory: Memory the job is expected to need, in bytes, checked against the pool's memory budget
+		:type memory: int
+
+		:param callback: Called with the job once it's finished, on the worker thread that ran it
+		:type callback: callable
+
+		:param name: Name shown when inspecting the pool
+		:type name: str
+
+		:return: The queued job
+		:rtype: :class:`Job`
+		"""
+		job = Job( self, func, args, priority, memory, callback, name or getattr( func, "__name__", "job" ) )
+		with self._cond:
+			heapq.heappush( self._queue, ( -priority, next( self._counter ), job ) )
+			self._cond.notify_all( )
+		return job
+
+
+	def SetLimit( self, limit ):
+		"""
+		Change how many jobs can run at once.
+
+		:param limit: Number of jobs, from 1 up to the number of worker threads
+		:type limit: int
+		"""
+		with self._cond:
+			self._limit = max( 1, min( limit, self.size ) )
+			self._cond.notify_all( )
+
+
+	def GetLimit( self ):
+		"""
+		:return: How many jobs can run at once
+		:rtype: int
+		"""
+		with self._cond:
+			return self._limit
+
+
+	def _cancel( self, job ):
+		with self._cond:
+			if job.state != JobState.Pending:
+				return False
+			job.state = JobState.Cancelled
+			self._queue = [ entry for entry in self._queue if entry[2] is not job ]
+			heapq.heapify( self._queue )
+			self._completed += 1
+			self._cond.notify_all( )
+		job._done.set( )
+		return True
+
+
+	def CancelPending( self ):
+		"""
+		Cancel every job that hasn't started yet.
+
+		:return: The jobs that were cancelled
+		:rtype: list[Job]
+		"""
+		with self._cond:
+			cancelled = [ entry[2] for entry in self._queue ]
+			self._queue = []
+			for job in cancelled:
+				job.state = JobState.Cancelled
+			self._completed += len( cancelled )
+			self._cond.notify_all( )
+		for job in cancelled:
+			job._done.set( )
+		return cancelled
+
+
+	def GetPendingJobs( self ):
+		"""
+		:return: Jobs waiting to run, in the order they'll run
+		:rtype: list[Job]
+		"""
+		with self._cond:
+			return [ entry[2] for entry in sorted( self._queue ) ]
+
+
+	def GetRunningJobs( self ):
+		"""
+		:return: Jobs currently running
+		:rtype: list[Job]
+		"""
+		with self._cond:
+			return list( self._running )
+
+
+	def GetOutstandingCount( self ):
+		"""
+		:return: Number of jobs that are queued or running
+		:rtype: int
+		"""
+		with self._cond:
+			return len( self._queue ) + len( self._running )
+
+
+	def GetIdleCount( self ):
+		"""
+		:return: Number of jobs that could be running but aren't, because there's nothing to run or not enough memory
+			to run it
+		:rtype: int
+		"""
+		with self._cond:
+			if self._queue and self._nextJobIndex( ) is not None:
+				return 0
+			return max( self._limit - len( self._running ), 0 )
+
+
+	def GetCompletedCount( self ):
+		"""
+		:return: Number of jobs that have finished or been cancelled since the pool was created
+		:rtype: int
+		"""
+		with self._cond:
+			return self._completed
+
+
+	def WaitForCompletion( self, completedCount, timeout = None ):
+		"""
+		Block until another job finishes, or until the timeout.
+
+		:param completedCount: The value GetCompletedCount() (or the last call to this) returned
+		:type completedCount: int
+
+		:param timeout: Longest time to wait, in seconds
+		:type timeout: float
+
+		:return: The number of jobs completed so far
+		:rtype: int
+		"""
+		with self._cond:
+			if self._completed == completedCount:
+				self._cond.wait( timeout )
+			return self._completed
+
+
+	def Close( self ):
+		"""
+		Stop the worker threads once they've finished what they're running. Pending jobs are cancelled.
+		"""
+		self.CancelPending( )
+		with self._cond:
+			self._closing = True
+			self._cond.notify_all( )
+		for thread in self._threads:
+			thread.join( )
+
+
+	def _nextJobIndex( self ):
+		#Index in the queue of the job to run next, or None if nothing queued fits in the memory left.
+		if not self.memoryBudget or not self._running:
+			return 0
+		available = self.memoryBudget - self._memoryInUse
+		if self._queue[0][2].memory <= available:
+			return 0
+		#Nothing can be started ahead of a job that's already been passed over too many times.
+		limit = None
+		for entry in self._queue:
+			if entry[2]._bypassed >= MAX_BYPASSES and ( limit is None or entry < limit ):
+				limit = entry
+		best = None
+		for index, entry in enumerate( self._queue ):
+			if entry[2].memory > available or ( limit is not None and entry > limit ):
+				continue
+			if best is None or entry < self._queue[best]:
+				best = index
+		return best
+
+
+	def _workerLoop( self ):
+		while True:
+			with self._cond:
+				while True:
+					if self._closing:
+						return
+					if self._queue and len( self._running ) < self._limit:
+						index = self._nextJobIndex( )
+						if index is not None:
+							break
+					self._cond.wait( )
+				if index == 0:
+					job = heapq.heappop( self._queue )[2]
+				else:
+					started = self._queue.pop( index )
+					job = started[2]
+					for entry in self._queue:
+						if entry < started:
+							entry[2]._bypassed += 1
+					heapq.heapify( self._queue )
+				job.state = JobState.Running
+				self._running.add( job )
+				self._memoryInUse += job.memory
+
+			try:
+				job.result = job._func( *job._args )
+			except Exception as e:
+				job.exception = e
+				log.LOG_ERROR( "Build job {} failed: {}".format( job.name, e ) )
+				traceback.print_exc( )
+
+			if job._callback is not None:
+				try:
+					job._callback( job )
+				except Exception:
+					traceback.print_exc( )
+
+			with self._cond:
+				job.state = JobState.Finished
+				self._running.discard( job )
+				self._memoryInUse -= job.memory
+				self._completed += 1
+				self._cond.notify_all( )
+			job._done.set( )
@@ -0,0 +1,191 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Adjusts how many compiles run at once to how busy the machine is, for -j auto.
+
+Every couple of seconds the monitor looks at the system load average and, where /proc/stat is available, at how much
+of the CPU went idle since it last looked. If other work on the machine is keeping the CPU busy, so the load is well
+above the number of processors and almost nothing is idle, the job pool's limit is lowered by one. If there's CPU to
+spare and compiles are waiting for a thread, it's raised by one, up to the pool's size. In between, it's left where it
+is, and after each change it's left alone for a few samples so the load average can catch up with it.
+
+Where the load and CPU times come from can be replaced, to drive the monitor without a real machine's load behind it.
+"""
+
+import os
+import threading
+
+from . import log
+
+#Seconds between samples
+_INTERVAL = 2.0
+
+#Samples to wait after changing the limit before changing it again
+_SETTLE_SAMPLES = 3
+
+#Load per processor above which, with almost no CPU idle, the limit is lowered
+_SHRINK_LOAD = 1.25
+_SHRINK_IDLE = 0.05
+
+#Idle CPU above which the limit is raised if compiles are waiting, as long as the load isn't high enough to lower it.
+# Without /proc/stat, it's raised when the load per processor drops below _GROW_LOAD instead.
+_GROW_IDLE = 0.2
+_GROW_LOAD = 0.9
+
+
+def IsSupported( ):
+	"""
+	:return: Whether the system load can be read on this platform
+	:rtype: bool
+	"""
+	return hasattr( os, "getloadavg" )
+
+
+def _readLoad( ):
+	return os.getloadavg( )[0]
+
+
+def _readCpuTimes( ):
+	#( idle, total ) jiffies across every processor since boot, or None where /proc/stat isn't available.
+	try:
+		with open( "/proc/stat", "r" ) as f:
+			fields = f.readline( ).split( )
+	except ( OSError, IOError ):
+		return None
+	if not fields or fields[0] != "cpu":
+		return None
+	times = [ int( field ) for field in fields[1:] ]
+	#idle and iowait
+	idle = times[3] + ( times[4] if len( times ) > 4 else 0 )
+	return idle, sum( times )
+
+
+class LoadMonitor( object ):
+	"""
+	Thread that adjusts a job pool's limit to the system load while a build is running.
+
+	:ivar pool: Pool whose limit is adjusted
+	:type pool: csbuild._job_pool.JobPool
+
+	:ivar processors: Number of processors on the machine
+	:type processors: int
+	"""
+	def __init__( self, pool, processors, getLoad = _readLoad, getCpuTimes = _readCpuTimes, interval = _INTERVAL ):
+		"""
+		:param pool: Pool whose limit is adjusted
+		:type pool: csbuild._job_pool.JobPool
+
+		:param processors: Number of processors on the machine
+		:type processors: int
+
+		:param getLoad: Returns the system load average
+		:type getLoad: callable
+
+		:param getCpuTimes: Returns the idle and total CPU time since boot, in any unit, or None if it can't tell
+		:type getCpuTimes: callable
+
+		:param interval: Seconds between samples
+		:type interval: float
+		"""
+		self.pool = pool
+		self.processors = processors
+		self._getLoad = getLoad
+		self._getCpuTimes = getCpuTimes
+		self._interval = interval
+		self._stop = threading.Event( )
+		self._thread = None
+		self._lastCpuTimes = None
+		self._settle = 0
+
+
+	def Start( self ):
+		"""
+		Set the pool's starting limit from the current load, and start adjusting it.
+		"""
+		self._lastCpuTimes = self._getCpuTimes( )
+		#Leave room for whatever else was already running when the build started.
+		load = self._getLoad( )
+		self.pool.SetLimit( self.pool.size - int( round( load ) ) )
+		log.LOG_THREAD( "Starting with {} of {} build threads (load {:.2f})".format(
+			self.pool.GetLimit( ), self.pool.size, load ) )
+
+		self._thread = threading.Thread( target = self._monitorLoop, name = "csbuild-load-monitor" )
+		self._thread.daemon = True
+		self._thread.start( )
+
+
+	def Stop( self ):
+		"""
+		Stop adjusting the pool.
+		"""
+		self._stop.set( )
+		if self._thread is not None:
+			self._thread.join( )
+			self._thread = None
+
+
+	def _sampleIdle( self ):
+		cpuTimes = self._getCpuTimes( )
+		lastCpuTimes = self._lastCpuTimes
+		self._lastCpuTimes = cpuTimes
+		if cpuTimes is None or lastCpuTimes is None:
+			return None
+		total = cpuTimes[1] - lastCpuTimes[1]
+		if total <= 0:
+			return None
+		return float( cpuTimes[0] - lastCpuTimes[0] ) / total
+
+
+	def _monitorLoop( self ):
+		while not self._stop.wait( self._interval ):
+			load = self._getLoad( ) / self.processors
+			idle = self._sampleIdle( )
+
+			if self._settle:
+				self._settle -= 1
+				continue
+
+			if idle is not None:
+				busy = load > _SHRINK_LOAD and idle < _SHRINK_IDLE
+				spare = load <= _SHRINK_LOAD and idle > _GROW_IDLE
+			else:
+				busy = load > _SHRINK_LOAD
+				spare = load < _GROW_LOAD
+
+			limit = self.pool.GetLimit( )
+			newLimit = limit
+			if busy:
+				newLimit = limit - 1
+			#Only worth raising if there's something waiting for the extra thread.
+			elif spare and self.pool.GetIdleCount( ) == 0 and self.pool.GetOutstandingCount( ) > limit:
+				newLimit = limit + 1
+
+			newLimit = max( 1, min( newLimit, self.pool.size ) )
+			if newLimit != limit:
+				self.pool.SetLimit( newLimit )
+				self._settle = _SETTLE_SAMPLES
+				log.LOG_THREAD( "{} build threads to {} (load {:.2f}{})".format(
+					"Raising" if newLimit > limit else "Lowering",
+					newLimit,
+					load * self.processors,
+					", {:.0f}% idle".format( idle * 100 ) if idle is not None else ""
+				) )
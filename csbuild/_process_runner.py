@@ -0,0 +1,304 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Reads the output of every compiler and linker process on a single asyncio event loop.
+
+Collecting a process's output used to take a thread for each of its stdout and stderr pipes, on top of the thread
+waiting for it to exit. The runner has one thread of its own, running an event loop that all of those pipes are
+registered with, so those two pipe-reading threads per process are gone. The caller's thread is not freed, though:
+Communicate() blocks it until the process has closed both pipes, so every process in flight still holds one job pool
+thread for as long as it runs, the same as before. Output is either collected and handed back once the process has
+closed both pipes, or handed over a line at a time as it arrives, for compiles being profiled.
+
+The loop watches the pipes of processes started with subprocess.Popen, rather than starting processes itself, so
+processes are still started, tracked for killing on exit, and reaped with os.wait4() the same way as before. Where
+asyncio isn't available (Python 2), SelectRunner does the same job with a plain poll() loop on one thread.
+
+Neither works on Windows, which can't wait on several anonymous pipes at once without overlapped I/O that subprocess
+doesn't set up. There, output is still read the old way, by Popen.communicate(), which has a thread read stderr while
+the calling thread reads stdout.
+"""
+
+import errno
+import os
+import select
+import sys
+import threading
+import traceback
+
+if sys.version_info >= (3, 4):
+	import asyncio
+	_ProtocolBase = asyncio.Protocol
+else:
+	asyncio = None
+	_ProtocolBase = object
+
+
+def IsSupported( ):
+	"""
+	:return: Whether process output can be read with a runner on this platform
+	:rtype: bool
+	"""
+	#Windows can't poll the anonymous pipes subprocess creates, with asyncio or otherwise.
+	return os.name == "posix"
+
+
+def Create( ):
+	"""
+	Start the runner that suits this Python. IsSupported() must be true.
+
+	:return: The runner, which has to be closed once the build is done
+	:rtype: :class:`ProcessRunner` or :class:`SelectRunner`
+	"""
+	if asyncio is not None:
+		return ProcessRunner( )
+	return SelectRunner( )
+
+
+class _PipeReader( _ProtocolBase ):
+	"""
+	Collects what comes through one pipe, on the runner's thread.
+	"""
+	def __init__( self, onLine, onClosed ):
+		self.chunks = []
+		self.error = None
+		self._partial = b""
+		self._onLine = onLine
+		self._onClosed = onClosed
+
+
+	def data_received( self, data ):
+		if self._onLine is None:
+			self.chunks.append( data )
+			return
+
+		data = self._partial + data
+		start = 0
+		while True:
+			end = data.find( b"\n", start ) + 1
+			if not end:
+				break
+			self._onLine( data[start:end] )
+			start = end
+		self._partial = data[start:]
+
+
+	def connection_lost( self, exc ):
+		if self._partial:
+			self._onLine( self._partial )
+			self._partial = b""
+		self._onClosed( )
+
+
+	def Failed( self, error ):
+		#Called if the pipe couldn't be watched at all.
+		self.error = error
+		self._onClosed( )
+
+
+class ProcessRunner( object ):
+	"""
+	Event loop, on a thread of its own, that reads the output of running processes.
+	"""
+	def __init__( self ):
+		self._loop = asyncio.new_event_loop( )
+		self._thread = threading.Thread( target = self._runLoop, name = "csbuild-process-runner" )
+		self._thread.daemon = True
+		self._thread.start( )
+
+
+	def _runLoop( self ):
+		asyncio.set_event_loop( self._loop )
+		self._loop.run_forever( )
+
+
+	def Communicate( self, proc, onLine = None ):
+		"""
+		Wait for a process to close its stdout and stderr, collecting what it writes to them. Unlike
+		Popen.communicate(), this doesn't wait for the process to exit, so it can still be reaped by the caller. The
+		calling thread is blocked until then.
+
+		:param proc: Process started with stdout and stderr piped
+		:type proc: subprocess.Popen
+
+		:param onLine: If given, called on the runner's thread with each line as it arrives, and with whether it came
+			from stderr, instead of the output being collected
+		:type onLine: callable
+
+		:return: What the process wrote to stdout and stderr, which is empty if onLine was given
+		:rtype: tuple[bytes, bytes]
+		"""
+		done = threading.Event( )
+		remaining = [ 2 ]
+
+		def PipeClosed( ):
+			remaining[0] -= 1
+			if not remaining[0]:
+				done.set( )
+
+		readers = []
+		for isError in ( False, True ):
+			lineHandler = None
+			if onLine is not None:
+				lineHandler = lambda line, isError = isError: onLine( line, isError )
+			readers.append( _PipeReader( lineHandler, PipeClosed ) )
+
+		def Connected( task, reader ):
+			if not task.cancelled( ) and task.exception( ) is not None:
+				reader.Failed( task.exception( ) )
+
+		def Start( ):
+			for pipe, reader in zip( ( proc.stdout, proc.stderr ), readers ):
+				task = self._loop.create_task( self._loop.connect_read_pipe( lambda reader = reader: reader, pipe ) )
+				task.add_done_callback( lambda task, reader = reader: Connected( task, reader ) )
+
+		self._loop.call_soon_threadsafe( Start )
+		done.wait( )
+
+		for reader in readers:
+			if reader.error is not None:
+				raise reader.error
+		return b"".join( readers[0].chunks ), b"".join( readers[1].chunks )
+
+
+	def Close( self ):
+		"""
+		Stop the event loop. Nothing should still be reading through it.
+		"""
+		self._loop.call_soon_threadsafe( self._loop.stop )
+		self._thread.join( )
+		self._loop.close( )
+
+
+class SelectRunner( object ):
+	"""
+	Same as ProcessRunner, for Pythons without asyncio: one thread polls every pipe being read and reads whichever have
+	something to read.
+	"""
+	def __init__( self ):
+		self._lock = threading.Lock( )
+		self._added = []
+		self._closing = False
+		#Written to whenever pipes are added, to wake the loop up so it starts polling them too.
+		self._wakeRead, self._wakeWrite = os.pipe( )
+		self._thread = threading.Thread( target = self._runLoop, name = "csbuild-process-runner" )
+		self._thread.daemon = True
+		self._thread.start( )
+
+
+	def _wake( self ):
+		os.write( self._wakeWrite, b"x" )
+
+
+	def _runLoop( self ):
+		readers = { }
+		usePoll = hasattr( select, "poll" )
+		if usePoll:
+			poller = select.poll( )
+			poller.register( self._wakeRead, select.POLLIN )
+
+		while True:
+			with self._lock:
+				added = self._added
+				self._added = []
+				closing = self._closing
+			for fd, reader in added:
+				readers[fd] = reader
+				if usePoll:
+					poller.register( fd, select.POLLIN )
+			if closing and not readers:
+				return
+
+			try:
+				if usePoll:
+					ready = [ fd for fd, _ in poller.poll( ) ]
+				else:
+					ready = select.select( [ self._wakeRead ] + list( readers ), [], [] )[0]
+			except ( select.error, OSError, IOError ) as e:
+				if e.args[0] == errno.EINTR:
+					continue
+				raise
+
+			for fd in ready:
+				if fd == self._wakeRead:
+					os.read( fd, 4096 )
+					continue
+				try:
+					data = os.read( fd, 65536 )
+				except OSError as e:
+					if e.errno in ( errno.EINTR, errno.EAGAIN ):
+						continue
+					data = b""
+				reader = readers[fd]
+				try:
+					if data:
+						reader.data_received( data )
+						continue
+					del readers[fd]
+					if usePoll:
+						poller.unregister( fd )
+					reader.connection_lost( None )
+				except Exception:
+					#Nothing would ever report it from this thread, and the loop has to keep going for everyone else.
+					traceback.print_exc( )
+
+
+	def Communicate( self, proc, onLine = None ):
+		"""
+		See ProcessRunner.Communicate().
+		"""
+		done = threading.Event( )
+		remaining = [ 2 ]
+
+		def PipeClosed( ):
+			remaining[0] -= 1
+			if not remaining[0]:
+				done.set( )
+
+		readers = []
+		for isError in ( False, True ):
+			lineHandler = None
+			if onLine is not None:
+				lineHandler = lambda line, isError = isError: onLine( line, isError )
+			readers.append( _PipeReader( lineHandler, PipeClosed ) )
+
+		with self._lock:
+			self._added.append( ( proc.stdout.fileno( ), readers[0] ) )
+			self._added.append( ( proc.stderr.fileno( ), readers[1] ) )
+		self._wake( )
+		done.wait( )
+
+		proc.stdout.close( )
+		proc.stderr.close( )
+		return b"".join( readers[0].chunks ), b"".join( readers[1].chunks )
+
+
+	def Close( self ):
+		"""
+		Stop the loop. Nothing should still be reading through it.
+		"""
+		with self._lock:
+			self._closing = True
+		self._wake( )
+		self._thread.join( )
+		os.close( self._wakeRead )
+		os.close( self._wakeWrite )
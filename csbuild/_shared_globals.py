@@ -142,8 +142,26 @@ columns = terminfo.TermInfo.GetNumColumns( ) if color_supported else 0
 max_threads = multiprocessing.cpu_count( )
 max_linker_threads = max_threads
 
-semaphore = threading.BoundedSemaphore( value = max_threads )
-link_semaphore = threading.BoundedSemaphore( value = max_linker_threads )
+#Pool of max_threads worker threads that compiles are queued on, while a build is running (see _job_pool.py)
+job_pool = None
+#Whether -j auto is adjusting the job pool's limit to the system load (see _load_monitor.py)
+adaptive_jobs = False
+#Memory budget for running compiles, in bytes, or 0 for no limit
+max_memory = 0
+#Event loop that reads compiler and linker output, while a build is running, where supported (see _process_runner.py)
+process_runner = None
+#Graph of every project's build actions, run on job_pool, while a build is running (see _action_graph.py)
+action_graph = None
+#Pool of up to max_linker_threads threads that links are queued on, while a build is running. Only one link runs at a
+# time until compile threads start going idle.
+link_pool = None
+
+#Pools used to check whether files are up to date during task preparation.
+#Threads handle the stat-bound work, processes (when enabled) handle the CPU-bound scanning and hashing.
+dependency_check_threads = max_threads
+dependency_check_processes = 0
+dependency_check_pool = None
+dependency_scan_pool = None
 
 lock = threading.Lock( )
 
@@ -157,8 +175,14 @@ interrupted = False
 
 show_commands = False
 
-oldmd5s = { }
 newmd5s = { }
+#hashlib algorithm used to fingerprint file contents
+fingerprint_digest = "md5"
+
+#Local compile cache (see _compile_cache.py); size is in bytes
+compile_cache = False
+compile_cache_size = 5 * 1024 * 1024 * 1024
+compile_cache_url = None
 
 times = []
 
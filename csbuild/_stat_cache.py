@@ -0,0 +1,288 @@
+# Copyright (C) 2013 Jaedyn K. Draper
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Per-run cache of file stats.
+
+File discovery, chunking, recompile checks and linking all need the size, modification time or existence of the
+same files. Rather than each of them asking the OS again, they go through this cache, so each file is stat'ed once
+per build. Directory walks made through Walk() also record the entries they find, which on Windows already carry
+their stat information and elsewhere save a lookup by name.
+
+Anything csbuild writes or deletes during the build (objects, chunk files, link outputs) must be passed to
+Invalidate() afterward so the next lookup sees the new state.
+
+Normally the cache is cleared at the start of every run. Under the build daemon, the server keeps it between builds
+instead, for directories a file watcher is monitoring, and invalidates whatever the watcher reports as changed; see
+_file_watcher.
+
+Lookups and updates are single dict operations, so the cache can be used from the dependency check and build
+threads without a lock; at worst two threads stat the same file at once.
+"""
+
+import os
+
+try:
+	from os import scandir as _scandir
+except ImportError:
+	try:
+		from scandir import scandir as _scandir
+	except ImportError:
+		_scandir = None
+
+#Marker for paths known not to exist
+_MISSING = object( )
+
+#{ absolute path : os.stat_result or _MISSING }
+_stats = {}
+#{ absolute path : DirEntry } for files seen by Walk() but not yet stat'ed
+_entries = {}
+#{ absolute directory : ( dirnames, filenames, symlinked dirnames ) } for directories listed by Walk()
+_listings = {}
+#Absolute paths of every directory passed to Walk()
+_walkedRoots = set()
+
+
+def _key( path ):
+	return os.path.abspath( path )
+
+
+def Stat( path ):
+	"""
+	Get the stat of a file, following symlinks.
+
+	:param path: File to stat
+	:type path: str
+
+	:return: The stat result, or None if the file doesn't exist
+	:rtype: os.stat_result or None
+	"""
+	key = _key( path )
+	result = _stats.get( key )
+	if result is None:
+		entry = _entries.pop( key, None )
+		try:
+			if entry is not None:
+				result = entry.stat( )
+			else:
+				result = os.stat( key )
+		except OSError:
+			result = _MISSING
+		_stats[key] = result
+	if result is _MISSING:
+		return None
+	return result
+
+
+def Exists( path ):
+	"""
+	:param path: File to check
+	:type path: str
+
+	:return: Whether the file exists
+	:rtype: bool
+	"""
+	return Stat( path ) is not None
+
+
+def GetMtime( path ):
+	"""
+	Drop-in replacement for os.path.getmtime().
+
+	:param path: File to check
+	:type path: str
+
+	:return: Modification time of the file
+	:rtype: float
+
+	:raises OSError: If the file doesn't exist
+	"""
+	result = Stat( path )
+	if result is None:
+		raise OSError( "No such file: {}".format( path ) )
+	return result.st_mtime
+
+
+def GetSize( path ):
+	"""
+	Drop-in replacement for os.path.getsize().
+
+	:param path: File to check
+	:type path: str
+
+	:return: Size of the file in bytes
+	:rtype: int
+
+	:raises OSError: If the file doesn't exist
+	"""
+	result = Stat( path )
+	if result is None:
+		raise OSError( "No such file: {}".format( path ) )
+	return result.st_size
+
+
+def Invalidate( path ):
+	"""
+	Forget what's known about a file. Must be called whenever csbuild creates, modifies or deletes a file that may
+	already have been looked up.
+
+	:param path: File that has changed
+	:type path: str
+	"""
+	key = _key( path )
+	_stats.pop( key, None )
+	_entries.pop( key, None )
+	#The file may have been created or deleted, so the listing of its directory may be out of date as well.
+	_listings.pop( os.path.dirname( key ), None )
+	_listings.pop( key, None )
+
+
+def InvalidateTree( directory ):
+	"""
+	Forget what's known about a directory and everything under it, such as after it's been deleted or moved.
+
+	:param directory: Directory that has changed
+	:type directory: str
+	"""
+	key = _key( directory )
+	prefix = os.path.join( key, "" )
+	for cache in ( _stats, _entries, _listings ):
+		for path in [ path for path in cache if path.startswith( prefix ) ]:
+			del cache[path]
+	Invalidate( key )
+
+
+def Clear( ):
+	"""
+	Forget everything. Called at the start of each run, and after anything that touches many files at once.
+	"""
+	_stats.clear( )
+	_entries.clear( )
+	_listings.clear( )
+	_walkedRoots.clear( )
+
+
+def GetWalkedRoots( ):
+	"""
+	:return: Absolute paths of every directory walked with Walk() since the cache was last cleared
+	:rtype: set[str]
+	"""
+	return set( _walkedRoots )
+
+
+def GetSnapshot( ):
+	"""
+	Get everything currently known, in a form that can be pickled and handed to another process.
+
+	:return: ( { path : stat result or None }, { directory : listing } )
+	:rtype: tuple
+	"""
+	stats = dict( ( path, None if result is _MISSING else result ) for path, result in _stats.items( ) )
+	return stats, dict( _listings )
+
+
+def ApplySnapshot( snapshot, directories ):
+	"""
+	Merge in what another process learned, keeping only files and listings within the given directories. Anything
+	already known is left alone, since it may be more recent. Symlinks are skipped, since their targets may live
+	anywhere.
+
+	:param snapshot: As returned by GetSnapshot()
+	:type snapshot: tuple
+
+	:param directories: Absolute paths of the directories whose contents can be trusted
+	:type directories: set[str]
+	"""
+	stats, listings = snapshot
+	for path, result in stats.items( ):
+		if path in _stats or os.path.dirname( path ) not in directories:
+			continue
+		if result is not None and os.path.islink( path ):
+			continue
+		_stats[path] = _MISSING if result is None else result
+	for directory, listing in listings.items( ):
+		if directory not in _listings and directory in directories:
+			_listings[directory] = listing
+
+
+def Walk( top ):
+	"""
+	Drop-in replacement for os.walk( top ), top-down and not following directory symlinks. Every file found is
+	recorded so that later lookups of it don't need to go back to the OS by name. As with os.walk, removing entries
+	from the yielded directory list prevents them from being visited.
+
+	:param top: Directory to walk
+	:type top: str
+
+	:return: Generator of ( root, dirnames, filenames )
+	:rtype: generator
+	"""
+	if _scandir is None:
+		for result in os.walk( top ):
+			yield result
+		return
+
+	_walkedRoots.add( _key( top ) )
+	pending = [ top ]
+	while pending:
+		root = pending.pop( )
+		absroot = _key( root )
+		listing = _listings.get( absroot )
+		if listing is not None:
+			dirnames = list( listing[0] )
+			filenames = list( listing[1] )
+			symlinks = listing[2]
+		else:
+			dirnames = []
+			filenames = []
+			symlinks = set( )
+			try:
+				#Scanned by absolute path, so the entries' own stat() still works after the working directory changes.
+				entries = list( _scandir( absroot ) )
+			except OSError:
+				continue
+
+			for entry in entries:
+				try:
+					isDir = entry.is_dir( )
+				except OSError:
+					isDir = False
+				if isDir:
+					dirnames.append( entry.name )
+					try:
+						if entry.is_symlink( ):
+							symlinks.add( entry.name )
+					except OSError:
+						pass
+				else:
+					filenames.append( entry.name )
+					path = os.path.join( absroot, entry.name )
+					if path not in _stats:
+						_entries[path] = entry
+
+			_listings[absroot] = ( tuple( dirnames ), tuple( filenames ), frozenset( symlinks ) )
+
+		yield root, dirnames, filenames
+
+		#Push in reverse so subdirectories are visited in listing order, as os.walk does.
+		for name in reversed( dirnames ):
+			if name not in symlinks:
+				pending.append( os.path.join( root, name ) )
+
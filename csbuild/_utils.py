@@ -18,6 +18,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import errno
 import os
 import re
 import hashlib
@@ -32,6 +33,9 @@ import traceback
 import platform
 import collections
 import contextlib
+import mmap
+import signal
+import struct
 if sys.version_info >= (3,0):
 	import io
 	StringIO = io.StringIO
@@ -39,9 +43,17 @@ else:
 	import cStringIO
 	StringIO = cStringIO.StringIO
 
+if sys.version_info < (3,0):
+	import cPickle as pickle
+	import Queue
+else:
+	import pickle
+	import queue as Queue
+
 import csbuild
 from . import log
 from . import _shared_globals
+from . import _stat_cache
 
 class OrderedSet(object):
 	def __init__(self, iterable=None):
@@ -177,35 +189,371 @@ def GetMd5( inFile ):
 		return hashlib.md5( RemoveWhitespace( remove_comments( inFile.read( ) ) ) ).digest( )
 
 
+_FINGERPRINT_BLOCK_SIZE = 256 * 1024
+
+
+def _hashBlocks( hasher, view, start, end, normalizeNewlines ):
+	#Feed a stretch of the file to the hasher in fixed-size blocks, normalizing line endings along the way.
+	while start < end:
+		blockEnd = min( start + _FINGERPRINT_BLOCK_SIZE, end )
+		if normalizeNewlines:
+			#Don't split a \r\n pair across two blocks.
+			if blockEnd < end and view[blockEnd-1:blockEnd] == b"\r":
+				blockEnd += 1
+			hasher.update( bytes( view[start:blockEnd] ).replace( b"\r\n", b"\n" ).replace( b"\r", b"\n" ) )
+		else:
+			hasher.update( view[start:blockEnd] )
+		start = blockEnd
+
+
+def HashWithoutComments( hasher, data, size ):
+	"""
+	Feed the contents of a C/C++ source buffer to a hasher with all comments removed, so that comment-only changes
+	don't change the result. String and character literals are left intact, and comments inside them are not treated
+	as comments. The hasher sees the same stream remove_comments() produces, but the buffer is never decoded or copied
+	into an intermediate string; the text between comments is handed to the hasher directly.
+
+	:param hasher: A hashlib object
+	:type hasher: hashlib hash
+
+	:param data: The file contents, as bytes or an mmap
+	:type data: bytes or mmap.mmap
+
+	:param size: Length of data
+	:type size: int
+	"""
+	if sys.version_info >= (3, 0):
+		view = memoryview( data )
+	else:
+		view = buffer( data ) #pylint: disable=undefined-variable
+
+	find = data.find
+	#remove_comments() sees text read with universal newlines, so a lone \r ends a line comment too.
+	normalizeNewlines = find( b"\r" ) != -1
+
+	try:
+		#Position of the next occurrence of each character that can start a comment or a literal, or size if there
+		#are no more. Each is only searched for again once the scan has moved past it, so every stretch of plain code
+		#is skipped over by a single find() rather than examined a character at a time.
+		nextSlash = find( b"/" )
+		if nextSlash == -1:
+			nextSlash = size
+		nextDoubleQuote = find( b'"' )
+		if nextDoubleQuote == -1:
+			nextDoubleQuote = size
+		nextSingleQuote = find( b"'" )
+		if nextSingleQuote == -1:
+			nextSingleQuote = size
+
+		emitFrom = 0
+		pos = 0
+		while True:
+			if nextSlash < pos:
+				nextSlash = find( b"/", pos )
+				if nextSlash == -1:
+					nextSlash = size
+			if nextDoubleQuote < pos:
+				nextDoubleQuote = find( b'"', pos )
+				if nextDoubleQuote == -1:
+					nextDoubleQuote = size
+			if nextSingleQuote < pos:
+				nextSingleQuote = find( b"'", pos )
+				if nextSingleQuote == -1:
+					nextSingleQuote = size
+
+			pos = nextSlash
+			if nextDoubleQuote < pos:
+				pos = nextDoubleQuote
+			if nextSingleQuote < pos:
+				pos = nextSingleQuote
+			if pos >= size:
+				break
+
+			if pos == nextSlash:
+				following = data[pos+1:pos+2]
+				if following == b"/":
+					end = find( b"\n", pos + 2 )
+					if end == -1:
+						end = size
+					if normalizeNewlines:
+						carriageReturn = find( b"\r", pos + 2, end )
+						if carriageReturn != -1:
+							end = carriageReturn
+					_hashBlocks( hasher, view, emitFrom, pos, normalizeNewlines )
+					emitFrom = pos = end
+				elif following == b"*":
+					end = find( b"*/", pos + 2 )
+					if end == -1:
+						pos += 1
+					else:
+						_hashBlocks( hasher, view, emitFrom, pos, normalizeNewlines )
+						emitFrom = pos = end + 2
+				else:
+					pos += 1
+			else:
+				#A quote only closes the literal if it's preceded by an even number of backslashes.
+				#Unterminated literals are treated as plain code.
+				quote = data[pos:pos+1]
+				start = pos
+				while True:
+					pos = find( quote, pos + 1 )
+					if pos == -1:
+						pos = start + 1
+						break
+					check = pos - 1
+					while check > start and data[check:check+1] == b"\\":
+						check -= 1
+					if ( pos - 1 - check ) % 2 == 0:
+						pos += 1
+						break
+
+		_hashBlocks( hasher, view, emitFrom, size, normalizeNewlines )
+	finally:
+		if sys.version_info >= (3, 0):
+			view.release( )
+
+
+def GetFileFingerprint( path ):
+	"""
+	Hash the contents of a file on disk, ignoring comments. The file is mapped into memory rather than read, and
+	hashed with the digest selected by --fingerprint-digest.
+
+	:param path: File to hash
+	:type path: str
+
+	:return: The digest
+	:rtype: bytes
+	"""
+	hasher = hashlib.new( _shared_globals.fingerprint_digest )
+	with open( path, "rb" ) as f:
+		size = os.fstat( f.fileno( ) ).st_size
+		if size == 0:
+			return hasher.digest( )
+		data = mmap.mmap( f.fileno( ), 0, access = mmap.ACCESS_READ )
+		try:
+			HashWithoutComments( hasher, data, size )
+		finally:
+			data.close( )
+	return hasher.digest( )
+
+
+def RunScanTask( func, *args ):
+	"""
+	Run a CPU-bound scanning or hashing function, handing it off to the dependency scan process pool
+	when one is active so that threads checking dependencies in parallel aren't serialized on the GIL.
+	func must be a module-level function so it can be sent to the worker processes.
+
+	:param func: Function to run
+	:type func: callable
+
+	:return: Whatever func returns
+	"""
+	pool = _shared_globals.dependency_scan_pool
+	if pool is not None and pool.CanRun( func ):
+		return pool.Run( func, *args )
+	return func( *args )
+
+
+class ScanProcessPool( object ):
+	"""
+	A small pool of forked worker processes for CPU-bound scanning and hashing work.
+
+	multiprocessing.Pool can't be used for this, since it pickles functions by reference to their module, which means
+	importing csbuild - and that deadlocks while the makefile is still in the middle of importing it. Instead, the
+	functions the workers may run are registered up front and requested by name, so only plain data crosses the pipes.
+	Any thread may call Run(); each call borrows an idle worker for the duration of the call.
+	"""
+	def __init__( self, numProcesses, functions ):
+		"""
+		:param numProcesses: Number of worker processes to fork
+		:type numProcesses: int
+
+		:param functions: Functions the workers are allowed to run
+		:type functions: list[callable]
+		"""
+		self.functions = { }
+		for func in functions:
+			self.functions[func.__name__] = func
+		self.workers = []
+		self.idleWorkers = Queue.Queue( )
+
+		for _ in range( numProcesses ):
+			requestRead, requestWrite = os.pipe( )
+			responseRead, responseWrite = os.pipe( )
+			pid = os.fork( )
+			if pid == 0:
+				os.close( requestWrite )
+				os.close( responseRead )
+				#Don't hold on to the other workers' pipes, or they'll never see their request pipe close.
+				for worker in self.workers:
+					worker[1].close( )
+					worker[2].close( )
+				self._serve( os.fdopen( requestRead, "rb" ), os.fdopen( responseWrite, "wb" ) )
+			os.close( requestRead )
+			os.close( responseWrite )
+			worker = ( pid, os.fdopen( requestWrite, "wb" ), os.fdopen( responseRead, "rb" ) )
+			self.workers.append( worker )
+			self.idleWorkers.put( worker )
+
+
+	@staticmethod
+	def _send( pipe, data ):
+		data = pickle.dumps( data, 2 )
+		pipe.write( struct.pack( "!I", len( data ) ) )
+		pipe.write( data )
+		pipe.flush( )
+
+
+	@staticmethod
+	def _receive( pipe ):
+		header = pipe.read( 4 )
+		if len( header ) < 4:
+			return None
+		size = struct.unpack( "!I", header )[0]
+		return pickle.loads( pipe.read( size ) )
+
+
+	def _serve( self, requests, responses ):
+		#Worker process main loop. The parent handles ctrl+c; workers just exit once their request pipe closes.
+		signal.signal( signal.SIGINT, signal.SIG_IGN )
+		try:
+			while True:
+				request = self._receive( requests )
+				if request is None:
+					break
+				name, args = request
+				try:
+					response = ( True, self.functions[name]( *args ) )
+				except Exception as e:
+					response = ( False, "{}: {}".format( type( e ).__name__, e ) )
+				self._send( responses, response )
+		finally:
+			os._exit( 0 )
+
+
+	def CanRun( self, func ):
+		return self.functions.get( func.__name__ ) is func
+
+
+	def Run( self, func, *args ):
+		"""
+		Run a registered function in one of the worker processes and return its result.
+		"""
+		worker = self.idleWorkers.get( )
+		try:
+			self._send( worker[1], ( func.__name__, args ) )
+			response = self._receive( worker[2] )
+		finally:
+			self.idleWorkers.put( worker )
+
+		if response is None:
+			raise RuntimeError( "Dependency scan worker process {} exited unexpectedly".format( worker[0] ) )
+		success, result = response
+		if not success:
+			raise RuntimeError( "{} failed in dependency scan worker: {}".format( func.__name__, result ) )
+		return result
+
+
+	def Close( self ):
+		"""
+		Shut down all of the worker processes.
+		"""
+		for pid, requests, responses in self.workers:
+			requests.close( )
+			responses.close( )
+			os.waitpid( pid, 0 )
+		self.workers = []
+
+
+def CommunicateWithPeakMemory( proc, onLine = None ):
+	"""
+	Collect everything a process prints and wait for it to exit, like Popen.communicate(), and also find out the most
+	memory it used. The process is reaped with os.wait4(), which reports its resource usage along with its exit status;
+	where that's not available, it's just waited for normally.
+
+	While a build is running, the output is read by the process runner (see _process_runner.py) where it's supported,
+	rather than by threads of this process's own. That's everywhere but Windows, where the pipes can't be polled
+	together, so they're read the way Popen.communicate() reads them, with one extra thread for stderr.
+
+	:param proc: Process started with stdout and stderr piped
+	:type proc: subprocess.Popen
+
+	:param onLine: If given, called with each line of output as it arrives, and with whether it came from stderr,
+		instead of the output being collected. Only supported while the process runner is.
+	:type onLine: callable
+
+	:return: What it wrote to stdout and stderr, and its peak resident memory in bytes, or None if that couldn't be
+		measured
+	:rtype: tuple[bytes, bytes, int or None]
+	"""
+	runner = _shared_globals.process_runner
+	if runner is not None:
+		outData, errData = runner.Communicate( proc, onLine )
+		if not hasattr( os, "wait4" ):
+			proc.wait( )
+			return outData, errData, None
+	elif not hasattr( os, "wait4" ):
+		outData, errData = proc.communicate( )
+		return outData, errData, None
+	else:
+		errors = []
+		errorThread = threading.Thread( target = lambda: errors.append( proc.stderr.read( ) ) )
+		errorThread.start( )
+		outData = proc.stdout.read( )
+		errorThread.join( )
+		proc.stdout.close( )
+		proc.stderr.close( )
+		errData = errors[0]
+
+	while True:
+		try:
+			_, status, usage = os.wait4( proc.pid, 0 )
+			break
+		except OSError as e:
+			if e.errno == errno.EINTR:
+				continue
+			if e.errno != errno.ECHILD:
+				raise
+			#Already reaped, most likely because csbuild is exiting and killed it.
+			proc.wait( )
+			return outData, errData, None
+
+	if os.WIFSIGNALED( status ):
+		proc.returncode = -os.WTERMSIG( status )
+	else:
+		proc.returncode = os.WEXITSTATUS( status )
+
+	#ru_maxrss is in bytes on macOS and kilobytes everywhere else.
+	peakMemory = usage.ru_maxrss
+	if platform.system( ) != "Darwin":
+		peakMemory *= 1024
+	return outData, errData, peakMemory
+
+
 def GetSize( chunk ):
 	size = 0
 	if type( chunk ) == list:
 		for source in chunk:
-			size += os.path.getsize( source )
+			size += _stat_cache.GetSize( source )
 		return size
 	else:
-		return os.path.getsize( chunk )
+		return _stat_cache.GetSize( chunk )
 
 
-class ThreadedBuild( threading.Thread ):
-	"""Multithreaded build system, launches a new thread to run the compiler in.
-	Uses a threading.BoundedSemaphore object to keep the number of threads equal to the number of processors on the
-	machine.
+class ThreadedBuild( object ):
+	"""Compiles a single translation unit. run() is called on one of the build job pool's worker threads, which keeps
+	the number of compiles running at once to the number of processors on the machine.
 	"""
 
 
 	def __init__( self, infile, inobj, proj, forPrecompiledHeader = False ):
-		"""Initialize the object. Also handles above-mentioned bug with dummy threads."""
-		threading.Thread.__init__( self )
 		self.file = os.path.normcase(infile)
 
 		self.originalIn = self.file
 		self.obj = os.path.abspath( inobj )
 		self.project = proj
 		self.forPrecompiledHeader = forPrecompiledHeader
-		#Prevent certain versions of python from choking on dummy threads.
-		if not hasattr( threading.Thread, "_Thread__block" ):
-			threading.Thread._Thread__block = _shared_globals.dummy_block( )
+		self.peakMemory = None
 
 
 	def run( self ):
@@ -362,8 +710,35 @@ class ThreadedBuild( threading.Thread ):
 			self.project.compileCommands[self.originalIn] = cmd
 			if _shared_globals.show_commands:
 				print(cmd)
-			if os.access(self.obj , os.F_OK):
+
+			compiler = self.project.activeToolchain.Compiler()
+			cacheEntry = None
+			if csbuild._compile_cache.IsEnabled( ) and not self.forPrecompiledHeader and not _shared_globals.profile:
+				cacheEntry = csbuild._compile_cache.Lookup(
+					compiler,
+					cmd,
+					compiler.GetCachePreprocessCommand( baseCommand, project, inc, os.path.abspath( self.file ) ),
+					os.path.abspath( self.file ),
+					self.obj,
+					self.project.workingDirectory,
+					toolchainEnv,
+					not self.project._hasNewHeaders
+				)
+				if cacheEntry is not None and cacheEntry.Restore( ):
+					self._recordDependencies( compiler )
+
+					with self.project.mutex:
+						self.project.compileOutput[self.originalIn] = ""
+						self.project.compileErrors[self.originalIn] = ""
+						self.project.fileStatus[self.originalIn] = _shared_globals.ProjectState.FINISHED
+						self.project.compilationCompleted += 1
+						self.project.fileEnd[self.originalIn] = time.time()
+						self.project.updated = True
+					return
+
+			if _stat_cache.Exists( self.obj ):
 				os.remove( self.obj )
+				_stat_cache.Invalidate( self.obj )
 
 			class StringRef(object):
 				def __init__(self):
@@ -371,139 +746,41 @@ class ThreadedBuild( threading.Thread ):
 
 			errors = StringRef()
 			output = StringRef()
-			if platform.system() != "Windows":
-				cmd = shlex.split(cmd)
-
-			maxNumRetries = 10
-			retryCount = 0
-
-			while retryCount < maxNumRetries:
-				try:
-					fd = subprocess.Popen( cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = self.project.workingDirectory, env = toolchainEnv )
-				except PermissionError:
-					# Sleep for a second before trying again.
-					time.sleep(1)
-					retryCount += 1
-				except:
-					# Other exceptions will raise normally.
-					raise
-				else:
-					# Successfully launched the process.
-					break
-
-			assert retryCount < maxNumRetries, "Failed to launch process due to PermissionError"
-
-			with _shared_globals.spmutex:
-				_shared_globals.subprocesses[self.obj] = fd
-
-			running = True
-
-			times = {}
-			lastTimes = {}
-
-			if platform.system() == "Windows":
-				timeFunc = time.clock
-			else:
-				timeFunc = time.time
-
-			sanitation_lines = self.project.activeToolchain.Compiler().GetPostPreprocessorSanitationLines()
-			ansi_escape = re.compile(r'\x1b[^m]*m')
-
-			summedTimes = {}
-
-			def GatherData(pipe, buffer):
-				while running:
-					try:
-						line = pipe.readline()
-					except IOError as e:
-						continue
-					if not line:
-						break
-
-					if sys.version_info >= (3, 0):
-						line = line.decode("utf-8");
-
-					stripped = line.strip()
-					baseFile = os.path.basename(self.file)
-					if stripped == baseFile:
-						continue
-					if not " " in stripped:
-						baseStripped = stripped.rsplit(".",1)[0]
-						baseFile = baseFile.rsplit(".", 1)[0]
-						if baseStripped == baseFile:
-							continue
-
-					if _shared_globals.profile:
-						sanitized = False
-						for sanitationLine in sanitation_lines:
-							if stripped == sanitationLine:
-								sanitized = True
-								break
-						if sanitized:
-							continue
-
-						if "CSBPF" in line:
-							sub = re.sub(ansi_escape, '', line)
-							split = sub.split("[")
-							file = reverseIndexes[int(split[1].split("]")[0])]
-							lineNo = int(split[2].split("]")[0]) - 1
-							now = timeFunc()
-							if file in lastTimes:
-								if file not in times:
-									times[file] = {}
-								if lineNo not in times[file]:
-									times[file][lineNo] = 0
-								times[file][lineNo] += now - lastTimes[file]
-							else:
-								summedTimes[file] = 0
-							lastTimes[file] = now
-							continue
-
-						if "CSBPL" in line:
-							sub = re.sub(ansi_escape, '', line)
-							split = sub.split("[")
-							file = reverseIndexes[int(split[1].split("]")[0])]
-							lineNo = int(split[2].split("]")[0])
-							if file not in times:
-								times[file] = {}
-							if lineNo not in times[file]:
-								times[file][lineNo] = 0
-							now = timeFunc()
-							times[file][lineNo] += now - lastTimes[file]
-							summedTimes[file] += now - lastTimes[file]
-							lastTimes[file] = now
-							continue
-
-					buffer.str += line
-
-			outputThread = threading.Thread(target=GatherData, args=(fd.stdout, output))
-			errorThread = threading.Thread(target=GatherData, args=(fd.stderr, errors))
 
-			outputThread.start()
-			errorThread.start()
-
-			fd.wait()
-
-			running = False
-
-			outputThread.join()
-			errorThread.join()
-
-			with _shared_globals.spmutex:
-				del _shared_globals.subprocesses[self.obj]
-				if _shared_globals.exiting:
-					#Don't bother with the rest, we're killing everything early.
-					return
-
-			with self.project.mutex:
-				self.project.times[self.originalIn] = times
-				for file in summedTimes:
-					if file in self.project.summedTimes:
-						self.project.summedTimes[file] += summedTimes[file]
-					else:
-						self.project.summedTimes[file] = summedTimes[file]
+			ret = None
+			worker = None
+			remoteCmd = None
+			if csbuild._distributed.IsEnabled( ) and not self.forPrecompiledHeader and not _shared_globals.profile:
+				remoteCmd = compiler.GetRemoteCompileCommand( baseCommand, project, os.path.abspath( self.file ),
+					csbuild._distributed.REMOTE_SOURCE_NAME, csbuild._distributed.REMOTE_OBJECT_NAME )
+				if remoteCmd is not None:
+					worker = csbuild._distributed.AcquireSlot( )
+			try:
+				if worker is not None:
+					result = csbuild._distributed.Compile(
+						worker,
+						compiler.GetCachePreprocessCommand( baseCommand, project, inc, os.path.abspath( self.file ), self.obj ),
+						remoteCmd,
+						self.obj,
+						self.project.workingDirectory,
+						toolchainEnv
+					)
+					if result is not None:
+						ret, output.str, errors.str = result
+					elif not _shared_globals.exiting:
+						#Compiled here after all, so trade the worker's slot for a local one.
+						csbuild._distributed.ReleaseSlot( worker )
+						worker = csbuild._distributed.AcquireSlot( localOnly = True )
+				if ret is None and not _shared_globals.exiting:
+					ret = self._runCompiler( cmd, toolchainEnv, reverseIndexes, output, errors )
+			finally:
+				if remoteCmd is not None:
+					csbuild._distributed.ReleaseSlot( worker )
+			if ret is None:
+				#Don't bother with the rest, we're killing everything early.
+				return
 
-			ret = fd.returncode
+			_stat_cache.Invalidate( self.obj )
 
 			output.str = output.str.replace("\r", "")
 			errors.str = errors.str.replace("\r", "")
@@ -513,6 +790,7 @@ class ThreadedBuild( threading.Thread ):
 			sys.stdout.flush()
 			sys.stderr.flush()
 
+			ansi_escape = re.compile(r'\x1b[^m]*m')
 			with self.project.mutex:
 				stripped_errors = re.sub(ansi_escape, '', errors.str)
 				self.project.compileOutput[self.originalIn] = output.str
@@ -566,17 +844,19 @@ class ThreadedBuild( threading.Thread ):
 				self.project.updated = True
 				self.project.compilationCompleted += 1
 				self.project.mutex.release( )
-				_shared_globals.semaphore.release( )
 				return
+
+			if not _shared_globals.profile:
+				self._recordDependencies( compiler )
+
+			#Only clean compiles are cached, so a cache hit never hides a warning.
+			if cacheEntry is not None and not output.str.strip() and not errors.str.strip():
+				cacheEntry.Store( )
 		except Exception as e:
-			#If we don't do this with ALL exceptions, any unhandled exception here will cause the semaphore to never
-			# release...
-			#Meaning the build will hang. And for whatever reason ctrl+c won't fix it.
-			#ABSOLUTELY HAVE TO release the semaphore on ANY exception.
+			#If we don't do this with ALL exceptions, the project will never be counted as finished and the build
+			# will hang waiting on it.
 			#if os.path.dirname(self.originalIn) == _csbuildDir:
 			#   os.remove(self.originalIn)
-			_shared_globals.semaphore.release( )
-
 			self.project.mutex.acquire( )
 			self.project.compilationFailed = True
 			self.project.compilationCompleted += 1
@@ -585,7 +865,6 @@ class ThreadedBuild( threading.Thread ):
 			self.project.updated = True
 			self.project.mutex.release( )
 
-			traceback.print_exc()
 			raise e
 		else:
 			#if os.path.dirname(self.originalIn) == _csbuildDir:
@@ -596,14 +875,185 @@ class ThreadedBuild( threading.Thread ):
 			#_shared_globals.times.append( endtime - starttime )
 			#_shared_globals.sgmutex.release( )
 
-			_shared_globals.semaphore.release( )
-
 			self.project.mutex.acquire( )
 			self.project.compilationCompleted += 1
 			self.project.fileEnd[self.originalIn] = time.time()
 			self.project.updated = True
 			self.project.mutex.release( )
 
+			#Cache hits and failed compiles return before getting here, so only real compiles are recorded.
+			sources = None
+			if not self.forPrecompiledHeader:
+				sources = self.project.chunksByFile.get( self.originalIn, [ self.originalIn ] )
+			csbuild._build_history.RecordCompile( self.obj, time.time( ) - starttime, self.peakMemory, sources )
+
+
+	def _runCompiler( self, cmd, toolchainEnv, reverseIndexes, output, errors ):
+		"""Run the compiler locally, collecting what it prints. Returns its exit code, or None if csbuild is exiting."""
+		if platform.system() != "Windows":
+			cmd = shlex.split(cmd)
+
+		maxNumRetries = 10
+		retryCount = 0
+
+		while retryCount < maxNumRetries:
+			try:
+				fd = subprocess.Popen( cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE, cwd = self.project.workingDirectory, env = toolchainEnv )
+			except PermissionError:
+				# Sleep for a second before trying again.
+				time.sleep(1)
+				retryCount += 1
+			except:
+				# Other exceptions will raise normally.
+				raise
+			else:
+				# Successfully launched the process.
+				break
+
+		assert retryCount < maxNumRetries, "Failed to launch process due to PermissionError"
+
+		with _shared_globals.spmutex:
+			_shared_globals.subprocesses[self.obj] = fd
+
+		running = True
+
+		times = {}
+		lastTimes = {}
+
+		if platform.system() == "Windows":
+			timeFunc = time.clock
+		else:
+			timeFunc = time.time
+
+		sanitation_lines = self.project.activeToolchain.Compiler().GetPostPreprocessorSanitationLines()
+		ansi_escape = re.compile(r'\x1b[^m]*m')
+
+		summedTimes = {}
+
+		def HandleLine(line, buffer):
+			stripped = line.strip()
+			baseFile = os.path.basename(self.file)
+			if stripped == baseFile:
+				return
+			if not " " in stripped:
+				baseStripped = stripped.rsplit(".",1)[0]
+				baseFile = baseFile.rsplit(".", 1)[0]
+				if baseStripped == baseFile:
+					return
+
+			if _shared_globals.profile:
+				sanitized = False
+				for sanitationLine in sanitation_lines:
+					if stripped == sanitationLine:
+						sanitized = True
+						break
+				if sanitized:
+					return
+
+				if "CSBPF" in line:
+					sub = re.sub(ansi_escape, '', line)
+					split = sub.split("[")
+					file = reverseIndexes[int(split[1].split("]")[0])]
+					lineNo = int(split[2].split("]")[0]) - 1
+					now = timeFunc()
+					if file in lastTimes:
+						if file not in times:
+							times[file] = {}
+						if lineNo not in times[file]:
+							times[file][lineNo] = 0
+						times[file][lineNo] += now - lastTimes[file]
+					else:
+						summedTimes[file] = 0
+					lastTimes[file] = now
+					return
+
+				if "CSBPL" in line:
+					sub = re.sub(ansi_escape, '', line)
+					split = sub.split("[")
+					file = reverseIndexes[int(split[1].split("]")[0])]
+					lineNo = int(split[2].split("]")[0])
+					if file not in times:
+						times[file] = {}
+					if lineNo not in times[file]:
+						times[file][lineNo] = 0
+					now = timeFunc()
+					times[file][lineNo] += now - lastTimes[file]
+					summedTimes[file] += now - lastTimes[file]
+					lastTimes[file] = now
+					return
+
+			buffer.str += line
+
+		def GatherData(pipe, buffer):
+			while running:
+				try:
+					line = pipe.readline()
+				except IOError as e:
+					continue
+				if not line:
+					break
+
+				if sys.version_info >= (3, 0):
+					line = line.decode("utf-8");
+
+				HandleLine(line, buffer)
+
+		if _shared_globals.profile and _shared_globals.process_runner is not None:
+			#Profiling times each line as the compiler prints it, so lines are handled as they arrive.
+			def LineReceived(line, isError):
+				HandleLine(line.decode("utf-8"), errors if isError else output)
+
+			_, _, self.peakMemory = CommunicateWithPeakMemory( fd, LineReceived )
+		elif _shared_globals.profile:
+			#Without the runner, the pipes have to be read by threads of their own while it runs.
+			outputThread = threading.Thread(target=GatherData, args=(fd.stdout, output))
+			errorThread = threading.Thread(target=GatherData, args=(fd.stderr, errors))
+
+			outputThread.start()
+			errorThread.start()
+
+			fd.wait()
+
+			running = False
+
+			outputThread.join()
+			errorThread.join()
+		else:
+			outData, errData, self.peakMemory = CommunicateWithPeakMemory( fd )
+			for data, buffer in ((outData, output), (errData, errors)):
+				if sys.version_info >= (3, 0):
+					data = data.decode("utf-8")
+				for line in data.splitlines(True):
+					HandleLine(line, buffer)
+
+		with _shared_globals.spmutex:
+			del _shared_globals.subprocesses[self.obj]
+			if _shared_globals.exiting:
+				#Don't bother with the rest, we're killing everything early.
+				return
+
+		with self.project.mutex:
+			self.project.times[self.originalIn] = times
+			for file in summedTimes:
+				if file in self.project.summedTimes:
+					self.project.summedTimes[file] += summedTimes[file]
+				else:
+					self.project.summedTimes[file] = summedTimes[file]
+
+		return fd.returncode
+
+
+	def _recordDependencies( self, compiler ):
+		"""Record the headers the compiler reported reading, if it writes dependency files."""
+		if not compiler.SupportsDependencyFiles():
+			return
+		depFile = compiler.GetDependencyFile( self.obj )
+		if os.access( depFile, os.F_OK ):
+			csbuild._header_cache.SetDependencies(
+				self.obj,
+				csbuild._header_cache.ParseDependencyFile( depFile, self.project.workingDirectory )
+			)
+
 
 def BaseNames( l ):
 	ret = []
@@ -739,7 +1189,12 @@ def PreparePrecompiles( ):
 			obj = project.activeToolchain.Compiler().GetPchFile( headerfile )
 
 			precompile = False
-			if not os.access(headerfile, os.F_OK ) or project.should_recompile( headerfile, obj, True ):
+			if not _stat_cache.Exists( headerfile ) or project.should_recompile( headerfile, obj, True ):
+				precompile = True
+			elif project.autoPrecompile and csbuild._auto_pch.GetPreviousHeaders( headerfile ) != [
+				os.path.abspath( header ) for header in allheaders if header not in precompileExcludeFiles
+			]:
+				log.LOG_INFO( "Going to recompile {0} because the headers chosen to precompile have changed.".format( headerfile ) )
 				precompile = True
 			else:
 				for header in allheaders:
@@ -750,6 +1205,13 @@ def PreparePrecompiles( ):
 			if not precompile:
 				return False, headerfile
 
+			pchIncludes = set( )
+			for header in allheaders:
+				if header not in precompileExcludeFiles:
+					pchIncludes.add( header )
+					project.follow_headers( header, pchIncludes )
+			project._scannedIncludes[headerfile] = pchIncludes
+
 			with open( headerfile, "w" ) as f:
 				for header in allheaders:
 					if header in precompileExcludeFiles:
@@ -761,7 +1223,7 @@ def PreparePrecompiles( ):
 					if header in project.cHeaders:
 						isPlainC = True
 					else:
-						extension = "." + header.rsplit(".", 1)[1]
+						extension = os.path.splitext( header )[1]
 						if extension in project.cHeaderExtensions:
 							isPlainC = True
 						elif extension in project.ambiguousHeaderExtensions and not project.hasCppFiles:
@@ -777,9 +1239,22 @@ def PreparePrecompiles( ):
 						project.cPchContents.append( header )
 					if externed:
 						f.write( "}\n" )
+			_stat_cache.Invalidate( headerfile )
 			return True, headerfile
 
 
+		if project.autoPrecompile:
+			project.precompile, project.precompileAsC = csbuild._auto_pch.SelectForProject(
+				project,
+				os.path.join( project.csbuildDir, "{}_cpp_precompiled_headers_{}.hpp".format(
+					project.outputName.split( '.' )[0],
+					project.targetName ) ),
+				os.path.join( project.csbuildDir, "{}_c_precompiled_headers_{}.h".format(
+					project.outputName.split( '.' )[0],
+					project.targetName ) ),
+				set( os.path.abspath( exclude ) for exclude in precompileExcludeFiles )
+			)
+
 		if project.chunkedPrecompile or project.precompile or project.precompileAsC:
 
 			if project.chunkedPrecompile:
@@ -849,31 +1324,30 @@ def ChunkedBuild( ):
 	if len(chunks_to_build) == 1 and not owningProject.unity:
 		chunkname = list(chunks_to_build)[0][1]
 
-		obj = GetSourceObjPath( owningProject, chunkname, sourceIsChunkPath=owningProject.ContainsChunk( chunkname ) )
-		for chunk in owningProject.chunks:
-			if GetChunkName( owningProject.outputName, chunk ) == chunkname:
-				if not owningProject.activeToolchain.Compiler().SupportsObjectScraping() and os.access(obj , os.F_OK):
-					os.remove(obj)
-					log.LOG_WARN_NOPUSH(
-						"Breaking chunk ({0}) into individual files to improve future iteration turnaround.".format(
-							chunk
-						)
-					)
-					for filename in chunk:
-						owningProject.splitChunks[filename] = chunkname
-					owningProject._finalChunkSet = chunk
-					return
-				else:
-					owningProject._finalChunkSet = owningProject.sources
-					return
+		chunk = owningProject.get_chunk_index( ).GetChunk( chunkname )
+		if chunk is None:
+			return
+		obj = GetSourceObjPath( owningProject, chunkname, sourceIsChunkPath=True )
+		if not owningProject.activeToolchain.Compiler().SupportsObjectScraping() and _stat_cache.Exists( obj ):
+			os.remove(obj)
+			_stat_cache.Invalidate( obj )
+			log.LOG_WARN_NOPUSH(
+				"Breaking chunk ({0}) into individual files to improve future iteration turnaround.".format(
+					chunk
+				)
+			)
+			for filename in chunk:
+				owningProject.splitChunks[filename] = chunkname
+			owningProject._finalChunkSet = chunk
+		else:
+			owningProject._finalChunkSet = owningProject.sources
 		return
 
 	for project in _shared_globals.projects.values( ):
-		for chunk in project.chunks:
-			sources_in_this_chunk = []
-			for source in project.sources:
-				if source in chunk:
-					sources_in_this_chunk.append( source )
+		chunkIndex = project.get_chunk_index( )
+		sourcesByChunk = chunkIndex.GroupSources( project.sources )
+		for chunk, chunkname in zip( chunkIndex.chunks, chunkIndex.names ):
+			sources_in_this_chunk = sourcesByChunk.get( chunkname, [] )
 
 			chunksize = GetSize( sources_in_this_chunk )
 
@@ -891,7 +1365,7 @@ def ChunkedBuild( ):
 				))
 			else:
 				outFile = os.path.join( project.csbuildDir, "{}{}".format(
-					GetChunkName( project.outputName, chunk ),
+					chunkname,
 					extension
 				))
 
@@ -916,7 +1390,7 @@ def ChunkedBuild( ):
 					) or (
 						(
 							project.unity
-							or os.access(outFile, os.F_OK)
+							or _stat_cache.Exists( outFile )
 						) and len(sources_in_this_chunk ) > 0
 					)
 				)
@@ -927,19 +1401,19 @@ def ChunkedBuild( ):
 					for source in chunk:
 						f.write(
 							'#include "{0}" // {1} bytes\n'.format( os.path.abspath( source ),
-								os.path.getsize( source ) ) )
+								_stat_cache.GetSize( source ) ) )
 						obj = GetSourceObjPath( project, source )
-						if os.access(obj , os.F_OK):
+						if _stat_cache.Exists( obj ):
 							os.remove( obj )
+							_stat_cache.Invalidate( obj )
 					f.write( "//Total size: {0} bytes".format( chunksize ) )
+				_stat_cache.Invalidate( outFile )
 
 				project._finalChunkSet.append( outFile )
 				project.chunksByFile.update( { outFile : chunk } )
 			elif len( sources_in_this_chunk ) > 0:
-				chunkname = GetChunkName( project.outputName, chunk )
-
-				obj = GetSourceObjPath( project, chunkname, sourceIsChunkPath=project.ContainsChunk( chunkname ) )
-				if os.access(obj , os.F_OK):
+				obj = GetSourceObjPath( project, chunkname, sourceIsChunkPath=True )
+				if _stat_cache.Exists( obj ):
 					#If the chunk object exists, the last build of these files was the full chunk.
 					#We're now splitting the chunk to speed things up for future incremental builds,
 					# which means the chunk
@@ -951,6 +1425,7 @@ def ChunkedBuild( ):
 						add_chunk = sources_in_this_chunk
 					else:
 						os.remove( obj )
+						_stat_cache.Invalidate( obj )
 						add_chunk = chunk
 						if project.useChunks and not _shared_globals.disable_chunks:
 							log.LOG_WARN_NOPUSH(
@@ -1152,4 +1627,43 @@ def ChangeDirectory(newCwd):
 	try:
 		yield
 	finally:
-		os.chdir(oldCwd)
\ No newline at end of file
+		os.chdir(oldCwd)
+
+def AtomicPickleDump( data, path ):
+	"""
+	Pickle data to a file without ever leaving a partially-written file behind, even if csbuild is killed
+	in the middle of writing it.
+
+	:param data: Object to pickle
+	:type data: any
+
+	:param path: Destination file
+	:type path: str
+	"""
+	tempFile = "{}.{}.tmp".format( path, os.getpid( ) )
+	with open( tempFile, "wb" ) as f:
+		pickle.dump( data, f, 2 )
+	if sys.version_info >= (3,3):
+		os.replace( tempFile, path )
+	else:
+		if os.access( path, os.F_OK ):
+			os.remove( path )
+		os.rename( tempFile, path )
+
+
+def GetFileStamp( path ):
+	"""
+	Get a stamp that changes whenever a file is rewritten, bypassing the stat cache. Used to tell whether a cache file
+	on disk is still the one that was loaded into memory.
+
+	:param path: File to check
+	:type path: str
+
+	:return: ( mtime, size, inode ), or None if the file doesn't exist
+	:rtype: tuple or None
+	"""
+	try:
+		st = os.stat( path )
+	except OSError:
+		return None
+	return ( st.st_mtime, st.st_size, st.st_ino )
@@ -40,7 +40,6 @@ import csbuild
 import fnmatch
 import os
 import re
-import hashlib
 import time
 import sys
 import math
@@ -54,6 +53,14 @@ import copy
 from . import log
 from . import _shared_globals
 from . import _utils
+from . import _header_cache
+from . import _fingerprints
+from . import _stat_cache
+from . import _include_index
+from . import _action_graph
+from . import _build_history
+from . import _chunking
+from . import _job_pool
 from . import toolchain
 from . import plugin_plist_generator
 
@@ -212,6 +219,10 @@ class projectSettings( object ):
 	:ivar chunkSizeTolerance: minimum total filesize of modified files needed to build a chunk as a chunk
 	:type chunkSizeTolerance: int
 
+	:ivar chunkCompileTime: compile time to aim for per chunk, in seconds, going by previous builds, or 0 to chunk by
+		chunkFilesize or chunkSize
+	:type chunkCompileTime: float
+
 	:ivar headerRecursionDepth: Depth to recurse when building header information
 	:type headerRecursionDepth: int
 
@@ -224,6 +235,18 @@ class projectSettings( object ):
 	:ivar chunkedPrecompile: Whether or not to precompile all headers in the project
 	:type chunkedPrecompile: bool
 
+	:ivar autoPrecompile: Whether or not to choose the headers to precompile from how widely they're included and how
+		often they change
+	:type autoPrecompile: bool
+
+	:ivar autoPrecompileMinShare: Smallest share of the translation units that have to include a header for it to be
+		chosen by autoPrecompile
+	:type autoPrecompileMinShare: float
+
+	:ivar autoPrecompileMaxChangeRate: Largest share of the builds with changes in them where a header chosen by
+		autoPrecompile, or anything it includes, can have changed
+	:type autoPrecompileMaxChangeRate: float
+
 	:ivar precompile: List of files to precompile
 	:type precompile: list[str]
 
@@ -279,6 +302,18 @@ class projectSettings( object ):
 		them as chunks, etc.
 	:type _finalChunkSet: list[str]
 
+	:ivar _unchangedIncludeSources: Sources the include index has shown to have no modified headers since the last
+		successful build, which don't need their headers followed
+	:type _unchangedIncludeSources: set[str]
+
+	:ivar _hasNewHeaders: Whether the project has headers that weren't there at the last successful build, any of
+		which could change which file an include resolves to
+	:type _hasNewHeaders: bool
+
+	:ivar _scannedIncludes: Every header each source or precompiled header includes, for those whose headers were
+		followed during this build
+	:type _scannedIncludes: dict[str, set[str]]
+
 	:ivar compilationCompleted: The number of files that have been compiled (successfully or not) at this point in the
 		compile process. Note that this variable is modified in multiple threads and should be handled within project.mutex
 	:type compilationCompleted: int
@@ -488,12 +523,14 @@ class projectSettings( object ):
 		self.chunks = []
 		self.forceChunks = []
 		self.chunksByFile = {}
+		self._chunkIndex = None
 
 		self.useChunks = True
 		self.chunkTolerance = 3
 		self.chunkSize = 0
 		self.chunkFilesize = 512000
 		self.chunkSizeTolerance = 128000
+		self.chunkCompileTime = 0
 
 		self.headerRecursionDepth = 0
 		self.ignoreExternalHeaders = False
@@ -501,6 +538,9 @@ class projectSettings( object ):
 		self.defaultTarget = "release"
 
 		self.chunkedPrecompile = False
+		self.autoPrecompile = False
+		self.autoPrecompileMinShare = 0.25
+		self.autoPrecompileMaxChangeRate = 0.1
 		self.precompile = []
 		self.precompileAsC = []
 		self.precompileExcludeFiles = []
@@ -533,6 +573,9 @@ class projectSettings( object ):
 		self.targetName = ""
 
 		self._finalChunkSet = []
+		self._unchangedIncludeSources = set()
+		self._hasNewHeaders = False
+		self._scannedIncludes = {}
 
 		self.compilationCompleted = 0
 
@@ -929,13 +972,20 @@ class projectSettings( object ):
 
 			#We'll do this even if _use_chunks is false, because it simplifies the linker logic.
 			self.chunks = self.make_chunks( self.allsources )
+			#Built here, rather than on first use, so the dependency check threads don't race to build it.
+			self.get_chunk_index( )
 		else:
 			self.allsources = list( itertools.chain( *self.forceChunks ) )
 
 		if not _shared_globals.CleanBuild and not _shared_globals.do_install and csbuild.GetOption(
 				"generate_solution" ) is None:
-			for source in self.allsources:
-				if self.should_recompile( source ):
+			self._unchangedIncludeSources = self.find_sources_with_unchanged_includes( )
+			if _shared_globals.dependency_check_pool is not None and len( self.allsources ) > 1:
+				results = _shared_globals.dependency_check_pool.map( self.should_recompile, self.allsources )
+			else:
+				results = [ self.should_recompile( source ) for source in self.allsources ]
+			for source, needsRecompile in zip( self.allsources, results ):
+				if needsRecompile:
 					self.sources.append( source )
 		else:
 			self.sources = list( self.allsources )
@@ -1255,15 +1305,20 @@ class projectSettings( object ):
 			"chunks": list( self.chunks ),
 			"forceChunks": list( self.forceChunks ),
 			"chunksByFile" : dict( self.chunksByFile ),
+			"_chunkIndex": None,
 			"useChunks": self.useChunks,
 			"chunkTolerance": self.chunkTolerance,
 			"chunkSize": self.chunkSize,
 			"chunkFilesize": self.chunkFilesize,
 			"chunkSizeTolerance": self.chunkSizeTolerance,
+			"chunkCompileTime": self.chunkCompileTime,
 			"headerRecursionDepth": self.headerRecursionDepth,
 			"ignoreExternalHeaders": self.ignoreExternalHeaders,
 			"defaultTarget": self.defaultTarget,
 			"chunkedPrecompile": self.chunkedPrecompile,
+			"autoPrecompile": self.autoPrecompile,
+			"autoPrecompileMinShare": self.autoPrecompileMinShare,
+			"autoPrecompileMaxChangeRate": self.autoPrecompileMaxChangeRate,
 			"precompile": list( self.precompile ),
 			"precompileAsC": list( self.precompileAsC ),
 			"precompileExcludeFiles": list( self.precompileExcludeFiles ),
@@ -1289,6 +1344,9 @@ class projectSettings( object ):
 			"cxxpcOverrideCmds" : dict(self.cxxpcOverrideCmds),
 			"targetName": self.targetName,
 			"_finalChunkSet": list( self._finalChunkSet ),
+			"_unchangedIncludeSources": set( self._unchangedIncludeSources ),
+			"_hasNewHeaders": self._hasNewHeaders,
+			"_scannedIncludes": dict( self._scannedIncludes ),
 			"needsPrecompileC": self.needsPrecompileC,
 			"needsPrecompileCpp": self.needsPrecompileCpp,
 			"compilationCompleted": self.compilationCompleted,
@@ -1431,7 +1489,7 @@ class projectSettings( object ):
 		ambiguousHeaders = set()
 
 		for sourceDir in [ '.' ] + self.extraDirs:
-			for root, dirnames, filenames in os.walk( sourceDir ):
+			for root, dirnames, filenames in _stat_cache.Walk( sourceDir ):
 				absroot = os.path.abspath( root )
 				if absroot in excludeDirs:
 					if absroot != self.csbuildDir:
@@ -1494,58 +1552,30 @@ class projectSettings( object ):
 
 
 	def get_full_path( self, headerFile, relativeDir ):
-		with _utils.ChangeDirectory(relativeDir):
-			if relativeDir in _shared_globals.headerPaths:
-				if headerFile in _shared_globals.headerPaths[relativeDir]:
-					return _shared_globals.headerPaths[relativeDir][headerFile]
-			else:
-				_shared_globals.headerPaths[relativeDir] = {}
+		#This is called from multiple threads during dependency checking, so it must not change directory.
+		cache = _shared_globals.headerPaths.setdefault( relativeDir, {} )
+		if headerFile in cache:
+			return cache[headerFile]
 
-			absHeaderPath = os.path.abspath(headerFile)
+		absHeaderPath = os.path.abspath( os.path.join( relativeDir, headerFile ) )
 
-			if os.access(absHeaderPath, os.F_OK):
-				_shared_globals.headerPaths[relativeDir][headerFile] = absHeaderPath
-				return absHeaderPath
-			else:
-				if relativeDir is not None:
-					path = os.path.join( relativeDir, headerFile )
-					if os.access(path, os.F_OK):
-						return os.path.abspath(path)
+		if _stat_cache.Exists( absHeaderPath ):
+			cache[headerFile] = absHeaderPath
+			return absHeaderPath
 
-				for incDir in self.includeDirs:
-					path = os.path.join( incDir, headerFile )
-					if os.access(path, os.F_OK):
-						path = os.path.abspath(path)
-						_shared_globals.headerPaths[relativeDir][headerFile] = path
-						return path
+		for incDir in self.includeDirs:
+			path = os.path.join( incDir, headerFile )
+			if _stat_cache.Exists( path ):
+				path = os.path.abspath(path)
+				cache[headerFile] = path
+				return path
 
-				_shared_globals.headerPaths[relativeDir][headerFile] = ""
-				return ""
+		cache[headerFile] = ""
+		return ""
 
 
 	def get_included_files( self, headerFile ):
-		headers = []
-		if sys.version_info >= (3, 0):
-			f = open( headerFile, encoding = "latin-1" )
-		else:
-			f = open( headerFile )
-		with f:
-			for line in f:
-				line = line.strip()
-				if not line or line[0] != '#':
-					continue
-
-				RMatch = re.search( r"#\s*include\s*[<\"](.*?)[\">]", line )
-				if RMatch is None:
-					continue
-
-				#Don't follow system headers, we should assume those are immutable
-				if "." not in RMatch.group( 1 ):
-					continue
-
-				headers.append( RMatch.group( 1 ) )
-
-		return headers
+		return _header_cache.GetIncludes( headerFile )
 
 
 	def follow_headers( self, headerFile, allheaders ):
@@ -1587,6 +1617,8 @@ class projectSettings( object ):
 				continue
 
 			if subpath in _shared_globals.allheaders:
+				#The cached set is what the header includes, which doesn't count the header itself.
+				allheaders.add( subpath )
 				allheaders.update(_shared_globals.allheaders[subpath])
 				continue
 
@@ -1637,6 +1669,7 @@ class projectSettings( object ):
 				continue
 
 			if subpath in _shared_globals.allheaders:
+				allheaders.add( subpath )
 				allheaders.update(_shared_globals.allheaders[subpath])
 				continue
 
@@ -1674,18 +1707,18 @@ class projectSettings( object ):
 
 				log.LOG_INFO("Checking for chunk file {}...".format(chunkfile))
 				#First check: If the object file doesn't exist, we obviously have to create it.
-				if not os.access(ofile , os.F_OK):
+				if not _stat_cache.Exists( ofile ):
 					ofile = chunkfile
 
-		if not os.access(ofile , os.F_OK):
+		if not _stat_cache.Exists( ofile ):
 			log.LOG_INFO(
 				"Going to recompile {0} because the associated object file does not exist.".format( srcFile ) )
 			return True
 
 		#Third check: modified time.
 		#If the source file is newer than the object file, we assume it's been changed and needs to recompile.
-		mtime = os.path.getmtime( srcFile )
-		omtime = os.path.getmtime( ofile )
+		mtime = _stat_cache.GetMtime( srcFile )
+		omtime = _stat_cache.GetMtime( ofile )
 
 		if mtime > omtime:
 			if for_precompiled_header:
@@ -1694,38 +1727,17 @@ class projectSettings( object ):
 						srcFile ) )
 				return True
 
-			oldmd5 = 1
-			newmd5 = 9
-
-			try:
-				newmd5 = _shared_globals.newmd5s[srcFile]
-			except KeyError:
-				with open( srcFile, "r" ) as f:
-					newmd5 = _utils.GetMd5( f )
-				_shared_globals.newmd5s.update( { srcFile: newmd5 } )
+			oldmd5 = _fingerprints.GetDatabase( self.csbuildDir ).Get( srcFile )
+			newmd5 = None
 
-			if platform.system( ) == "Windows":
-				src = srcFile[2:]
-			else:
-				src = srcFile
-
-			if sys.version_info >= (3,0):
-				src = src.encode("utf-8")
-				baseName = os.path.basename( src ).decode("utf-8")
-			else:
-				baseName = os.path.basename( src )
-
-			md5file = "{}.md5".format( os.path.join( self.csbuildDir, "md5s", hashlib.md5( src ).hexdigest(), baseName ) )
-
-			if os.access(md5file , os.F_OK):
+			if oldmd5 is not None:
 				try:
-					oldmd5 = _shared_globals.oldmd5s[md5file]
+					newmd5 = _shared_globals.newmd5s[srcFile]
 				except KeyError:
-					with open( md5file, "rb" ) as f:
-						oldmd5 = f.read( )
-					_shared_globals.oldmd5s.update( { md5file: oldmd5 } )
+					newmd5 = _utils.RunScanTask( _utils.GetFileFingerprint, srcFile )
+					_shared_globals.newmd5s.update( { srcFile: newmd5 } )
 
-			if oldmd5 != newmd5:
+			if oldmd5 is None or oldmd5 != newmd5:
 				log.LOG_INFO(
 					"Going to recompile {0} because it has been modified since the last successful build.".format(srcFile ) )
 				return True
@@ -1734,9 +1746,42 @@ class projectSettings( object ):
 		#If any included header file (recursive, to include headers included by headers) has been changed,
 		#then we need to recompile every source that includes that header.
 		#Follow the headers for this source file and find out if any have been changed o necessitate a recompile.
-		headers = set()
+		#If the include index shows that nothing this file included last time has changed, there's nothing to follow.
+		if srcFile in self._unchangedIncludeSources:
+			log.LOG_INFO( "Skipping {0}: Already up to date".format( srcFile ) )
+			return False
 
-		self.follow_headers( srcFile, headers )
+		#If the compiler told us exactly what it read last time, use that instead of scanning for includes. That's
+		#only safe if there's no new header, which could shadow one of the files it read.
+		headers = None
+		if self.activeToolchain.Compiler().SupportsDependencyFiles() and not self._hasNewHeaders:
+			dependencies = _header_cache.GetDependencies( os.path.abspath( ofile ) )
+			if dependencies is not None:
+				headers = set()
+				sourceExtensions = set( self.cppExtensions ) | set( self.cExtensions )
+				for dependency in dependencies:
+					if os.path.splitext( dependency )[1] in sourceExtensions:
+						continue
+					if not _stat_cache.Exists( dependency ):
+						log.LOG_INFO(
+							"Going to recompile {0} because its dependency {1} no longer exists.".format( srcFile, dependency ) )
+						return True
+					headers.add( dependency )
+
+		if headers is None:
+			#A header that's gone can't show up as modified, but whatever it shadowed may be included in its place.
+			previousHeaders = _include_index.GetIndex( self.csbuildDir, self.key ).GetIncludes( srcFile )
+			for header in previousHeaders or ():
+				if not _stat_cache.Exists( header ):
+					log.LOG_INFO(
+						"Going to recompile {0} because its included header {1} no longer exists.".format( srcFile, header ) )
+					return True
+
+			headers = set()
+			self.follow_headers( srcFile, headers )
+
+		if not for_precompiled_header:
+			self._scannedIncludes[srcFile] = headers
 
 		updatedheaders = []
 
@@ -1750,11 +1795,10 @@ class projectSettings( object ):
 				b = _shared_globals.headerCheck[header]
 				if b:
 					updatedheaders.append( [header, path] )
-				else:
-					continue
+				continue
 
 
-			header_mtime = os.path.getmtime( path )
+			header_mtime = _stat_cache.GetMtime( path )
 
 			if header_mtime > omtime:
 				if for_precompiled_header:
@@ -1762,41 +1806,18 @@ class projectSettings( object ):
 					_shared_globals.headerCheck[header] = True
 					continue
 
-				#newmd5 is 0, oldmd5 is 1, so that they won't report equal if we ignore them.
-				newmd5 = 0
-				oldmd5 = 1
+				#If we've never recorded this header, don't bother hashing it - it has to be treated as changed.
+				oldmd5 = _fingerprints.GetDatabase( self.csbuildDir ).Get( path )
+				newmd5 = None
 
-				if platform.system( ) == "Windows":
-					header = header[2:]
-
-				if sys.version_info >= (3,0):
-					header = header.encode("utf-8")
-					baseName = os.path.basename( header ).decode("utf-8")
-				else:
-					baseName = os.path.basename( header )
-
-				md5file = "{}.md5".format( os.path.join( self.csbuildDir, "md5s", hashlib.md5( header ).hexdigest(), baseName ) )
-
-				if os.access(md5file , os.F_OK):
+				if oldmd5 is not None:
 					try:
 						newmd5 = _shared_globals.newmd5s[path]
 					except KeyError:
-						if sys.version_info >= (3, 0):
-							f = open( path, encoding = "latin-1" )
-						else:
-							f = open( path )
-						with f:
-							newmd5 = _utils.GetMd5( f )
+						newmd5 = _utils.RunScanTask( _utils.GetFileFingerprint, path )
 						_shared_globals.newmd5s.update( { path: newmd5 } )
-					if os.access(md5file , os.F_OK):
-						try:
-							oldmd5 = _shared_globals.oldmd5s[md5file]
-						except KeyError:
-							with open( md5file, "rb" ) as f:
-								oldmd5 = f.read( )
-							_shared_globals.oldmd5s.update( { md5file: oldmd5 } )
-
-				if oldmd5 != newmd5:
+
+				if oldmd5 is None or oldmd5 != newmd5:
 					updatedheaders.append( [header, path] )
 					_shared_globals.headerCheck[header] = True
 					continue
@@ -1821,6 +1842,156 @@ class projectSettings( object ):
 		return False
 
 
+	def find_sources_with_unchanged_includes( self ):
+		"""
+		Use the include index to find the sources whose headers don't need to be followed this build: those that were
+		indexed at the last successful build and include none of the headers that have changed since. Also notes
+		whether any of the project's headers are new since then.
+
+		:return: Sources that can skip the header check in should_recompile
+		:rtype: set[str]
+		"""
+		self._hasNewHeaders = False
+		if self.recompileAll:
+			return set()
+
+		index = _include_index.GetIndex( self.csbuildDir, self.key )
+
+		#A header that wasn't there last time could shadow an indexed one through the include paths, in which case
+		#the index no longer says what each source includes.
+		for header in self.allheaders:
+			if not index.HasBaseline( header ):
+				log.LOG_INFO( "Not using the include index for {0}: {1} is a new header.".format( self.name, header ) )
+				self._hasNewHeaders = True
+				return set()
+
+		changedHeaders = index.GetChangedHeaders( )
+		affected = index.GetAffectedTranslationUnits( changedHeaders )
+		log.LOG_INFO(
+			"{0} headers changed since the last successful build of {1}, affecting {2} translation units.".format(
+				len( changedHeaders ), self.name, len( affected ) ) )
+
+		return set(
+			source for source in self.allsources
+			if source not in affected and index.GetIncludes( source ) is not None and not self._has_new_includes( index, source )
+		)
+
+
+	def _has_new_includes( self, index, translationUnit ):
+		#An include that couldn't be found when the translation unit was indexed but can be now means its recorded
+		#includes are incomplete.
+		for includer, name in index.GetUnresolved( translationUnit ):
+			if self.get_full_path( name, os.path.dirname( includer ) ):
+				log.LOG_INFO( "Not using the include index for {0}: {1} can now be found.".format( translationUnit, name ) )
+				return True
+		return False
+
+
+	def find_unresolved_includes( self, translationUnit, headers ):
+		"""
+		Find the includes of a translation unit that don't resolve to a file, in the translation unit itself and in
+		the headers it includes from the project and its include directories.
+
+		:param translationUnit: Absolute path of a source file or precompiled header
+		:type translationUnit: str
+
+		:param headers: Every header it includes, directly or indirectly
+		:type headers: set[str]
+
+		:return: The includes that couldn't be found, as ( including file, include name )
+		:rtype: set[tuple[str, str]]
+		"""
+		roots = tuple(
+			os.path.join( os.path.abspath( directory ), "" )
+			for directory in [ self.workingDirectory ] + list( self.includeDirs )
+		)
+		unresolved = set( )
+		for includer in itertools.chain( ( translationUnit, ), headers ):
+			if includer != translationUnit and not includer.startswith( roots ):
+				continue
+			if not _stat_cache.Exists( includer ):
+				continue
+			for name in self.get_included_files( includer ):
+				if not self.get_full_path( name, os.path.dirname( includer ) ):
+					unresolved.add( ( includer, name ) )
+		return unresolved
+
+
+	def _index_includes( self, index, translationUnit, headers ):
+		#An empty set for a file that does include something means its includes couldn't be followed (for instance
+		#a header that couldn't be stat'ed), not that it has none, so it isn't trusted to the index.
+		if not headers and _stat_cache.Exists( translationUnit ) and self.get_included_files( translationUnit ):
+			index.RemoveIncludes( translationUnit )
+			return
+		index.SetIncludes( translationUnit, headers, self.find_unresolved_includes( translationUnit, headers ) )
+
+
+	def save_include_index( self ):
+		"""
+		Record the includes of every source and precompiled header in the include index, along with the current state
+		of every file involved as the baseline for the next build. Only done when everything in the project compiled
+		successfully; otherwise the baseline could mark changes as seen that some sources were never rebuilt against.
+		"""
+		if self.compilationFailed or self.precompileFailed or _shared_globals.interrupted:
+			return
+
+		if self.compilationCompleted < len( self._finalChunkSet ) + int( self.needsPrecompileC ) + int( self.needsPrecompileCpp ):
+			return
+
+		index = _include_index.GetIndex( self.csbuildDir, self.key )
+
+		translationUnits = set( self.allsources )
+		for pchFile in ( self.cppHeaderFile, self.cHeaderFile ):
+			if pchFile:
+				translationUnits.add( pchFile )
+		index.Prune( translationUnits )
+
+		recompiled = set( self.sources )
+		useDependencyFiles = self.activeToolchain.Compiler().SupportsDependencyFiles()
+		sourceExtensions = set( self.cppExtensions ) | set( self.cExtensions )
+		for source in self.allsources:
+			headers = self._scannedIncludes.get( source )
+			if headers is None:
+				if source not in recompiled and index.GetIncludes( source ) is not None:
+					continue
+				headers = set()
+				self.follow_headers( source, headers )
+
+			#Anything the compiler reported reading when it built this file on its own is included too.
+			if useDependencyFiles and source in recompiled and source in self._finalChunkSet:
+				dependencies = _header_cache.GetDependencies( os.path.abspath( _utils.GetSourceObjPath( self, source ) ) )
+				if dependencies:
+					headers = set( headers )
+					headers.update(
+						dependency for dependency in dependencies
+						if os.path.splitext( dependency )[1] not in sourceExtensions
+					)
+
+			self._index_includes( index, source, headers )
+
+		for translationUnit, headers in self._scannedIncludes.items( ):
+			if translationUnit in translationUnits and translationUnit not in self.allsources:
+				self._index_includes( index, translationUnit, headers )
+
+		index.UpdateBaseline( set( index.dependents ) | set( self.allheaders ) )
+		index.Flush( )
+
+
+	def GetDependentTranslationUnits( self, header ):
+		"""
+		Get every source file and precompiled header in this project that includes the given header, directly or
+		indirectly, as of the last successful build.
+
+		:param header: Path to the header
+		:type header: str
+
+		:return: Absolute paths of the dependent translation units
+		:rtype: list[str]
+		"""
+		index = _include_index.GetIndex( self.csbuildDir, self.key )
+		return sorted( index.GetDependents( os.path.abspath( header ) ) )
+
+
 	def check_libraries( self ):
 		"""Checks the libraries designated by the make script.
 		Invokes ld to determine whether or not the library exists.1
@@ -1866,37 +2037,6 @@ class projectSettings( object ):
 		log.LOG_INFO( "Libraries OK!" )
 		return True
 
-	def CanJoinChunk(self, chunk, newFile):
-		if not chunk:
-			return True
-
-		extension = "." + chunk[0].rsplit(".", 1)[1]
-		newFileExtension = "." + newFile.rsplit(".", 1)[1]
-
-		#TODO: Remove this once the source file extension management has been reworked.
-		# Objective-C/C++ files should not be chunked since they won't play nice with C++.
-		if newFileExtension == ".m" or newFileExtension == ".mm":
-			return False
-
-		if(
-			(extension in self.cExtensions and newFileExtension in self.cppExtensions) or
-			(extension in self.cppExtensions and newFileExtension in self.cExtensions)
-		):
-			return False
-
-		if newFile in self.chunkExcludes:
-			return False #NEVER ok to join chunk with this file!
-
-		for sourceFile in chunk:
-			if newFile in self.chunkMutexes and sourceFile in self.chunkMutexes[newFile]:
-				log.LOG_INFO("Rejecting {} for this chunk because it is labeled as mutually exclusive with {} for chunking".format(newFile, sourceFile))
-				return False
-			if sourceFile in self.chunkMutexes and newFile in self.chunkMutexes[sourceFile]:
-				log.LOG_INFO("Rejecting {} for this chunk because it is labeled as mutually exclusive with {} for chunking".format(newFile, sourceFile))
-				return False
-
-		return True
-
 	def make_chunks( self, l ):
 		""" Converts the list into a list of lists - i.e., "chunks"
 		Each chunk represents one compilation unit in the chunked build system.
@@ -1906,115 +2046,110 @@ class projectSettings( object ):
 
 		if self.unity:
 			return [l]
-		chunks = []
-		if self.chunkFilesize > 0:
-			sorted_list = sorted( l, key = os.path.getsize, reverse=True )
-			while sorted_list:
-				remaining = []
-				chunksize = 0
-				chunk = [sorted_list[0]]
-				chunksize += os.path.getsize( sorted_list[0] )
-				sorted_list.pop( 0 )
-				for i in reversed(range(len(sorted_list))):
-					srcFile = sorted_list[i]
-					if not self.CanJoinChunk(chunk, srcFile):
-						remaining.append(srcFile)
-						continue
-					filesize = os.path.getsize( srcFile )
-					if chunksize + filesize > self.chunkFilesize:
-						chunks.append( chunk )
-						remaining += sorted_list[i::-1]
-						log.LOG_INFO( "Made chunk: {0}".format( chunk ) )
-						log.LOG_INFO( "Chunk size: {0}".format( chunksize ) )
-						chunk = []
-						break
-					else:
-						chunk.append( srcFile )
-						chunksize += filesize
-				if remaining:
-					sorted_list = sorted( remaining, key = os.path.getsize, reverse=True )
-				else:
-					sorted_list = None
 
-				if chunk:
-					chunks.append( chunk )
-					log.LOG_INFO( "Made chunk: {0}".format( chunk ) )
-					log.LOG_INFO( "Chunk size: {0}".format( chunksize ) )
+		costs = None
+		if self.chunkCompileTime > 0:
+			costs = self.get_compile_costs( l )
+		if costs is not None:
+			mode = "time"
+			budget = self.chunkCompileTime
+			costFormat = "Chunk compile time: {0:.2f}s"
+		elif self.chunkFilesize > 0:
+			mode = "size"
+			costs = dict( ( srcFile, _stat_cache.GetSize( srcFile ) ) for srcFile in l )
+			budget = self.chunkFilesize
+			costFormat = "Chunk size: {0}"
 		elif self.chunkSize > 0:
-			tempList = l
-			while tempList:
-				chunk = []
-				remaining = []
-				for i in range(len(tempList)):
-					srcFile = tempList[i]
-					if not self.CanJoinChunk(chunk, srcFile):
-						remaining.append(srcFile)
-						continue
-
-					chunk.append(srcFile)
-
-					if len(chunk) == self.chunkSize:
-						remaining += tempList[i+1:]
-						chunks.append( chunk )
-						log.LOG_INFO( "Made chunk: {0}".format( chunk ) )
-						chunk = []
-						break
-				tempList = remaining
-				if chunk:
-					chunks.append( chunk )
-					log.LOG_INFO( "Made chunk: {0}".format( chunk ) )
+			mode = "count"
+			costs = dict.fromkeys( l, 1 )
+			budget = self.chunkSize
+			costFormat = None
 		else:
 			return [l]
+
+		#Start from the chunks the last build made, so adding or removing a file only changes the chunk it's in.
+		mode = ( mode, budget )
+		rules = _chunking.ChunkRules( self.cExtensions, self.cppExtensions, self.chunkExcludes, self.chunkMutexes )
+		assignmentPath = _chunking.GetAssignmentPath( self.csbuildDir, self.key )
+		previous = _chunking.LoadAssignment( assignmentPath, mode )
+		if previous is None:
+			chunks, chunkCosts = _chunking.PackChunks( l, costs, budget, rules )
+		else:
+			chunks, chunkCosts = _chunking.UpdateChunks( previous, l, costs, budget, rules )
+		if chunks != previous:
+			_chunking.SaveAssignment( assignmentPath, mode, chunks )
+
+		for chunk, cost in zip( chunks, chunkCosts ):
+			log.LOG_INFO( "Made chunk: {0}".format( chunk ) )
+			if costFormat is not None:
+				log.LOG_INFO( costFormat.format( cost ) )
 		return chunks
 
 
+	def get_compile_costs( self, l ):
+		"""
+		Work out how long each file is expected to take to compile, for chunking by compile time. Files that have
+		never been compiled are estimated from their size, at the rate the project's other files compiled at.
+
+		:return: Seconds for each file, or None if none of them have been compiled before
+		:rtype: dict[str, float] or None
+		"""
+		costs = {}
+		unknown = []
+		knownTime = 0.0
+		knownSize = 0
+		for srcFile in l:
+			seconds = _build_history.GetSourceCompileTime( srcFile )
+			if seconds is None:
+				unknown.append( srcFile )
+				continue
+			costs[srcFile] = seconds
+			knownTime += seconds
+			knownSize += _stat_cache.GetSize( srcFile )
+
+		if not costs:
+			return None
+
+		if knownSize:
+			secondsPerByte = knownTime / knownSize
+			for srcFile in unknown:
+				costs[srcFile] = _stat_cache.GetSize( srcFile ) * secondsPerByte
+		else:
+			for srcFile in unknown:
+				costs[srcFile] = knownTime / len( costs )
+		return costs
+
+
+	def get_chunk_index( self ):
+		"""
+		Retrieves the lookup tables for the project's chunks, building them if the chunks have changed since they
+		were last built.
+
+		:rtype: csbuild._chunking.ChunkIndex
+		"""
+		index = self._chunkIndex
+		if index is None or index.chunks is not self.chunks or index.outputName != self.outputName:
+			index = _chunking.ChunkIndex( self.outputName, self.chunks )
+			self._chunkIndex = index
+		return index
+
+
 	def get_chunk( self, srcFile ):
 		"""Retrieves the chunk that a given file belongs to."""
-		for chunk in self.chunks:
-			if srcFile in chunk:
-				return _utils.GetChunkName( self.outputName, chunk )
-		return None
+		return self.get_chunk_index( ).GetChunkName( srcFile )
 
 
 	def ContainsChunk( self, inputChunkFile ):
-		# This logic really sucks and needs to be improved.
 		inputChunkFile = os.path.splitext( os.path.basename( inputChunkFile ) )[0]
-		for chunk in self.chunks:
-			chunkName = _utils.GetChunkName( self.outputName, chunk )
-			if inputChunkFile == chunkName:
-				return True
-		return False
+		return self.get_chunk_index( ).GetChunk( inputChunkFile ) is not None
 
 
 	def save_md5( self, inFile ):
-		# If we're running on Windows, we need to remove the drive letter from the input file path.
-		#if platform.system( ) == "Windows":
-		#	inFile = inFile[2:]
-
-		if sys.version_info >= (3,0):
-			inFile = inFile.encode("utf-8")
-			baseName = os.path.basename( inFile ).decode("utf-8")
-		else:
-			baseName = os.path.basename( inFile )
-
-		md5file = "{}.md5".format( os.path.join( self.csbuildDir, "md5s", hashlib.md5( inFile ).hexdigest(), baseName ) )
-
-		md5dir = os.path.dirname( md5file )
-		if not os.access(md5dir , os.F_OK):
-			os.makedirs( md5dir )
-		newmd5 = ""
 		try:
 			newmd5 = _shared_globals.newmd5s[inFile]
 		except KeyError:
-			if sys.version_info >= (3, 0):
-				f = open( inFile, encoding = "latin-1" )
-			else:
-				f = open( inFile )
-			with f:
-				newmd5 = _utils.GetMd5( f )
-		finally:
-			with open( md5file, "wb" ) as f:
-				f.write( newmd5 )
+			newmd5 = _utils.GetFileFingerprint( inFile )
+		_fingerprints.GetDatabase( self.csbuildDir ).Set( inFile, newmd5 )
 
 
 	def save_md5s( self, sources, headers ):
@@ -2027,12 +2162,23 @@ class projectSettings( object ):
 		for path in self.allPaths:
 			self.save_md5( path )
 
+		_fingerprints.GetDatabase( self.csbuildDir ).Flush( )
+
 
-	def precompile_headers( self ):
+	def precompile_headers( self, graph ):
+		"""
+		Queue this project's precompiled headers on the build's action graph.
+
+		:param graph: Graph the build's actions are added to
+		:type graph: csbuild._action_graph.ActionGraph
+
+		:return: The precompile action for each header being precompiled, keyed by the header. Each of the project's
+			compiles only has to wait for the one it's compiled with.
+		:rtype: dict[str, csbuild._action_graph.Action]
+		"""
 		if not self.needsPrecompileC and not self.needsPrecompileCpp:
-			return True
+			return {}
 
-		starttime = time.time( )
 		log.LOG_BUILD( "Precompiling headers..." )
 
 		self._builtSomething = True
@@ -2040,70 +2186,73 @@ class projectSettings( object ):
 		if not os.access(self.objDir , os.F_OK):
 			os.makedirs( self.objDir )
 
-		thread = None
-		cthread = None
-		cppobj = ""
-		cobj = ""
+		headers = []
 		if self.needsPrecompileCpp:
-			if not _shared_globals.semaphore.acquire( False ):
-				if _shared_globals.max_threads != 1:
-					log.LOG_INFO( "Waiting for a build thread to become available..." )
-				_shared_globals.semaphore.acquire( True )
-			if _shared_globals.interrupted:
-				csbuild.Exit( 2 )
+			headers.append( self.cppHeaderFile )
+		if self.needsPrecompileC:
+			headers.append( self.cHeaderFile )
 
-			log.LOG_BUILD(
-				"Precompiling {0} ({1}/{2})...".format(
-					self.cppHeaderFile,
-					_shared_globals.current_compile,
-					_shared_globals.total_compiles ) )
+		starttime = time.time( )
+		remaining = [ len( headers ) ]
 
-			_shared_globals.current_compile += 1
+		def precompileDone( ):
+			with self.mutex:
+				remaining[0] -= 1
+				if remaining[0]:
+					return
 
-			cppobj = self.activeToolchain.Compiler().GetPchFile( self.cppHeaderFile )
+			totaltime = time.time( ) - starttime
+			totalmin = math.floor( totaltime / 60 )
+			totalsec = math.floor( totaltime % 60 )
+			log.LOG_BUILD( "Precompile took {0}:{1:02}".format( int( totalmin ), int( totalsec ) ) )
 
-			#precompiled headers block on current thread - run runs on current thread rather than starting a new one
-			thread = _utils.ThreadedBuild( self.cppHeaderFile, cppobj, self, True )
-			thread.start( )
+			self.precompileDone = True
+			self.precompileFailed = self.compilationFailed
 
-		if self.needsPrecompileC:
-			if not _shared_globals.semaphore.acquire( False ):
-				if _shared_globals.max_threads != 1:
-					log.LOG_INFO( "Waiting for a build thread to become available..." )
-				_shared_globals.semaphore.acquire( True )
-			if _shared_globals.interrupted:
-				csbuild.Exit( 2 )
+		def precompile( headerFile, obj ):
+			with _shared_globals.sgmutex:
+				current = _shared_globals.current_compile
+				_shared_globals.current_compile += 1
 
 			log.LOG_BUILD(
 				"Precompiling {0} ({1}/{2})...".format(
-					self.cHeaderFile,
-					_shared_globals.current_compile,
+					headerFile,
+					current,
 					_shared_globals.total_compiles ) )
 
-			_shared_globals.current_compile += 1
-
-			cobj = self.activeToolchain.Compiler().GetPchFile( self.cHeaderFile )
-
-			#precompiled headers block on current thread - run runs on current thread rather than starting a new one
-			cthread = _utils.ThreadedBuild( self.cHeaderFile, cobj, self, True )
-			cthread.start( )
-
-		if thread:
-			thread.join( )
-			_shared_globals.precompiles_done += 1
-		if cthread:
-			cthread.join( )
-			_shared_globals.precompiles_done += 1
+			_utils.ThreadedBuild( headerFile, obj, self, True ).run( )
 
-		totaltime = time.time( ) - starttime
-		totalmin = math.floor( totaltime / 60 )
-		totalsec = math.floor( totaltime % 60 )
-		log.LOG_BUILD( "Precompile took {0}:{1:02}".format( int( totalmin ), int( totalsec ) ) )
+			with _shared_globals.sgmutex:
+				_shared_globals.precompiles_done += 1
+			precompileDone( )
+			return not self.compilationFailed
 
-		self.precompileDone = True
-		self.precompileFailed = self.compilationFailed
-
-		return not self.compilationFailed
+		def onCancelled( action ):
+			if action.state != _action_graph.ActionState.Cancelled:
+				return
+			#Never ran, but the project still has to count it as done to be seen as finished.
+			with self.mutex:
+				self.fileStatus[os.path.normcase( action.args[0] )] = _shared_globals.ProjectState.ABORTED
+				self.compilationFailed = True
+				self.compilationCompleted += 1
+				self.updated = True
+			with _shared_globals.sgmutex:
+				_shared_globals.total_compiles -= 1
+			precompileDone( )
+
+		actions = {}
+		for headerFile in headers:
+			obj = self.activeToolchain.Compiler().GetPchFile( headerFile )
+			#Precompiled headers go ahead of everything else queued, since this project's compiles can't start until they're done.
+			actions[headerFile] = graph.Add(
+				precompile,
+				( headerFile, obj ),
+				priority = _job_pool.PRECOMPILE_PRIORITY,
+				memory = _build_history.GetPeakMemory( obj ) or 0,
+				callback = onCancelled,
+				name = os.path.basename( obj )
+			)
+		return actions
 
 
 
@@ -683,6 +683,21 @@ class SettingsOverrider( object ):
 		self._settingsOverrides["chunkSize"] = i
 
 
+	def SetMaxChunkCompileTime( self, seconds ):
+		"""
+		Make up chunks by how long their files took to compile on previous builds, rather than by their size, so each
+		chunk takes about the given time to compile and they all finish at around the same time. Files that have never
+		been compiled are estimated from their size. Until anything in the project has been compiled, chunks are made
+		the usual way, by SetMaxChunkFileSize() or SetNumFilesPerChunk().
+
+		This value is ignored if SetChunks is called.
+
+		:type seconds: float
+		:param seconds: Compile time to aim for per chunk, or 0 to go back to chunking by size or number of files.
+		"""
+		self._settingsOverrides["chunkCompileTime"] = seconds
+
+
 	def SetChunkTolerance( self, i ):
 		"""
 		**If building using ChunkSize():**
@@ -790,6 +805,7 @@ class SettingsOverrider( object ):
 			newArgs.append( arg )
 		self._settingsOverrides["precompileTemp"] += newArgs
 		self._settingsOverrides["chunkedPrecompile"] = False
+		self._settingsOverrides["autoPrecompile"] = False
 		self._settingsOverrides["tempsDirty"] = True
 
 
@@ -815,6 +831,30 @@ class SettingsOverrider( object ):
 		When this is enabled, all header files will be precompiled into a single "superheader" and included in all files.
 		"""
 		self._settingsOverrides["chunkedPrecompile"] = True
+		self._settingsOverrides["autoPrecompile"] = False
+
+
+	def EnableAutoPrecompile( self, minShare = 0.25, maxChangeRate = 0.1 ):
+		"""
+		When this is enabled, the headers to precompile are chosen each build: those included by enough of the project's
+		translation units that rarely change, going by the include index and how often each header has changed in past
+		builds. The headers chosen, and how much they're expected to save, are reported at the start of the build.
+		Disables chunk precompile and any explicit list of headers to precompile.
+
+		:type minShare: float
+		:param minShare: Smallest share of the translation units (0 to 1) that have to include a header for it to be chosen.
+
+		:type maxChangeRate: float
+		:param maxChangeRate: Largest share of the builds with changes in them (0 to 1) where a chosen header, or anything
+		it includes, can have changed.
+		"""
+		self._settingsOverrides["autoPrecompile"] = True
+		self._settingsOverrides["autoPrecompileMinShare"] = minShare
+		self._settingsOverrides["autoPrecompileMaxChangeRate"] = maxChangeRate
+		self._settingsOverrides["chunkedPrecompile"] = False
+		self._settingsOverrides["precompileTemp"] = []
+		self._settingsOverrides["precompileAsCTemp"] = []
+		self._settingsOverrides["tempsDirty"] = True
 
 
 	def DisablePrecompile( self, *args ):
@@ -838,6 +878,7 @@ class SettingsOverrider( object ):
 			self._settingsOverrides["precompileExcludeFilesTemp"] += newargs
 		else:
 			self._settingsOverrides["chunkedPrecompile"] = False
+			self._settingsOverrides["autoPrecompile"] = False
 			self._settingsOverrides["precompileTemp"] = []
 			self._settingsOverrides["precompileAsCTemp"] = []
 		self._settingsOverrides["tempsDirty"] = True
@@ -1438,6 +1479,60 @@ class compilerBase( toolBase ):
 		return ""
 
 
+	def GetCachePreprocessCommand( self, baseCmd, project, forceIncludeFile, inFile, outObj = None ):
+		"""
+		Retrieves a command that runs only the preprocessor on a file, with exactly the settings GetExtendedCommand()
+		would compile it with, and writes the result to stdout. The compile cache hashes its output to identify the
+		object file when dependency files aren't available, and distributed builds send it to a worker to compile.
+
+		:param baseCmd: The project's base command, as passed to GetExtendedCommand()
+		:type baseCmd: str
+
+		:param project: The project currently being compiled
+		:type project: :class:`csbuild.projectSettings.projectSettings`
+
+		:param forceIncludeFile: A precompiled header that's being forcefully included.
+		:type forceIncludeFile: str
+
+		:param inFile: The file to preprocess
+		:type inFile: str
+
+		:param outObj: If given, the object file the source will be compiled to; the preprocessor also writes its
+			dependency file, if the compiler supports them
+		:type outObj: str
+
+		:return: The command, or None if this compiler can't preprocess this way
+		:rtype: str or None
+		"""
+		return None
+
+
+	def GetRemoteCompileCommand( self, baseCmd, project, inFile, preprocessedFile, outObj ):
+		"""
+		Retrieves a command that compiles the output of GetCachePreprocessCommand() on a build worker, without access
+		to the sources or include directories.
+
+		:param baseCmd: The project's base command, as passed to GetExtendedCommand()
+		:type baseCmd: str
+
+		:param project: The project currently being compiled
+		:type project: :class:`csbuild.projectSettings.projectSettings`
+
+		:param inFile: The original source file
+		:type inFile: str
+
+		:param preprocessedFile: The preprocessed source, relative to the directory the worker compiles in
+		:type preprocessedFile: str
+
+		:param outObj: The object file to write, relative to the directory the worker compiles in
+		:type outObj: str
+
+		:return: The command, or None if this compiler's files can't be compiled remotely
+		:rtype: str or None
+		"""
+		return None
+
+
 	@abstractmethod
 	def PragmaMessage(self, message):
 		return ""
@@ -1457,6 +1552,25 @@ class compilerBase( toolBase ):
 		"""
 		pass
 
+	def SupportsDependencyFiles(self):
+		"""
+		Whether or not this compiler is currently set up to write a dependency file for each object it builds.
+		"""
+		return False
+
+	def GetDependencyFile(self, outObj):
+		"""
+		Get the dependency file the compiler writes for a given object. Only called when SupportsDependencyFiles()
+		returns True.
+
+		:param outObj: The output object file
+		:type outObj: str
+
+		:return: The make-style dependency file written alongside the object
+		:rtype: str
+		"""
+		return None
+
 	def SupportsObjectScraping(self):
 		return False
 
@@ -233,6 +233,7 @@ class GccCompiler( gccBase, toolchain.compilerBase ):
 		self.warnFlags = _utils.OrderedSet()
 		self.cppStandard = ""
 		self.cStandard = ""
+		self.useDependencyFiles = False
 
 		#self._settingsOverrides["cxx"] = "g++"
 		#self._settingsOverrides["cc"] = "gcc"
@@ -244,6 +245,7 @@ class GccCompiler( gccBase, toolchain.compilerBase ):
 		ret.warnFlags = _utils.OrderedSet( self.warnFlags )
 		ret.cppStandard = self.cppStandard
 		ret.cStandard = self.cStandard
+		ret.useDependencyFiles = self.useDependencyFiles
 		return ret
 
 
@@ -352,11 +354,15 @@ class GccCompiler( gccBase, toolchain.compilerBase ):
 		inc = ""
 		if forceIncludeFile:
 			inc = "-include {0}".format( forceIncludeFile )
-		return "{} {}{}{}{} -o\"{}\" \"{}\"".format(
+		depFlags = ""
+		if self.useDependencyFiles:
+			depFlags = "-MMD -MF\"{}\" ".format( self.GetDependencyFile( outObj ) )
+		return "{} {}{}{}{}{} -o\"{}\" \"{}\"".format(
 			baseCmd,
 			self._getWarnings( self.warnFlags, project.noWarnings ),
 			self._getIncludeDirs( project.includeDirs ),
 			self._getObjcAbiVersionArg( inFile ),
+			depFlags,
 			inc,
 			outObj,
 			inFile
@@ -385,6 +391,43 @@ class GccCompiler( gccBase, toolchain.compilerBase ):
 		return "\"{}\" -E {} \"{}\"".format(baseCmd, self._getIncludeDirs( project.includeDirs ), inFile)
 
 
+	def GetCachePreprocessCommand( self, baseCmd, project, forceIncludeFile, inFile, outObj = None ):
+		inc = ""
+		if forceIncludeFile:
+			inc = "-include {0}".format( forceIncludeFile )
+		depFlags = ""
+		if outObj is not None and self.useDependencyFiles:
+			depFlags = "-MMD -MF\"{}\" -MT\"{}\" ".format( self.GetDependencyFile( outObj ), outObj )
+		return "{} -E {}{}{}{} \"{}\"".format(
+			baseCmd,
+			self._getIncludeDirs( project.includeDirs ),
+			self._getObjcAbiVersionArg( inFile ),
+			depFlags,
+			inc,
+			inFile
+		)
+
+
+	def GetRemoteCompileCommand( self, baseCmd, project, inFile, preprocessedFile, outObj ):
+		extension = os.path.splitext( inFile )[1]
+		if extension == ".m":
+			language = "objective-c-cpp-output"
+		elif extension == ".mm":
+			language = "objective-c++-cpp-output"
+		elif extension in project.cExtensions:
+			language = "cpp-output"
+		else:
+			language = "c++-cpp-output"
+		return "{} {}{}-x {} -o\"{}\" \"{}\"".format(
+			baseCmd,
+			self._getWarnings( self.warnFlags, project.noWarnings ),
+			self._getObjcAbiVersionArg( inFile ),
+			language,
+			outObj,
+			preprocessedFile
+		)
+
+
 	def PragmaMessage(self, message):
 		return "#pragma message \"{}\"".format(message)
 
@@ -439,6 +482,28 @@ class GccCompiler( gccBase, toolchain.compilerBase ):
 		self.cStandard = s
 
 
+	def EnableDependencyFiles( self ):
+		"""
+		Have the compiler write out a dependency file (-MMD -MF) alongside each object.
+		csbuild will then use the exact list of headers the compiler actually read when deciding whether
+		a file needs to be rebuilt, rather than scanning sources for #include directives.
+		"""
+		self.useDependencyFiles = True
+
+
+	def DisableDependencyFiles( self ):
+		"""Turns off dependency file generation, falling back to scanning sources for #include directives."""
+		self.useDependencyFiles = False
+
+
+	def SupportsDependencyFiles( self ):
+		return self.useDependencyFiles
+
+
+	def GetDependencyFile( self, outObj ):
+		return outObj + ".d"
+
+
 	def SupportsObjectScraping(self):
 		return False
 
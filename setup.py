@@ -10,6 +10,7 @@ setup(name='csbuild',
       #py_modules=['csbuild'],
       packages=["csbuild"],
       package_data={"csbuild":["version", "*.py", "*/*.py", "*/*/*.py"]},
+      scripts=["scripts/csbuild-cache-server"],
       author="Jaedyn K. Draper",
       author_email="jaedyn.pypi@jaedyn.co",
       url="https://github.com/3Jade/csbuild",